@@ -23,10 +23,57 @@ def create_app():
     app.config['JWT_SECRET_KEY'] = os.getenv('JWT_SECRET_KEY', 'jwt-secret-key')
     app.config['JWT_ACCESS_TOKEN_EXPIRES'] = timedelta(days=30)
 
+    # Reverse proxy fidati davanti all'app (0 = nessuno: remote_addr è il client)
+    trusted_proxies = int(os.getenv('TRUSTED_PROXIES', '0'))
+    if trusted_proxies > 0:
+        from werkzeug.middleware.proxy_fix import ProxyFix
+        app.wsgi_app = ProxyFix(app.wsgi_app, x_for=trusted_proxies, x_proto=trusted_proxies)
+
     db.init_app(app)
     migrate.init_app(app, db)
     jwt.init_app(app)
 
+    # Principal JWT (ruolo/tenant/account) risolto una volta per richiesta
+    from app.services.principal_service import init_app as init_principal
+    init_principal(app)
+
+    # Saldi contratti (admin_contract_ledgers) aggiornati sulle scritture AdminInvoice
+    from app.services.finance_ledger_service import init_app as init_finance_ledger
+    init_finance_ledger(app)
+
+    # Tracking pubblico (proposte/risorse) scritto a batch da un thread di flush
+    from app.services.tracking_buffer import init_app as init_tracking_buffer
+    init_tracking_buffer(app)
+
+    # Catalogo inventario: search_text e cache versionata per club
+    from app.services.inventory_catalog_service import init_app as init_inventory_catalog
+    init_inventory_catalog(app)
+
+    # Drive sponsor: contatori cartelle/categorie e nome normalizzato
+    from app.services.sponsor_drive_service import init_app as init_sponsor_drive
+    init_sponsor_drive(app)
+
+    # Ricerca risorse: indice invertito invalidato al commit delle modifiche
+    from app.services.resource_search_service import init_app as init_resource_search
+    init_resource_search(app)
+
+    # Rubrica telefoni CRM (E.164) per il matching delle chat WhatsApp
+    from app.services.phone_directory_service import init_app as init_phone_directory
+    init_phone_directory(app)
+
+    # Timeline contratti e analytics sponsor: cache per club con versione
+    # condivisa in cache_versions, incrementata dalle scritture su sponsor e contratti
+    from app.services.contract_timeline_service import init_app as init_contract_timeline
+    init_contract_timeline(app)
+
+    # Contatori di task e milestone per progetto, aggiornati nella flush
+    from app.services.project_metrics_service import init_app as init_project_metrics
+    init_project_metrics(app)
+
+    # Google Calendar: scritture in batch e sync incrementale in background
+    from app.services.google_calendar_sync import init_app as init_google_calendar_sync
+    init_google_calendar_sync(app)
+
     # JWT error handlers
     @jwt.invalid_token_loader
     def invalid_token_callback(error):
@@ -59,7 +106,35 @@ def create_app():
         }
     })
 
-    # Register blueprints
+    # Register blueprints (saltabili per migrazioni/script: SKIP_BLUEPRINTS=true)
+    if os.getenv('SKIP_BLUEPRINTS', 'false').lower() == 'true':
+        from app import models  # noqa: F401 - metadata per Alembic
+    else:
+        register_blueprints(app)
+
+    # Profiler dei tempi di import all'avvio
+    from app.startup_profile import register_cli as register_startup_profile
+    register_startup_profile(app)
+
+    # Start Automation Scheduler (in development mode)
+    if os.getenv('FLASK_ENV') != 'production' or os.getenv('START_SCHEDULER', 'false').lower() == 'true':
+        from app.services.automation_scheduler import scheduler
+        # Avviato al primo request servito, da un solo processo (lock su file)
+        scheduler.init_app(app)
+
+    # Start WhatsApp Node.js sidecar
+    from app.services.whatsapp_manager import init_app as init_whatsapp
+    init_whatsapp(app)
+
+    # Test endpoint
+    @app.route('/api/test')
+    def test():
+        return {'message': 'CORS working!'}
+
+    return app
+
+
+def register_blueprints(app):
     from app.routes.admin_routes import admin_bp
     from app.routes.club_routes import club_bp
     from app.routes.sponsor_routes import sponsor_bp
@@ -220,20 +295,3 @@ def create_app():
     app.register_blueprint(catalog_bp, url_prefix='/api/club')
     # Club Activation Blueprint (public routes)
     app.register_blueprint(club_activation_bp, url_prefix='/api')
-
-    # Start Automation Scheduler (in development mode)
-    if os.getenv('FLASK_ENV') != 'production' or os.getenv('START_SCHEDULER', 'false').lower() == 'true':
-        from app.services.automation_scheduler import scheduler
-        scheduler.init_app(app)
-        # Lo scheduler verrà avviato manualmente o dal run.py
-
-    # Start WhatsApp Node.js sidecar
-    from app.services.whatsapp_manager import init_app as init_whatsapp
-    init_whatsapp(app)
-
-    # Test endpoint
-    @app.route('/api/test')
-    def test():
-        return {'message': 'CORS working!'}
-
-    return app
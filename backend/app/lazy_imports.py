@@ -0,0 +1,64 @@
+"""
+Import differiti per le dipendenze pesanti (WeasyPrint, qrcode, requests, ...).
+
+    weasyprint = lazy_import('weasyprint')
+    weasyprint.HTML(string=html)      # il modulo viene importato qui
+
+Il modulo reale viene caricato al primo accesso a un attributo; il tempo di
+import è registrato e consultabile con loaded_modules() (usato dal comando
+`flask profile-startup`).
+"""
+import importlib
+import threading
+import time
+
+
+_registry = {}
+_registry_lock = threading.Lock()
+
+
+class LazyModule:
+    """Proxy che importa il modulo al primo accesso a un attributo"""
+
+    def __init__(self, name):
+        self.__dict__['_lazy_name'] = name
+        self.__dict__['_lazy_module'] = None
+
+    def _load(self):
+        module = self.__dict__['_lazy_module']
+        if module is None:
+            name = self.__dict__['_lazy_name']
+            started = time.perf_counter()
+            module = importlib.import_module(name)
+            elapsed = (time.perf_counter() - started) * 1000
+            self.__dict__['_lazy_module'] = module
+            with _registry_lock:
+                _registry[name]['loaded_ms'] = round(elapsed, 2)
+        return module
+
+    def __getattr__(self, attr):
+        return getattr(self._load(), attr)
+
+    def __setattr__(self, attr, value):
+        setattr(self._load(), attr, value)
+
+    def __repr__(self):
+        name = self.__dict__['_lazy_name']
+        state = 'loaded' if self.__dict__['_lazy_module'] is not None else 'not loaded'
+        return f'<LazyModule {name} ({state})>'
+
+
+def lazy_import(name):
+    """Ritorna un proxy condiviso per il modulo `name` (import al primo uso)"""
+    with _registry_lock:
+        entry = _registry.get(name)
+        if entry is None:
+            entry = {'proxy': LazyModule(name), 'loaded_ms': None}
+            _registry[name] = entry
+        return entry['proxy']
+
+
+def loaded_modules():
+    """{nome modulo: ms di import oppure None se mai usato}"""
+    with _registry_lock:
+        return {name: entry['loaded_ms'] for name, entry in _registry.items()}
@@ -667,6 +667,29 @@ class ContactPerson(db.Model):
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
 
+class PhoneDirectoryEntry(db.Model):
+    """
+    Rubrica telefoni CRM (Club, Lead, ContactPerson) con numero normalizzato
+    E.164, mantenuta dai listener di phone_directory_service.
+    """
+    __tablename__ = 'phone_directory'
+    __table_args__ = (
+        db.UniqueConstraint('entity_type', 'entity_id', name='uq_phone_directory_entity'),
+        db.Index('ix_phone_directory_phone', 'phone_e164'),
+        db.Index('ix_phone_directory_listing', 'nome', 'id'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    entity_type = db.Column(db.String(20), nullable=False)  # club, lead, contatto
+    entity_id = db.Column(db.Integer, nullable=False)
+    telefono = db.Column(db.String(30), nullable=False)  # come inserito
+    phone_e164 = db.Column(db.String(16))  # None se non normalizzabile
+    nome = db.Column(db.String(300), nullable=False, default='')
+    email = db.Column(db.String(120))
+    ruolo = db.Column(db.String(150))
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+
 class Note(db.Model):
     """Nota con timestamp per Lead o Sponsor"""
     __tablename__ = 'crm_notes'
@@ -734,6 +757,10 @@ class Fattura(db.Model):
 
 class HeadOfTerms(db.Model):
     __tablename__ = 'head_of_terms'
+    __table_args__ = (
+        db.Index('ix_head_of_terms_club_timeline', 'club_id', 'status', 'data_fine'),
+        db.Index('ix_head_of_terms_sponsor_timeline', 'sponsor_id', 'status', 'data_fine'),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     club_id = db.Column(db.Integer, db.ForeignKey('clubs.id'), nullable=False)
@@ -838,6 +865,9 @@ class Document(db.Model):
 class SponsorDriveFile(db.Model):
     """File nel drive condiviso tra club e sponsor - può essere collegato a contratti, attivazioni, asset"""
     __tablename__ = 'sponsor_drive_files'
+    __table_args__ = (
+        db.Index('ix_sponsor_drive_files_listing', 'club_id', 'sponsor_id', 'stato', 'created_at', 'id'),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     club_id = db.Column(db.Integer, db.ForeignKey('clubs.id'), nullable=False)
@@ -845,6 +875,7 @@ class SponsorDriveFile(db.Model):
 
     # Dati file
     nome = db.Column(db.String(300), nullable=False)
+    nome_search = db.Column(db.String(300))  # nome normalizzato per la ricerca (mantenuto dagli eventi ORM)
     file_url = db.Column(db.String(500), nullable=False)
     file_size = db.Column(db.Integer)  # bytes
     file_type = db.Column(db.String(100))  # mime type: application/pdf, image/png, etc.
@@ -895,6 +926,28 @@ class SponsorDriveFile(db.Model):
     inventory_asset = db.relationship('InventoryAsset', backref='drive_files')
 
 
+class SponsorDriveCounter(db.Model):
+    """
+    Contatori del drive sponsor per dimensione (totale, cartella, categoria,
+    collegamento), aggiornati a ogni scrittura di SponsorDriveFile. Le righe
+    'cartella' formano l'albero cartelle materializzato (antenati inclusi).
+    """
+    __tablename__ = 'sponsor_drive_counters'
+
+    club_id = db.Column(db.Integer, db.ForeignKey('clubs.id', ondelete='CASCADE'), primary_key=True)
+    sponsor_id = db.Column(db.Integer, db.ForeignKey('sponsors.id', ondelete='CASCADE'), primary_key=True)
+    dimensione = db.Column(db.String(20), primary_key=True)  # totale, cartella, categoria, collegamento
+    valore = db.Column(db.String(500), primary_key=True)  # '*', path cartella, categoria, contract/activation/asset
+
+    # File attivi (tutti / visibili allo sponsor)
+    files_count = db.Column(db.Integer, default=0, nullable=False)
+    bytes_total = db.Column(db.BigInteger, default=0, nullable=False)
+    sponsor_files_count = db.Column(db.Integer, default=0, nullable=False)
+    sponsor_bytes_total = db.Column(db.BigInteger, default=0, nullable=False)
+
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+
 class Media(db.Model):
     __tablename__ = 'media'
 
@@ -1904,11 +1957,14 @@ class Project(db.Model):
             'priorita': self.priorita,
             'progresso_percentuale': self.progresso_percentuale,
             'budget_allocato': float(self.budget_allocato) if self.budget_allocato else None,
-            'milestones_count': self.milestones.count(),
-            'milestones_completati': self.milestones.filter_by(stato='completato').count(),
-            'tasks_count': self.tasks.count(),
-            'tasks_completati': self.tasks.filter_by(stato='completato').count(),
-            'updates_count': self.updates.count(),
+            # Contatori mantenuti in project_metrics (caricati in join col progetto)
+            'milestones_count': self.metrics.milestones_total if self.metrics else 0,
+            'milestones_completati': self.metrics.milestones_completati if self.metrics else 0,
+            'milestones_in_ritardo': self.metrics.milestones_in_ritardo if self.metrics else 0,
+            'tasks_count': self.metrics.tasks_total if self.metrics else 0,
+            'tasks_completati': self.metrics.tasks_completati if self.metrics else 0,
+            'tasks_in_ritardo': self.metrics.tasks_in_ritardo if self.metrics else 0,
+            'updates_count': self.metrics.updates_total if self.metrics else 0,
             'created_at': self.created_at.isoformat(),
             'updated_at': self.updated_at.isoformat(),
             'archived_at': self.archived_at.isoformat() if self.archived_at else None
@@ -1922,19 +1978,20 @@ class Project(db.Model):
         return data
 
     def calculate_progress(self):
-        total_tasks = self.tasks.count()
-        if total_tasks == 0:
+        if not self.metrics or self.metrics.tasks_total == 0:
             return 0
-        completed_tasks = self.tasks.filter_by(stato='completato').count()
-        return int((completed_tasks / total_tasks) * 100)
+        return int((self.metrics.tasks_completati / self.metrics.tasks_total) * 100)
 
     def update_progress(self):
+        # progresso_percentuale è aggiornato nella flush delle task (ProjectMetricsService)
         self.progresso_percentuale = self.calculate_progress()
-        db.session.commit()
 
 
 class ProjectMilestone(db.Model):
     __tablename__ = 'project_milestones'
+    __table_args__ = (
+        db.Index('ix_project_milestones_due', 'project_id', 'stato', 'data_scadenza'),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     project_id = db.Column(db.Integer, db.ForeignKey('projects.id'), nullable=False)
@@ -1976,6 +2033,9 @@ class ProjectMilestone(db.Model):
 
 class ProjectTask(db.Model):
     __tablename__ = 'project_tasks'
+    __table_args__ = (
+        db.Index('ix_project_tasks_due', 'project_id', 'stato', 'data_scadenza'),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     project_id = db.Column(db.Integer, db.ForeignKey('projects.id'), nullable=False)
@@ -2066,7 +2126,6 @@ class ProjectTask(db.Model):
         self.stato = 'completato'
         self.completato_il = datetime.utcnow()
         db.session.commit()
-        self.project.update_progress()
 
 
 class ProjectUpdate(db.Model):
@@ -2118,6 +2177,39 @@ class ProjectUpdate(db.Model):
         return 'Unknown'
 
 
+class ProjectMetrics(db.Model):
+    """Contatori di task, milestone e aggiornamenti per progetto, aggiornati a ogni scrittura"""
+    __tablename__ = 'project_metrics'
+
+    project_id = db.Column(db.Integer, db.ForeignKey('projects.id', ondelete='CASCADE'), primary_key=True)
+
+    tasks_total = db.Column(db.Integer, default=0, nullable=False)
+    tasks_completati = db.Column(db.Integer, default=0, nullable=False)
+    tasks_in_corso = db.Column(db.Integer, default=0, nullable=False)
+    tasks_in_ritardo = db.Column(db.Integer, default=0, nullable=False)
+    milestones_total = db.Column(db.Integer, default=0, nullable=False)
+    milestones_completati = db.Column(db.Integer, default=0, nullable=False)
+    milestones_in_ritardo = db.Column(db.Integer, default=0, nullable=False)
+    updates_total = db.Column(db.Integer, default=0, nullable=False)
+
+    # Prima scadenza futura aperta: fino ad allora i conteggi in ritardo sono validi
+    ritardi_task_fino = db.Column(db.DateTime)
+    ritardi_milestone_fino = db.Column(db.Date)
+
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    project = db.relationship('Project', backref=db.backref('metrics', uselist=False, lazy='joined',
+                                                           cascade='all, delete-orphan', passive_deletes=True))
+
+    def is_stale(self, now=None, today=None):
+        """True se una scadenza è passata dall'ultimo ricalcolo dei ritardi"""
+        from datetime import date
+        now = now or datetime.utcnow()
+        today = today or date.today()
+        return ((self.ritardi_task_fino is not None and now > self.ritardi_task_fino) or
+                (self.ritardi_milestone_fino is not None and today > self.ritardi_milestone_fino))
+
+
 class TaskComment(db.Model):
     __tablename__ = 'task_comments'
 
@@ -2175,6 +2267,10 @@ class TaskComment(db.Model):
 
 class Notification(db.Model):
     __tablename__ = 'notifications'
+    __table_args__ = (
+        # Dedup del fan-out: destinatari che hanno già la notifica (tipo, oggetto)
+        db.Index('ix_notifications_dedup', 'oggetto_type', 'oggetto_id', 'tipo', 'user_type', 'user_id', 'created_at'),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
 
@@ -2248,6 +2344,16 @@ class Notification(db.Model):
         return notification
 
 
+class AdminNotificationScanState(db.Model):
+    """Watermark dei generatori di notifiche admin (scansioni incrementali)"""
+    __tablename__ = 'admin_notification_scan_state'
+
+    generatore = db.Column(db.String(50), primary_key=True)
+    watermark = db.Column(db.DateTime)  # inizio dell'ultima scansione completata
+    creati = db.Column(db.Integer, default=0, nullable=False)  # notifiche create dall'ultima scansione
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+
 # ============================================================================
 # BUDGET & FINANCIAL MANAGEMENT MODELS
 # ============================================================================
@@ -3401,7 +3507,9 @@ class InventoryCategory(db.Model):
     club = db.relationship('Club', backref='inventory_categories')
     assets = db.relationship('InventoryAsset', backref='category', lazy=True, cascade='all, delete-orphan')
 
-    def to_dict(self):
+    def to_dict(self, assets_count=None):
+        if assets_count is None:
+            assets_count = len(self.assets) if self.assets else 0
         return {
             'id': self.id,
             'club_id': self.club_id,
@@ -3412,7 +3520,7 @@ class InventoryCategory(db.Model):
             'colore': self.colore,
             'ordine': self.ordine,
             'attivo': self.attivo,
-            'assets_count': len(self.assets) if self.assets else 0,
+            'assets_count': assets_count,
             'created_at': self.created_at.isoformat() if self.created_at else None
         }
 
@@ -3470,16 +3578,24 @@ class InventoryAsset(db.Model):
     data_archiviazione = db.Column(db.DateTime)
     motivo_archiviazione = db.Column(db.Text)
 
+    # Testo normalizzato per la ricerca (nome, descrizioni, posizione, tags),
+    # mantenuto da inventory_catalog_service
+    search_text = db.Column(db.Text)
+
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
+    __table_args__ = (
+        db.Index('ix_inventory_assets_club_order', 'club_id', 'ordine', 'nome', 'id'),
+    )
+
     # Relazioni
     club = db.relationship('Club', backref='inventory_assets')
     pricing_tiers = db.relationship('AssetPricingTier', backref='asset', lazy=True, cascade='all, delete-orphan')
     availabilities = db.relationship('AssetAvailability', backref='asset', lazy=True, cascade='all, delete-orphan')
     allocations = db.relationship('AssetAllocation', backref='asset', lazy=True, cascade='all, delete-orphan')
 
-    def to_dict(self, include_pricing=False, include_availability=False):
+    def to_dict(self, include_pricing=False, include_availability=False, category=None):
         import json
 
         # Parse JSON fields
@@ -3508,7 +3624,7 @@ class InventoryAsset(db.Model):
             'id': self.id,
             'club_id': self.club_id,
             'category_id': self.category_id,
-            'category': self.category.to_dict() if self.category else None,
+            'category': category if category is not None else (self.category.to_dict() if self.category else None),
             'nome': self.nome,
             'descrizione': self.descrizione,
             'descrizione_breve': self.descrizione_breve,
@@ -5164,6 +5280,11 @@ class ProposalTracking(db.Model):
 
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
 
+    __table_args__ = (
+        db.Index('ix_proposal_tracking_proposal_created', 'proposal_id', 'created_at'),
+        db.Index('ix_proposal_tracking_created', 'created_at', 'id'),
+    )
+
     def to_dict(self):
         return {
             'id': self.id,
@@ -5180,6 +5301,84 @@ class ProposalTracking(db.Model):
         }
 
 
+class ProposalDailyStat(db.Model):
+    """Aggregato giornaliero del tracking di una proposta (rollup incrementale)"""
+    __tablename__ = 'proposal_daily_stats'
+
+    proposal_id = db.Column(db.Integer, db.ForeignKey('proposals.id', ondelete='CASCADE'), primary_key=True)
+    giorno = db.Column(db.Date, primary_key=True)
+
+    eventi = db.Column(db.Integer, default=0, nullable=False)
+    visualizzazioni = db.Column(db.Integer, default=0, nullable=False)
+    nuovi_visitatori = db.Column(db.Integer, default=0, nullable=False)  # Visitatori unici alla prima visita
+    download = db.Column(db.Integer, default=0, nullable=False)
+    tempo_totale = db.Column(db.Integer, default=0, nullable=False)  # Secondi
+
+    def to_dict(self):
+        return {
+            'giorno': self.giorno.isoformat() if self.giorno else None,
+            'eventi': self.eventi,
+            'visualizzazioni': self.visualizzazioni,
+            'nuovi_visitatori': self.nuovi_visitatori,
+            'download': self.download,
+            'tempo_totale': self.tempo_totale
+        }
+
+
+class ProposalSectionStat(db.Model):
+    """Aggregato per sezione: eventi e tempo di permanenza"""
+    __tablename__ = 'proposal_section_stats'
+
+    proposal_id = db.Column(db.Integer, db.ForeignKey('proposals.id', ondelete='CASCADE'), primary_key=True)
+    sezione = db.Column(db.String(100), primary_key=True)
+
+    eventi = db.Column(db.Integer, default=0, nullable=False)
+    tempo_totale = db.Column(db.Integer, default=0, nullable=False)  # Secondi
+    eventi_con_durata = db.Column(db.Integer, default=0, nullable=False)
+
+    def to_dict(self):
+        return {
+            'sezione': self.sezione,
+            'eventi': self.eventi,
+            'tempo_totale': self.tempo_totale,
+            'tempo_medio': round(self.tempo_totale / self.eventi_con_durata, 1) if self.eventi_con_durata else 0
+        }
+
+
+class ProposalVisitor(db.Model):
+    """Visitatore unico di una proposta (fingerprint IP + User-Agent)"""
+    __tablename__ = 'proposal_visitors'
+
+    proposal_id = db.Column(db.Integer, db.ForeignKey('proposals.id', ondelete='CASCADE'), primary_key=True)
+    fingerprint = db.Column(db.String(40), primary_key=True)
+
+    prima_visita = db.Column(db.DateTime)
+    ultima_visita = db.Column(db.DateTime)
+    visualizzazioni = db.Column(db.Integer, default=0, nullable=False)
+    tempo_totale = db.Column(db.Integer, default=0, nullable=False)
+    ha_scaricato = db.Column(db.Boolean, default=False, nullable=False)
+
+
+class AnalyticsRollupState(db.Model):
+    """Watermark dei rollup incrementali (ultima riga sorgente elaborata: created_at, id)"""
+    __tablename__ = 'analytics_rollup_state'
+
+    nome = db.Column(db.String(100), primary_key=True)
+    last_id = db.Column(db.Integer, default=0, nullable=False)
+    last_created_at = db.Column(db.DateTime)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+
+class CacheVersion(db.Model):
+    """Versione per club delle cache in memoria (incrementata nella transazione di ogni scrittura)"""
+    __tablename__ = 'cache_versions'
+
+    scope = db.Column(db.String(50), primary_key=True)  # inventory, contract_timeline, sponsor_analytics
+    club_id = db.Column(db.Integer, primary_key=True)
+    version = db.Column(db.Integer, default=0, nullable=False)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+
 class ProposalComment(db.Model):
     """Commenti interni sulla proposta"""
     __tablename__ = 'proposal_comments'
@@ -5820,6 +6019,9 @@ class CRMLead(db.Model):
 class CRMLeadActivity(db.Model):
     """Attività/interazioni con un CRM lead (admin)"""
     __tablename__ = 'crm_lead_activities'
+    __table_args__ = (
+        db.Index('ix_crm_lead_activities_lead_created', 'lead_id', 'created_at'),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     lead_id = db.Column(db.Integer, db.ForeignKey('crm_leads.id'), nullable=False)
@@ -6582,6 +6784,57 @@ class AdminInvoice(db.Model):
         }
 
 
+class InvoiceSequence(db.Model):
+    """Contatore numeri fattura per prefisso e anno (es. PP-2026-0001)"""
+    __tablename__ = 'invoice_sequences'
+
+    prefix = db.Column(db.String(20), primary_key=True, default='PP')
+    year = db.Column(db.Integer, primary_key=True)
+    last_number = db.Column(db.Integer, default=0, nullable=False)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    def to_dict(self):
+        return {
+            'prefix': self.prefix,
+            'year': self.year,
+            'last_number': self.last_number,
+            'updated_at': self.updated_at.isoformat() if self.updated_at else None
+        }
+
+
+class AdminContractLedger(db.Model):
+    """Saldo progressivo per contratto, aggiornato a ogni scrittura di AdminInvoice"""
+    __tablename__ = 'admin_contract_ledgers'
+
+    contract_id = db.Column(db.Integer, db.ForeignKey('admin_contracts.id', ondelete='CASCADE'), primary_key=True)
+    club_id = db.Column(db.Integer, db.ForeignKey('clubs.id'), nullable=False, index=True)
+
+    # Totali fatture (con IVA), escluse le fatture annullate
+    invoice_count = db.Column(db.Integer, default=0, nullable=False)
+    invoiced_total = db.Column(db.Float, default=0, nullable=False)
+    paid_count = db.Column(db.Integer, default=0, nullable=False)
+    paid_total = db.Column(db.Float, default=0, nullable=False)
+    outstanding_total = db.Column(db.Float, default=0, nullable=False)  # emesso - pagato
+    last_payment_date = db.Column(db.Date)
+
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    contract = db.relationship('AdminContract', backref=db.backref('ledger', uselist=False, passive_deletes=True))
+
+    def to_dict(self):
+        return {
+            'contract_id': self.contract_id,
+            'club_id': self.club_id,
+            'invoice_count': self.invoice_count,
+            'invoiced_total': self.invoiced_total,
+            'paid_count': self.paid_count,
+            'paid_total': self.paid_total,
+            'outstanding_total': self.outstanding_total,
+            'last_payment_date': self.last_payment_date.isoformat() if self.last_payment_date else None,
+            'updated_at': self.updated_at.isoformat() if self.updated_at else None
+        }
+
+
 # ============================================================
 # Contract Document Models (Template PDF + Firma Digitale)
 # ============================================================
@@ -6877,6 +7130,10 @@ class AdminTask(db.Model):
 class AdminCalendarEvent(db.Model):
     """Eventi calendario admin (appuntamenti, demo, meeting, ecc.)"""
     __tablename__ = 'admin_calendar_events'
+    __table_args__ = (
+        # Unico: la sync fa upsert su (admin, evento Google)
+        db.Index('ix_admin_calendar_events_admin_google', 'admin_id', 'google_event_id', unique=True),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     admin_id = db.Column(db.Integer, db.ForeignKey('admins.id'), nullable=True)
@@ -6926,6 +7183,61 @@ class AdminCalendarEvent(db.Model):
         }
 
 
+class GoogleCalendarSyncState(db.Model):
+    """Stato sync incrementale Google Calendar per admin (syncToken ed esito ultima sync)"""
+    __tablename__ = 'google_calendar_sync_state'
+
+    admin_id = db.Column(db.Integer, db.ForeignKey('admins.id', ondelete='CASCADE'), primary_key=True)
+    sync_token = db.Column(db.Text, nullable=True)
+    last_sync_at = db.Column(db.DateTime, nullable=True)
+    last_full_sync_at = db.Column(db.DateTime, nullable=True)
+    last_error = db.Column(db.Text, nullable=True)
+    creati = db.Column(db.Integer, default=0)
+    aggiornati = db.Column(db.Integer, default=0)
+    eliminati = db.Column(db.Integer, default=0)
+    # Sync richiesta e non ancora eseguita (ripresa dal job dello scheduler)
+    sync_richiesta = db.Column(db.Boolean, default=False)
+    sync_completa_richiesta = db.Column(db.Boolean, default=False)
+    # Lease: un solo processo alla volta invia scritture e legge modifiche per admin
+    lease_owner = db.Column(db.String(100), nullable=True)
+    lease_until = db.Column(db.DateTime, nullable=True)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    def to_dict(self):
+        return {
+            'admin_id': self.admin_id,
+            'incrementale': bool(self.sync_token),
+            'in_attesa': bool(self.sync_richiesta),
+            'last_sync_at': self.last_sync_at.isoformat() if self.last_sync_at else None,
+            'last_full_sync_at': self.last_full_sync_at.isoformat() if self.last_full_sync_at else None,
+            'last_error': self.last_error,
+            'stats': {
+                'created': self.creati or 0,
+                'updated': self.aggiornati or 0,
+                'deleted': self.eliminati or 0
+            }
+        }
+
+
+class GoogleCalendarOutbox(db.Model):
+    """Scritture verso Google Calendar in attesa di invio (insert/update/delete), una riga per modifica"""
+    __tablename__ = 'google_calendar_outbox'
+    __table_args__ = (
+        db.Index('ix_google_calendar_outbox_admin', 'admin_id', 'id'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    admin_id = db.Column(db.Integer, db.ForeignKey('admins.id', ondelete='CASCADE'), nullable=False)
+    event_id = db.Column(db.Integer, nullable=True)  # evento locale (può essere già eliminato)
+    google_event_id = db.Column(db.String(255), nullable=True)
+    action = db.Column(db.String(10), nullable=False)  # insert, update, delete
+    body = db.Column(db.JSON, nullable=True)
+    meet = db.Column(db.Boolean, default=False)
+    tentativi = db.Column(db.Integer, default=0)
+    last_error = db.Column(db.Text, nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+
 class AdminAvailability(db.Model):
     """Disponibilita settimanale admin per booking demo"""
     __tablename__ = 'admin_availability'
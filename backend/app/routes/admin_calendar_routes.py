@@ -64,6 +64,8 @@ def get_events():
         query = query.filter(AdminCalendarEvent.tipo == tipo)
 
     events = query.order_by(AdminCalendarEvent.data_inizio.asc()).all()
+
+    # Le viste leggono solo il DB locale: la sync con Google gira nello scheduler
     return jsonify([e.to_dict() for e in events]), 200
 
 
@@ -98,22 +100,20 @@ def create_event():
     )
 
     db.session.add(event)
-    db.session.commit()
 
-    # Google Calendar sync (con Meet opzionale)
+    # Google Calendar sync (con Meet opzionale): la scrittura entra nell'outbox
+    # nella stessa transazione dell'evento
+    from app.services.google_calendar_sync import google_calendar_sync
     try:
-        from app.services.google_calendar_service import google_calendar_service
-        admin = Admin.query.get(int(admin_id))
-        if admin and google_calendar_service.is_connected(admin):
-            result = google_calendar_service.create_event(admin, data, genera_meet=genera_meet)
-            if result:
-                event.google_event_id = result.get('google_event_id')
-                if result.get('meet_link'):
-                    event.meet_link = result['meet_link']
-                db.session.commit()
+        google_calendar_sync.push_create(Admin.query.get(int(admin_id)), event, genera_meet=genera_meet)
     except Exception as e:
         print(f"Google sync on create: {e}")
 
+    db.session.commit()
+
+    # Il link Meet serve nella risposta: invio immediato (se fallisce resta in outbox)
+    google_calendar_sync.deliver(event.admin_id, urgent=genera_meet)
+
     log_action('create', 'calendar_event', event.id, f"Creato evento: {event.titolo}")
 
     # Trigger automazione
@@ -172,18 +172,17 @@ def update_event(event_id):
     if 'note' in data:
         event.note = data['note']
 
-    db.session.commit()
-
-    # Google Calendar sync
+    # Google Calendar sync (outbox, stessa transazione)
+    from app.services.google_calendar_sync import google_calendar_sync
+    admin = Admin.query.get(int(get_jwt_identity()))
     try:
-        from app.services.google_calendar_service import google_calendar_service
-        admin_id = get_jwt_identity()
-        admin = Admin.query.get(int(admin_id))
-        if admin and google_calendar_service.is_connected(admin) and event.google_event_id:
-            google_calendar_service.update_event(admin, event.google_event_id, event.to_dict())
+        google_calendar_sync.push_update(admin, event)
     except Exception as e:
         print(f"Google sync on update: {e}")
 
+    db.session.commit()
+    google_calendar_sync.deliver(admin.id if admin else None)
+
     log_action('update', 'calendar_event', event.id, f"Aggiornato evento: {event.titolo}")
 
     return jsonify(event.to_dict()), 200
@@ -199,19 +198,20 @@ def delete_event(event_id):
     if not event:
         return jsonify({'error': 'Evento non trovato'}), 404
 
-    # Google Calendar delete
+    titolo = event.titolo
+    google_event_id = event.google_event_id
+    db.session.delete(event)
+
+    # Google Calendar delete (outbox, stessa transazione)
+    from app.services.google_calendar_sync import google_calendar_sync
+    admin = Admin.query.get(int(get_jwt_identity()))
     try:
-        from app.services.google_calendar_service import google_calendar_service
-        admin_id = get_jwt_identity()
-        admin = Admin.query.get(int(admin_id))
-        if admin and google_calendar_service.is_connected(admin) and event.google_event_id:
-            google_calendar_service.delete_event(admin, event.google_event_id)
+        google_calendar_sync.push_delete(admin, event_id, google_event_id)
     except Exception as e:
         print(f"Google sync on delete: {e}")
 
-    titolo = event.titolo
-    db.session.delete(event)
     db.session.commit()
+    google_calendar_sync.deliver(admin.id if admin else None)
 
     log_action('delete', 'calendar_event', event_id, f"Eliminato evento: {titolo}")
 
@@ -342,13 +342,19 @@ def google_status():
         return jsonify({'error': 'Accesso non autorizzato'}), 403
 
     from app.services.google_calendar_service import google_calendar_service
+    from app.services.google_calendar_sync import google_calendar_sync
+    from app.models import GoogleCalendarSyncState
 
     admin_id = get_jwt_identity()
     admin = Admin.query.get(int(admin_id))
+    connected = google_calendar_service.is_connected(admin) if admin else False
+    state = GoogleCalendarSyncState.query.get(admin.id) if connected else None
 
     return jsonify({
         'configured': google_calendar_service.is_configured,
-        'connected': google_calendar_service.is_connected(admin) if admin else False
+        'connected': connected,
+        'sync': state.to_dict() if state else None,
+        'scritture_in_coda': google_calendar_sync.pending_count(admin.id) if connected else 0
     }), 200
 
 
@@ -385,6 +391,10 @@ def google_callback():
 
     success = google_calendar_service.handle_callback(admin, code)
     if success:
+        # Prima sync completa: avviata in un thread (se il lease è occupato la esegue il job)
+        from app.services.google_calendar_sync import google_calendar_sync
+        google_calendar_sync.request_sync(admin.id, full=True)
+
         # Redirect to frontend calendar page
         frontend_url = os.environ.get('FRONTEND_URL', 'http://localhost:3001')
         return f'<html><script>window.location.href="{frontend_url}/admin/calendario?google=connected"</script></html>'
@@ -399,6 +409,8 @@ def google_sync():
         return jsonify({'error': 'Accesso non autorizzato'}), 403
 
     from app.services.google_calendar_service import google_calendar_service
+    from app.services.google_calendar_sync import google_calendar_sync
+    from app.models import GoogleCalendarSyncState
 
     admin_id = get_jwt_identity()
     admin = Admin.query.get(int(admin_id))
@@ -406,16 +418,21 @@ def google_sync():
     if not admin or not google_calendar_service.is_connected(admin):
         return jsonify({'error': 'Google Calendar non connesso'}), 400
 
-    now = datetime.utcnow()
-    start = now - timedelta(days=30)
-    end = now + timedelta(days=90)
-
-    stats = google_calendar_service.sync_events(admin, start, end)
+    # Incrementale (syncToken); ?full=true riparte dalla finestra completa
+    full = request.args.get('full', 'false').lower() == 'true'
+    stats = google_calendar_sync.request_sync(admin.id, full=full)
+    if stats is not None:
+        return jsonify({
+            'message': 'Sincronizzazione completata',
+            'stats': stats
+        }), 200
 
+    state = GoogleCalendarSyncState.query.get(admin.id)
     return jsonify({
-        'message': 'Sincronizzazione completata',
-        'stats': stats
-    }), 200
+        'message': 'Sincronizzazione avviata',
+        'stats': state.to_dict()['stats'] if state else {'created': 0, 'updated': 0, 'deleted': 0},
+        'sync': state.to_dict() if state else None
+    }), 202
 
 
 @admin_calendar_bp.route('/calendar/google/disconnect', methods=['POST'])
@@ -432,6 +449,9 @@ def google_disconnect():
     if admin:
         google_calendar_service.disconnect(admin)
 
+        from app.services.google_calendar_sync import google_calendar_sync
+        google_calendar_sync.forget(admin.id)
+
     return jsonify({'message': 'Google Calendar disconnesso'}), 200
 
 
@@ -1,7 +1,7 @@
 from flask import Blueprint, request, jsonify
 from flask_jwt_extended import jwt_required, get_jwt_identity, get_jwt
 from app import db
-from app.models import AdminContract, AdminInvoice, Club, ClubActivity, Admin
+from app.models import AdminContract, AdminInvoice, AdminContractLedger, Club, ClubActivity, Admin
 from datetime import datetime, date
 from sqlalchemy import func
 
@@ -252,8 +252,9 @@ def delete_contract(contract_id):
     if paid_invoices > 0:
         return jsonify({'error': 'Impossibile eliminare un contratto con fatture pagate'}), 400
 
-    # Elimina fatture associate non pagate
+    # Elimina fatture associate non pagate e il saldo del contratto
     AdminInvoice.query.filter_by(contract_id=contract_id).delete()
+    AdminContractLedger.query.filter_by(contract_id=contract_id).delete()
 
     db.session.delete(contract)
     db.session.commit()
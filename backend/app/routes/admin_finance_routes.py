@@ -2,7 +2,9 @@ from flask import Blueprint, request, jsonify
 from flask_jwt_extended import jwt_required, get_jwt_identity, get_jwt
 from app import db
 from app.models import AdminContract, AdminInvoice, Club
-from datetime import datetime, date, timedelta
+from app.services.finance_ledger_service import FinanceLedgerService
+from app.services.billing_service import InvoiceSequenceService, BillingRunService
+from datetime import datetime, date
 from sqlalchemy import func, extract
 
 admin_finance_bp = Blueprint('admin_finance', __name__)
@@ -17,20 +19,8 @@ def verify_admin():
 
 
 def generate_invoice_number():
-    """Genera un numero fattura univoco"""
-    year = datetime.now().year
-    # Trova l'ultimo numero fattura dell'anno
-    last_invoice = AdminInvoice.query.filter(
-        AdminInvoice.invoice_number.ilike(f'PP-{year}-%')
-    ).order_by(AdminInvoice.id.desc()).first()
-
-    if last_invoice:
-        last_num = int(last_invoice.invoice_number.split('-')[-1])
-        new_num = last_num + 1
-    else:
-        new_num = 1
-
-    return f'PP-{year}-{new_num:04d}'
+    """Genera un numero fattura univoco (riservato nella transazione corrente)"""
+    return InvoiceSequenceService.allocate(1)[0]
 
 
 # ========================================
@@ -271,130 +261,9 @@ def get_finance_dashboard():
         return jsonify({'error': 'Accesso non autorizzato'}), 403
 
     year = request.args.get('year', datetime.now().year, type=int)
-    today = date.today()
-
-    # === ARR (Annual Recurring Revenue) - con IVA ===
-    active_contracts = AdminContract.query.filter(
-        AdminContract.status == 'active'
-    ).all()
-    total_arr = sum(c.total_value_with_vat for c in active_contracts)
-    mrr = total_arr / 12
-
-    # ARR per piano (con IVA)
-    arr_by_plan = {'basic': 0, 'premium': 0, 'elite': 0}
-    for contract in active_contracts:
-        plan = contract.plan_type.lower()
-        if plan in arr_by_plan:
-            arr_by_plan[plan] += contract.total_value_with_vat
-        elif plan == 'kickoff':
-            arr_by_plan['basic'] += contract.total_value_with_vat
-
-    # === CASH-IN (Fatture pagate) ===
-    # Totale anno
-    paid_invoices_year = AdminInvoice.query.filter(
-        AdminInvoice.status == 'paid',
-        extract('year', AdminInvoice.payment_date) == year
-    ).all()
-    total_cash_in_year = sum(inv.total_amount for inv in paid_invoices_year)
-
-    # Cash-in per mese
-    cash_in_by_month = {}
-    for month in range(1, 13):
-        month_invoices = [inv for inv in paid_invoices_year
-                        if inv.payment_date and inv.payment_date.month == month]
-        cash_in_by_month[month] = sum(inv.total_amount for inv in month_invoices)
-
-    # Cash-in questo mese
-    current_month = today.month
-    cash_in_this_month = cash_in_by_month.get(current_month, 0)
-
-    # === DA INCASSARE (basato sui contratti con IVA, non solo fatture) ===
-    # Totale pagato da tutti i contratti attivi
-    total_paid_from_contracts = 0
-    for contract in active_contracts:
-        contract_invoices = AdminInvoice.query.filter_by(contract_id=contract.id, status='paid').all()
-        total_paid_from_contracts += sum(inv.total_amount for inv in contract_invoices)
-
-    # Da incassare = valore totale contratti (con IVA) - già pagato (fatture con IVA)
-    total_pending = total_arr - total_paid_from_contracts
-    pending_count = len(active_contracts)  # Numero di contratti attivi
-
-    # Fatture scadute (queste rimangono basate sulle fatture emesse)
-    overdue_invoices = AdminInvoice.query.filter(
-        AdminInvoice.status.in_(['pending', 'overdue']),
-        AdminInvoice.due_date < today
-    ).all()
-    total_overdue = sum(inv.total_amount for inv in overdue_invoices)
-
-    # Aggiorna status fatture scadute
-    for inv in overdue_invoices:
-        if inv.status != 'overdue':
-            inv.status = 'overdue'
-    db.session.commit()
 
-    # === PREVISIONI ===
-    # Fatture in scadenza nei prossimi 30 giorni
-    next_30_days = today + timedelta(days=30)
-    upcoming_invoices = AdminInvoice.query.filter(
-        AdminInvoice.status == 'pending',
-        AdminInvoice.due_date >= today,
-        AdminInvoice.due_date <= next_30_days
-    ).all()
-    expected_cash_in_30d = sum(inv.total_amount for inv in upcoming_invoices)
-
-    # === RIEPILOGO PER CLUB (con IVA) ===
-    club_stats = []
-    for contract in active_contracts:
-        club = contract.club
-        # Get all invoices for this specific contract
-        contract_invoices = AdminInvoice.query.filter_by(contract_id=contract.id).all()
-        paid = sum(inv.total_amount for inv in contract_invoices if inv.status == 'paid')
-        # "Da Pagare" = valore contratto con IVA - fatture pagate (già con IVA)
-        contract_total = contract.total_value_with_vat
-        pending = contract_total - paid
-
-        club_stats.append({
-            'club_id': club.id,
-            'club_name': club.nome,
-            'club_logo_url': club.logo_url,
-            'plan': contract.plan_type,
-            'contract_value': contract_total,
-            'vat_rate': contract.vat_rate if contract.vat_rate is not None else 22.0,
-            'paid': paid,
-            'pending': max(0, pending),  # Ensure non-negative
-            'balance': max(0, pending)
-        })
-
-    return jsonify({
-        # ARR & MRR
-        'arr': {
-            'total': total_arr,
-            'mrr': mrr,
-            'by_plan': arr_by_plan,
-            'active_contracts': len(active_contracts)
-        },
-        # Cash-in
-        'cash_in': {
-            'year_total': total_cash_in_year,
-            'this_month': cash_in_this_month,
-            'by_month': cash_in_by_month
-        },
-        # Da incassare (basato su contratti attivi)
-        'pending': {
-            'total': max(0, total_pending),
-            'count': pending_count,
-            'overdue_total': total_overdue,
-            'overdue_count': len(overdue_invoices)
-        },
-        # Previsioni
-        'forecast': {
-            'expected_30_days': expected_cash_in_30d
-        },
-        # Per club
-        'by_club': sorted(club_stats, key=lambda x: x['contract_value'], reverse=True),
-        # Anno riferimento
-        'year': year
-    })
+    # ARR, cash-in, saldi per contratto e previsioni con query aggregate
+    return jsonify(FinanceLedgerService.dashboard(year, today=date.today()))
 
 
 @admin_finance_bp.route('/finance/monthly-report', methods=['GET'])
@@ -446,95 +315,17 @@ def generate_invoices():
         return jsonify({'error': 'Accesso non autorizzato'}), 403
 
     data = request.get_json() or {}
-    year = data.get('year', datetime.now().year)
-    month = data.get('month', datetime.now().month)
-
-    # Trova contratti attivi senza fattura per questo mese
-    active_contracts = AdminContract.query.filter(
-        AdminContract.status == 'active'
-    ).all()
-
-    generated = []
-    skipped = []
-
-    for contract in active_contracts:
-        # Verifica se esiste già una fattura per questo periodo
-        existing = AdminInvoice.query.filter(
-            AdminInvoice.contract_id == contract.id,
-            extract('year', AdminInvoice.period_start) == year,
-            extract('month', AdminInvoice.period_start) == month
-        ).first()
-
-        if existing:
-            skipped.append({
-                'contract_id': contract.id,
-                'club_name': contract.club.nome,
-                'reason': 'Fattura già esistente'
-            })
-            continue
-
-        # Calcola importo in base ai termini di pagamento
-        if contract.payment_terms == 'annual':
-            amount = contract.total_value
-        elif contract.payment_terms == 'semi_annual':
-            amount = contract.total_value / 2
-        elif contract.payment_terms == 'quarterly':
-            amount = contract.total_value / 4
-        else:  # monthly
-            amount = contract.total_value / 12
-
-        # Date
-        issue_date = date(year, month, 1)
-        due_date = date(year, month, 28)  # Fine mese circa
-        period_start = issue_date
-        if contract.payment_terms == 'annual':
-            period_end = date(year, 12, 31)
-        elif contract.payment_terms == 'semi_annual':
-            period_end = date(year, month + 5, 28) if month <= 7 else date(year + 1, (month + 5) % 12, 28)
-        elif contract.payment_terms == 'quarterly':
-            period_end = date(year, month + 2, 28) if month <= 10 else date(year + 1, (month + 2) % 12, 28)
-        else:
-            period_end = date(year, month, 28)
-
-        # Calcola IVA
-        vat_rate = 22.0
-        vat_amount = amount * (vat_rate / 100)
-        total_amount = amount + vat_amount
-
-        # Crea fattura
-        invoice = AdminInvoice(
-            contract_id=contract.id,
-            club_id=contract.club_id,
-            invoice_number=generate_invoice_number(),
-            amount=amount,
-            vat_rate=vat_rate,
-            vat_amount=vat_amount,
-            total_amount=total_amount,
-            line_items=[{
-                'description': f'Piano {contract.plan_type.capitalize()} - {contract.club.nome}',
-                'amount': contract.plan_price / (12 if contract.payment_terms == 'monthly' else
-                                                  4 if contract.payment_terms == 'quarterly' else
-                                                  2 if contract.payment_terms == 'semi_annual' else 1)
-            }] + [{'description': addon.get('name'), 'amount': addon.get('price', 0)} for addon in (contract.addons or [])],
-            issue_date=issue_date,
-            due_date=due_date,
-            period_start=period_start,
-            period_end=period_end,
-            status='pending',
-            created_by=get_jwt_identity()
-        )
-
-        db.session.add(invoice)
-        generated.append({
-            'invoice_number': invoice.invoice_number,
-            'club_name': contract.club.nome,
-            'amount': total_amount
-        })
+    year = int(data.get('year', datetime.now().year))
+    month = int(data.get('month', datetime.now().month))
+    dry_run = bool(data.get('dry_run', False))
 
-    db.session.commit()
+    # Contratti e fatture del periodo precaricati, numeri allocati a blocco, INSERT multiplo
+    result = BillingRunService.run(year, month, created_by=get_jwt_identity(), dry_run=dry_run)
 
     return jsonify({
-        'message': f'Generate {len(generated)} fatture',
-        'generated': generated,
-        'skipped': skipped
+        'message': (f"Anteprima: {len(result['generated'])} fatture da generare" if dry_run
+                    else f"Generate {len(result['generated'])} fatture"),
+        'generated': result['generated'],
+        'skipped': result['skipped'],
+        'dry_run': dry_run
     })
@@ -15,13 +15,14 @@ def _require_admin():
     return True
 
 
-# POST - Genera notifiche admin (scansiona DB)
+# POST - Genera notifiche admin (scansione incrementale, anche nello scheduler)
 @admin_notification_bp.route('/notifications/generate', methods=['POST'])
 @jwt_required()
 def generate_notifications():
     if not _require_admin():
         return jsonify({'error': 'Accesso non autorizzato'}), 403
 
+    # Incrementale dal watermark di ogni generatore: legge solo le righe nuove
     results = AdminNotificationService.generate_all()
     return jsonify({
         'message': f'{results["totale"]} nuove notifiche generate',
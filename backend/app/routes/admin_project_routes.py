@@ -1,6 +1,7 @@
 from flask import Blueprint, request, jsonify
 from app import db
 from app.models import Project, ProjectTask, ProjectMilestone, Notification
+from app.services.project_metrics_service import ProjectMetricsService
 from flask_jwt_extended import jwt_required, get_jwt_identity, get_jwt
 from datetime import datetime, timedelta
 from sqlalchemy import func
@@ -38,7 +39,7 @@ def get_all_projects():
         query = query.filter_by(sponsor_id=sponsor_id)
 
     query = query.filter(Project.archived_at.is_(None))
-    projects = query.order_by(Project.created_at.desc()).all()
+    projects = ProjectMetricsService.ensure_fresh(query.order_by(Project.created_at.desc()).all())
 
     return jsonify({
         'projects': [p.to_dict() for p in projects],
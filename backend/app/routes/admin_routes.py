@@ -8,11 +8,12 @@ from app.models import (
     ClubInvoice, ClubActivity, AdminContract, AdminInvoice,
     AdminWorkflow, NewsletterCampaign, AdminTask
 )
+from app.services.auth_service import AuthService, rate_limited_response
 from datetime import datetime, timedelta
 from sqlalchemy import func, and_, or_
 import json
 import os
-import requests as req_lib
+from app.services.whatsapp_client import whatsapp_client
 
 
 def verify_admin():
@@ -55,9 +56,13 @@ def login():
     if not email or not password:
         return jsonify({'error': 'Email e password richiesti'}), 400
 
+    retry_after = AuthService.check_rate_limit(email)
+    if retry_after:
+        return rate_limited_response(retry_after)
+
     admin = Admin.query.filter_by(email=email).first()
 
-    if not admin or not admin.check_password(password):
+    if not admin or not AuthService.verify(admin, password):
         return jsonify({'error': 'Credenziali non valide'}), 401
 
     if not admin.is_active:
@@ -66,6 +71,7 @@ def login():
     # Aggiorna last_login
     admin.last_login = datetime.utcnow()
     db.session.commit()
+    AuthService.login_succeeded(email)
 
     access_token = create_access_token(
         identity=str(admin.id),
@@ -2353,19 +2359,9 @@ def create_club_invoice(club_id):
     if not active_contract:
         return jsonify({'error': 'Nessun contratto attivo per questo club. Crea prima un contratto.'}), 400
 
-    # Genera numero fattura
-    year = datetime.utcnow().year
-    last_invoice = AdminInvoice.query.filter(
-        AdminInvoice.invoice_number.ilike(f'PP-{year}-%')
-    ).order_by(AdminInvoice.id.desc()).first()
-
-    if last_invoice:
-        last_num = int(last_invoice.invoice_number.split('-')[-1])
-        new_num = last_num + 1
-    else:
-        new_num = 1
-
-    invoice_number = f"PP-{year}-{new_num:04d}"
+    # Genera numero fattura (sequenza annuale, riservato nella transazione corrente)
+    from app.services.billing_service import InvoiceSequenceService
+    invoice_number = InvoiceSequenceService.allocate(1)[0]
 
     # Calcola importi
     subtotal = float(data.get('subtotal', 0))
@@ -2696,12 +2692,10 @@ def admin_global_search():
             'link': '/admin/newsletter'
         })
 
-    # Search WhatsApp (proxy to sidecar)
-    sidecar_url = os.getenv('WHATSAPP_SIDECAR_URL', 'http://localhost:3200')
+    # Search WhatsApp (proxy to sidecar, fallisce subito se il circuito è aperto)
     try:
-        wa_resp = req_lib.get(f'{sidecar_url}/search', params={'q': q}, timeout=3)
-        if wa_resp.status_code == 200:
-            wa_data = wa_resp.json()
+        wa_data, wa_status = whatsapp_client.get_json('/search', 'search', params={'q': q})
+        if wa_status == 200:
             for item in (wa_data.get('results') or [])[:limit_per_type]:
                 results.append({
                     'type': 'whatsapp',
@@ -1,13 +1,11 @@
-import os
-import requests
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, Response, request, jsonify, stream_with_context
 from flask_jwt_extended import jwt_required, get_jwt
-from app import db
-from app.models import Club, Lead, ContactPerson
+from app.services.phone_directory_service import PhoneDirectoryService, normalize_phone
+from app.services.whatsapp_client import whatsapp_client, SidecarUnavailable
 
 admin_whatsapp_bp = Blueprint('admin_whatsapp', __name__)
 
-SIDECAR_URL = os.getenv('WHATSAPP_SIDECAR_URL', 'http://localhost:3200')
+SIDECAR_DOWN_ERROR = 'Servizio WhatsApp non raggiungibile. Assicurati che il sidecar sia avviato.'
 
 
 def _require_admin():
@@ -15,24 +13,24 @@ def _require_admin():
     return claims.get('role') == 'admin'
 
 
-def _proxy_get(path, timeout=15):
+def _proxy_get(path, endpoint, cache_key=None):
     """Proxy GET request to the WhatsApp sidecar."""
     try:
-        resp = requests.get(f'{SIDECAR_URL}{path}', timeout=timeout)
-        return jsonify(resp.json()), resp.status_code
-    except requests.ConnectionError:
-        return jsonify({'error': 'Servizio WhatsApp non raggiungibile. Assicurati che il sidecar sia avviato.'}), 502
+        data, status = whatsapp_client.get_json(path, endpoint, cache_key=cache_key)
+        return jsonify(data), status
+    except SidecarUnavailable:
+        return jsonify({'error': SIDECAR_DOWN_ERROR}), 502
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 
-def _proxy_post(path, data=None):
+def _proxy_post(path, endpoint, data=None):
     """Proxy POST request to the WhatsApp sidecar."""
     try:
-        resp = requests.post(f'{SIDECAR_URL}{path}', json=data or {}, timeout=30)
-        return jsonify(resp.json()), resp.status_code
-    except requests.ConnectionError:
-        return jsonify({'error': 'Servizio WhatsApp non raggiungibile. Assicurati che il sidecar sia avviato.'}), 502
+        data, status = whatsapp_client.post_json(path, endpoint, data)
+        return jsonify(data), status
+    except SidecarUnavailable:
+        return jsonify({'error': SIDECAR_DOWN_ERROR}), 502
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -44,7 +42,7 @@ def _proxy_post(path, data=None):
 def whatsapp_status():
     if not _require_admin():
         return jsonify({'error': 'Accesso non autorizzato'}), 403
-    return _proxy_get('/status')
+    return _proxy_get('/status', 'status')
 
 
 @admin_whatsapp_bp.route('/whatsapp/qr', methods=['GET'])
@@ -52,7 +50,7 @@ def whatsapp_status():
 def whatsapp_qr():
     if not _require_admin():
         return jsonify({'error': 'Accesso non autorizzato'}), 403
-    return _proxy_get('/qr')
+    return _proxy_get('/qr', 'qr')
 
 
 @admin_whatsapp_bp.route('/whatsapp/send', methods=['POST'])
@@ -60,8 +58,14 @@ def whatsapp_qr():
 def whatsapp_send():
     if not _require_admin():
         return jsonify({'error': 'Accesso non autorizzato'}), 403
-    data = request.get_json()
-    return _proxy_post('/send', data)
+    data = request.get_json() or {}
+    try:
+        result, status = whatsapp_client.send_message(data.get('to'), data.get('message'), data.get('media'))
+        return jsonify(result), status
+    except SidecarUnavailable:
+        return jsonify({'error': SIDECAR_DOWN_ERROR}), 502
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
 
 
 @admin_whatsapp_bp.route('/whatsapp/contacts', methods=['GET'])
@@ -69,7 +73,7 @@ def whatsapp_send():
 def whatsapp_contacts():
     if not _require_admin():
         return jsonify({'error': 'Accesso non autorizzato'}), 403
-    return _proxy_get('/contacts')
+    return _proxy_get('/contacts', 'contacts', cache_key='contacts')
 
 
 @admin_whatsapp_bp.route('/whatsapp/chats', methods=['GET'])
@@ -77,9 +81,28 @@ def whatsapp_contacts():
 def whatsapp_chats():
     if not _require_admin():
         return jsonify({'error': 'Accesso non autorizzato'}), 403
-    refresh = request.args.get('refresh', '')
-    path = '/chats?refresh=true' if refresh == 'true' else '/chats'
-    return _proxy_get(path)
+    refresh = request.args.get('refresh', '') == 'true'
+    if refresh:
+        whatsapp_client.invalidate('chats')
+    if request.args.get('resolve', '') != 'true':
+        return _proxy_get('/chats?refresh=true', 'chats') if refresh else _proxy_get('/chats', 'chats', cache_key='chats')
+
+    # Chat annotate con le entità CRM proprietarie (una sola query sulla rubrica)
+    try:
+        data, status = whatsapp_client.get_json(
+            '/chats?refresh=true' if refresh else '/chats', 'chats', cache_key=None if refresh else 'chats'
+        )
+    except SidecarUnavailable:
+        return jsonify({'error': SIDECAR_DOWN_ERROR}), 502
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+    if status != 200:
+        return jsonify(data), status
+
+    chats = data.get('chats') or []
+    resolved = PhoneDirectoryService.resolve_chats([c.get('id') for c in chats if not c.get('isGroup')])
+    data = dict(data, chats=[dict(c, crm=resolved.get(c.get('id'), [])) for c in chats])
+    return jsonify(data), status
 
 
 @admin_whatsapp_bp.route('/whatsapp/chats/<path:chat_id>/messages', methods=['GET'])
@@ -87,7 +110,7 @@ def whatsapp_chats():
 def whatsapp_chat_messages(chat_id):
     if not _require_admin():
         return jsonify({'error': 'Accesso non autorizzato'}), 403
-    return _proxy_get(f'/chats/{chat_id}/messages')
+    return _proxy_get(f'/chats/{chat_id}/messages', 'messages')
 
 
 @admin_whatsapp_bp.route('/whatsapp/media/<path:msg_id>', methods=['GET'])
@@ -95,7 +118,14 @@ def whatsapp_chat_messages(chat_id):
 def whatsapp_media(msg_id):
     if not _require_admin():
         return jsonify({'error': 'Accesso non autorizzato'}), 403
-    return _proxy_get(f'/media/{msg_id}', timeout=30)
+    # Il JSON del sidecar (media in base64) è inoltrato a blocchi senza bufferizzarlo
+    try:
+        body, status, content_type = whatsapp_client.stream(f'/media/{msg_id}', 'media')
+    except SidecarUnavailable:
+        return jsonify({'error': SIDECAR_DOWN_ERROR}), 502
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+    return Response(stream_with_context(body), status=status, content_type=content_type)
 
 
 @admin_whatsapp_bp.route('/whatsapp/messages-by-phone/<phone>', methods=['GET'])
@@ -103,7 +133,7 @@ def whatsapp_media(msg_id):
 def whatsapp_messages_by_phone(phone):
     if not _require_admin():
         return jsonify({'error': 'Accesso non autorizzato'}), 403
-    return _proxy_get(f'/messages-by-phone/{phone}', timeout=30)
+    return _proxy_get(f'/messages-by-phone/{phone}', 'messages_by_phone')
 
 
 @admin_whatsapp_bp.route('/whatsapp/disconnect', methods=['POST'])
@@ -111,10 +141,12 @@ def whatsapp_messages_by_phone(phone):
 def whatsapp_disconnect():
     if not _require_admin():
         return jsonify({'error': 'Accesso non autorizzato'}), 403
-    return _proxy_post('/disconnect')
+    result = _proxy_post('/disconnect', 'disconnect')
+    whatsapp_client.invalidate()
+    return result
 
 
-# --- DB Contacts (direct query, no sidecar) ---
+# --- DB Contacts (rubrica phone_directory, no sidecar) ---
 
 @admin_whatsapp_bp.route('/whatsapp/db-contacts', methods=['GET'])
 @jwt_required()
@@ -122,49 +154,41 @@ def whatsapp_db_contacts():
     if not _require_admin():
         return jsonify({'error': 'Accesso non autorizzato'}), 403
 
-    contacts = []
-
-    # Club con telefono
-    clubs = Club.query.filter(
-        Club.telefono.isnot(None),
-        Club.telefono != ''
-    ).all()
-    for c in clubs:
-        contacts.append({
-            'tipo': 'club',
-            'id': c.id,
-            'nome': c.nome,
-            'telefono': c.telefono,
-            'email': c.email or ''
-        })
-
-    # Lead con telefono
-    leads = Lead.query.filter(
-        Lead.telefono.isnot(None),
-        Lead.telefono != ''
-    ).all()
-    for l in leads:
-        contacts.append({
-            'tipo': 'lead',
-            'id': l.id,
-            'nome': l.ragione_sociale,
-            'telefono': l.telefono,
-            'email': l.email or ''
-        })
-
-    # ContactPerson con telefono
-    contact_persons = ContactPerson.query.filter(
-        ContactPerson.telefono.isnot(None),
-        ContactPerson.telefono != ''
-    ).all()
-    for cp in contact_persons:
-        contacts.append({
-            'tipo': 'contatto',
-            'id': cp.id,
-            'nome': f'{cp.nome} {cp.cognome}',
-            'telefono': cp.telefono,
-            'email': cp.email or '',
-            'ruolo': cp.ruolo or ''
-        })
-
-    return jsonify({'contacts': contacts}), 200
+    try:
+        contacts, next_cursor = PhoneDirectoryService.list_contacts(
+            tipo=request.args.get('tipo'),
+            search=request.args.get('search'),
+            limit=request.args.get('limit', type=int),
+            cursor=request.args.get('cursor')
+        )
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    return jsonify({'contacts': contacts, 'next_cursor': next_cursor}), 200
+
+
+@admin_whatsapp_bp.route('/whatsapp/owner/<phone>', methods=['GET'])
+@jwt_required()
+def whatsapp_phone_owner(phone):
+    """Entità CRM associate a un numero (o chat id) WhatsApp"""
+    if not _require_admin():
+        return jsonify({'error': 'Accesso non autorizzato'}), 403
+
+    return jsonify({
+        'phone': normalize_phone(phone),
+        'owners': PhoneDirectoryService.owners(phone)
+    }), 200
+
+
+@admin_whatsapp_bp.route('/whatsapp/resolve-chats', methods=['POST'])
+@jwt_required()
+def whatsapp_resolve_chats():
+    """Risolve in blocco chat id/numeri nelle entità CRM proprietarie"""
+    if not _require_admin():
+        return jsonify({'error': 'Accesso non autorizzato'}), 403
+
+    chat_ids = (request.get_json() or {}).get('chat_ids') or []
+    if not isinstance(chat_ids, list):
+        return jsonify({'error': 'chat_ids deve essere una lista'}), 400
+
+    return jsonify({'resolved': PhoneDirectoryService.resolve_chats([str(c) for c in chat_ids[:5000]])}), 200
@@ -2,6 +2,7 @@ from flask import Blueprint, request, jsonify
 from flask_jwt_extended import create_access_token
 from app import db
 from app.models import Admin, ClubUser, SponsorAccount, Sponsor, Club
+from app.services.auth_service import AuthService, rate_limited_response
 from datetime import datetime
 
 auth_bp = Blueprint('auth', __name__)
@@ -22,12 +23,27 @@ def unified_login():
     if not email or not password:
         return jsonify({'error': 'Email e password richiesti'}), 400
 
+    retry_after = AuthService.check_rate_limit(email)
+    if retry_after:
+        return rate_limited_response(retry_after)
+
     available_roles = []
     blocked_messages = []
 
-    # --- 1. Check Admin ---
+    # Carica tutti gli account candidati e verifica la password in parallelo
     admin = Admin.query.filter_by(email=email).first()
-    if admin and admin.check_password(password):
+    club_users = ClubUser.query.filter_by(email=email).all()
+    sponsor_account = SponsorAccount.query.filter_by(email=email).first()
+    legacy_sponsor = Sponsor.query.filter_by(email=email).first() if not sponsor_account else None
+
+    candidates = [admin] + club_users + [sponsor_account, legacy_sponsor]
+    verified = AuthService.verify_many(candidates, password)
+    admin_ok = verified[0]
+    club_users_ok = verified[1:1 + len(club_users)]
+    sponsor_account_ok, legacy_ok = verified[-2], verified[-1]
+
+    # --- 1. Check Admin ---
+    if admin and admin_ok:
         if not admin.is_active:
             blocked_messages.append('Account admin disabilitato.')
         else:
@@ -39,9 +55,8 @@ def unified_login():
             })
 
     # --- 2. Check ClubUser ---
-    club_users = ClubUser.query.filter_by(email=email).all()
-    for user in club_users:
-        if user.check_password(password):
+    for user, user_ok in zip(club_users, club_users_ok):
+        if user_ok:
             if not user.is_active:
                 blocked_messages.append(f'Utente club disabilitato ({user.club.nome}).')
                 continue
@@ -63,8 +78,7 @@ def unified_login():
             })
 
     # --- 3. Check SponsorAccount ---
-    sponsor_account = SponsorAccount.query.filter_by(email=email).first()
-    if sponsor_account and sponsor_account.check_password(password):
+    if sponsor_account and sponsor_account_ok:
         if not sponsor_account.account_attivo:
             blocked_messages.append('Account sponsor disattivato.')
         else:
@@ -85,8 +99,7 @@ def unified_login():
 
     # --- 4. Check Sponsor legacy ---
     if not sponsor_account:
-        legacy_sponsor = Sponsor.query.filter_by(email=email).first()
-        if legacy_sponsor and legacy_sponsor.password_hash and legacy_sponsor.check_password(password):
+        if legacy_sponsor and legacy_ok:
             if not legacy_sponsor.account_attivo:
                 blocked_messages.append('Account sponsor disattivato.')
             elif not legacy_sponsor.club.is_licenza_valida() or not legacy_sponsor.club.account_attivo:
@@ -132,6 +145,7 @@ def unified_login():
         chosen = available_roles[0]
 
     # --- Login per il ruolo scelto ---
+    AuthService.login_succeeded(email)
     if chosen['role'] == 'admin':
         return _login_admin(admin)
     elif chosen['role'] == 'club':
@@ -250,6 +264,9 @@ def _login_sponsor_account(sponsor_account):
 
 
 def _login_sponsor_legacy(legacy_sponsor):
+    # Salva l'eventuale rehash della password
+    db.session.commit()
+
     access_token = create_access_token(
         identity=str(legacy_sponsor.id),
         additional_claims={
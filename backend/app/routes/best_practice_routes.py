@@ -9,9 +9,10 @@ Route pubbliche per eventi Best Practice (Sponsor & Club)
 from flask import Blueprint, request, jsonify
 from flask_jwt_extended import jwt_required, get_jwt_identity, get_jwt
 from app import db
-from app.models import BestPracticeEvent, EventRegistration, EventQuestion, Sponsor, Club
+from app.models import BestPracticeEvent, EventRegistration, EventQuestion
 from datetime import datetime
 from sqlalchemy import or_, and_
+from app.services.principal_service import current_principal
 
 best_practice_bp = Blueprint('best_practice', __name__)
 
@@ -26,12 +27,13 @@ def get_current_user():
 
 def get_user_info(role, user_id):
     """Ottieni nome e email utente"""
+    principal = current_principal()
+    if principal and principal.role == role and principal.name:
+        return principal.name, principal.email
     if role == 'sponsor':
-        sponsor = Sponsor.query.get(user_id)
-        return sponsor.ragione_sociale if sponsor else f'Sponsor {user_id}', sponsor.email if sponsor else None
+        return f'Sponsor {user_id}', None
     elif role == 'club':
-        club = Club.query.get(user_id)
-        return club.nome_club if club else f'Club {user_id}', club.email if club else None
+        return f'Club {user_id}', None
     return f'User {user_id}', None
 
 
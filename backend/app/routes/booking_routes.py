@@ -132,27 +132,20 @@ def reserve_booking():
     )
     db.session.add(event)
 
-    # Google Calendar sync (sempre con Meet per le demo)
+    # Google Calendar sync (sempre con Meet per le demo): la creazione entra
+    # nell'outbox nella stessa transazione della prenotazione
+    from app.services.google_calendar_sync import google_calendar_sync
     try:
-        from app.services.google_calendar_service import google_calendar_service
-        if admin and google_calendar_service.is_connected(admin):
-            result = google_calendar_service.create_event(admin, {
-                'titolo': event.titolo,
-                'descrizione': event.descrizione,
-                'data_inizio': data_ora.isoformat(),
-                'data_fine': (data_ora + timedelta(minutes=30)).isoformat(),
-            }, genera_meet=True)
-            if result:
-                event.google_event_id = result.get('google_event_id')
-                booking.google_event_id = result.get('google_event_id')
-                if result.get('meet_link'):
-                    event.meet_link = result['meet_link']
-                    booking.meet_link = result['meet_link']
+        google_calendar_sync.push_create(admin, event, genera_meet=True)
     except Exception as e:
         print(f"Google sync on booking: {e}")
 
     db.session.commit()
 
+    # Invio immediato: id Google e link Meet tornano nella risposta. Se Google
+    # non risponde la creazione resta in outbox e meet_link arriva dal job.
+    google_calendar_sync.deliver(booking.admin_id, urgent=True)
+
     # Trigger automazione
     try:
         from app.services.admin_automation_triggers import trigger_admin_booking_created
@@ -191,17 +184,18 @@ def cancel_booking(token):
     if booking.calendar_event:
         booking.calendar_event.titolo = f"[ANNULLATO] {booking.calendar_event.titolo}"
 
-    # Google Calendar delete
+    # Google Calendar delete (outbox, stessa transazione)
+    from app.services.google_calendar_sync import google_calendar_sync
     try:
-        from app.services.google_calendar_service import google_calendar_service
-        if booking.admin_id and booking.google_event_id:
-            admin = Admin.query.get(booking.admin_id)
-            if admin and google_calendar_service.is_connected(admin):
-                google_calendar_service.delete_event(admin, booking.google_event_id)
+        if booking.admin_id and (booking.google_event_id or booking.calendar_event):
+            event_id = booking.calendar_event.id if booking.calendar_event else None
+            google_event_id = booking.google_event_id or (booking.calendar_event.google_event_id if booking.calendar_event else None)
+            google_calendar_sync.push_delete(Admin.query.get(booking.admin_id), event_id, google_event_id)
     except Exception as e:
         print(f"Google delete on cancel: {e}")
 
     db.session.commit()
+    google_calendar_sync.deliver(booking.admin_id)
 
     return jsonify({
         'message': 'Prenotazione annullata',
@@ -2,15 +2,45 @@ from flask import Blueprint, request, jsonify
 from flask_jwt_extended import jwt_required, get_jwt_identity, get_jwt
 from app import db
 from app.models import BusinessBox, BoxInvite, Match, Sponsor, Notification
+from app.services.qr_service import QRService, FORMATS as QR_FORMATS
 from datetime import datetime
 import uuid
-import qrcode
-import io
-import base64
 import os
 
 box_bp = Blueprint('box', __name__)
 
+MAX_BULK_INVITES = 200
+
+
+def _qr_url(codice_invito, fmt='png'):
+    """URL del QR dell'invito (generato su richiesta da serve_qr_code)"""
+    return f"/api/uploads/qr_codes/{codice_invito}.{fmt}"
+
+
+def _build_invite(box, match_id, data):
+    """BoxInvite (non ancora aggiunto alla sessione) con nuovo codice e URL del QR"""
+    codice_invito = str(uuid.uuid4())
+    return BoxInvite(
+        business_box_id=box.id,
+        match_id=match_id,
+        sponsor_id=box.sponsor_id,
+        nome=data['nome'],
+        cognome=data['cognome'],
+        email=data['email'],
+        telefono=data.get('telefono'),
+        azienda=data.get('azienda'),
+        ruolo=data.get('ruolo'),
+        codice_invito=codice_invito,
+        qr_code_url=_qr_url(codice_invito),
+        status='inviato',
+        inviato_il=datetime.utcnow(),
+        note_ospite=data.get('note_ospite'),
+        note_sponsor=data.get('note_sponsor'),
+        vip=data.get('vip', False),
+        parcheggio_richiesto=data.get('parcheggio_richiesto', False),
+        badge_nome=data.get('badge_nome') or f"{data['nome']} {data['cognome']}"
+    )
+
 
 # CREATE - Crea business box
 @box_bp.route('/business-boxes', methods=['POST'])
@@ -142,45 +172,8 @@ def create_box_invite(box_id):
         return jsonify({'error': 'Box completo per questa partita'}), 400
 
     try:
-        # Genera codice invito univoco
-        codice_invito = str(uuid.uuid4())
-
-        # Genera QR code
-        qr = qrcode.QRCode(version=1, box_size=10, border=5)
-        qr.add_data(codice_invito)
-        qr.make(fit=True)
-
-        img = qr.make_image(fill_color="black", back_color="white")
-
-        # Salva QR code come immagine
-        qr_folder = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(__file__))), 'uploads', 'qr_codes')
-        os.makedirs(qr_folder, exist_ok=True)
-        qr_filename = f"{codice_invito}.png"
-        qr_path = os.path.join(qr_folder, qr_filename)
-        img.save(qr_path)
-        qr_url = f"/api/uploads/qr_codes/{qr_filename}"
-
-        # Crea invito
-        invite = BoxInvite(
-            business_box_id=box_id,
-            match_id=data['match_id'],
-            sponsor_id=box.sponsor_id,
-            nome=data['nome'],
-            cognome=data['cognome'],
-            email=data['email'],
-            telefono=data.get('telefono'),
-            azienda=data.get('azienda'),
-            ruolo=data.get('ruolo'),
-            codice_invito=codice_invito,
-            qr_code_url=qr_url,
-            status='inviato',
-            inviato_il=datetime.utcnow(),
-            note_ospite=data.get('note_ospite'),
-            note_sponsor=data.get('note_sponsor'),
-            vip=data.get('vip', False),
-            parcheggio_richiesto=data.get('parcheggio_richiesto', False),
-            badge_nome=data.get('badge_nome') or f"{data['nome']} {data['cognome']}"
-        )
+        # Codice invito univoco; il QR viene generato su richiesta dal codice
+        invite = _build_invite(box, data['match_id'], data)
 
         db.session.add(invite)
         db.session.commit()
@@ -216,6 +209,95 @@ def create_box_invite(box_id):
         return jsonify({'error': str(e)}), 500
 
 
+# CREATE - Inviti in blocco per business box (tutti gli ospiti di una partita)
+@box_bp.route('/business-boxes/<int:box_id>/invites/bulk', methods=['POST'])
+@jwt_required()
+def create_box_invites_bulk(box_id):
+    claims = get_jwt()
+    role = claims.get('role')
+    user_id = int(get_jwt_identity())
+
+    box = BusinessBox.query.get(box_id)
+    if not box:
+        return jsonify({'error': 'Business box non trovato'}), 404
+
+    # Verifica accesso
+    if role == 'club':
+        if box.club_id != user_id:
+            return jsonify({'error': 'Accesso non autorizzato'}), 403
+    elif role == 'sponsor':
+        if box.sponsor_id != user_id:
+            return jsonify({'error': 'Accesso non autorizzato'}), 403
+    else:
+        return jsonify({'error': 'Accesso non autorizzato'}), 403
+
+    data = request.get_json() or {}
+    guests = data.get('guests') or []
+
+    # Validazione
+    if not data.get('match_id') or not isinstance(guests, list) or not guests:
+        return jsonify({'error': 'Match ID e lista ospiti (guests) sono obbligatori'}), 400
+    if len(guests) > MAX_BULK_INVITES:
+        return jsonify({'error': f'Massimo {MAX_BULK_INVITES} ospiti per richiesta'}), 400
+    invalid = [i for i, g in enumerate(guests)
+               if not isinstance(g, dict) or not g.get('nome') or not g.get('cognome') or not g.get('email')]
+    if invalid:
+        return jsonify({'error': 'Nome, cognome ed email sono obbligatori per ogni ospite', 'righe_non_valide': invalid}), 400
+
+    match = Match.query.get(data['match_id'])
+    if not match:
+        return jsonify({'error': 'Partita non trovata'}), 404
+
+    # Verifica posti disponibili per quella partita
+    existing_invites = BoxInvite.query.filter_by(
+        business_box_id=box_id,
+        match_id=data['match_id']
+    ).count()
+
+    posti_liberi = box.numero_posti - existing_invites
+    if len(guests) > posti_liberi:
+        return jsonify({'error': 'Posti insufficienti per questa partita', 'posti_liberi': max(posti_liberi, 0)}), 400
+
+    try:
+        # Tutti gli inviti e la notifica in un'unica transazione
+        invites = [_build_invite(box, data['match_id'], g) for g in guests]
+        db.session.add_all(invites)
+
+        if role == 'sponsor':
+            db.session.add(Notification(
+                user_type='club',
+                user_id=box.club_id,
+                tipo='nuovo_invito_box',
+                titolo='Nuovi ospiti registrati per Business Box',
+                messaggio=f'{len(invites)} ospiti invitati in {box.nome} per partita vs {match.avversario}',
+                link=f'/matches/{match.id}'
+            ))
+        db.session.commit()
+
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 500
+
+    # QR generati in lotto nel process pool: le richieste successive sono in cache
+    try:
+        QRService.render_many([i.codice_invito for i in invites])
+    except Exception as e:
+        print(f"[BusinessBox] Pre-generazione QR fallita (verranno generati su richiesta): {e}")
+
+    return jsonify({
+        'message': f'{len(invites)} inviti creati con successo',
+        'invites': [{
+            'id': invite.id,
+            'codice_invito': invite.codice_invito,
+            'qr_code_url': invite.qr_code_url,
+            'nome': invite.nome,
+            'cognome': invite.cognome,
+            'email': invite.email,
+            'status': invite.status
+        } for invite in invites]
+    }), 201
+
+
 # READ - Ottieni inviti per business box
 @box_bp.route('/business-boxes/<int:box_id>/invites', methods=['GET'])
 @jwt_required()
@@ -506,9 +588,20 @@ def delete_invite(invite_id):
 
 
 # Serve QR codes
-from flask import send_from_directory
+from flask import send_from_directory, Response
 QR_FOLDER = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(__file__))), 'uploads', 'qr_codes')
 
 @box_bp.route('/uploads/qr_codes/<filename>')
 def serve_qr_code(filename):
-    return send_from_directory(QR_FOLDER, filename)
+    """QR dell'invito (<codice>.png o <codice>.svg): file legacy se presente, altrimenti generato dal codice"""
+    if os.path.isfile(os.path.join(QR_FOLDER, filename)):
+        return send_from_directory(QR_FOLDER, filename)
+
+    codice_invito, _, fmt = filename.rpartition('.')
+    if fmt not in QR_FORMATS or not db.session.query(BoxInvite.id).filter_by(codice_invito=codice_invito).first():
+        return jsonify({'error': 'QR code non trovato'}), 404
+
+    response = Response(QRService.render(codice_invito, fmt), mimetype=QRService.mimetype(fmt))
+    # Il QR di un codice non cambia mai
+    response.headers['Cache-Control'] = 'public, max-age=86400, immutable'
+    return response
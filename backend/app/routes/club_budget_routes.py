@@ -5,8 +5,8 @@ from app.models import (
     Budget, BudgetCategory, Expense, Payment, FinancialDocument, BudgetAlert,
     HeadOfTerms, Club, Sponsor, Project, Activation, Event, Notification
 )
+from app.services.budget_analytics_service import BudgetAnalyticsService
 from datetime import datetime, date
-from sqlalchemy import extract, func
 
 club_budget_bp = Blueprint('club_budget', __name__)
 
@@ -923,52 +923,7 @@ def get_budget_report(budget_id):
     if not budget or budget.owner_type != 'club' or budget.owner_id != club_id:
         return jsonify({'error': 'Budget non trovato'}), 404
 
-    # Spese per categoria
-    categories_report = []
-    for category in budget.categories:
-        categories_report.append({
-            'nome': category.nome,
-            'allocato': float(category.importo_allocato),
-            'speso': float(category.importo_speso),
-            'percentuale': category.get_percentage_used()
-        })
-
-    # Spese per mese
-    monthly_expenses = db.session.query(
-        extract('month', Expense.data_spesa).label('month'),
-        func.sum(Expense.importo).label('total')
-    ).filter(
-        Expense.budget_id == budget_id,
-        Expense.stato == 'pagato'
-    ).group_by('month').all()
-
-    monthly_report = [{
-        'mese': int(month),
-        'totale': float(total)
-    } for month, total in monthly_expenses]
-
-    # Pagamenti overview
-    total_payments = budget.payments.count()
-    completed_payments = budget.payments.filter_by(stato='completato').count()
-    late_payments = budget.payments.filter_by(stato='in_ritardo').count()
-
-    return jsonify({
-        'report': {
-            'budget_overview': {
-                'totale': float(budget.importo_totale),
-                'speso': float(budget.importo_speso),
-                'rimanente': float(budget.calculate_remaining()),
-                'percentuale_utilizzo': budget.get_percentage_used()
-            },
-            'categories': categories_report,
-            'monthly_expenses': monthly_report,
-            'payments_overview': {
-                'totale': total_payments,
-                'completati': completed_payments,
-                'in_ritardo': late_payments
-            }
-        }
-    }), 200
+    return jsonify({'report': BudgetAnalyticsService.budget_report(budget)}), 200
 
 
 @club_budget_bp.route('/budgets/<int:budget_id>/forecast', methods=['GET'])
@@ -983,38 +938,22 @@ def get_budget_forecast(budget_id):
     if not budget or budget.owner_type != 'club' or budget.owner_id != club_id:
         return jsonify({'error': 'Budget non trovato'}), 404
 
-    # Calcola burn rate (spesa media mensile)
-    paid_expenses = budget.expenses.filter_by(stato='pagato').all()
-
-    if not paid_expenses:
-        return jsonify({
-            'forecast': {
-                'burn_rate_mensile': 0,
-                'mesi_rimanenti': 0,
-                'data_esaurimento_prevista': None
-            }
-        }), 200
+    # Media mobile (?window=mesi) con correzione stagionale
+    window = min(max(request.args.get('window', 3, type=int), 1), 12)
+    return jsonify({'forecast': BudgetAnalyticsService.budget_forecast(budget, window=window)}), 200
 
-    # Raggruppa per mese
-    monthly_totals = {}
-    for expense in paid_expenses:
-        month_key = expense.data_spesa.strftime('%Y-%m')
-        monthly_totals[month_key] = monthly_totals.get(month_key, 0) + float(expense.importo)
 
-    # Burn rate medio
-    burn_rate = sum(monthly_totals.values()) / len(monthly_totals)
-
-    # Stima mesi rimanenti
-    mesi_rimanenti = float(budget.calculate_remaining()) / burn_rate if burn_rate > 0 else 0
-
-    # Data esaurimento prevista
-    from datetime import timedelta
-    data_esaurimento = datetime.utcnow() + timedelta(days=mesi_rimanenti * 30)
+@club_budget_bp.route('/budgets/portfolio', methods=['GET'])
+@jwt_required()
+def get_budget_portfolio():
+    """Vista portafoglio di tutti i budget del club"""
+    club_id = verify_club()
+    if not club_id:
+        return jsonify({'error': 'Accesso non autorizzato'}), 403
 
-    return jsonify({
-        'forecast': {
-            'burn_rate_mensile': round(burn_rate, 2),
-            'mesi_rimanenti': round(mesi_rimanenti, 1),
-            'data_esaurimento_prevista': data_esaurimento.date().isoformat() if mesi_rimanenti > 0 else None
-        }
-    }), 200
+    window = min(max(request.args.get('window', 3, type=int), 1), 12)
+    return jsonify({'portfolio': BudgetAnalyticsService.portfolio(
+        'club', club_id,
+        anno_fiscale=request.args.get('anno_fiscale', type=int),
+        window=window
+    )}), 200
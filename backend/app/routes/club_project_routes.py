@@ -2,6 +2,7 @@ from flask import Blueprint, request, jsonify
 from app import db
 from app.models import Project, ProjectMilestone, ProjectTask, ProjectUpdate, HeadOfTerms, Club, Sponsor
 from app.services.notification_service import NotificationService
+from app.services.project_metrics_service import ProjectMetricsService
 from datetime import datetime
 import json
 
@@ -48,7 +49,7 @@ def get_projects(current_user):
         query = query.filter_by(priorita=priorita)
 
     query = query.filter(Project.archived_at.is_(None))  # Escludi archiviati
-    projects = query.order_by(Project.created_at.desc()).all()
+    projects = ProjectMetricsService.ensure_fresh(query.order_by(Project.created_at.desc()).all())
 
     return jsonify({
         'projects': [p.to_dict() for p in projects],
@@ -99,6 +100,7 @@ def get_project(current_user, id):
     if not project or project.club_id != club_id:
         return jsonify({'error': 'Progetto non trovato'}), 404
 
+    ProjectMetricsService.ensure_fresh([project])
     return jsonify({'project': project.to_dict_detailed()}), 200
 
 
@@ -375,7 +377,6 @@ def update_task(current_user, project_id, id):
         task.tags = data['tags']
 
     db.session.commit()
-    project.update_progress()
 
     return jsonify({
         'message': 'Task aggiornato',
@@ -430,7 +431,6 @@ def delete_task(current_user, project_id, id):
 
     db.session.delete(task)
     db.session.commit()
-    project.update_progress()
 
     return jsonify({'message': 'Task eliminato'}), 200
 
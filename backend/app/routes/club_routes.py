@@ -2,10 +2,11 @@ from flask import Blueprint, request, jsonify
 from flask_jwt_extended import create_access_token, jwt_required, get_jwt_identity, get_jwt
 from werkzeug.utils import secure_filename
 from app import db
-from app.models import Club, ClubUser, Sponsor, SponsorInvitation, HeadOfTerms, Pagamento, Fattura
+from app.models import Club, ClubUser, Sponsor, SponsorInvitation, Pagamento, Fattura
+from app.services.auth_service import AuthService, rate_limited_response
+from app.services.sponsor_analytics_service import SponsorAnalyticsService
+from app.services.contract_timeline_service import ContractTimelineService
 from datetime import datetime, timedelta
-from sqlalchemy import func
-from collections import Counter
 import os
 import uuid
 
@@ -44,6 +45,10 @@ def login():
     if not email or not password:
         return jsonify({'error': 'Email e password richiesti'}), 400
 
+    retry_after = AuthService.check_rate_limit(email)
+    if retry_after:
+        return rate_limited_response(retry_after)
+
     # Cerca l'utente per email
     user = ClubUser.query.filter_by(email=email).first()
 
@@ -51,7 +56,7 @@ def login():
         return jsonify({'error': 'Credenziali non valide'}), 401
 
     # Verifica password utente
-    if not user.check_password(password):
+    if not AuthService.verify(user, password):
         return jsonify({'error': 'Credenziali non valide'}), 401
 
     # Verifica utente attivo
@@ -76,6 +81,7 @@ def login():
     # Aggiorna last_login
     user.last_login = datetime.utcnow()
     db.session.commit()
+    AuthService.login_succeeded(email)
 
     access_token = create_access_token(
         identity=str(user.id),
@@ -246,14 +252,14 @@ def get_sponsors():
 
     sponsors = Sponsor.query.filter_by(club_id=club_id).all()
 
+    # Contratti attivi per sponsor dalla timeline del club (una lettura in cache)
+    contracts_by_sponsor = {}
+    for c in ContractTimelineService.active_contracts(club_id):
+        contracts_by_sponsor.setdefault(c.sponsor_id, []).append(c)
+
     sponsors_data = []
     for s in sponsors:
-        # Calcola contratti attivi e valore totale per questo sponsor
-        active_contracts = HeadOfTerms.query.filter_by(
-            sponsor_id=s.id,
-            status='attivo'
-        ).all()
-
+        active_contracts = contracts_by_sponsor.get(s.id, [])
         active_contracts_count = len(active_contracts)
         active_contracts_value = sum(c.compenso for c in active_contracts if c.compenso)
 
@@ -283,47 +289,19 @@ def get_sponsors_analytics():
     if not club_id:
         return jsonify({'error': 'Accesso non autorizzato'}), 403
 
-    # Valore totale contratti attivi
-    total_value = db.session.query(func.sum(HeadOfTerms.compenso)).filter(
-        HeadOfTerms.club_id == club_id,
-        HeadOfTerms.status == 'attivo'
-    ).scalar() or 0
-
-    # Timeline acquisizione sponsor (ultimi 12 mesi)
-    twelve_months_ago = datetime.utcnow() - timedelta(days=365)
-    recent_sponsors = Sponsor.query.filter(
-        Sponsor.club_id == club_id,
-        Sponsor.created_at >= twelve_months_ago
-    ).all()
-    month_counts = Counter(
-        s.created_at.strftime('%Y-%m') for s in recent_sponsors if s.created_at
-    )
-    timeline_data = [{'month': m, 'count': c} for m, c in sorted(month_counts.items())]
-
-    # Contratti in scadenza (prossimi 60 giorni)
-    sixty_days_from_now = datetime.utcnow() + timedelta(days=60)
-    expiring_contracts = HeadOfTerms.query.filter(
-        HeadOfTerms.club_id == club_id,
-        HeadOfTerms.status == 'attivo',
-        HeadOfTerms.data_fine <= sixty_days_from_now,
-        HeadOfTerms.data_fine >= datetime.utcnow()
-    ).order_by(HeadOfTerms.data_fine).all()
-
-    expiring_data = [{
-        'contract_id': c.id,
-        'contract_name': c.nome_contratto,
-        'sponsor_id': c.sponsor_id,
-        'sponsor_name': c.sponsor.ragione_sociale,
-        'expiry_date': c.data_fine.isoformat(),
-        'days_left': (c.data_fine - datetime.utcnow()).days,
-        'value': c.compenso
-    } for c in expiring_contracts]
+    return jsonify(SponsorAnalyticsService.summary(club_id)), 200
 
-    return jsonify({
-        'total_active_value': total_value,
-        'sponsors_timeline': timeline_data,
-        'expiring_contracts': expiring_data
-    }), 200
+
+@club_bp.route('/sponsors/analytics/cohorts', methods=['GET'])
+@jwt_required()
+def get_sponsors_cohorts():
+    """Coorti sponsor: tasso di rinnovo per stagione e valore per settore"""
+    club_id = verify_club()
+    if not club_id:
+        return jsonify({'error': 'Accesso non autorizzato'}), 403
+
+    seasons = max(1, min(request.args.get('seasons', 6, type=int), 20))
+    return jsonify(SponsorAnalyticsService.cohorts(club_id, seasons)), 200
 
 
 @club_bp.route('/sponsors/<int:sponsor_id>', methods=['GET'])
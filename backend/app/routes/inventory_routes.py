@@ -11,8 +11,10 @@ from app.models import (
     AssetAllocation, AssetPackage, AssetPackageItem, CategoryExclusivity,
     PackageLevel, Club, Sponsor, HeadOfTerms
 )
+from app.services.inventory_catalog_service import InventoryCatalogService
+from app.services.occupancy_service import OccupancyService, season_range
 from datetime import datetime, date
-from sqlalchemy import func, or_, and_
+from sqlalchemy import and_
 import json
 
 inventory_bp = Blueprint('inventory', __name__)
@@ -163,57 +165,38 @@ def get_assets():
     if not club_id:
         return jsonify({'error': 'Accesso non autorizzato'}), 403
 
-    # Filtri
-    category_id = request.args.get('category_id', type=int)
-    tipo = request.args.get('tipo')
-    disponibile = request.args.get('disponibile')
-    search = request.args.get('search', '')
-    in_evidenza = request.args.get('in_evidenza')
-    visibile_marketplace = request.args.get('visibile_marketplace')
+    def flag(name):
+        value = request.args.get(name)
+        return None if value is None else value == 'true'
 
     # Filter by archiviato status (default: show only non-archived)
-    include_archived = request.args.get('include_archived', 'false') == 'true'
-    only_archived = request.args.get('only_archived', 'false') == 'true'
-
-    query = InventoryAsset.query.filter_by(club_id=club_id, attivo=True)
-
-    if only_archived:
-        query = query.filter_by(archiviato=True)
-    elif not include_archived:
-        query = query.filter(or_(InventoryAsset.archiviato == False, InventoryAsset.archiviato == None))
-
-    if category_id:
-        query = query.filter_by(category_id=category_id)
-    if tipo:
-        query = query.filter_by(tipo=tipo)
-    if disponibile is not None:
-        query = query.filter_by(disponibile=disponibile == 'true')
-    if in_evidenza is not None:
-        query = query.filter_by(in_evidenza=in_evidenza == 'true')
-    if visibile_marketplace is not None:
-        query = query.filter_by(visibile_marketplace=visibile_marketplace == 'true')
-    if search:
-        query = query.filter(
-            or_(
-                InventoryAsset.nome.ilike(f'%{search}%'),
-                InventoryAsset.descrizione.ilike(f'%{search}%')
-            )
+    archived = 'exclude'
+    if request.args.get('only_archived', 'false') == 'true':
+        archived = 'only'
+    elif request.args.get('include_archived', 'false') == 'true':
+        archived = 'include'
+
+    filters = {
+        'category_id': request.args.get('category_id', type=int),
+        'tipo': request.args.get('tipo'),
+        'disponibile': flag('disponibile'),
+        'in_evidenza': flag('in_evidenza'),
+        'visibile_marketplace': flag('visibile_marketplace'),
+        'search': request.args.get('search', ''),
+        'archived': archived
+    }
+
+    # Paginazione keyset: ?limit (default INVENTORY_PAGE_SIZE) e poi ?cursor=<next_cursor>
+    try:
+        result = InventoryCatalogService.list_assets(
+            club_id, filters,
+            limit=request.args.get('limit', type=int),
+            cursor=request.args.get('cursor')
         )
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
 
-    assets = query.order_by(InventoryAsset.ordine, InventoryAsset.nome).all()
-
-    # Calcola statistiche
-    total_value = sum(a.prezzo_listino or 0 for a in assets)
-    available_count = sum(1 for a in assets if a.disponibile)
-
-    return jsonify({
-        'assets': [a.to_dict(include_pricing=True) for a in assets],
-        'stats': {
-            'total': len(assets),
-            'available': available_count,
-            'total_value': total_value
-        }
-    }), 200
+    return jsonify(result), 200
 
 
 @inventory_bp.route('/assets/<int:asset_id>', methods=['GET'])
@@ -1177,76 +1160,50 @@ def get_inventory_stats():
     if not club_id:
         return jsonify({'error': 'Accesso non autorizzato'}), 403
 
-    # Totale asset (esclusi archiviati)
-    total_assets = InventoryAsset.query.filter_by(club_id=club_id, attivo=True).filter(
-        or_(InventoryAsset.archiviato == False, InventoryAsset.archiviato == None)
-    ).count()
-    available_assets = InventoryAsset.query.filter_by(club_id=club_id, attivo=True, disponibile=True).filter(
-        or_(InventoryAsset.archiviato == False, InventoryAsset.archiviato == None)
-    ).count()
-    archived_assets = InventoryAsset.query.filter_by(club_id=club_id, attivo=True, archiviato=True).count()
+    return jsonify(InventoryCatalogService.stats(club_id)), 200
 
-    # Valore inventario (esclusi archiviati)
-    assets = InventoryAsset.query.filter_by(club_id=club_id, attivo=True).filter(
-        or_(InventoryAsset.archiviato == False, InventoryAsset.archiviato == None)
-    ).all()
-    total_value = sum(a.prezzo_listino or 0 for a in assets)
-    available_value = sum(a.prezzo_listino or 0 for a in assets if a.disponibile)
-
-    # Allocazioni attive
-    active_allocations = AssetAllocation.query.filter_by(club_id=club_id, status='attiva').count()
-    allocation_value = db.session.query(func.sum(AssetAllocation.prezzo_concordato)).filter_by(
-        club_id=club_id, status='attiva'
-    ).scalar() or 0
-
-    # Per categoria
-    categories = InventoryCategory.query.filter_by(club_id=club_id, attivo=True).all()
-    by_category = []
-    for cat in categories:
-        cat_assets = InventoryAsset.query.filter_by(club_id=club_id, category_id=cat.id, attivo=True).all()
-        by_category.append({
-            'category': cat.to_dict(),
-            'total_assets': len(cat_assets),
-            'available_assets': sum(1 for a in cat_assets if a.disponibile),
-            'total_value': sum(a.prezzo_listino or 0 for a in cat_assets),
-            'available_value': sum(a.prezzo_listino or 0 for a in cat_assets if a.disponibile)
-        })
-
-    # Esclusività
-    total_exclusivities = CategoryExclusivity.query.filter_by(club_id=club_id).count()
-    assigned_exclusivities = CategoryExclusivity.query.filter_by(club_id=club_id, attiva=True).count()
-
-    # Packages
-    total_packages = AssetPackage.query.filter_by(club_id=club_id, attivo=True).count()
-    packages_sold = db.session.query(func.sum(AssetPackage.vendite_attuali)).filter_by(
-        club_id=club_id, attivo=True
-    ).scalar() or 0
 
-    return jsonify({
-        'inventory': {
-            'total_assets': total_assets,
-            'available_assets': available_assets,
-            'archived_assets': archived_assets,
-            'occupancy_rate': round((total_assets - available_assets) / total_assets * 100, 1) if total_assets > 0 else 0,
-            'total_value': total_value,
-            'available_value': available_value,
-            'allocated_value': allocation_value
-        },
-        'allocations': {
-            'active': active_allocations,
-            'total_value': allocation_value
-        },
-        'exclusivities': {
-            'total': total_exclusivities,
-            'assigned': assigned_exclusivities,
-            'available': total_exclusivities - assigned_exclusivities
-        },
-        'packages': {
-            'total': total_packages,
-            'sold': packages_sold
-        },
-        'by_category': by_category
-    }), 200
+# =============================================================================
+# OCCUPAZIONE
+# =============================================================================
+
+@inventory_bp.route('/occupancy', methods=['GET'])
+@jwt_required()
+def get_occupancy():
+    """
+    Occupazione di asset (kind=assets) o diritti (kind=rights) per periodo o stagione.
+    Query: start/end (YYYY-MM-DD) oppure stagione, ids, category_id, quantita,
+    durata_giorni, match_days=true per la disponibilità per giornata di gara.
+    """
+    club_id = verify_club()
+    if not club_id:
+        return jsonify({'error': 'Accesso non autorizzato'}), 403
+
+    try:
+        if request.args.get('stagione') and not request.args.get('start'):
+            start, end = season_range(request.args.get('stagione'))
+        else:
+            start = datetime.strptime(request.args.get('start', ''), '%Y-%m-%d').date()
+            end = datetime.strptime(request.args.get('end', ''), '%Y-%m-%d').date()
+    except ValueError:
+        return jsonify({'error': 'Specificare start/end (YYYY-MM-DD) o stagione'}), 400
+
+    ids = [int(i) for i in request.args.get('ids', '').split(',') if i.strip().isdigit()]
+
+    try:
+        result = OccupancyService.occupancy(
+            club_id, start, end,
+            kind=request.args.get('kind', 'assets'),
+            ids=ids or None,
+            category_id=request.args.get('category_id', type=int),
+            quantity=request.args.get('quantita', 1, type=int),
+            min_days=request.args.get('durata_giorni', type=int),
+            include_match_days=request.args.get('match_days', 'false') == 'true'
+        )
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    return jsonify(result), 200
 
 
 # =============================================================================
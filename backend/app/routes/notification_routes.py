@@ -2,10 +2,17 @@ from flask import Blueprint, request, jsonify
 from flask_jwt_extended import jwt_required, get_jwt_identity, get_jwt
 from app import db
 from app.models import Notification
-from datetime import datetime
+from datetime import datetime, timedelta
+import os
 
 notification_bp = Blueprint('notification', __name__)
 
+# Intervallo del polling sul database dello stream SSE (notifiche di altri processi)
+STREAM_POLL_SECONDS = int(os.getenv('NOTIFICATION_STREAM_POLL_SECONDS', '5'))
+# Il poll rilegge anche gli ultimi secondi già coperti: righe con created_at
+# assegnato prima del poll ma committate dopo (es. blocchi del fan-out)
+STREAM_POLL_OVERLAP = int(os.getenv('NOTIFICATION_STREAM_POLL_OVERLAP', '30'))
+
 
 # READ - Ottieni tutte le notifiche dell'utente corrente
 @notification_bp.route('/notifications', methods=['GET'])
@@ -218,7 +225,7 @@ def clear_read_notifications():
 def notification_stream():
     """SSE endpoint per notifiche real-time"""
     from flask import Response, stream_with_context
-    from flask_jwt_extended import decode_token
+    from app.services.principal_service import PrincipalService
     import json
     import time
 
@@ -228,50 +235,75 @@ def notification_stream():
         return jsonify({'error': 'Token mancante'}), 401
 
     try:
-        decoded = decode_token(token)
-        user_type = decoded['sub'].get('role') if isinstance(decoded['sub'], dict) else None
-        user_id = int(decoded['sub'].get('id')) if isinstance(decoded['sub'], dict) else int(decoded['sub'])
-
-        if not user_type:
-            # Fallback per token vecchio formato
-            from flask_jwt_extended import get_jwt
-            claims = get_jwt()
-            user_type = claims.get('role')
+        principal = PrincipalService.from_token(token)
+        if not principal:
+            return jsonify({'error': 'Token non valido'}), 401
+        user_type = principal.role
+        user_id = principal.identity
     except Exception as e:
         return jsonify({'error': 'Token non valido'}), 401
 
     def event_stream():
         """Generator per SSE"""
-        last_check = datetime.utcnow()
-
-        while True:
-            # Poll database ogni 2 secondi per nuove notifiche
-            new_notifications = Notification.query.filter(
-                Notification.user_type == user_type,
-                Notification.user_id == user_id,
-                Notification.created_at > last_check,
-                Notification.letta == False
-            ).order_by(Notification.created_at.desc()).all()
-
-            if new_notifications:
-                # Invia nuove notifiche come SSE
-                data = json.dumps([{
-                    'id': n.id,
-                    'tipo': n.tipo,
-                    'titolo': n.titolo,
-                    'messaggio': n.messaggio,
-                    'link': n.link,
-                    'priorita': n.priorita if hasattr(n, 'priorita') else 'normale',
-                    'created_at': n.created_at.isoformat()
-                } for n in new_notifications])
-                yield f"data: {data}\n\n"
-
-                last_check = datetime.utcnow()
-
-            # Heartbeat ogni 30 secondi
-            yield f": heartbeat\n\n"
-
-            time.sleep(2)
+        from app.services.notification_fanout import notification_hub
+        import queue
+
+        # Le notifiche pubblicate in batch da questo processo arrivano dal canale;
+        # quelle create altrove dal polling periodico sul database
+        channel = notification_hub.subscribe(user_type, user_id)
+        delivered = {}  # id -> created_at delle notifiche inviate nella finestra di overlap
+        stream_started = datetime.utcnow()
+        last_check = stream_started
+        last_poll = time.monotonic()
+        overlap = timedelta(seconds=STREAM_POLL_OVERLAP)
+
+        try:
+            while True:
+                try:
+                    batch = channel.get(timeout=2)
+                except queue.Empty:
+                    batch = None
+
+                if batch:
+                    batch = [n for n in batch if n['id'] not in delivered]
+                    delivered.update((n['id'], datetime.fromisoformat(n['created_at'])) for n in batch)
+                    if batch:
+                        yield f"data: {json.dumps(batch)}\n\n"
+
+                if time.monotonic() - last_poll >= STREAM_POLL_SECONDS:
+                    poll_started = datetime.utcnow()
+                    new_notifications = Notification.query.filter(
+                        Notification.user_type == user_type,
+                        Notification.user_id == user_id,
+                        Notification.created_at > max(stream_started, last_check - overlap),
+                        Notification.letta == False
+                    ).order_by(Notification.created_at.desc()).all()
+                    db.session.rollback()  # rilascia la connessione tra un poll e l'altro
+
+                    fresh = [n for n in new_notifications if n.id not in delivered]
+                    if fresh:
+                        # Invia nuove notifiche come SSE
+                        data = json.dumps([{
+                            'id': n.id,
+                            'tipo': n.tipo,
+                            'titolo': n.titolo,
+                            'messaggio': n.messaggio,
+                            'link': n.link,
+                            'priorita': n.priorita if hasattr(n, 'priorita') else 'normale',
+                            'created_at': n.created_at.isoformat()
+                        } for n in fresh])
+                        yield f"data: {data}\n\n"
+                        delivered.update((n.id, n.created_at) for n in fresh)
+
+                    # Gli id inviati servono finché rientrano nella finestra del prossimo poll
+                    last_check = poll_started
+                    delivered = {nid: created for nid, created in delivered.items() if created > last_check - overlap}
+                    last_poll = time.monotonic()
+
+                if not batch:
+                    yield f": heartbeat\n\n"
+        finally:
+            notification_hub.unsubscribe(user_type, user_id, channel)
 
     return Response(
         stream_with_context(event_stream()),
@@ -7,6 +7,7 @@ from app.models import (
     MarketplaceOpportunity, OpportunityApplication, PressPublication,
     BestPracticeEvent, EventInvitation
 )
+from app.services.contract_timeline_service import ContractTimelineService
 from datetime import datetime
 
 pitchy_bp = Blueprint('pitchy', __name__)
@@ -30,7 +31,7 @@ def get_pitchy_context():
         if club:
             print(f"DEBUG: Found Club: {club.nome}")
             # --- CORE CONTEXT ---
-            active_contracts = HeadOfTerms.query.filter_by(club_id=club.id, status='attivo').all()
+            active_contracts = ContractTimelineService.active_contracts(club.id)
             next_matches = Match.query.filter_by(club_id=club.id).filter(Match.data_ora >= datetime.utcnow()).order_by(Match.data_ora).limit(3).all()
             
             context_text += f"Sei l'assistente del Club '{club.nome}'. "
@@ -44,7 +45,7 @@ def get_pitchy_context():
             if active_contracts:
                 context_text += "Sponsor attivi: "
                 for c in active_contracts:
-                    sponsor_name = c.sponsor.ragione_sociale if c.sponsor else "Sconosciuto"
+                    sponsor_name = c.sponsor_name or "Sconosciuto"
                     context_text += f"- {sponsor_name} (Valore: €{c.compenso}, Scadenza: {c.data_fine.strftime('%d/%m/%Y')}). "
 
             # --- 1. ASSETS & ACTIVATIONS ---
@@ -120,7 +121,7 @@ def get_pitchy_context():
         if sponsor:
             print(f"DEBUG: Found Sponsor: {sponsor.ragione_sociale}")
             # --- CORE CONTEXT ---
-            active_contracts = HeadOfTerms.query.filter_by(sponsor_id=sponsor.id, status='attivo').all()
+            active_contracts = ContractTimelineService.active_contracts(sponsor.club_id, sponsor_id=sponsor.id)
             
             context_text += f"Sei l'assistente per lo Sponsor '{sponsor.ragione_sociale}'. "
             context_text += f"Settore: {sponsor.settore_merceologico}. "
@@ -128,7 +129,7 @@ def get_pitchy_context():
             if active_contracts:
                 context_text += f"Hai {len(active_contracts)} contratti attivi. "
                 for c in active_contracts:
-                    club_name = c.club.nome if c.club else "Sconosciuto"
+                    club_name = sponsor.club.nome if sponsor.club else "Sconosciuto"
                     context_text += f"Sponsorizzi il club {club_name} (Investimento: €{c.compenso}). "
             else:
                 context_text += "Al momento non hai contratti attivi. "
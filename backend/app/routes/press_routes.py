@@ -7,9 +7,11 @@ Route per press area social - stile Instagram
 """
 
 from flask import Blueprint, request, jsonify
-from flask_jwt_extended import jwt_required, get_jwt_identity, get_jwt
+from flask_jwt_extended import jwt_required
 from app import db
 from app.models import PressPublication, PressReaction, PressComment, PressView, Club, Sponsor, HeadOfTerms
+from app.services.principal_service import current_principal
+from app.services.contract_timeline_service import ContractTimelineService
 from datetime import datetime
 from sqlalchemy import or_, and_, func
 
@@ -17,17 +19,22 @@ press_bp = Blueprint('press', __name__)
 
 
 def get_current_user():
-    """Restituisce (role, user_id, user_name) dell'utente corrente"""
-    claims = get_jwt()
-    role = claims.get('role')
-    user_id = int(get_jwt_identity())
+    """
+    Restituisce (role, user_id, user_name, user_obj) dell'utente corrente.
+    user_id resta l'identity del JWT: è l'id salvato su reazioni, commenti e
+    pubblicazioni e usato nei controlli di proprietà.
+    """
+    principal = current_principal()
+    if not principal:
+        return (None, None, None, None)
 
-    if role == 'club':
-        club = Club.query.get(user_id)
+    user_id = principal.identity
+    if principal.is_club:
+        club = principal.club if principal.club_id == user_id else db.session.get(Club, user_id)
         user_name = club.nome if club else f'Club {user_id}'
         return ('club', user_id, user_name, club)
-    elif role == 'sponsor':
-        sponsor = Sponsor.query.get(user_id)
+    elif principal.is_sponsor:
+        sponsor = principal.membership if principal.membership_id == user_id else db.session.get(Sponsor, user_id)
         user_name = sponsor.ragione_sociale if sponsor else f'Sponsor {user_id}'
         return ('sponsor', user_id, user_name, sponsor)
     else:
@@ -63,10 +70,7 @@ def get_unified_feed():
 
         if role == 'club':
             # CLUB: Vede i suoi post + post di tutti i suoi sponsor (interna) + post community
-            sponsor_ids = db.session.query(Sponsor.id).join(HeadOfTerms).filter(
-                HeadOfTerms.club_id == user_id
-            ).all()
-            sponsor_ids = [s[0] for s in sponsor_ids]
+            sponsor_ids = list(ContractTimelineService.sponsor_ids(user_id))
 
             # Query: (post interni del club+sponsor) OR (post community di tutti)
             query = PressPublication.query.filter(
@@ -92,10 +96,7 @@ def get_unified_feed():
                 # Se sponsor senza club, vede solo community
                 query = PressPublication.query.filter_by(visibility='community', pubblicato=True)
             else:
-                sponsor_ids = db.session.query(Sponsor.id).join(HeadOfTerms).filter(
-                    HeadOfTerms.club_id == club_id
-                ).all()
-                sponsor_ids = [s[0] for s in sponsor_ids]
+                sponsor_ids = list(ContractTimelineService.sponsor_ids(club_id))
 
                 # Query: (post interni del club+sponsor) OR (post community di tutti)
                 query = PressPublication.query.filter(
@@ -1,11 +1,14 @@
 from flask import Blueprint, request, jsonify, g
-from flask_jwt_extended import jwt_required, get_jwt_identity, get_jwt
+from flask_jwt_extended import jwt_required
 from app import db
 from app.models import (
     Proposal, ProposalTemplate, ProposalItem, ProposalVersion,
-    ProposalTracking, ProposalComment, Club, Sponsor, Lead,
+    ProposalComment, Sponsor, Lead,
     InventoryAsset, Right, InventoryCategory, RightCategory
 )
+from app.services.principal_service import current_principal
+from app.services.tracking_buffer import tracking_buffer
+from app.services.proposal_analytics_service import ProposalAnalyticsService
 from datetime import datetime, timedelta
 import json
 import uuid
@@ -16,13 +19,11 @@ proposal_bp = Blueprint('proposals', __name__)
 def verify_club():
     """Helper function to verify club role and return club_id, also sets g.club_id"""
     try:
-        claims = get_jwt()
-        if claims.get('role') != 'club':
+        principal = current_principal()
+        if not principal or not principal.is_club:
             return None
-        club_id = int(get_jwt_identity())
-        g.club_id = club_id
-        g.club = Club.query.get(club_id)
-        return club_id
+        g.club_id = principal.club_id
+        return principal.club_id
     except Exception:
         return None
 
@@ -30,11 +31,9 @@ def verify_club():
 def setup_club_context():
     """Setup club context from JWT for authenticated routes"""
     try:
-        claims = get_jwt()
-        if claims.get('role') == 'club':
-            club_id = int(get_jwt_identity())
-            g.club_id = club_id
-            g.club = Club.query.get(club_id)
+        principal = current_principal()
+        if principal and principal.is_club:
+            g.club_id = principal.club_id
     except Exception:
         pass
 
@@ -886,6 +885,41 @@ def create_proposal_version(proposal, note=''):
     return version
 
 
+# =============================================================================
+# ANALYTICS
+# =============================================================================
+
+@proposal_bp.route('/<int:proposal_id>/analytics', methods=['GET'])
+@jwt_required()
+def get_proposal_analytics(proposal_id):
+    """Engagement proposta: totali, funnel, sezioni e andamento giornaliero"""
+    club_id = verify_club()
+    if not club_id:
+        return jsonify({'error': 'Accesso non autorizzato'}), 403
+
+    proposal = Proposal.query.filter_by(id=proposal_id, club_id=club_id).first()
+    if not proposal:
+        return jsonify({'error': 'Proposta non trovata'}), 404
+
+    days = min(max(request.args.get('days', 30, type=int), 1), 365)
+
+    # Solo tabelle aggregate: il rollup gira nel thread del tracking buffer
+    return jsonify(ProposalAnalyticsService.proposal_analytics(proposal, days=days))
+
+
+@proposal_bp.route('/analytics/compare', methods=['GET'])
+@jwt_required()
+def get_proposals_analytics_comparison():
+    """Confronto engagement tra le proposte del club"""
+    club_id = verify_club()
+    if not club_id:
+        return jsonify({'error': 'Accesso non autorizzato'}), 403
+
+    limit = min(request.args.get('limit', 100, type=int), 500)
+
+    return jsonify(ProposalAnalyticsService.club_comparison(club_id, limit=limit))
+
+
 # =============================================================================
 # TRACKING (Public)
 # =============================================================================
@@ -905,25 +939,20 @@ def get_public_proposal(link):
         db.session.commit()
         return jsonify({'error': 'Proposta scaduta'}), 410
 
-    # Registra visualizzazione
-    proposal.visualizzazioni = (proposal.visualizzazioni or 0) + 1
-    proposal.ultima_visualizzazione = datetime.utcnow()
+    # Registra visualizzazione (write-behind: tracking e contatori scritti a batch)
+    counted = tracking_buffer.record_proposal_event(
+        proposal.id, 'view',
+        ip_address=request.remote_addr,
+        user_agent=request.headers.get('User-Agent', ''),
+        referrer=request.headers.get('Referer', '')
+    )
 
-    if not proposal.data_prima_visualizzazione:
+    # La prima visualizzazione cambia lo stato: resta sincrona (una volta per proposta)
+    if counted and not proposal.data_prima_visualizzazione:
         proposal.data_prima_visualizzazione = datetime.utcnow()
         if proposal.stato == 'inviata':
             proposal.stato = 'visualizzata'
-
-    # Tracking
-    tracking = ProposalTracking(
-        proposal_id=proposal.id,
-        evento='view',
-        ip_address=request.remote_addr,
-        user_agent=request.headers.get('User-Agent', '')[:500],
-        referrer=request.headers.get('Referer', '')[:500]
-    )
-    db.session.add(tracking)
-    db.session.commit()
+        db.session.commit()
 
     # Ritorna proposta senza note interne
     result = proposal.to_dict(include_items=True)
@@ -956,30 +985,18 @@ def track_proposal_event(link):
     if not proposal or not proposal.link_attivo:
         return jsonify({'error': 'Proposta non trovata'}), 404
 
-    data = request.get_json()
+    data = request.get_json() or {}
 
-    tracking = ProposalTracking(
-        proposal_id=proposal.id,
-        evento=data.get('evento', 'interaction'),
+    # Accodato: tempo totale e download aggiornati dal flush del buffer
+    tracking_buffer.record_proposal_event(
+        proposal.id, data.get('evento', 'interaction'),
+        ip_address=request.remote_addr,
+        user_agent=request.headers.get('User-Agent', ''),
         sezione=data.get('sezione'),
         dettaglio=json.dumps(data.get('dettaglio')) if data.get('dettaglio') else None,
-        durata_secondi=data.get('durata_secondi'),
-        ip_address=request.remote_addr,
-        user_agent=request.headers.get('User-Agent', '')[:500]
+        durata_secondi=data.get('durata_secondi')
     )
 
-    db.session.add(tracking)
-
-    # Aggiorna tempo totale se time_spent
-    if data.get('durata_secondi'):
-        proposal.tempo_visualizzazione_totale = (proposal.tempo_visualizzazione_totale or 0) + data['durata_secondi']
-
-    # Incrementa download se evento download
-    if data.get('evento') == 'download':
-        proposal.download_pdf = (proposal.download_pdf or 0) + 1
-
-    db.session.commit()
-
     return jsonify({'message': 'Evento registrato'})
 
 
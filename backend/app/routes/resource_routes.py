@@ -2,8 +2,10 @@ from flask import Blueprint, request, jsonify
 from flask_jwt_extended import jwt_required, get_jwt_identity, get_jwt
 from app import db
 from app.models import Resource, ResourceCategory, ResourceReview, ResourceCollection, ResourceView, ResourceBookmark, Club, Sponsor
+from app.services.tracking_buffer import tracking_buffer
 from datetime import datetime
 from sqlalchemy import func, desc, or_
+from sqlalchemy.orm import joinedload
 from functools import wraps
 
 bp = Blueprint('resources', __name__, url_prefix='/api/resources')
@@ -68,13 +70,18 @@ def get_public_categories():
     return jsonify({'categories': result}), 200
 
 
-@bp.route('', methods=['GET'])
-@token_required
-def browse_resources(current_user, user_type):
-    """Browse resources with filters (accessible by Club and Sponsor)"""
-    page = request.args.get('page', 1, type=int)
-    per_page = request.args.get('per_page', 20, type=int)
+def _bookmarked_ids(user_type, user_id, resource_ids):
+    """Risorse della pagina salvate dall'utente (una query)"""
+    if not user_id or not resource_ids:
+        return set()
+    return {rid for (rid,) in db.session.query(ResourceBookmark.resource_id).filter(
+        ResourceBookmark.user_type == user_type,
+        ResourceBookmark.user_id == user_id,
+        ResourceBookmark.resource_id.in_(resource_ids)
+    ).all()}
 
+
+def _browse_query(user_type, filters):
     query = Resource.query.filter_by(pubblicata=True)
 
     # Access control based on user type
@@ -92,98 +99,115 @@ def browse_resources(current_user, user_type):
                 Resource.visibilita == 'club-only'
             )
         )
-    else:
-        # Admin sees all
-        pass
-
-    # Filters
-    if request.args.get('category_id'):
-        query = query.filter_by(category_id=request.args.get('category_id', type=int))
-
-    if request.args.get('tipo_risorsa'):
-        query = query.filter_by(tipo_risorsa=request.args.get('tipo_risorsa'))
-
-    if request.args.get('tag'):
-        tag = request.args.get('tag')
-        query = query.filter(Resource.tags.contains([tag]))
-
-    if request.args.get('settore'):
-        settore = request.args.get('settore')
-        query = query.filter(Resource.settori.contains([settore]))
-
-    if request.args.get('search'):
-        search = f"%{request.args.get('search')}%"
-        query = query.filter(
-            or_(
-                Resource.titolo.ilike(search),
-                Resource.descrizione.ilike(search),
-                Resource.autore.ilike(search)
-            )
-        )
 
-    # Featured/Recommended filters
-    if request.args.get('in_evidenza') == 'true':
+    if filters.get('category_id'):
+        query = query.filter_by(category_id=filters['category_id'])
+    if filters.get('tipo_risorsa'):
+        query = query.filter_by(tipo_risorsa=filters['tipo_risorsa'])
+    if filters.get('tag'):
+        query = query.filter(Resource.tags.contains([filters['tag']]))
+    if filters.get('settore'):
+        query = query.filter(Resource.settori.contains([filters['settore']]))
+    if filters.get('in_evidenza'):
         query = query.filter_by(in_evidenza=True)
-
-    if request.args.get('consigliata') == 'true':
+    if filters.get('consigliata'):
         query = query.filter_by(consigliata=True)
+    return query
+
+
+def _resource_summary(r, is_bookmarked, score=None):
+    data = {
+        'id': r.id,
+        'titolo': r.titolo,
+        'slug': r.slug,
+        'descrizione': r.descrizione,
+        'tipo_risorsa': r.tipo_risorsa,
+        'category': {'id': r.category.id, 'nome': r.category.nome, 'icona': r.category.icona} if r.category else None,
+        'tags': r.tags or [],
+        'settori': r.settori or [],
+        'file_tipo': r.file_tipo,
+        'file_size_kb': r.file_size_kb,
+        'anteprima_url': r.anteprima_url,
+        'autore': r.autore,
+        'fonte': r.fonte,
+        'data_pubblicazione': r.data_pubblicazione.isoformat() if r.data_pubblicazione else None,
+        'views_count': r.views_count,
+        'downloads_count': r.downloads_count,
+        'bookmarks_count': r.bookmarks_count,
+        'avg_rating': round(r.avg_rating or 0, 1),
+        'reviews_count': r.reviews_count,
+        'in_evidenza': r.in_evidenza,
+        'consigliata': r.consigliata,
+        'is_bookmarked': is_bookmarked,
+        'created_at': r.created_at.isoformat()
+    }
+    if score is not None:
+        data['score'] = score
+    return data
 
-    # Sort
-    sort_by = request.args.get('sort', 'recent')
-    if sort_by == 'popular':
-        query = query.order_by(desc(Resource.views_count))
-    elif sort_by == 'downloads':
-        query = query.order_by(desc(Resource.downloads_count))
-    elif sort_by == 'rating':
-        query = query.order_by(desc(Resource.avg_rating))
-    elif sort_by == 'recent':
-        query = query.order_by(desc(Resource.created_at))
-    else:
-        query = query.order_by(desc(Resource.created_at))
 
-    pagination = query.paginate(page=page, per_page=per_page, error_out=False)
-
-    resources = []
-    for r in pagination.items:
-        # Check if user has bookmarked
-        is_bookmarked = False
-        if current_user:
-            is_bookmarked = ResourceBookmark.query.filter_by(
-                resource_id=r.id,
-                user_type=user_type,
-                user_id=current_user.id
-            ).first() is not None
-
-        resources.append({
-            'id': r.id,
-            'titolo': r.titolo,
-            'slug': r.slug,
-            'descrizione': r.descrizione,
-            'tipo_risorsa': r.tipo_risorsa,
-            'category': {'id': r.category.id, 'nome': r.category.nome, 'icona': r.category.icona} if r.category else None,
-            'tags': r.tags or [],
-            'settori': r.settori or [],
-            'file_tipo': r.file_tipo,
-            'file_size_kb': r.file_size_kb,
-            'anteprima_url': r.anteprima_url,
-            'autore': r.autore,
-            'fonte': r.fonte,
-            'data_pubblicazione': r.data_pubblicazione.isoformat() if r.data_pubblicazione else None,
-            'views_count': r.views_count,
-            'downloads_count': r.downloads_count,
-            'bookmarks_count': r.bookmarks_count,
-            'avg_rating': round(r.avg_rating, 1),
-            'reviews_count': r.reviews_count,
-            'in_evidenza': r.in_evidenza,
-            'consigliata': r.consigliata,
-            'is_bookmarked': is_bookmarked,
-            'created_at': r.created_at.isoformat()
-        })
+@bp.route('', methods=['GET'])
+@token_required
+def browse_resources(current_user, user_type):
+    """
+    Browse resources with filters (accessible by Club and Sponsor).
+    Con `search` i risultati vengono dall'indice risorse, ordinati per
+    rilevanza (sort=relevance, default); la risposta include sempre le
+    faccette categoria / tipo_risorsa / settore.
+    """
+    page = max(1, request.args.get('page', 1, type=int))
+    per_page = min(max(1, request.args.get('per_page', 20, type=int)), 100)
+
+    filters = {
+        'category_id': request.args.get('category_id', type=int),
+        'tipo_risorsa': request.args.get('tipo_risorsa'),
+        'tag': request.args.get('tag'),
+        'settore': request.args.get('settore'),
+        'in_evidenza': request.args.get('in_evidenza') == 'true',
+        'consigliata': request.args.get('consigliata') == 'true',
+    }
+    search = (request.args.get('search') or '').strip()
+    sort_by = request.args.get('sort', 'relevance' if search else 'recent')
+
+    from app.services.resource_search_service import resource_search
+    result = resource_search.search(user_type, search, filters)
+    scores = result['scores']
+
+    if search and sort_by == 'relevance':
+        total = len(result['ids'])
+        page_ids = result['ids'][(page - 1) * per_page:page * per_page]
+        by_id = {r.id: r for r in Resource.query.options(joinedload(Resource.category)).filter(
+            Resource.id.in_(page_ids)
+        ).all()} if page_ids else {}
+        items = [by_id[rid] for rid in page_ids if rid in by_id]
+        pages = (total + per_page - 1) // per_page
+    else:
+        if search:
+            query = Resource.query.filter(Resource.id.in_(result['ids'] or [-1]))
+        else:
+            query = _browse_query(user_type, filters)
+
+        # Sort
+        if sort_by == 'popular':
+            query = query.order_by(desc(Resource.views_count))
+        elif sort_by == 'downloads':
+            query = query.order_by(desc(Resource.downloads_count))
+        elif sort_by == 'rating':
+            query = query.order_by(desc(Resource.avg_rating))
+        else:
+            query = query.order_by(desc(Resource.created_at))
+
+        pagination = query.options(joinedload(Resource.category)).paginate(page=page, per_page=per_page, error_out=False)
+        items, total, pages = pagination.items, pagination.total, pagination.pages
+
+    bookmarked = _bookmarked_ids(user_type, current_user.id if current_user else None, [r.id for r in items])
 
     return jsonify({
-        'resources': resources,
-        'total': pagination.total,
-        'pages': pagination.pages,
+        'resources': [_resource_summary(r, r.id in bookmarked, scores.get(r.id) if search else None) for r in items],
+        'facets': result['facets'],
+        'sort': sort_by,
+        'total': total,
+        'pages': pages,
         'current_page': page,
         'per_page': per_page
     }), 200
@@ -738,31 +762,13 @@ def get_my_activity(current_user, user_type):
 # ============================================
 
 def track_resource_action(resource_id, user_type, user_id, action_type, request_obj):
-    """Track a resource view or download"""
-    resource = Resource.query.get(resource_id)
-    if not resource:
-        return
-
-    # Create view record
-    view = ResourceView(
-        resource_id=resource_id,
-        user_type=user_type,
-        user_id=user_id,
-        tipo_azione=action_type,
+    """Track a resource view or download (buffered, flushed in batch)"""
+    tracking_buffer.record_resource_action(
+        resource_id, user_type, user_id, action_type,
         ip_address=request_obj.remote_addr,
-        user_agent=request_obj.headers.get('User-Agent', '')[:500]
+        user_agent=request_obj.headers.get('User-Agent', '')
     )
 
-    db.session.add(view)
-
-    # Update resource stats
-    if action_type == 'view':
-        resource.views_count += 1
-    elif action_type == 'download':
-        resource.downloads_count += 1
-
-    db.session.commit()
-
 
 def recalculate_resource_rating(resource_id):
     """Recalculate avg_rating and reviews_count for a resource"""
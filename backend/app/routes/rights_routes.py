@@ -4,16 +4,17 @@ Sistema completo per la gestione dei diritti di sponsorizzazione
 """
 
 from flask import Blueprint, request, jsonify
-from flask_jwt_extended import jwt_required, get_jwt_identity
+from flask_jwt_extended import jwt_required
 from app import db
 from app.models import (
-    Club, Sponsor, HeadOfTerms,
+    Sponsor, HeadOfTerms,
     RightCategory, Right, RightPricingTier, RightAvailability,
     RightAllocation, SectorExclusivity, RightConflict,
     RightPackage, RightPackageItem
 )
 from datetime import datetime, date
 from sqlalchemy import or_, and_, func
+from app.services.principal_service import current_principal
 import json
 
 rights_bp = Blueprint('rights', __name__)
@@ -25,10 +26,10 @@ rights_bp = Blueprint('rights', __name__)
 
 def get_current_club():
     """Ottiene il club corrente dall'identità JWT"""
-    identity = get_jwt_identity()
-    if identity.get('role') != 'club':
+    principal = current_principal()
+    if not principal or not principal.is_club:
         return None
-    return Club.query.get(identity.get('id'))
+    return principal.club
 
 
 def check_sector_conflict(club_id, settore, sponsor_id, data_inizio, data_fine, exclude_allocation_id=None):
@@ -5,6 +5,7 @@ from app.models import (
     Budget, BudgetCategory, Expense, Payment, FinancialDocument,
     HeadOfTerms, Club, Sponsor, Notification
 )
+from app.services.budget_analytics_service import BudgetAnalyticsService
 from datetime import datetime
 from sqlalchemy import extract, func
 
@@ -456,44 +457,20 @@ def get_budget_report(budget_id):
     if not budget or budget.owner_type != 'sponsor' or budget.owner_id != sponsor_id:
         return jsonify({'error': 'Budget non trovato'}), 404
 
-    # Spese per categoria
-    categories_report = []
-    for category in budget.categories:
-        categories_report.append({
-            'nome': category.nome,
-            'allocato': float(category.importo_allocato),
-            'speso': float(category.importo_speso),
-            'percentuale': category.get_percentage_used()
-        })
-
-    # Pagamenti overview
-    total_payments_amount = db.session.query(func.sum(Payment.importo)).filter(
-        Payment.budget_id == budget_id
-    ).scalar() or 0
+    return jsonify({'report': BudgetAnalyticsService.budget_report(budget)}), 200
 
-    paid_amount = db.session.query(func.sum(Payment.importo)).filter(
-        Payment.budget_id == budget_id,
-        Payment.stato == 'completato'
-    ).scalar() or 0
 
-    pending_amount = db.session.query(func.sum(Payment.importo)).filter(
-        Payment.budget_id == budget_id,
-        Payment.stato.in_(['pianificato', 'in_corso'])
-    ).scalar() or 0
+@sponsor_budget_bp.route('/budgets/portfolio', methods=['GET'])
+@jwt_required()
+def get_budget_portfolio():
+    """Vista portafoglio di tutti i budget dello sponsor"""
+    sponsor_id = verify_sponsor()
+    if not sponsor_id:
+        return jsonify({'error': 'Accesso non autorizzato'}), 403
 
-    return jsonify({
-        'report': {
-            'budget_overview': {
-                'totale': float(budget.importo_totale),
-                'speso': float(budget.importo_speso),
-                'rimanente': float(budget.calculate_remaining()),
-                'percentuale_utilizzo': budget.get_percentage_used()
-            },
-            'categories': categories_report,
-            'payments_overview': {
-                'totale_da_pagare': float(total_payments_amount),
-                'gia_pagato': float(paid_amount),
-                'da_pagare': float(pending_amount)
-            }
-        }
-    }), 200
+    window = min(max(request.args.get('window', 3, type=int), 1), 12)
+    return jsonify({'portfolio': BudgetAnalyticsService.portfolio(
+        'sponsor', sponsor_id,
+        anno_fiscale=request.args.get('anno_fiscale', type=int),
+        window=window
+    )}), 200
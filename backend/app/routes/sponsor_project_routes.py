@@ -1,8 +1,10 @@
 from flask import Blueprint, request, jsonify
 from app import db
-from app.models import Project, ProjectTask, TaskComment
+from app.models import Project, ProjectTask, ProjectUpdate, TaskComment
 from app.services.notification_service import NotificationService
+from app.services.project_metrics_service import ProjectMetricsService
 from datetime import datetime
+from sqlalchemy import case, func
 import json
 
 sponsor_project_bp = Blueprint('sponsor_projects', __name__)
@@ -45,7 +47,7 @@ def get_projects(current_user):
         query = query.filter_by(priorita=priorita)
 
     query = query.filter(Project.archived_at.is_(None))
-    projects = query.order_by(Project.created_at.desc()).all()
+    projects = ProjectMetricsService.ensure_fresh(query.order_by(Project.created_at.desc()).all())
 
     return jsonify({
         'projects': [p.to_dict() for p in projects],
@@ -63,6 +65,7 @@ def get_project(current_user, id):
     if not project or project.sponsor_id != sponsor_id:
         return jsonify({'error': 'Progetto non trovato'}), 404
 
+    ProjectMetricsService.ensure_fresh([project])
     return jsonify({'project': project.to_dict_detailed()}), 200
 
 
@@ -146,8 +149,6 @@ def update_task_status(current_user, id):
     else:
         db.session.commit()
 
-    task.project.update_progress()
-
     return jsonify({
         'message': 'Stato task aggiornato',
         'task': task.to_dict()
@@ -297,17 +298,20 @@ def get_project_stats(current_user, id):
     if not project or project.sponsor_id != sponsor_id:
         return jsonify({'error': 'Progetto non trovato'}), 404
 
-    # Tasks stats
-    my_tasks = ProjectTask.query.filter_by(
-        project_id=id,
-        assegnato_a_type='sponsor',
-        assegnato_a_id=sponsor_id
-    )
-
-    total_tasks = my_tasks.count()
-    completed_tasks = my_tasks.filter_by(stato='completato').count()
-    in_progress_tasks = my_tasks.filter_by(stato='in_corso').count()
-    late_tasks = sum(1 for t in my_tasks.all() if t.is_late())
+    # Tasks stats: contatori del progetto (già caricati) e mie task in una query aggregata
+    ProjectMetricsService.ensure_fresh([project])
+    is_open = func.coalesce(ProjectTask.stato, '') != 'completato'
+    total_tasks, completed_tasks, in_progress_tasks, late_tasks = db.session.query(
+        func.count(ProjectTask.id),
+        func.coalesce(func.sum(case((ProjectTask.stato == 'completato', 1), else_=0)), 0),
+        func.coalesce(func.sum(case((ProjectTask.stato == 'in_corso', 1), else_=0)), 0),
+        func.coalesce(func.sum(case((is_open & (ProjectTask.data_scadenza < datetime.utcnow()), 1), else_=0)), 0)
+    ).filter(
+        ProjectTask.project_id == id,
+        ProjectTask.assegnato_a_type == 'sponsor',
+        ProjectTask.assegnato_a_id == sponsor_id
+    ).one()
+    completed_tasks, in_progress_tasks, late_tasks = int(completed_tasks), int(in_progress_tasks), int(late_tasks)
 
     # Comments stats
     my_comments = TaskComment.query.filter_by(
@@ -324,7 +328,8 @@ def get_project_stats(current_user, id):
             'late_tasks': late_tasks,
             'completion_rate': (completed_tasks / total_tasks * 100) if total_tasks > 0 else 0,
             'total_comments': my_comments
-        }
+        },
+        'project_stats': ProjectMetricsService.counters(project)
     }), 200
 
 
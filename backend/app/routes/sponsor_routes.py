@@ -2,9 +2,11 @@ from flask import Blueprint, request, jsonify
 from flask_jwt_extended import create_access_token, jwt_required, get_jwt_identity, get_jwt
 from app import db
 from app.models import Sponsor, HeadOfTerms, SponsorAccount, SponsorInvitation, Club
+from app.services.principal_service import current_principal
+from app.services.auth_service import AuthService, rate_limited_response
+from app.services.sponsor_analytics_service import SponsorAnalyticsService
+from app.services.contract_timeline_service import ContractTimelineService
 from datetime import datetime, timedelta
-from sqlalchemy import func
-from collections import Counter
 import secrets
 
 
@@ -46,11 +48,15 @@ def login():
     if not email or not password:
         return jsonify({'error': 'Email e password richiesti'}), 400
 
+    retry_after = AuthService.check_rate_limit(email)
+    if retry_after:
+        return rate_limited_response(retry_after)
+
     # 1. Prima prova con il nuovo sistema (SponsorAccount)
     sponsor_account = SponsorAccount.query.filter_by(email=email).first()
 
     if sponsor_account:
-        if not sponsor_account.check_password(password):
+        if not AuthService.verify(sponsor_account, password):
             return jsonify({'error': 'Credenziali non valide'}), 401
 
         if not sponsor_account.account_attivo:
@@ -75,6 +81,7 @@ def login():
         # Aggiorna ultimo accesso
         sponsor_account.ultimo_accesso = datetime.utcnow()
         db.session.commit()
+        AuthService.login_succeeded(email)
 
         # Crea token con account_id e current_club
         access_token = create_access_token(
@@ -118,13 +125,17 @@ def login():
     # 2. Fallback: prova con sistema legacy (Sponsor con password_hash)
     legacy_sponsor = Sponsor.query.filter_by(email=email).first()
 
-    if legacy_sponsor and legacy_sponsor.password_hash and legacy_sponsor.check_password(password):
+    if legacy_sponsor and AuthService.verify(legacy_sponsor, password):
         if not legacy_sponsor.account_attivo:
             return jsonify({'error': 'Account disattivato. Contattare il club'}), 403
 
         if not legacy_sponsor.club.is_licenza_valida() or not legacy_sponsor.club.account_attivo:
             return jsonify({'error': 'Account club non attivo. Contattare il club'}), 403
 
+        # Salva l'eventuale rehash della password
+        db.session.commit()
+        AuthService.login_succeeded(email)
+
         access_token = create_access_token(
             identity=str(legacy_sponsor.id),
             additional_claims={
@@ -361,49 +372,7 @@ def get_sponsors_analytics():
     if not club_id:
         return jsonify({'error': 'Accesso non autorizzato'}), 403
 
-    # Valore totale contratti attivi
-    total_active = db.session.query(func.sum(HeadOfTerms.valore_totale)).filter(
-        HeadOfTerms.club_id == club_id,
-        HeadOfTerms.stato == 'attivo'
-    ).scalar() or 0
-
-    # Nuovi sponsor negli ultimi 12 mesi
-    twelve_months_ago = datetime.utcnow() - timedelta(days=365)
-    recent_sponsors = Sponsor.query.filter(
-        Sponsor.club_id == club_id,
-        Sponsor.created_at >= twelve_months_ago
-    ).all()
-    month_counts = Counter(
-        s.created_at.strftime('%Y-%m') for s in recent_sponsors if s.created_at
-    )
-    timeline_data = [{'month': m, 'count': c} for m, c in sorted(month_counts.items())]
-
-    # Contratti in scadenza (60 giorni)
-    sixty_days = datetime.utcnow() + timedelta(days=60)
-    expiring = HeadOfTerms.query.filter(
-        HeadOfTerms.club_id == club_id,
-        HeadOfTerms.stato == 'attivo',
-        HeadOfTerms.data_fine <= sixty_days,
-        HeadOfTerms.data_fine >= datetime.utcnow()
-    ).all()
-
-    expiring_data = []
-    for contract in expiring:
-        days_left = (contract.data_fine - datetime.utcnow()).days
-        expiring_data.append({
-            'contract_id': contract.id,
-            'contract_name': contract.nome_accordo,
-            'sponsor_name': contract.sponsor.ragione_sociale,
-            'value': float(contract.valore_totale),
-            'expiry_date': contract.data_fine.isoformat(),
-            'days_left': days_left
-        })
-
-    return jsonify({
-        'total_active_value': float(total_active),
-        'sponsors_timeline': timeline_data,
-        'expiring_contracts': expiring_data
-    }), 200
+    return jsonify(SponsorAnalyticsService.summary(club_id)), 200
 
 
 # POST - Crea nuovo sponsor (con sistema inviti)
@@ -899,79 +868,29 @@ def get_sponsor_drive(sponsor_id):
     if sponsor.club_id != club_id:
         return jsonify({'error': 'Accesso non autorizzato'}), 403
 
-    from app.models import SponsorDriveFile
-
-    # Filtri opzionali
-    contract_id = request.args.get('contract_id', type=int)
-    activation_id = request.args.get('activation_id', type=int)
-    event_activation_id = request.args.get('event_activation_id', type=int)
-    inventory_asset_id = request.args.get('inventory_asset_id', type=int)
-    categoria = request.args.get('categoria')
-    cartella = request.args.get('cartella')
-    search = request.args.get('search')
-
-    query = SponsorDriveFile.query.filter_by(
-        club_id=club_id,
-        sponsor_id=sponsor_id,
-        stato='attivo'
-    )
-
-    # Filtro per entità collegata
-    if contract_id:
-        query = query.filter_by(contract_id=contract_id)
-    if activation_id:
-        query = query.filter_by(activation_id=activation_id)
-    if event_activation_id:
-        query = query.filter_by(event_activation_id=event_activation_id)
-    if inventory_asset_id:
-        query = query.filter_by(inventory_asset_id=inventory_asset_id)
-    if categoria:
-        query = query.filter_by(categoria=categoria)
-    if cartella:
-        query = query.filter_by(cartella=cartella)
-    if search:
-        query = query.filter(SponsorDriveFile.nome.ilike(f'%{search}%'))
-
-    files = query.order_by(SponsorDriveFile.created_at.desc()).all()
-
-    files_data = []
-    for f in files:
-        import json
-        tags = []
-        if f.tags:
-            try:
-                tags = json.loads(f.tags)
-            except:
-                pass
-
-        files_data.append({
-            'id': f.id,
-            'nome': f.nome,
-            'file_url': f.file_url,
-            'file_size': f.file_size,
-            'file_type': f.file_type,
-            'estensione': f.estensione,
-            'descrizione': f.descrizione,
-            'categoria': f.categoria,
-            'cartella': f.cartella,
-            'tags': tags,
-            'contract_id': f.contract_id,
-            'contract_nome': f.contract.nome_contratto if f.contract else None,
-            'activation_id': f.activation_id,
-            'event_activation_id': f.event_activation_id,
-            'inventory_asset_id': f.inventory_asset_id,
-            'inventory_asset_nome': f.inventory_asset.nome if f.inventory_asset else None,
-            'caricato_da': f.caricato_da,
-            'caricato_da_nome': f.caricato_da_nome,
-            'thumbnail_url': f.thumbnail_url,
-            'created_at': f.created_at.isoformat() if f.created_at else None,
-            'updated_at': f.updated_at.isoformat() if f.updated_at else None
-        })
+    from app.services.sponsor_drive_service import SponsorDriveService
+
+    filters = {
+        'contract_id': request.args.get('contract_id', type=int),
+        'activation_id': request.args.get('activation_id', type=int),
+        'event_activation_id': request.args.get('event_activation_id', type=int),
+        'inventory_asset_id': request.args.get('inventory_asset_id', type=int),
+        'categoria': request.args.get('categoria'),
+        'cartella': request.args.get('cartella'),
+        'search': request.args.get('search')
+    }
+
+    # Paginazione keyset opzionale: ?limit=50 e poi ?cursor=<next_cursor>
+    try:
+        result = SponsorDriveService.list_files(
+            club_id, sponsor_id, filters,
+            limit=request.args.get('limit', type=int),
+            cursor=request.args.get('cursor')
+        )
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
 
-    return jsonify({
-        'total': len(files_data),
-        'files': files_data
-    }), 200
+    return jsonify(result), 200
 
 
 # GET - Struttura cartelle del drive
@@ -987,30 +906,10 @@ def get_sponsor_drive_folders(sponsor_id):
     if sponsor.club_id != club_id:
         return jsonify({'error': 'Accesso non autorizzato'}), 403
 
-    from app.models import SponsorDriveFile
+    from app.services.sponsor_drive_service import SponsorDriveService
 
-    folders = db.session.query(SponsorDriveFile.cartella).filter_by(
-        club_id=club_id,
-        sponsor_id=sponsor_id,
-        stato='attivo'
-    ).distinct().all()
-
-    # Conta file per cartella
-    folder_data = []
-    for (folder,) in folders:
-        count = SponsorDriveFile.query.filter_by(
-            club_id=club_id,
-            sponsor_id=sponsor_id,
-            cartella=folder,
-            stato='attivo'
-        ).count()
-        folder_data.append({
-            'path': folder,
-            'name': folder.split('/')[-1] if folder != '/' else 'Root',
-            'files_count': count
-        })
-
-    return jsonify(folder_data), 200
+    # Albero cartelle materializzato: file diretti e totali di sottoalbero
+    return jsonify(SponsorDriveService.folder_tree(club_id, sponsor_id)), 200
 
 
 # POST - Carica file nel drive
@@ -1177,62 +1076,9 @@ def get_sponsor_drive_stats(sponsor_id):
     if sponsor.club_id != club_id:
         return jsonify({'error': 'Accesso non autorizzato'}), 403
 
-    from app.models import SponsorDriveFile
+    from app.services.sponsor_drive_service import SponsorDriveService
 
-    # Totale file attivi
-    total_files = SponsorDriveFile.query.filter_by(
-        club_id=club_id,
-        sponsor_id=sponsor_id,
-        stato='attivo'
-    ).count()
-
-    # Dimensione totale
-    total_size = db.session.query(func.sum(SponsorDriveFile.file_size)).filter_by(
-        club_id=club_id,
-        sponsor_id=sponsor_id,
-        stato='attivo'
-    ).scalar() or 0
-
-    # File per categoria
-    by_category = db.session.query(
-        SponsorDriveFile.categoria,
-        func.count(SponsorDriveFile.id)
-    ).filter_by(
-        club_id=club_id,
-        sponsor_id=sponsor_id,
-        stato='attivo'
-    ).group_by(SponsorDriveFile.categoria).all()
-
-    # File collegati a entità
-    files_with_contract = SponsorDriveFile.query.filter(
-        SponsorDriveFile.club_id == club_id,
-        SponsorDriveFile.sponsor_id == sponsor_id,
-        SponsorDriveFile.stato == 'attivo',
-        SponsorDriveFile.contract_id.isnot(None)
-    ).count()
-
-    files_with_activation = SponsorDriveFile.query.filter(
-        SponsorDriveFile.club_id == club_id,
-        SponsorDriveFile.sponsor_id == sponsor_id,
-        SponsorDriveFile.stato == 'attivo',
-        (SponsorDriveFile.activation_id.isnot(None)) | (SponsorDriveFile.event_activation_id.isnot(None))
-    ).count()
-
-    files_with_asset = SponsorDriveFile.query.filter(
-        SponsorDriveFile.club_id == club_id,
-        SponsorDriveFile.sponsor_id == sponsor_id,
-        SponsorDriveFile.stato == 'attivo',
-        SponsorDriveFile.inventory_asset_id.isnot(None)
-    ).count()
-
-    return jsonify({
-        'total_files': total_files,
-        'total_size_bytes': total_size,
-        'by_category': [{'categoria': cat, 'count': count} for cat, count in by_category],
-        'files_with_contract': files_with_contract,
-        'files_with_activation': files_with_activation,
-        'files_with_asset': files_with_asset
-    }), 200
+    return jsonify(SponsorDriveService.stats(club_id, sponsor_id)), 200
 
 
 # ================== PUBLIC INVITATION ENDPOINTS ==================
@@ -1460,10 +1306,14 @@ def login_and_join(token):
     if not email or not password:
         return jsonify({'error': 'Email e password richiesti'}), 400
 
+    retry_after = AuthService.check_rate_limit(email)
+    if retry_after:
+        return rate_limited_response(retry_after)
+
     # Trova l'account sponsor
     sponsor_account = SponsorAccount.query.filter_by(email=email).first()
 
-    if not sponsor_account or not sponsor_account.check_password(password):
+    if not sponsor_account or not AuthService.verify(sponsor_account, password):
         return jsonify({'error': 'Credenziali non valide'}), 401
 
     if not sponsor_account.account_attivo:
@@ -1564,20 +1414,14 @@ def login_and_join(token):
 
 def get_sponsor_membership():
     """Helper function per ottenere la membership corrente dello sponsor"""
-    claims = get_jwt()
-    if claims.get('role') != 'sponsor':
+    principal = current_principal()
+    if not principal or not principal.is_sponsor:
         return None, None
 
-    auth_type = claims.get('auth_type', 'legacy')
-    current_club_id = claims.get('current_club_id')
-    membership_id = claims.get('membership_id')
-
-    if auth_type == 'legacy':
-        membership = Sponsor.query.get(membership_id)
-        return membership, membership.club_id if membership else None
-    else:
-        membership = Sponsor.query.get(membership_id)
-        return membership, current_club_id
+    membership = principal.membership
+    if not membership:
+        return None, None
+    return membership, principal.club_id
 
 
 @sponsor_bp.route('/sponsor/dashboard', methods=['GET'])
@@ -1588,20 +1432,14 @@ def get_sponsor_dashboard():
     if not membership:
         return jsonify({'error': 'Accesso non autorizzato'}), 403
 
-    from app.models import (HeadOfTerms, Activation, Event, EventAssetActivation,
+    from app.models import (Activation, Event, EventAssetActivation,
                            EventInvitation, SponsorDriveFile, AssetAllocation,
                            InventoryAsset, Match, ProjectTask, Project)
 
     now = datetime.utcnow()
 
-    # 1. Contratti attivi
-    contracts = HeadOfTerms.query.filter_by(
-        sponsor_id=membership.id,
-        club_id=club_id
-    ).all()
-
-    active_contracts = [c for c in contracts if c.status == 'attivo' and
-                        c.data_inizio <= now and c.data_fine >= now]
+    # 1. Contratti attivi (nel periodo di validità)
+    active_contracts = ContractTimelineService.active_contracts(club_id, sponsor_id=membership.id, current=True)
 
     total_value = sum(c.compenso or 0 for c in active_contracts)
 
@@ -1705,12 +1543,8 @@ def get_sponsor_dashboard():
     } for f in recent_files]
 
     # 7. Statistiche generali
-    total_files = SponsorDriveFile.query.filter_by(
-        sponsor_id=membership.id,
-        club_id=club_id,
-        visibile_sponsor=True,
-        stato='attivo'
-    ).count()
+    from app.services.sponsor_drive_service import SponsorDriveService
+    total_files = SponsorDriveService.total_files(club_id, membership.id, sponsor_view=True)
 
     return jsonify({
         'stats': {
@@ -2139,88 +1973,31 @@ def get_sponsor_drive_files():
     if not membership:
         return jsonify({'error': 'Accesso non autorizzato'}), 403
 
-    from app.models import SponsorDriveFile
-    import json
-
-    # Filtri
-    categoria = request.args.get('categoria')
-    cartella = request.args.get('cartella')
-    contract_id = request.args.get('contract_id', type=int)
-    search = request.args.get('search')
-
-    query = SponsorDriveFile.query.filter_by(
-        sponsor_id=membership.id,
-        club_id=club_id,
-        visibile_sponsor=True,
-        stato='attivo'
-    )
-
-    if categoria:
-        query = query.filter_by(categoria=categoria)
-    if cartella:
-        query = query.filter_by(cartella=cartella)
-    if contract_id:
-        query = query.filter_by(contract_id=contract_id)
-    if search:
-        query = query.filter(SponsorDriveFile.nome.ilike(f'%{search}%'))
-
-    files = query.order_by(SponsorDriveFile.created_at.desc()).all()
-
-    files_data = []
-    for f in files:
-        tags = []
-        if f.tags:
-            try:
-                tags = json.loads(f.tags)
-            except:
-                pass
-
-        files_data.append({
-            'id': f.id,
-            'nome': f.nome,
-            'file_url': f.file_url,
-            'file_size': f.file_size,
-            'file_type': f.file_type,
-            'estensione': f.estensione,
-            'descrizione': f.descrizione,
-            'categoria': f.categoria,
-            'cartella': f.cartella,
-            'tags': tags,
-            'contract_id': f.contract_id,
-            'contract_nome': f.contract.nome_contratto if f.contract else None,
-            'caricato_da': f.caricato_da,
-            'caricato_da_nome': f.caricato_da_nome,
-            'thumbnail_url': f.thumbnail_url,
-            'created_at': f.created_at.isoformat() if f.created_at else None
-        })
-
-    # Cartelle uniche
-    folders = db.session.query(SponsorDriveFile.cartella).filter_by(
-        sponsor_id=membership.id,
-        club_id=club_id,
-        visibile_sponsor=True,
-        stato='attivo'
-    ).distinct().all()
-
-    folder_list = list(set([f[0] for f in folders if f[0]]))
-
-    # Categorie con conteggio
-    categories = db.session.query(
-        SponsorDriveFile.categoria,
-        func.count(SponsorDriveFile.id)
-    ).filter_by(
-        sponsor_id=membership.id,
-        club_id=club_id,
-        visibile_sponsor=True,
-        stato='attivo'
-    ).group_by(SponsorDriveFile.categoria).all()
-
-    return jsonify({
-        'files': files_data,
-        'total': len(files_data),
-        'folders': folder_list,
-        'categories': [{'categoria': cat, 'count': count} for cat, count in categories]
-    }), 200
+    from app.services.sponsor_drive_service import SponsorDriveService
+
+    filters = {
+        'categoria': request.args.get('categoria'),
+        'cartella': request.args.get('cartella'),
+        'contract_id': request.args.get('contract_id', type=int),
+        'search': request.args.get('search')
+    }
+
+    try:
+        result = SponsorDriveService.list_files(
+            club_id, membership.id, filters,
+            limit=request.args.get('limit', type=int),
+            cursor=request.args.get('cursor'),
+            sponsor_view=True
+        )
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    # Cartelle e categorie dai contatori del drive
+    tree = SponsorDriveService.folder_tree(club_id, membership.id, sponsor_view=True)
+    result['folders'] = [f['path'] for f in tree if f['files_count']]
+    result['folder_tree'] = tree
+    result['categories'] = SponsorDriveService.categories(club_id, membership.id, sponsor_view=True)
+    return jsonify(result), 200
 
 
 @sponsor_bp.route('/sponsor/drive', methods=['POST'])
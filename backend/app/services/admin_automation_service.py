@@ -1,8 +1,18 @@
 """
 Admin Automation Service - Engine di esecuzione workflow admin
 Specchia automation_service.py per il contesto admin (CRM leads, contratti, fatture, ecc.)
+
+Gli step vengono letti dal piano compilato del workflow (workflow_plan), il
+context carica le entità con una query per tipo anche per più execution
+insieme e lo stato di execution/step viene scritto con un commit per fase
+(esecuzione immediata o blocco di step ritardati della stessa execution).
+Ogni step gira in un savepoint: se fallisce, solo le sue scritture vengono
+annullate.
 """
+import copy
+from collections import OrderedDict, defaultdict
 from datetime import datetime, timedelta
+from sqlalchemy import exists, func
 from app import db
 from app.models import (
     AdminWorkflow, AdminWorkflowExecution, AdminWorkflowStepExecution,
@@ -10,9 +20,156 @@ from app.models import (
     AdminInvoice, AdminTask, DemoBooking, Club, AdminEmailTemplate,
     Notification, AdminCalendarEvent
 )
-import requests
+from app.services import rule_compiler
+from app.services.workflow_plan import workflow_compiler
+from app.services.whatsapp_client import whatsapp_client
+from app.lazy_imports import lazy_import
 import json
-import re
+
+requests = lazy_import('requests')
+
+
+def _iso(value):
+    return value.isoformat() if value else None
+
+
+def _lead_data(lead):
+    return {
+        'id': lead.id,
+        'nome_club': lead.nome_club,
+        'contatto_nome': lead.contatto_nome,
+        'contatto_cognome': lead.contatto_cognome,
+        'contatto_email': lead.contatto_email,
+        'contatto_telefono': lead.contatto_telefono,
+        'contatto_ruolo': getattr(lead, 'contatto_ruolo', None),
+        'referente_nome': getattr(lead, 'referente_nome', None),
+        'referente_email': getattr(lead, 'referente_email', None),
+        'stage': lead.stage,
+        'temperatura': lead.temperatura,
+        'valore_stimato': lead.valore_stimato,
+        'probabilita': getattr(lead, 'probabilita', None),
+        'tipologia_sport': lead.tipologia_sport,
+        'citta': lead.citta,
+        'provincia': getattr(lead, 'provincia', None),
+        'regione': getattr(lead, 'regione', None),
+        'fonte': lead.fonte,
+        'score': getattr(lead, 'score', None),
+        'priorita': getattr(lead, 'priorita', None),
+        'prossima_azione': getattr(lead, 'prossima_azione', None),
+        'data_prossima_azione': _iso(getattr(lead, 'data_prossima_azione', None)),
+    }
+
+
+def _contract_data(contract):
+    return {
+        'id': contract.id,
+        'club_id': contract.club_id,
+        'plan_type': contract.plan_type,
+        'plan_price': contract.plan_price,
+        'total_value': contract.total_value,
+        'vat_rate': contract.vat_rate,
+        'start_date': _iso(contract.start_date),
+        'end_date': _iso(contract.end_date),
+        'renewal_date': _iso(getattr(contract, 'renewal_date', None)),
+        'status': contract.status,
+        'payment_terms': getattr(contract, 'payment_terms', None),
+        'signed_by': getattr(contract, 'signed_by', None),
+    }
+
+
+def _invoice_data(invoice):
+    return {
+        'id': invoice.id,
+        'invoice_number': invoice.invoice_number,
+        'amount': invoice.amount,
+        'vat_amount': invoice.vat_amount,
+        'total_amount': invoice.total_amount,
+        'status': invoice.status,
+        'issue_date': _iso(invoice.issue_date),
+        'due_date': _iso(invoice.due_date),
+        'payment_date': _iso(invoice.payment_date),
+        'contract_id': invoice.contract_id,
+        'club_id': invoice.club_id,
+    }
+
+
+def _booking_data(booking):
+    return {
+        'id': booking.id,
+        'nome': booking.nome,
+        'cognome': booking.cognome,
+        'email': booking.email,
+        'nome_club': booking.nome_club,
+        'telefono': getattr(booking, 'telefono', None),
+        'sport_tipo': getattr(booking, 'sport_tipo', None),
+        'stato': getattr(booking, 'stato', None),
+        'durata': getattr(booking, 'durata', None),
+        'data_ora': _iso(booking.data_ora),
+    }
+
+
+def _club_summary(club):
+    return {'id': club.id, 'nome': club.nome, 'email': club.email}
+
+
+def _club_data(club):
+    return {
+        **_club_summary(club),
+        'tipologia': getattr(club, 'tipologia', None),
+        'telefono': getattr(club, 'telefono', None),
+        'citta': getattr(club, 'citta', None),
+        'referente_nome': getattr(club, 'referente_nome', None),
+        'account_attivo': getattr(club, 'account_attivo', None),
+    }
+
+
+def _task_data(task):
+    return {
+        'id': task.id,
+        'titolo': task.titolo,
+        'descrizione': task.descrizione,
+        'tipo': task.tipo,
+        'priorita': task.priorita,
+        'stato': task.stato,
+        'lead_id': task.lead_id,
+        'club_id': task.club_id,
+        'data_scadenza': _iso(task.data_scadenza),
+    }
+
+
+def _calendar_event_data(event):
+    return {
+        'id': event.id,
+        'titolo': event.titolo,
+        'tipo': event.tipo,
+        'descrizione': getattr(event, 'descrizione', None),
+        'data_inizio': _iso(event.data_inizio),
+        'data_fine': _iso(event.data_fine),
+        'lead_id': event.lead_id,
+        'club_id': event.club_id,
+    }
+
+
+# entity_type -> (modello, serializzatore, carica anche il club collegato)
+CONTEXT_ENTITIES = {
+    'lead': (CRMLead, _lead_data, False),
+    'contract': (AdminContract, _contract_data, True),
+    'invoice': (AdminInvoice, _invoice_data, True),
+    'booking': (DemoBooking, _booking_data, False),
+    'club': (Club, _club_data, False),
+    'task': (AdminTask, _task_data, False),
+    'calendar_event': (AdminCalendarEvent, _calendar_event_data, False),
+}
+
+
+def _entity_ref(trigger_data):
+    """(entity_type, entity_id) caricabile dal trigger, altrimenti None"""
+    if not trigger_data or trigger_data.get('entity_type') not in CONTEXT_ENTITIES:
+        return None
+    try:
+        return trigger_data['entity_type'], int(trigger_data.get('entity_id'))
+    except (TypeError, ValueError):
+        return None
 
 
 class AdminAutomationService:
@@ -28,6 +185,11 @@ class AdminAutomationService:
             return func
         return decorator
 
+    @classmethod
+    def plan(cls, workflow):
+        """Piano compilato (in cache) del workflow"""
+        return workflow_compiler.plan('admin', workflow, cls.STEP_HANDLERS)
+
     @staticmethod
     def execute_workflow(workflow, trigger_data=None):
         """
@@ -37,6 +199,7 @@ class AdminAutomationService:
         if workflow.tipo == 'email_sequence' and trigger_data:
             return AdminAutomationService._enroll_in_sequence(workflow, trigger_data)
 
+        plan = AdminAutomationService.plan(workflow)
         execution = AdminWorkflowExecution(
             workflow_id=workflow.id,
             status='running',
@@ -47,86 +210,36 @@ class AdminAutomationService:
         db.session.flush()
 
         context = AdminAutomationService._build_admin_context(trigger_data)
-        steps = workflow.steps or []
         all_success = True
         has_pending = False
         skip_branches = set()
 
-        for idx, step in enumerate(steps):
-            step_type = step.get('type')
-            step_config = step.get('config', {})
-            step_id = step.get('id', str(idx))
-            branch = step.get('branch')
-            parent_condition_id = step.get('parent_condition_id')
-
+        for step in plan.steps:
             # Skip se appartiene a un branch da skippare
-            if parent_condition_id and branch:
-                key = f"{parent_condition_id}:{branch}"
-                if key in skip_branches:
-                    continue
-
-            step_exec = AdminWorkflowStepExecution(
-                execution_id=execution.id,
-                step_index=idx,
-                step_type=step_type,
-                step_id=step_id,
-                input_data=step_config,
-                status='pending'
-            )
-            db.session.add(step_exec)
-            db.session.flush()
+            if step.branch_key in skip_branches:
+                continue
+
+            step_exec = AdminAutomationService._new_step_exec(execution, step)
 
             # Gestisci delay
-            if step_type == 'delay':
-                minutes = step_config.get('minutes', 0)
-                hours = step_config.get('hours', 0)
-                days = step_config.get('days', 0)
-                total_minutes = minutes + (hours * 60) + (days * 24 * 60)
-                if total_minutes > 0:
-                    step_exec.scheduled_for = datetime.utcnow() + timedelta(minutes=total_minutes)
-                    step_exec.status = 'pending'
+            if step.type == 'delay':
+                if step.delay > 0:
+                    step_exec.scheduled_for = datetime.utcnow() + timedelta(minutes=step.delay)
                     has_pending = True
                     # Tutti gli step successivi diventano pending
-                    for remaining_idx in range(idx + 1, len(steps)):
-                        rem_step = steps[remaining_idx]
-                        rem_exec = AdminWorkflowStepExecution(
-                            execution_id=execution.id,
-                            step_index=remaining_idx,
-                            step_type=rem_step.get('type'),
-                            step_id=rem_step.get('id', str(remaining_idx)),
-                            input_data=rem_step.get('config', {}),
-                            status='pending',
-                            scheduled_for=step_exec.scheduled_for
-                        )
-                        db.session.add(rem_exec)
+                    for remaining in plan.steps[step.index + 1:]:
+                        AdminAutomationService._new_step_exec(execution, remaining, step_exec.scheduled_for)
                     break
                 continue
 
-            # Esegui step
-            try:
-                step_exec.status = 'running'
-                step_exec.started_at = datetime.utcnow()
-                db.session.commit()
-
-                result = AdminAutomationService.execute_step(step_type, step_config, context)
-
-                step_exec.status = 'completed'
-                step_exec.output_data = result
-                step_exec.completed_at = datetime.utcnow()
-
-                context['last_step_output'] = result
-
-                # Gestisci branching per condition
-                if step_type == 'condition' and result:
-                    condition_met = result.get('condition_met', False)
-                    skip_branch = 'if_false' if condition_met else 'if_true'
-                    skip_branches.add(f"{step_id}:{skip_branch}")
-
-            except Exception as e:
-                step_exec.status = 'failed'
-                step_exec.error_message = str(e)
-                step_exec.completed_at = datetime.utcnow()
+            result = AdminAutomationService._run_step(step_exec, step.type, step.config, context)
+            if step_exec.status == 'failed':
                 all_success = False
+            elif step.type == 'condition' and result:
+                # Gestisci branching per condition
+                condition_met = result.get('condition_met', False)
+                skip_branch = 'if_false' if condition_met else 'if_true'
+                skip_branches.add(f"{step.id}:{skip_branch}")
 
         # Aggiorna execution status
         if has_pending:
@@ -146,6 +259,40 @@ class AdminAutomationService:
         db.session.commit()
         return execution
 
+    @staticmethod
+    def _new_step_exec(execution, step, scheduled_for=None):
+        step_exec = AdminWorkflowStepExecution(
+            execution_id=execution.id,
+            step_index=step.index,
+            step_type=step.type,
+            step_id=step.id,
+            input_data=copy.deepcopy(step.config),
+            status='pending',
+            scheduled_for=scheduled_for
+        )
+        db.session.add(step_exec)
+        return step_exec
+
+    @staticmethod
+    def _run_step(step_exec, step_type, config, context):
+        """Esegue uno step in un savepoint e ne registra l'esito su step_exec (il commit è del chiamante)"""
+        step_exec.status = 'running'
+        step_exec.started_at = datetime.utcnow()
+        try:
+            with db.session.begin_nested():
+                result = AdminAutomationService.execute_step(step_type, config, context)
+        except Exception as e:
+            step_exec.status = 'failed'
+            step_exec.error_message = str(e)
+            step_exec.completed_at = datetime.utcnow()
+            return None
+
+        step_exec.status = 'completed'
+        step_exec.output_data = result
+        step_exec.completed_at = datetime.utcnow()
+        context['last_step_output'] = result
+        return result
+
     @staticmethod
     def _enroll_in_sequence(workflow, trigger_data):
         """Enrolla un lead in una sequenza email"""
@@ -162,13 +309,7 @@ class AdminAutomationService:
         if existing:
             return None
 
-        steps = workflow.steps or []
-        first_delay = 0
-        for step in steps:
-            if step.get('type') == 'delay':
-                cfg = step.get('config', {})
-                first_delay = cfg.get('minutes', 0) + cfg.get('hours', 0) * 60 + cfg.get('days', 0) * 1440
-                break
+        first_delay = AdminAutomationService.plan(workflow).first_delay
 
         enrollment = AdminWorkflowEnrollment(
             workflow_id=workflow.id,
@@ -188,309 +329,164 @@ class AdminAutomationService:
         handler = AdminAutomationService.STEP_HANDLERS.get(step_type)
         if not handler:
             raise ValueError(f"Handler non trovato per step type: {step_type}")
-        return handler(config, context)
+        # Copia per esecuzione: la config arriva dal piano in cache e gli
+        # handler possono modificarla (es. headers di handle_webhook)
+        return handler(copy.deepcopy(config), context)
 
     @staticmethod
     def execute_pending_steps():
-        """Esegue step pendenti con delay scaduto"""
+        """
+        Esegue step pendenti con delay scaduto, raggruppati per execution:
+        context costruito una volta per execution e un commit per execution.
+        """
         now = datetime.utcnow()
         pending_steps = AdminWorkflowStepExecution.query.filter(
             AdminWorkflowStepExecution.status == 'pending',
             AdminWorkflowStepExecution.scheduled_for <= now,
             AdminWorkflowStepExecution.scheduled_for.isnot(None)
+        ).order_by(
+            AdminWorkflowStepExecution.execution_id, AdminWorkflowStepExecution.step_index
         ).all()
 
+        # Dati letti prima dei commit (che fanno scadere gli oggetti caricati)
+        groups = OrderedDict()
         for step_exec in pending_steps:
+            groups.setdefault(step_exec.execution_id, []).append(
+                (step_exec, step_exec.step_type, step_exec.input_data or {})
+            )
+        executions = {
+            execution.id: execution
+            for execution in AdminWorkflowExecution.query.filter(AdminWorkflowExecution.id.in_(list(groups))).all()
+        } if groups else {}
+        statuses = {execution_id: execution.status for execution_id, execution in executions.items()}
+        # Step orfani (execution eliminata): restano pending come nella versione club
+        execution_ids = [execution_id for execution_id in groups if execution_id in executions]
+        contexts = dict(zip(execution_ids, AdminAutomationService._build_admin_contexts(
+            [executions[execution_id].trigger_data for execution_id in execution_ids]
+        )))
+        counts = AdminAutomationService._step_counts(execution_ids)
+
+        for execution_id, jobs in groups.items():
+            if execution_id not in executions:
+                continue
+            context = contexts[execution_id]
+            failed = 0
+            for step_exec, step_type, config in jobs:
+                AdminAutomationService._run_step(step_exec, step_type, config, context)
+                failed += step_exec.status == 'failed'
+
+            execution = executions[execution_id]
+            if statuses[execution_id] == 'partial' and counts.get((execution_id, 'pending'), 0) <= len(jobs):
+                execution.status = 'failed' if failed or counts.get((execution_id, 'failed')) else 'completed'
+                execution.completed_at = datetime.utcnow()
             try:
-                execution = step_exec.execution
-                workflow = execution.workflow
-
-                context = AdminAutomationService._build_admin_context(execution.trigger_data)
-
-                step_exec.status = 'running'
-                step_exec.started_at = datetime.utcnow()
                 db.session.commit()
-
-                result = AdminAutomationService.execute_step(
-                    step_exec.step_type,
-                    step_exec.input_data,
-                    context
-                )
-
-                step_exec.status = 'completed'
-                step_exec.output_data = result
-                step_exec.completed_at = datetime.utcnow()
-
             except Exception as e:
-                step_exec.status = 'failed'
-                step_exec.error_message = str(e)
-                step_exec.completed_at = datetime.utcnow()
+                db.session.rollback()
+                print(f"[AdminAutomation] Error committing execution {execution_id}: {e}")
 
-        db.session.commit()
         AdminAutomationService._update_execution_statuses()
 
+    @staticmethod
+    def _step_counts(execution_ids):
+        """{(execution_id, status): n} degli step pending/failed (1 query)"""
+        if not execution_ids:
+            return {}
+        rows = db.session.query(
+            AdminWorkflowStepExecution.execution_id,
+            AdminWorkflowStepExecution.status,
+            func.count(AdminWorkflowStepExecution.id)
+        ).filter(
+            AdminWorkflowStepExecution.execution_id.in_(execution_ids),
+            AdminWorkflowStepExecution.status.in_(('pending', 'failed'))
+        ).group_by(AdminWorkflowStepExecution.execution_id, AdminWorkflowStepExecution.status).all()
+        return {(execution_id, status): count for execution_id, status, count in rows}
+
     @staticmethod
     def _update_execution_statuses():
-        """Aggiorna status delle execution con step pendenti completati"""
-        partial_executions = AdminWorkflowExecution.query.filter_by(status='partial').all()
-
-        for execution in partial_executions:
-            pending_count = execution.step_executions.filter_by(status='pending').count()
-            failed_count = execution.step_executions.filter_by(status='failed').count()
-
-            if pending_count == 0:
-                if failed_count > 0:
-                    execution.status = 'failed'
-                else:
-                    execution.status = 'completed'
-                execution.completed_at = datetime.utcnow()
+        """Chiude le execution 'partial' senza più step pendenti"""
+        has_pending = exists().where(
+            AdminWorkflowStepExecution.execution_id == AdminWorkflowExecution.id,
+            AdminWorkflowStepExecution.status == 'pending'
+        )
+        finished = AdminWorkflowExecution.query.filter(
+            AdminWorkflowExecution.status == 'partial', ~has_pending
+        ).all()
+        if not finished:
+            return
+
+        counts = AdminAutomationService._step_counts([execution.id for execution in finished])
+        for execution in finished:
+            execution.status = 'failed' if counts.get((execution.id, 'failed')) else 'completed'
+            execution.completed_at = datetime.utcnow()
 
         db.session.commit()
 
+    @staticmethod
+    def _load_context_entities(refs):
+        """{(entity_type, entity_id): {chiave: dati}} per i riferimenti dati (1 query per tipo)"""
+        ids_by_type = defaultdict(set)
+        for entity_type, entity_id in refs:
+            ids_by_type[entity_type].add(entity_id)
+
+        loaded = {}
+        for entity_type, ids in ids_by_type.items():
+            model, serialize, with_club = CONTEXT_ENTITIES[entity_type]
+            if with_club:
+                rows = db.session.query(model, Club).outerjoin(
+                    Club, Club.id == model.club_id
+                ).filter(model.id.in_(ids)).all()
+            else:
+                rows = [(entity, None) for entity in model.query.filter(model.id.in_(ids)).all()]
+
+            for entity, club in rows:
+                data = {entity_type: serialize(entity)}
+                if club is not None:
+                    data['club'] = _club_summary(club)
+                loaded[(entity_type, entity.id)] = data
+        return loaded
+
+    @staticmethod
+    def _build_admin_contexts(trigger_data_list):
+        """Context per più trigger con le entità caricate in blocco"""
+        refs = [_entity_ref(trigger_data) for trigger_data in trigger_data_list]
+        entities = AdminAutomationService._load_context_entities({ref for ref in refs if ref})
+
+        contexts = []
+        for trigger_data, ref in zip(trigger_data_list, refs):
+            context = {
+                'trigger_data': trigger_data or {},
+                'now': datetime.utcnow()
+            }
+            if ref:
+                context.update(entities.get(ref, {}))
+
+            # Aggiungi dati extra dal trigger
+            for key, value in (trigger_data or {}).items():
+                if key not in ('entity_type', 'entity_id') and key not in context:
+                    context[key] = value
+            contexts.append(context)
+        return contexts
+
     @staticmethod
     def _build_admin_context(trigger_data):
         """Costruisce il context per l'esecuzione degli step admin"""
-        context = {
-            'trigger_data': trigger_data or {},
-            'now': datetime.utcnow()
-        }
-
-        if not trigger_data:
-            return context
-
-        entity_type = trigger_data.get('entity_type')
-        entity_id = trigger_data.get('entity_id')
-
-        if entity_type == 'lead' and entity_id:
-            lead = CRMLead.query.get(entity_id)
-            if lead:
-                context['lead'] = {
-                    'id': lead.id,
-                    'nome_club': lead.nome_club,
-                    'contatto_nome': lead.contatto_nome,
-                    'contatto_cognome': lead.contatto_cognome,
-                    'contatto_email': lead.contatto_email,
-                    'contatto_telefono': lead.contatto_telefono,
-                    'contatto_ruolo': getattr(lead, 'contatto_ruolo', None),
-                    'referente_nome': getattr(lead, 'referente_nome', None),
-                    'referente_email': getattr(lead, 'referente_email', None),
-                    'stage': lead.stage,
-                    'temperatura': lead.temperatura,
-                    'valore_stimato': lead.valore_stimato,
-                    'probabilita': getattr(lead, 'probabilita', None),
-                    'tipologia_sport': lead.tipologia_sport,
-                    'citta': lead.citta,
-                    'provincia': getattr(lead, 'provincia', None),
-                    'regione': getattr(lead, 'regione', None),
-                    'fonte': lead.fonte,
-                    'score': getattr(lead, 'score', None),
-                    'priorita': getattr(lead, 'priorita', None),
-                    'prossima_azione': getattr(lead, 'prossima_azione', None),
-                    'data_prossima_azione': lead.data_prossima_azione.isoformat() if getattr(lead, 'data_prossima_azione', None) else None,
-                }
-
-        elif entity_type == 'contract' and entity_id:
-            contract = AdminContract.query.get(entity_id)
-            if contract:
-                context['contract'] = {
-                    'id': contract.id,
-                    'club_id': contract.club_id,
-                    'plan_type': contract.plan_type,
-                    'plan_price': contract.plan_price,
-                    'total_value': contract.total_value,
-                    'vat_rate': contract.vat_rate,
-                    'start_date': contract.start_date.isoformat() if contract.start_date else None,
-                    'end_date': contract.end_date.isoformat() if contract.end_date else None,
-                    'renewal_date': contract.renewal_date.isoformat() if getattr(contract, 'renewal_date', None) else None,
-                    'status': contract.status,
-                    'payment_terms': getattr(contract, 'payment_terms', None),
-                    'signed_by': getattr(contract, 'signed_by', None),
-                }
-                # Carica anche il club
-                club = Club.query.get(contract.club_id)
-                if club:
-                    context['club'] = {
-                        'id': club.id,
-                        'nome': club.nome,
-                        'email': club.email,
-                    }
-
-        elif entity_type == 'invoice' and entity_id:
-            invoice = AdminInvoice.query.get(entity_id)
-            if invoice:
-                context['invoice'] = {
-                    'id': invoice.id,
-                    'invoice_number': invoice.invoice_number,
-                    'amount': invoice.amount,
-                    'vat_amount': invoice.vat_amount,
-                    'total_amount': invoice.total_amount,
-                    'status': invoice.status,
-                    'issue_date': invoice.issue_date.isoformat() if invoice.issue_date else None,
-                    'due_date': invoice.due_date.isoformat() if invoice.due_date else None,
-                    'payment_date': invoice.payment_date.isoformat() if invoice.payment_date else None,
-                    'contract_id': invoice.contract_id,
-                    'club_id': invoice.club_id,
-                }
-                # Carica club associato
-                if invoice.club_id:
-                    club = Club.query.get(invoice.club_id)
-                    if club:
-                        context['club'] = {
-                            'id': club.id,
-                            'nome': club.nome,
-                            'email': club.email,
-                        }
-
-        elif entity_type == 'booking' and entity_id:
-            booking = DemoBooking.query.get(entity_id)
-            if booking:
-                context['booking'] = {
-                    'id': booking.id,
-                    'nome': booking.nome,
-                    'cognome': booking.cognome,
-                    'email': booking.email,
-                    'nome_club': booking.nome_club,
-                    'telefono': getattr(booking, 'telefono', None),
-                    'sport_tipo': getattr(booking, 'sport_tipo', None),
-                    'stato': getattr(booking, 'stato', None),
-                    'durata': getattr(booking, 'durata', None),
-                    'data_ora': booking.data_ora.isoformat() if booking.data_ora else None,
-                }
-
-        elif entity_type == 'club' and entity_id:
-            club = Club.query.get(entity_id)
-            if club:
-                context['club'] = {
-                    'id': club.id,
-                    'nome': club.nome,
-                    'email': club.email,
-                    'tipologia': getattr(club, 'tipologia', None),
-                    'telefono': getattr(club, 'telefono', None),
-                    'citta': getattr(club, 'citta', None),
-                    'referente_nome': getattr(club, 'referente_nome', None),
-                    'account_attivo': getattr(club, 'account_attivo', None),
-                }
-
-        elif entity_type == 'task' and entity_id:
-            task = AdminTask.query.get(entity_id)
-            if task:
-                context['task'] = {
-                    'id': task.id,
-                    'titolo': task.titolo,
-                    'descrizione': task.descrizione,
-                    'tipo': task.tipo,
-                    'priorita': task.priorita,
-                    'stato': task.stato,
-                    'lead_id': task.lead_id,
-                    'club_id': task.club_id,
-                    'data_scadenza': task.data_scadenza.isoformat() if task.data_scadenza else None,
-                }
-
-        elif entity_type == 'calendar_event' and entity_id:
-            event = AdminCalendarEvent.query.get(entity_id)
-            if event:
-                context['calendar_event'] = {
-                    'id': event.id,
-                    'titolo': event.titolo,
-                    'tipo': event.tipo,
-                    'descrizione': getattr(event, 'descrizione', None),
-                    'data_inizio': event.data_inizio.isoformat() if event.data_inizio else None,
-                    'data_fine': event.data_fine.isoformat() if event.data_fine else None,
-                    'lead_id': event.lead_id,
-                    'club_id': event.club_id,
-                }
-
-        # Aggiungi dati extra dal trigger
-        for key, value in (trigger_data or {}).items():
-            if key not in ('entity_type', 'entity_id') and key not in context:
-                context[key] = value
-
-        return context
+        return AdminAutomationService._build_admin_contexts([trigger_data])[0]
 
     @staticmethod
     def render_template(template_str, context):
-        """Sostituzione variabili {{lead.nome_club}}, {{contract.total_value}}, ecc."""
-        if not template_str:
-            return template_str
-
-        def replacer(match):
-            path = match.group(1).strip()
-            value = AdminAutomationService._get_nested_value(context, path)
-            return str(value) if value is not None else ''
-
-        return re.sub(r'\{\{(.+?)\}\}', replacer, template_str)
+        """Sostituzione variabili {{lead.nome_club}}, {{contract.total_value}}, ecc. (template compilato in cache)"""
+        return rule_compiler.render_template(template_str, context)
 
     @staticmethod
     def _get_nested_value(obj, path):
         """Recupera valore nested da dict usando dot notation"""
-        parts = path.split('.')
-        value = obj
-        for part in parts:
-            if isinstance(value, dict):
-                value = value.get(part)
-            else:
-                return None
-        return value
+        return rule_compiler.get_path(obj, rule_compiler.compile_path(path))
 
     @staticmethod
     def check_conditions(conditions, context):
-        """Verifica se le condizioni sono soddisfatte"""
-        if not conditions:
-            return True
-
-        rules = conditions.get('rules', [])
-        operator = conditions.get('operator', 'AND')
-
-        if not rules:
-            return True
-
-        results = []
-        for rule in rules:
-            field_path = rule.get('field', '')
-            op = rule.get('operator', 'equals')
-            expected_value = rule.get('value')
-
-            actual_value = AdminAutomationService._get_nested_value(context, field_path)
-            result = AdminAutomationService._evaluate_condition(actual_value, op, expected_value)
-            results.append(result)
-
-        if operator == 'AND':
-            return all(results)
-        else:
-            return any(results)
-
-    @staticmethod
-    def _evaluate_condition(actual, operator, expected):
-        """Valuta una singola condizione"""
-        if actual is None:
-            return operator == 'is_empty'
-
-        if operator == 'equals':
-            return str(actual).lower() == str(expected).lower()
-        elif operator == 'not_equals':
-            return str(actual).lower() != str(expected).lower()
-        elif operator == 'contains':
-            return str(expected).lower() in str(actual).lower()
-        elif operator == 'not_contains':
-            return str(expected).lower() not in str(actual).lower()
-        elif operator == 'greater_than':
-            try:
-                return float(actual) > float(expected)
-            except (ValueError, TypeError):
-                return False
-        elif operator == 'less_than':
-            try:
-                return float(actual) < float(expected)
-            except (ValueError, TypeError):
-                return False
-        elif operator == 'is_empty':
-            return not actual
-        elif operator == 'is_not_empty':
-            return bool(actual)
-        elif operator == 'in_list':
-            return actual in (expected if isinstance(expected, list) else [expected])
-
-        return False
+        """Verifica se le condizioni sono soddisfatte (regole compilate in cache)"""
+        return rule_compiler.check_conditions(conditions, context)
 
 
 # ==================== STEP HANDLERS ====================
@@ -557,7 +553,7 @@ def handle_create_task(config, context):
         data_scadenza=scadenza
     )
     db.session.add(task)
-    db.session.commit()
+    db.session.flush()
 
     return {'task_id': task.id, 'titolo': titolo}
 
@@ -579,7 +575,7 @@ def handle_create_notification(config, context):
         priorita=config.get('priorita', 'normale')
     )
     db.session.add(notification)
-    db.session.commit()
+    db.session.flush()
 
     return {'notification_id': notification.id}
 
@@ -608,7 +604,7 @@ def handle_update_lead_stage(config, context):
         descrizione=f"[Automazione] Stage cambiato da {old_stage} a {new_stage}"
     )
     db.session.add(activity)
-    db.session.commit()
+    db.session.flush()
 
     return {'lead_id': lead_id, 'old_stage': old_stage, 'new_stage': new_stage}
 
@@ -630,7 +626,7 @@ def handle_update_lead_temperature(config, context):
     old_temp = lead.temperatura
     lead.temperatura = new_temp
     lead.updated_at = datetime.utcnow()
-    db.session.commit()
+    db.session.flush()
 
     return {'lead_id': lead_id, 'old_temperatura': old_temp, 'new_temperatura': new_temp}
 
@@ -704,7 +700,7 @@ def handle_update_contract_status(config, context):
 
     old_status = contract.status
     contract.status = new_status
-    db.session.commit()
+    db.session.flush()
 
     return {'contract_id': contract_id, 'old_status': old_status, 'new_status': new_status}
 
@@ -727,7 +723,7 @@ def handle_update_task_status(config, context):
     task.stato = new_status
     if new_status == 'completato':
         task.completato_il = datetime.utcnow()
-    db.session.commit()
+    db.session.flush()
 
     return {'task_id': task_id, 'old_status': old_status, 'new_status': new_status}
 
@@ -762,7 +758,7 @@ def handle_create_calendar_event(config, context):
         event.club_id = trigger_data.get('club_id')
 
     db.session.add(event)
-    db.session.commit()
+    db.session.flush()
 
     return {'event_id': event.id, 'titolo': titolo}
 
@@ -786,7 +782,7 @@ def handle_log_lead_activity(config, context):
         descrizione=descrizione
     )
     db.session.add(activity)
-    db.session.commit()
+    db.session.flush()
 
     return {'activity_id': activity.id}
 
@@ -814,7 +810,7 @@ def handle_update_lead_field(config, context):
 
     old_value = getattr(lead, field_name, None)
     setattr(lead, field_name, value)
-    db.session.commit()
+    db.session.flush()
 
     return {'field': field_name, 'old_value': str(old_value), 'new_value': str(value)}
 
@@ -843,7 +839,7 @@ def handle_enroll_in_sequence(config, context):
         enrolled_at=datetime.utcnow()
     )
     db.session.add(enrollment)
-    db.session.commit()
+    db.session.flush()
 
     return {'enrollment_id': enrollment.id}
 
@@ -864,7 +860,7 @@ def handle_remove_from_sequence(config, context):
         enrollment.status = 'removed'
         enrollment.exited_at = datetime.utcnow()
         enrollment.exit_reason = 'Rimosso da automazione'
-        db.session.commit()
+        db.session.flush()
         return {'removed': True}
     return {'removed': False}
 
@@ -883,11 +879,8 @@ def handle_send_whatsapp(config, context):
     # Normalizza numero: rimuovi +, spazi, trattini
     to_normalized = re.sub(r'[\s\-\+]', '', to)
 
-    resp = requests.post('http://localhost:3200/send', json={
-        'to': to_normalized,
-        'message': messaggio
-    }, timeout=30)
-    resp.raise_for_status()
-    data = resp.json()
+    data, status = whatsapp_client.send_message(to_normalized, messaggio)
+    if status >= 400:
+        raise RuntimeError(f"Sidecar WhatsApp: {data.get('error') or status}")
 
-    return {'to': to_normalized, 'message_id': data.get('message_id'), 'sent': True}
+    return {'to': to_normalized, 'message_id': data.get('messageId'), 'sent': True}
@@ -1,9 +1,14 @@
 """
 Admin Automation Triggers - Gestione trigger real-time per workflow admin
 """
-from datetime import datetime, date
+from collections import defaultdict
+from datetime import datetime, date, timedelta
+from sqlalchemy import func, or_
 from app import db
-from app.models import AdminWorkflow, AdminWorkflowExecution
+from app.models import (
+    AdminWorkflow, AdminWorkflowExecution, CRMLead, CRMLeadActivity,
+    AdminContract, AdminInvoice, AdminTask
+)
 from app.services.admin_automation_service import AdminAutomationService
 
 
@@ -49,37 +54,52 @@ class AdminAutomationTriggers:
 
     @staticmethod
     def _check_trigger_conditions(workflow, entity_data):
-        """Verifica che le condizioni del trigger siano soddisfatte"""
-        trigger_config = workflow.trigger_config or {}
-
-        # Filtri specifici per trigger type
-        if workflow.trigger_type == 'lead_stage_changed':
-            from_stage = trigger_config.get('from_stage')
-            to_stage = trigger_config.get('to_stage')
-            if from_stage and entity_data.get('old_stage') != from_stage:
-                return False
-            if to_stage and entity_data.get('new_stage') != to_stage:
-                return False
-
-        if workflow.trigger_type == 'contract_status_changed':
-            from_status = trigger_config.get('from_status')
-            to_status = trigger_config.get('to_status')
-            if from_status and entity_data.get('old_status') != from_status:
-                return False
-            if to_status and entity_data.get('new_status') != to_status:
-                return False
-
-        # Filtri generici
-        filters = trigger_config.get('filters', {})
-        for field, expected_value in filters.items():
-            actual_value = entity_data.get(field)
-            if isinstance(expected_value, list):
-                if actual_value not in expected_value:
-                    return False
-            elif actual_value != expected_value:
-                return False
-
-        return True
+        """Verifica che le condizioni del trigger siano soddisfatte (filtri compilati nel piano)"""
+        return AdminAutomationService.plan(workflow).matches_trigger(entity_data)
+
+    @staticmethod
+    def fire_bulk(pairs):
+        """
+        Esegue in blocco coppie (workflow, entity_data) già selezionate:
+        filtri del trigger dal piano compilato e deduplicazione giornaliera
+        con una sola query per tutti i workflow coinvolti.
+
+        Returns:
+            list: Lista di esecuzioni/enrollment create
+        """
+        pairs = list(pairs)
+        fired = AdminAutomationTriggers._fired_today({workflow.id for workflow, _ in pairs})
+
+        results = []
+        for workflow, entity_data in pairs:
+            workflow_id = workflow.id
+            key = (workflow_id, entity_data.get('entity_id'))
+            try:
+                if key in fired or not AdminAutomationTriggers._check_trigger_conditions(workflow, entity_data):
+                    continue
+                result = AdminAutomationService.execute_workflow(workflow, entity_data)
+                fired.add(key)
+                if result:
+                    results.append(result)
+            except Exception as e:
+                db.session.rollback()
+                print(f"[AdminAutomationTriggers] Error executing workflow {workflow_id}: {e}")
+
+        return results
+
+    @staticmethod
+    def _fired_today(workflow_ids):
+        """{(workflow_id, entity_id)} delle esecuzioni di oggi (1 query)"""
+        if not workflow_ids:
+            return set()
+        today_start = datetime.combine(date.today(), datetime.min.time())
+        rows = db.session.query(
+            AdminWorkflowExecution.workflow_id, AdminWorkflowExecution.trigger_data
+        ).filter(
+            AdminWorkflowExecution.workflow_id.in_(list(workflow_ids)),
+            AdminWorkflowExecution.started_at >= today_start
+        ).all()
+        return {(workflow_id, trigger_data.get('entity_id')) for workflow_id, trigger_data in rows if trigger_data}
 
     @staticmethod
     def _is_duplicate(workflow, entity_data):
@@ -87,18 +107,164 @@ class AdminAutomationTriggers:
         entity_id = entity_data.get('entity_id')
         if not entity_id:
             return False
+        return (workflow.id, entity_id) in AdminAutomationTriggers._fired_today([workflow.id])
 
-        today_start = datetime.combine(date.today(), datetime.min.time())
-        existing = AdminWorkflowExecution.query.filter(
-            AdminWorkflowExecution.workflow_id == workflow.id,
-            AdminWorkflowExecution.started_at >= today_start
+
+class AdminTimeBasedTriggers:
+    """
+    Trigger temporali admin valutati a insiemi (1 volta al giorno).
+
+    I workflow attivi dei trigger temporali sono caricati con una query; per
+    ogni tipo di trigger una sola query SQL trova le entità candidate per la
+    soglia più larga tra i workflow (ultima attività dei lead via GROUP BY
+    MAX), poi ogni workflow riceve solo le entità che rispettano la propria
+    soglia `days`. Le coppie (workflow, entità) passano in blocco a fire_bulk.
+    """
+
+    TRIGGER_TYPES = ('lead_inactive', 'contract_expiring', 'contract_expired', 'invoice_overdue', 'task_overdue')
+    DEFAULT_DAYS = {'lead_inactive': 7, 'contract_expiring': 30, 'invoice_overdue': 7}
+
+    @classmethod
+    def _days(cls, workflow):
+        default = cls.DEFAULT_DAYS[workflow.trigger_type]
+        try:
+            return int((workflow.trigger_config or {}).get('days', default))
+        except (TypeError, ValueError):
+            return default
+
+    @classmethod
+    def run(cls, now=None):
+        """Valuta tutti i trigger temporali ed esegue i workflow. Ritorna {trigger_type: esecuzioni}"""
+        now = now or datetime.utcnow()
+        workflows = defaultdict(list)
+        for workflow in AdminWorkflow.query.filter(
+            AdminWorkflow.abilitata == True,
+            AdminWorkflow.trigger_type.in_(cls.TRIGGER_TYPES)
+        ).all():
+            workflows[workflow.trigger_type].append(workflow)
+
+        fired = {}
+        for trigger_type in cls.TRIGGER_TYPES:
+            if not workflows[trigger_type]:
+                continue
+            try:
+                pairs = getattr(cls, f'_{trigger_type}')(workflows[trigger_type], now)
+                fired[trigger_type] = len(AdminAutomationTriggers.fire_bulk(pairs))
+            except Exception as e:
+                db.session.rollback()
+                print(f"[AdminScheduler] {trigger_type} check error: {e}")
+        return fired
+
+    @classmethod
+    def _lead_inactive(cls, workflows, now):
+        """Lead aperti senza modifiche né attività da almeno `days` giorni"""
+        thresholds = [(workflow, now - timedelta(days=cls._days(workflow))) for workflow in workflows]
+        widest = max(cutoff for _, cutoff in thresholds)
+
+        last_activity = db.session.query(
+            CRMLeadActivity.lead_id.label('lead_id'),
+            func.max(CRMLeadActivity.created_at).label('last_at')
+        ).group_by(CRMLeadActivity.lead_id).subquery()
+        rows = db.session.query(
+            CRMLead.id, CRMLead.nome_club, CRMLead.contatto_email, CRMLead.updated_at, last_activity.c.last_at
+        ).outerjoin(
+            last_activity, last_activity.c.lead_id == CRMLead.id
+        ).filter(
+            CRMLead.stage.notin_(['vinto', 'perso']),
+            CRMLead.updated_at < widest,
+            or_(last_activity.c.last_at.is_(None), last_activity.c.last_at < widest)
+        ).all()
+
+        for workflow, cutoff in thresholds:
+            for row in rows:
+                if row.updated_at < cutoff and (row.last_at is None or row.last_at < cutoff):
+                    yield workflow, {
+                        'entity_type': 'lead',
+                        'entity_id': row.id,
+                        'nome_club': row.nome_club,
+                        'contatto_email': row.contatto_email,
+                        'days_inactive': cls._days(workflow),
+                    }
+
+    @classmethod
+    def _contract_expiring(cls, workflows, now):
+        """Contratti attivi che scadono entro `days` giorni"""
+        today = now.date()
+        thresholds = [(workflow, today + timedelta(days=cls._days(workflow))) for workflow in workflows]
+        rows = db.session.query(
+            AdminContract.id, AdminContract.club_id, AdminContract.plan_type,
+            AdminContract.total_value, AdminContract.end_date
+        ).filter(
+            AdminContract.status == 'active',
+            AdminContract.end_date <= max(limit for _, limit in thresholds),
+            AdminContract.end_date > today
         ).all()
 
-        for exec_record in existing:
-            if exec_record.trigger_data and exec_record.trigger_data.get('entity_id') == entity_id:
-                return True
+        for workflow, limit in thresholds:
+            for row in rows:
+                if row.end_date <= limit:
+                    yield workflow, {
+                        'entity_type': 'contract',
+                        'entity_id': row.id,
+                        'club_id': row.club_id,
+                        'plan_type': row.plan_type,
+                        'total_value': row.total_value,
+                        'end_date': row.end_date.isoformat() if row.end_date else None,
+                    }
+
+    @classmethod
+    def _contract_expired(cls, workflows, now):
+        """Contratti ancora attivi con data di fine passata"""
+        rows = db.session.query(AdminContract.id, AdminContract.club_id).filter(
+            AdminContract.status == 'active',
+            AdminContract.end_date < now.date()
+        ).all()
+        for workflow in workflows:
+            for row in rows:
+                yield workflow, {'entity_type': 'contract', 'entity_id': row.id, 'club_id': row.club_id}
+
+    @classmethod
+    def _invoice_overdue(cls, workflows, now):
+        """Fatture non pagate scadute da almeno `days` giorni"""
+        today = now.date()
+        thresholds = [(workflow, today - timedelta(days=cls._days(workflow))) for workflow in workflows]
+        rows = db.session.query(
+            AdminInvoice.id, AdminInvoice.invoice_number, AdminInvoice.amount,
+            AdminInvoice.total_amount, AdminInvoice.due_date
+        ).filter(
+            AdminInvoice.status.in_(['pending', 'overdue']),
+            AdminInvoice.due_date <= max(limit for _, limit in thresholds)
+        ).all()
 
-        return False
+        for workflow, limit in thresholds:
+            for row in rows:
+                if row.due_date <= limit:
+                    yield workflow, {
+                        'entity_type': 'invoice',
+                        'entity_id': row.id,
+                        'invoice_number': row.invoice_number,
+                        'amount': row.amount,
+                        'total_amount': row.total_amount,
+                    }
+
+    @classmethod
+    def _task_overdue(cls, workflows, now):
+        """Task non completati oltre la scadenza"""
+        rows = db.session.query(
+            AdminTask.id, AdminTask.titolo, AdminTask.tipo, AdminTask.priorita
+        ).filter(
+            AdminTask.stato != 'completato',
+            AdminTask.data_scadenza < now
+        ).all()
+        for workflow in workflows:
+            for row in rows:
+                yield workflow, {
+                    'entity_type': 'task',
+                    'entity_id': row.id,
+                    'titolo': row.titolo,
+                    'tipo': row.tipo,
+                    'priorita': row.priorita,
+                }
 
 
 # ==================== HELPER FUNCTIONS PER TRIGGER SPECIFICI ====================
@@ -1,226 +1,278 @@
+"""
+Admin Notification Service - notifiche automatiche per gli admin.
+
+I generatori girano nello scheduler condiviso (AutomationScheduler) con un
+watermark ciascuno in admin_notification_scan_state: una scansione considera
+solo le righe modificate dall'ultima esecuzione (updated_at) più quelle
+entrate nel frattempo nella finestra temporale del generatore (es. contratti
+che ora scadono entro 30 giorni); la prima esecuzione è completa. Gli oggetti
+già notificati sono esclusi con un anti-join nella query dei candidati e le
+nuove notifiche sono inserite in blocco. L'endpoint admin esegue la stessa
+scansione incrementale a ogni richiesta.
+"""
 from datetime import datetime, timedelta
+
+from sqlalchemy import or_
+
 from app import db
-from app.models import Notification, AdminContract, AdminInvoice, Club, CRMLead
+from app.models import AdminContract, AdminInvoice, Club, CRMLead, AdminNotificationScanState
+from app.services.notification_fanout import NotificationFanout
+
+
+# Sovrapposizione tra scansioni: copre le transazioni ancora aperte al
+# watermark precedente (il dedup scarta gli oggetti già notificati)
+WATERMARK_OVERLAP = timedelta(minutes=5)
+EXPIRY_WINDOW_DAYS = 30
+NEW_CLUB_DAYS = 7
+
+
+def _expiry_priority(days_left):
+    if days_left <= 7:
+        return 'urgente'
+    if days_left <= 15:
+        return 'alta'
+    return 'normale'
 
 
 class AdminNotificationService:
     """Genera notifiche automatiche per gli admin."""
 
-    @staticmethod
-    def _notification_exists(tipo, oggetto_type, oggetto_id):
-        """Check deduplicazione: evita notifiche duplicate per lo stesso oggetto."""
-        return Notification.query.filter_by(
-            user_type='admin',
-            user_id=0,
-            tipo=tipo,
-            oggetto_type=oggetto_type,
-            oggetto_id=oggetto_id
-        ).first() is not None
+    # Chiave del riepilogo (e del watermark) -> metodo che produce le righe
+    GENERATORS = (
+        ('contratti_scadenza', '_contract_expiring_rows'),
+        ('fatture_scadute', '_overdue_invoice_rows'),
+        ('nuovi_club', '_new_club_rows'),
+        ('lead_followup', '_lead_followup_rows'),
+        ('licenze_scadenza', '_license_expiring_rows'),
+    )
 
     @staticmethod
-    def _create(tipo, titolo, messaggio, oggetto_type, oggetto_id, priorita='normale', link_url=None):
-        """Crea notifica admin con deduplicazione."""
-        if AdminNotificationService._notification_exists(tipo, oggetto_type, oggetto_id):
-            return None
-        return Notification.create_notification(
-            user_type='admin',
-            user_id=0,
-            tipo=tipo,
-            titolo=titolo,
-            messaggio=messaggio,
-            oggetto_type=oggetto_type,
-            oggetto_id=oggetto_id,
-            priorita=priorita,
-            link_url=link_url
-        )
+    def _not_notified(tipo, oggetto_type, oggetto_column):
+        """Anti-join: oggetti senza una notifica admin (tipo, oggetto)."""
+        return ~NotificationFanout.already_notified('admin', 0, tipo, oggetto_type, oggetto_column)
 
     @staticmethod
-    def generate_contract_expiring():
-        """Contratti attivi con end_date entro 30/15/7 giorni."""
-        today = datetime.utcnow().date()
-        count = 0
+    def _row(now, tipo, titolo, messaggio, oggetto_type, oggetto_id, priorita='normale', link_url=None):
+        return {
+            'user_type': 'admin',
+            'user_id': 0,
+            'tipo': tipo,
+            'titolo': titolo,
+            'messaggio': messaggio,
+            'link': link_url,
+            'oggetto_type': oggetto_type,
+            'oggetto_id': oggetto_id,
+            'priorita': priorita,
+            'letta': False,
+            'created_at': now,
+        }
 
-        contracts = AdminContract.query.filter(
+    # ------------------------------------------------------------------ generatori
+    @classmethod
+    def _contract_expiring_rows(cls, since, now):
+        """Contratti attivi con end_date entro 30/15/7 giorni."""
+        today = now.date()
+        query = db.session.query(
+            AdminContract.id, AdminContract.plan_type, AdminContract.end_date, Club.nome
+        ).outerjoin(Club, Club.id == AdminContract.club_id).filter(
             AdminContract.status == 'active',
-            AdminContract.end_date <= today + timedelta(days=30),
-            AdminContract.end_date >= today
-        ).all()
-
-        for c in contracts:
+            AdminContract.end_date <= today + timedelta(days=EXPIRY_WINDOW_DAYS),
+            AdminContract.end_date >= today,
+            cls._not_notified('contratto_scadenza', 'admin_contract', AdminContract.id)
+        )
+        if since is not None:
+            # Modificati dall'ultima scansione o entrati da allora nella finestra
+            query = query.filter(or_(
+                AdminContract.updated_at >= since,
+                AdminContract.end_date >= since.date() + timedelta(days=EXPIRY_WINDOW_DAYS)
+            ))
+
+        rows = []
+        for c in query.all():
             days_left = (c.end_date - today).days
-            if days_left <= 7:
-                priorita = 'urgente'
-                titolo = f'Contratto in scadenza tra {days_left} giorni'
-            elif days_left <= 15:
-                priorita = 'alta'
-                titolo = f'Contratto in scadenza tra {days_left} giorni'
-            else:
-                priorita = 'normale'
-                titolo = f'Contratto in scadenza tra {days_left} giorni'
-
-            club_name = c.club.nome if c.club else 'Club sconosciuto'
-            messaggio = f'Il contratto {c.plan_type} di {club_name} scade il {c.end_date.strftime("%d/%m/%Y")}.'
-
-            created = AdminNotificationService._create(
+            club_name = c.nome or 'Club sconosciuto'
+            rows.append(cls._row(
+                now,
                 tipo='contratto_scadenza',
-                titolo=titolo,
-                messaggio=messaggio,
+                titolo=f'Contratto in scadenza tra {days_left} giorni',
+                messaggio=f'Il contratto {c.plan_type} di {club_name} scade il {c.end_date.strftime("%d/%m/%Y")}.',
                 oggetto_type='admin_contract',
                 oggetto_id=c.id,
-                priorita=priorita,
+                priorita=_expiry_priority(days_left),
                 link_url=f'/admin/contratti/{c.id}'
-            )
-            if created:
-                count += 1
-
-        return count
+            ))
+        return rows
 
-    @staticmethod
-    def generate_overdue_invoices():
+    @classmethod
+    def _overdue_invoice_rows(cls, since, now):
         """Fatture con due_date < oggi e status non paid/cancelled."""
-        today = datetime.utcnow().date()
-        count = 0
-
-        invoices = AdminInvoice.query.filter(
+        today = now.date()
+        query = db.session.query(
+            AdminInvoice.id, AdminInvoice.invoice_number, AdminInvoice.due_date,
+            AdminInvoice.total_amount, Club.nome
+        ).outerjoin(Club, Club.id == AdminInvoice.club_id).filter(
             AdminInvoice.due_date < today,
-            AdminInvoice.status.notin_(['paid', 'cancelled'])
-        ).all()
-
-        for inv in invoices:
+            AdminInvoice.status.notin_(['paid', 'cancelled']),
+            cls._not_notified('fattura_scaduta', 'admin_invoice', AdminInvoice.id)
+        )
+        if since is not None:
+            # Modificate dall'ultima scansione o scadute da allora
+            query = query.filter(or_(
+                AdminInvoice.updated_at >= since,
+                AdminInvoice.due_date >= since.date()
+            ))
+
+        rows = []
+        for inv in query.all():
             days_overdue = (today - inv.due_date).days
-            club_name = inv.club.nome if inv.club else 'Club sconosciuto'
-            messaggio = (
-                f'Fattura {inv.invoice_number} di {club_name} scaduta da {days_overdue} giorni. '
-                f'Importo: {inv.total_amount:.2f}€.'
-            )
-
-            created = AdminNotificationService._create(
+            club_name = inv.nome or 'Club sconosciuto'
+            rows.append(cls._row(
+                now,
                 tipo='fattura_scaduta',
                 titolo=f'Fattura scaduta: {inv.invoice_number}',
-                messaggio=messaggio,
+                messaggio=(
+                    f'Fattura {inv.invoice_number} di {club_name} scaduta da {days_overdue} giorni. '
+                    f'Importo: {inv.total_amount:.2f}€.'
+                ),
                 oggetto_type='admin_invoice',
                 oggetto_id=inv.id,
                 priorita='alta',
                 link_url='/admin/finanze'
-            )
-            if created:
-                count += 1
+            ))
+        return rows
 
-        return count
-
-    @staticmethod
-    def generate_new_clubs():
+    @classmethod
+    def _new_club_rows(cls, since, now):
         """Club creati negli ultimi 7 giorni."""
-        seven_days_ago = datetime.utcnow() - timedelta(days=7)
-        count = 0
-
-        clubs = Club.query.filter(
-            Club.created_at >= seven_days_ago
-        ).all()
-
-        for club in clubs:
-            messaggio = f'Il club {club.nome} si è registrato il {club.created_at.strftime("%d/%m/%Y")}.'
-
-            created = AdminNotificationService._create(
-                tipo='nuovo_club',
-                titolo=f'Nuovo club: {club.nome}',
-                messaggio=messaggio,
-                oggetto_type='club',
-                oggetto_id=club.id,
-                priorita='normale',
-                link_url=f'/admin/clubs/{club.id}'
-            )
-            if created:
-                count += 1
-
-        return count
-
-    @staticmethod
-    def generate_lead_followups():
+        query = db.session.query(Club.id, Club.nome, Club.created_at).filter(
+            Club.created_at >= now - timedelta(days=NEW_CLUB_DAYS),
+            cls._not_notified('nuovo_club', 'club', Club.id)
+        )
+        if since is not None:
+            query = query.filter(Club.created_at >= since)
+
+        return [cls._row(
+            now,
+            tipo='nuovo_club',
+            titolo=f'Nuovo club: {club.nome}',
+            messaggio=f'Il club {club.nome} si è registrato il {club.created_at.strftime("%d/%m/%Y")}.',
+            oggetto_type='club',
+            oggetto_id=club.id,
+            priorita='normale',
+            link_url=f'/admin/clubs/{club.id}'
+        ) for club in query.all()]
+
+    @classmethod
+    def _lead_followup_rows(cls, since, now):
         """CRMLead con data_prossima_azione < oggi e stage non vinto/perso."""
-        today = datetime.utcnow()
-        count = 0
-
-        leads = CRMLead.query.filter(
-            CRMLead.data_prossima_azione < today,
-            CRMLead.stage.notin_(['vinto', 'perso'])
-        ).all()
-
-        for lead in leads:
-            days_overdue = (today - lead.data_prossima_azione).days
+        query = db.session.query(
+            CRMLead.id, CRMLead.nome_club, CRMLead.stage, CRMLead.prossima_azione, CRMLead.data_prossima_azione
+        ).filter(
+            CRMLead.data_prossima_azione < now,
+            CRMLead.stage.notin_(['vinto', 'perso']),
+            cls._not_notified('lead_followup', 'crm_lead', CRMLead.id)
+        )
+        if since is not None:
+            # Modificati dall'ultima scansione o scaduti da allora
+            query = query.filter(or_(
+                CRMLead.updated_at >= since,
+                CRMLead.data_prossima_azione >= since
+            ))
+
+        rows = []
+        for lead in query.all():
+            days_overdue = (now - lead.data_prossima_azione).days
             azione = lead.prossima_azione or 'Follow-up'
-            messaggio = (
-                f'{azione} per {lead.nome_club} in ritardo di {days_overdue} giorni. '
-                f'Stage: {lead.stage}.'
-            )
-
-            created = AdminNotificationService._create(
+            rows.append(cls._row(
+                now,
                 tipo='lead_followup',
                 titolo=f'Follow-up scaduto: {lead.nome_club}',
-                messaggio=messaggio,
+                messaggio=(
+                    f'{azione} per {lead.nome_club} in ritardo di {days_overdue} giorni. '
+                    f'Stage: {lead.stage}.'
+                ),
                 oggetto_type='crm_lead',
                 oggetto_id=lead.id,
                 priorita='normale',
                 link_url=f'/admin/leads/{lead.id}'
-            )
-            if created:
-                count += 1
-
-        return count
+            ))
+        return rows
 
-    @staticmethod
-    def generate_license_expiring():
+    @classmethod
+    def _license_expiring_rows(cls, since, now):
         """Club con data_scadenza_licenza entro 30/15/7 giorni."""
-        today = datetime.utcnow()
-        count = 0
-
-        clubs = Club.query.filter(
+        query = db.session.query(
+            Club.id, Club.nome, Club.nome_abbonamento, Club.data_scadenza_licenza
+        ).filter(
             Club.data_scadenza_licenza.isnot(None),
-            Club.data_scadenza_licenza <= today + timedelta(days=30),
-            Club.data_scadenza_licenza >= today
-        ).all()
-
-        for club in clubs:
-            days_left = (club.data_scadenza_licenza - today).days
-            if days_left <= 7:
-                priorita = 'urgente'
-                titolo = f'Licenza in scadenza tra {days_left} giorni'
-            elif days_left <= 15:
-                priorita = 'alta'
-                titolo = f'Licenza in scadenza tra {days_left} giorni'
-            else:
-                priorita = 'normale'
-                titolo = f'Licenza in scadenza tra {days_left} giorni'
-
-            messaggio = (
-                f'La licenza di {club.nome} scade il '
-                f'{club.data_scadenza_licenza.strftime("%d/%m/%Y")}. '
-                f'Piano: {club.nome_abbonamento or "N/D"}.'
-            )
-
-            created = AdminNotificationService._create(
+            Club.data_scadenza_licenza <= now + timedelta(days=EXPIRY_WINDOW_DAYS),
+            Club.data_scadenza_licenza >= now,
+            cls._not_notified('licenza_scadenza', 'club', Club.id)
+        )
+        if since is not None:
+            # Modificati dall'ultima scansione o entrati da allora nella finestra
+            query = query.filter(or_(
+                Club.updated_at >= since,
+                Club.data_scadenza_licenza >= since + timedelta(days=EXPIRY_WINDOW_DAYS)
+            ))
+
+        rows = []
+        for club in query.all():
+            days_left = (club.data_scadenza_licenza - now).days
+            rows.append(cls._row(
+                now,
                 tipo='licenza_scadenza',
-                titolo=titolo,
-                messaggio=messaggio,
+                titolo=f'Licenza in scadenza tra {days_left} giorni',
+                messaggio=(
+                    f'La licenza di {club.nome} scade il '
+                    f'{club.data_scadenza_licenza.strftime("%d/%m/%Y")}. '
+                    f'Piano: {club.nome_abbonamento or "N/D"}.'
+                ),
                 oggetto_type='club',
                 oggetto_id=club.id,
-                priorita=priorita,
+                priorita=_expiry_priority(days_left),
                 link_url=f'/admin/clubs/{club.id}'
+            ))
+        return rows
+
+    # ------------------------------------------------------------------ esecuzione
+    @staticmethod
+    def _lock_watermark(name):
+        """Blocca la riga del watermark (serializza le scansioni tra processi) e ritorna il watermark"""
+        state = AdminNotificationScanState.__table__
+        result = db.session.execute(
+            state.update().where(state.c.generatore == name).values(updated_at=datetime.utcnow())
+        )
+        if result.rowcount == 0:
+            db.session.add(AdminNotificationScanState(generatore=name, creati=0))
+            db.session.flush()
+            return None
+        return db.session.query(AdminNotificationScanState.watermark).filter_by(generatore=name).scalar()
+
+    @classmethod
+    def run_generator(cls, name, full=False):
+        """Esegue un generatore (incrementale dal watermark o completo). Ritorna le notifiche create."""
+        builder = getattr(cls, dict(cls.GENERATORS)[name])
+        now = datetime.utcnow()
+        try:
+            watermark = cls._lock_watermark(name)
+            since = watermark - WATERMARK_OVERLAP if watermark and not full else None
+            inserted = NotificationFanout.insert_rows(builder(since, now))
+            db.session.query(AdminNotificationScanState).filter_by(generatore=name).update(
+                {'watermark': now, 'creati': len(inserted)}, synchronize_session=False
             )
-            if created:
-                count += 1
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            print(f"[AdminNotifications] Error in {name}: {e}")
+            return 0
 
-        return count
+        NotificationFanout.publish(inserted)
+        return len(inserted)
 
-    @staticmethod
-    def generate_all():
+    @classmethod
+    def generate_all(cls, full=False):
         """Chiama tutti i generatori e ritorna il riepilogo."""
-        results = {
-            'contratti_scadenza': AdminNotificationService.generate_contract_expiring(),
-            'fatture_scadute': AdminNotificationService.generate_overdue_invoices(),
-            'nuovi_club': AdminNotificationService.generate_new_clubs(),
-            'lead_followup': AdminNotificationService.generate_lead_followups(),
-            'licenze_scadenza': AdminNotificationService.generate_license_expiring(),
-        }
+        results = {name: cls.run_generator(name, full) for name, _ in cls.GENERATORS}
         results['totale'] = sum(results.values())
         return results
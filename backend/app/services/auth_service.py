@@ -0,0 +1,289 @@
+"""
+Auth Service - verifica password fuori dal thread della richiesta.
+
+La verifica pbkdf2 è CPU-bound: viene eseguita in un process pool limitato
+(AUTH_HASH_WORKERS) così un picco di login non blocca i worker HTTP. Le
+verifiche riuscite sono memorizzate per pochi minuti (chiave HMAC, nessuna
+password in chiaro in memoria) e gli hash con parametri diversi da quelli
+configurati vengono aggiornati al login. Un token bucket in memoria per
+IP e per coppia (account, IP) limita i tentativi prima di qualsiasi calcolo:
+chi sbaglia password da un altro indirizzo non blocca il titolare
+dell'account. L'IP è request.remote_addr; dietro reverse proxy va
+configurato TRUSTED_PROXIES (ProxyFix) invece di leggere X-Forwarded-For.
+"""
+import hashlib
+import hmac
+import os
+import secrets
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeout
+from concurrent.futures.process import BrokenProcessPool
+import multiprocessing
+
+from werkzeug.security import generate_password_hash, check_password_hash
+
+
+PASSWORD_METHOD = os.getenv('AUTH_PASSWORD_METHOD', 'pbkdf2:sha256:600000')
+HASH_WORKERS = int(os.getenv('AUTH_HASH_WORKERS', str(min(4, os.cpu_count() or 1))))
+HASH_TIMEOUT = 10  # secondi
+
+# Token bucket: capacità e ricarica (token al secondo)
+ACCOUNT_BUCKET = (int(os.getenv('AUTH_RATE_ACCOUNT_BURST', '10')), float(os.getenv('AUTH_RATE_ACCOUNT_REFILL', '0.05')))
+# Solo account, da qualunque IP: più largo, limita i tentativi distribuiti su molti IP
+ACCOUNT_GLOBAL_BUCKET = (int(os.getenv('AUTH_RATE_ACCOUNT_GLOBAL_BURST', '50')),
+                         float(os.getenv('AUTH_RATE_ACCOUNT_GLOBAL_REFILL', '0.02')))
+IP_BUCKET = (int(os.getenv('AUTH_RATE_IP_BURST', '30')), float(os.getenv('AUTH_RATE_IP_REFILL', '0.5')))
+
+
+def _verify_worker(pwhash, password):
+    return check_password_hash(pwhash, password)
+
+
+def _hash_worker(password, method):
+    return generate_password_hash(password, method=method)
+
+
+class TokenBucketLimiter:
+    """Token bucket in memoria per chiave (thread-safe, con pulizia periodica)"""
+
+    _MAX_KEYS = 50000
+
+    def __init__(self, capacity, refill_rate):
+        self.capacity = capacity
+        self.refill_rate = refill_rate
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def consume(self, key, tokens=1):
+        """Consuma un token; ritorna 0 se consentito, altrimenti i secondi di attesa"""
+        now = time.monotonic()
+        with self._lock:
+            level, ts = self._buckets.get(key, (self.capacity, now))
+            level = min(self.capacity, level + (now - ts) * self.refill_rate)
+            if level >= tokens:
+                self._buckets[key] = (level - tokens, now)
+                return 0
+            self._buckets[key] = (level, now)
+            if len(self._buckets) > self._MAX_KEYS:
+                self._prune(now)
+            if self.refill_rate <= 0:
+                return 3600
+            return int((tokens - level) / self.refill_rate) + 1
+
+    def reset(self, key):
+        with self._lock:
+            self._buckets.pop(key, None)
+
+    def _prune(self, now):
+        # Rimuove i bucket ormai pieni (inattivi abbastanza a lungo da essersi ricaricati)
+        full_after = self.capacity / self.refill_rate if self.refill_rate > 0 else 3600
+        for key in [k for k, (_, ts) in self._buckets.items() if now - ts > full_after]:
+            del self._buckets[key]
+
+
+class AuthService:
+    _pool = None
+    _pool_lock = threading.Lock()
+
+    _cache = {}
+    _cache_lock = threading.Lock()
+    _CACHE_TTL = 300  # 5 minuti
+    _CACHE_MAX = 10000
+    _cache_secret = secrets.token_bytes(32)
+
+    _account_limiter = TokenBucketLimiter(*ACCOUNT_BUCKET)
+    _account_global_limiter = TokenBucketLimiter(*ACCOUNT_GLOBAL_BUCKET)
+    _ip_limiter = TokenBucketLimiter(*IP_BUCKET)
+
+    # ------------------------------------------------------------------ pool
+    @classmethod
+    def _get_pool(cls):
+        if HASH_WORKERS <= 0:
+            return None
+        with cls._pool_lock:
+            if cls._pool is None:
+                try:
+                    # spawn: il processo web è multi-thread, fork non è sicuro
+                    cls._pool = ProcessPoolExecutor(
+                        max_workers=HASH_WORKERS,
+                        mp_context=multiprocessing.get_context('spawn')
+                    )
+                except Exception as e:
+                    print(f"[Auth] Process pool non disponibile, verifica inline: {e}")
+                    return None
+            return cls._pool
+
+    @classmethod
+    def _reset_pool(cls):
+        with cls._pool_lock:
+            if cls._pool is not None:
+                cls._pool.shutdown(wait=False, cancel_futures=True)
+            cls._pool = None
+
+    @classmethod
+    def _run(cls, fn, *args):
+        """Esegue fn nel pool; in caso di pool rotto o assente la esegue inline"""
+        pool = cls._get_pool()
+        if pool is None:
+            return fn(*args)
+        try:
+            return pool.submit(fn, *args).result(timeout=HASH_TIMEOUT)
+        except (BrokenProcessPool, FutureTimeout) as e:
+            print(f"[Auth] Errore process pool ({type(e).__name__}), verifica inline")
+            cls._reset_pool()
+            return fn(*args)
+
+    @classmethod
+    def shutdown(cls):
+        cls._reset_pool()
+
+    # ------------------------------------------------------------------ cache
+    @classmethod
+    def _cache_key(cls, pwhash, password):
+        msg = pwhash.encode() + b'\x00' + password.encode()
+        return hmac.new(cls._cache_secret, msg, hashlib.sha256).digest()
+
+    @classmethod
+    def _cache_hit(cls, cache_key):
+        with cls._cache_lock:
+            ts = cls._cache.get(cache_key)
+            if ts and (time.time() - ts) < cls._CACHE_TTL:
+                return True
+            cls._cache.pop(cache_key, None)
+            return False
+
+    @classmethod
+    def _cache_set(cls, cache_key):
+        with cls._cache_lock:
+            if len(cls._cache) >= cls._CACHE_MAX:
+                now = time.time()
+                for k in [k for k, ts in cls._cache.items() if now - ts >= cls._CACHE_TTL]:
+                    del cls._cache[k]
+                if len(cls._cache) >= cls._CACHE_MAX:
+                    cls._cache.clear()
+            cls._cache[cache_key] = time.time()
+
+    # ------------------------------------------------------------------ verify
+    @staticmethod
+    def needs_rehash(pwhash):
+        """True se l'hash non usa i parametri configurati in PASSWORD_METHOD"""
+        if not pwhash or '$' not in pwhash:
+            return False
+        return pwhash.split('$', 1)[0] != PASSWORD_METHOD
+
+    @classmethod
+    def verify_hash(cls, pwhash, password):
+        if not pwhash or not password:
+            return False
+        cache_key = cls._cache_key(pwhash, password)
+        if cls._cache_hit(cache_key):
+            return True
+        ok = cls._run(_verify_worker, pwhash, password)
+        if ok:
+            cls._cache_set(cache_key)
+        return ok
+
+    @classmethod
+    def verify(cls, account, password):
+        """
+        Verifica la password di un account (Admin, ClubUser, SponsorAccount,
+        Sponsor legacy). Se corretta e l'hash è obsoleto, lo aggiorna sul
+        modello: il commit resta a carico della route (es. update last_login).
+        """
+        if account is None or not getattr(account, 'password_hash', None):
+            return False
+        if not cls.verify_hash(account.password_hash, password):
+            return False
+        if cls.needs_rehash(account.password_hash):
+            try:
+                account.password_hash = cls._run(_hash_worker, password, PASSWORD_METHOD)
+                cls._cache_set(cls._cache_key(account.password_hash, password))
+            except Exception as e:
+                print(f"[Auth] Errore rehash password: {e}")
+        return True
+
+    @classmethod
+    def verify_many(cls, accounts, password):
+        """
+        Verifica la stessa password su più account in parallelo (login
+        unificato). Ritorna la lista dei risultati nello stesso ordine.
+        """
+        accounts = list(accounts)
+        pool = cls._get_pool()
+        if pool is None or len(accounts) < 2:
+            return [cls.verify(a, password) for a in accounts]
+
+        results = [False] * len(accounts)
+        pending = {}
+        for i, account in enumerate(accounts):
+            pwhash = getattr(account, 'password_hash', None)
+            if not pwhash or not password:
+                continue
+            if cls._cache_hit(cls._cache_key(pwhash, password)):
+                results[i] = True
+            else:
+                pending[i] = pool.submit(_verify_worker, pwhash, password)
+
+        for i, future in pending.items():
+            try:
+                results[i] = future.result(timeout=HASH_TIMEOUT)
+            except (BrokenProcessPool, FutureTimeout):
+                cls._reset_pool()
+                results[i] = _verify_worker(accounts[i].password_hash, password)
+            if results[i]:
+                cls._cache_set(cls._cache_key(accounts[i].password_hash, password))
+
+        # Rehash (raro) sugli account verificati
+        for i, ok in enumerate(results):
+            if ok and cls.needs_rehash(accounts[i].password_hash):
+                cls.verify(accounts[i], password)
+        return results
+
+    # ------------------------------------------------------------------ rate limit
+    @staticmethod
+    def client_ip():
+        """
+        IP del client. X-Forwarded-For non viene letto direttamente: con
+        TRUSTED_PROXIES > 0 ProxyFix riscrive remote_addr usando solo gli hop
+        dei proxy fidati.
+        """
+        from flask import request
+        return request.remote_addr or 'unknown'
+
+    @classmethod
+    def _account_key(cls, email):
+        return ((email or '').strip().lower(), cls.client_ip())
+
+    @classmethod
+    def check_rate_limit(cls, email):
+        """
+        Consuma un tentativo per IP, per (account, IP) e per account. Ritorna 0
+        se il login può procedere, altrimenti i secondi da attendere (Retry-After).
+        """
+        retry_ip = cls._ip_limiter.consume(cls.client_ip())
+        if retry_ip:
+            return retry_ip
+        if email:
+            account, _ = cls._account_key(email)
+            return (cls._account_limiter.consume(cls._account_key(email))
+                    or cls._account_global_limiter.consume(account))
+        return 0
+
+    @classmethod
+    def login_succeeded(cls, email):
+        """
+        Ripristina il bucket (account, IP) dopo un login riuscito. Il bucket
+        del solo account si ricarica col tempo: un login riuscito da un IP non
+        azzera i tentativi fatti da altri.
+        """
+        if email:
+            cls._account_limiter.reset(cls._account_key(email))
+
+
+def rate_limited_response(retry_after):
+    from flask import jsonify
+    response = jsonify({'error': 'Troppi tentativi di accesso. Riprova più tardi.'})
+    response.status_code = 429
+    response.headers['Retry-After'] = str(retry_after)
+    return response
@@ -1,11 +1,17 @@
 """
 Automation Scheduler - Cron job interno per trigger temporali
 """
+import os
 import threading
 import time
 from datetime import datetime, timedelta
 from flask import current_app
 
+try:
+    import fcntl
+except ImportError:  # Windows: nessun lock tra processi
+    fcntl = None
+
 
 class AutomationScheduler:
     """
@@ -13,21 +19,65 @@ class AutomationScheduler:
     Gira in un thread separato e controlla periodicamente:
     - Automazioni schedulate (cron, interval)
     - Step pendenti con delay scaduto
+    - Outbox e sync Google Calendar
+    - Ritardi dei contatori progetto
     """
 
     def __init__(self, app=None):
         self.app = app
         self._thread = None
         self._running = False
+        self._start_lock = threading.Lock()
+        self._start_attempted = False
+        self._lock_file = None
         self._interval = 60  # Controlla ogni 60 secondi
+        self._admin_notifications_interval = int(os.getenv('ADMIN_NOTIFICATION_INTERVAL', '300'))
 
     def init_app(self, app):
         self.app = app
+        # Avvio al primo request servito: comandi CLI, migrazioni e script
+        # che creano l'app non avviano i job
+        app.before_request(self._start_once)
+
+    def _start_once(self):
+        if self._start_attempted:
+            return
+        with self._start_lock:
+            if self._start_attempted:
+                return
+            self._start_attempted = True
+        self.start()
+
+    def _acquire_process_lock(self):
+        """
+        Lock esclusivo su file nell'instance path: con più worker solo il primo
+        processo esegue i job. Il sistema lo rilascia all'uscita del processo.
+        """
+        if fcntl is None:
+            return True
+        try:
+            os.makedirs(self.app.instance_path, exist_ok=True)
+            self._lock_file = open(os.path.join(self.app.instance_path, 'automation_scheduler.lock'), 'w')
+            fcntl.flock(self._lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            return True
+        except OSError:
+            if self._lock_file:
+                self._lock_file.close()
+                self._lock_file = None
+            return False
+
+    def _release_process_lock(self):
+        if self._lock_file:
+            self._lock_file.close()  # chiudere il file rilascia il flock
+            self._lock_file = None
 
     def start(self):
-        """Avvia lo scheduler in un thread separato"""
+        """Avvia lo scheduler in un thread separato (un solo processo per host)"""
         if self._running:
             return
+        if not self._acquire_process_lock():
+            print("[AutomationScheduler] Già attivo in un altro processo")
+            return
 
         self._running = True
         self._thread = threading.Thread(target=self._run_loop, daemon=True)
@@ -39,28 +89,51 @@ class AutomationScheduler:
         self._running = False
         if self._thread:
             self._thread.join(timeout=5)
+        self._release_process_lock()
         print("[AutomationScheduler] Stopped")
 
+    def _run_job(self, name, job):
+        """Esegue un job isolato: un errore non salta i job successivi del giro"""
+        from app import db
+        try:
+            job()
+        except Exception as e:
+            db.session.rollback()
+            print(f"[AutomationScheduler] Error in {name}: {e}")
+
     def _run_loop(self):
         """Loop principale dello scheduler"""
         last_daily_check = None
+        last_admin_notifications = None
         while self._running:
             try:
                 with self.app.app_context():
-                    self._check_scheduled_automations()
-                    self._check_pending_steps()
+                    self._run_job('scheduled automations', self._check_scheduled_automations)
+                    self._run_job('pending steps', self._check_pending_steps)
 
                     # Admin workflow checks
-                    self._check_admin_scheduled_workflows()
-                    self._check_admin_pending_steps()
-                    self._process_admin_email_sequences()
+                    self._run_job('admin scheduled workflows', self._check_admin_scheduled_workflows)
+                    self._run_job('admin pending steps', self._check_admin_pending_steps)
+                    self._run_job('admin email sequences', self._process_admin_email_sequences)
 
                     # Daily admin time-based triggers (1 volta al giorno)
                     today = datetime.utcnow().date()
                     if last_daily_check != today:
-                        self._check_admin_time_based_triggers()
+                        self._run_job('admin time-based triggers', self._check_admin_time_based_triggers)
                         last_daily_check = today
 
+                    # Notifiche admin incrementali (watermark per generatore)
+                    if (last_admin_notifications is None
+                            or time.monotonic() - last_admin_notifications >= self._admin_notifications_interval):
+                        self._run_job('admin notifications', self._generate_admin_notifications)
+                        last_admin_notifications = time.monotonic()
+
+                    # Google Calendar: retry outbox e sync incrementale (lease per admin)
+                    self._run_job('google calendar sync', self._sync_google_calendar)
+
+                    # Contatori progetto con una scadenza passata dall'ultimo conteggio dei ritardi
+                    self._run_job('project metrics', self._refresh_project_metrics)
+
             except Exception as e:
                 print(f"[AutomationScheduler] Error: {e}")
 
@@ -201,159 +274,38 @@ class AutomationScheduler:
 
     def _check_admin_time_based_triggers(self):
         """Controlla trigger temporali admin (1 volta al giorno)"""
-        from app import db
-        from app.models import (
-            CRMLead, CRMLeadActivity, AdminContract, AdminInvoice, AdminTask
-        )
-        from app.services.admin_automation_triggers import AdminAutomationTriggers
+        from app.services.admin_automation_triggers import AdminTimeBasedTriggers
 
-        now = datetime.utcnow()
+        fired = AdminTimeBasedTriggers.run()
+        if fired:
+            print(f"[AdminScheduler] Time-based triggers: {fired}")
 
-        # Lead inattivi
-        try:
-            from app.models import AdminWorkflow
-            inactive_workflows = AdminWorkflow.query.filter_by(
-                abilitata=True, trigger_type='lead_inactive'
-            ).all()
-
-            for wf in inactive_workflows:
-                days = (wf.trigger_config or {}).get('days', 7)
-                cutoff = now - timedelta(days=days)
-
-                # Lead senza attivita recenti
-                inactive_leads = CRMLead.query.filter(
-                    CRMLead.stage.notin_(['vinto', 'perso']),
-                    CRMLead.updated_at < cutoff
-                ).all()
-
-                for lead in inactive_leads:
-                    last_activity = CRMLeadActivity.query.filter_by(
-                        lead_id=lead.id
-                    ).order_by(CRMLeadActivity.created_at.desc()).first()
-
-                    if not last_activity or last_activity.created_at < cutoff:
-                        entity_data = {
-                            'entity_type': 'lead',
-                            'entity_id': lead.id,
-                            'nome_club': lead.nome_club,
-                            'contatto_email': lead.contatto_email,
-                            'days_inactive': days,
-                        }
-                        try:
-                            AdminAutomationTriggers.fire_trigger('lead_inactive', entity_data)
-                        except Exception as e:
-                            print(f"[AdminScheduler] Lead inactive trigger error: {e}")
-        except Exception as e:
-            print(f"[AdminScheduler] Lead inactive check error: {e}")
+    def _generate_admin_notifications(self):
+        """Scansione incrementale dei generatori di notifiche admin"""
+        from app.services.admin_notification_service import AdminNotificationService
 
-        # Contratti in scadenza
-        try:
-            expiring_workflows = AdminWorkflow.query.filter_by(
-                abilitata=True, trigger_type='contract_expiring'
-            ).all()
-
-            for wf in expiring_workflows:
-                days = (wf.trigger_config or {}).get('days', 30)
-                expiry_date = (now + timedelta(days=days)).date()
-
-                contracts = AdminContract.query.filter(
-                    AdminContract.status == 'active',
-                    AdminContract.end_date <= expiry_date,
-                    AdminContract.end_date > now.date()
-                ).all()
-
-                for contract in contracts:
-                    entity_data = {
-                        'entity_type': 'contract',
-                        'entity_id': contract.id,
-                        'club_id': contract.club_id,
-                        'plan_type': contract.plan_type,
-                        'total_value': contract.total_value,
-                        'end_date': contract.end_date.isoformat() if contract.end_date else None,
-                    }
-                    try:
-                        AdminAutomationTriggers.fire_trigger('contract_expiring', entity_data)
-                    except Exception as e:
-                        print(f"[AdminScheduler] Contract expiring trigger error: {e}")
-        except Exception as e:
-            print(f"[AdminScheduler] Contract expiring check error: {e}")
+        results = AdminNotificationService.generate_all()
+        if results['totale']:
+            print(f"[AdminScheduler] Admin notifications: {results}")
 
-        # Contratti scaduti
-        try:
-            expired_contracts = AdminContract.query.filter(
-                AdminContract.status == 'active',
-                AdminContract.end_date < now.date()
-            ).all()
-
-            for contract in expired_contracts:
-                entity_data = {
-                    'entity_type': 'contract',
-                    'entity_id': contract.id,
-                    'club_id': contract.club_id,
-                }
-                try:
-                    AdminAutomationTriggers.fire_trigger('contract_expired', entity_data)
-                except Exception as e:
-                    print(f"[AdminScheduler] Contract expired trigger error: {e}")
-        except Exception as e:
-            print(f"[AdminScheduler] Contract expired check error: {e}")
+    def _sync_google_calendar(self):
+        """Invia le scritture in outbox e sincronizza gli admin con sync scaduta o richiesta"""
+        from app.services.google_calendar_sync import google_calendar_sync
 
-        # Fatture scadute
-        try:
-            overdue_workflows = AdminWorkflow.query.filter_by(
-                abilitata=True, trigger_type='invoice_overdue'
-            ).all()
-
-            for wf in overdue_workflows:
-                days = (wf.trigger_config or {}).get('days', 7)
-                overdue_date = (now - timedelta(days=days)).date()
-
-                invoices = AdminInvoice.query.filter(
-                    AdminInvoice.status.in_(['pending', 'overdue']),
-                    AdminInvoice.due_date <= overdue_date
-                ).all()
-
-                for invoice in invoices:
-                    entity_data = {
-                        'entity_type': 'invoice',
-                        'entity_id': invoice.id,
-                        'invoice_number': invoice.invoice_number,
-                        'amount': invoice.amount,
-                        'total_amount': invoice.total_amount,
-                    }
-                    try:
-                        AdminAutomationTriggers.fire_trigger('invoice_overdue', entity_data)
-                    except Exception as e:
-                        print(f"[AdminScheduler] Invoice overdue trigger error: {e}")
-        except Exception as e:
-            print(f"[AdminScheduler] Invoice overdue check error: {e}")
+        google_calendar_sync.run()
 
-        # Task scaduti
-        try:
-            overdue_tasks = AdminTask.query.filter(
-                AdminTask.stato != 'completato',
-                AdminTask.data_scadenza < now
-            ).all()
-
-            for task in overdue_tasks:
-                entity_data = {
-                    'entity_type': 'task',
-                    'entity_id': task.id,
-                    'titolo': task.titolo,
-                    'tipo': task.tipo,
-                    'priorita': task.priorita,
-                }
-                try:
-                    AdminAutomationTriggers.fire_trigger('task_overdue', entity_data)
-                except Exception as e:
-                    print(f"[AdminScheduler] Task overdue trigger error: {e}")
-        except Exception as e:
-            print(f"[AdminScheduler] Task overdue check error: {e}")
+    def _refresh_project_metrics(self):
+        """Ricalcola e salva i ritardi dei progetti con contatori scaduti"""
+        from app.services.project_metrics_service import ProjectMetricsService
+
+        refreshed = ProjectMetricsService.refresh_stale()
+        if refreshed:
+            print(f"[AutomationScheduler] Project metrics ricalcolati: {refreshed}")
 
     def _process_admin_email_sequences(self):
         """Processa enrollment attivi con next_send_at <= now"""
         from app import db
-        from app.models import AdminWorkflowEnrollment, AdminWorkflow, CRMLead
+        from app.models import AdminWorkflowEnrollment
         from app.services.admin_automation_service import AdminAutomationService
 
         now = datetime.utcnow()
@@ -363,66 +315,60 @@ class AutomationScheduler:
             AdminWorkflowEnrollment.next_send_at <= now
         ).all()
 
-        for enrollment in active_enrollments:
+        # Context dei lead caricati in blocco (letti prima dei commit per enrollment)
+        jobs = list(zip(active_enrollments, AdminAutomationService._build_admin_contexts([
+            {'entity_type': 'lead', 'entity_id': enrollment.lead_id} for enrollment in active_enrollments
+        ])))
+
+        for enrollment, context in jobs:
             try:
                 workflow = enrollment.workflow
                 if not workflow or not workflow.abilitata:
                     continue
 
-                lead = CRMLead.query.get(enrollment.lead_id)
+                lead = context.get('lead')
                 if not lead:
                     enrollment.status = 'removed'
                     enrollment.exit_reason = 'Lead non trovato'
                     enrollment.exited_at = now
+                    db.session.commit()
                     continue
 
                 # Check exit conditions
-                if workflow.sequence_exit_on_convert and lead.stage == 'vinto':
+                if workflow.sequence_exit_on_convert and lead['stage'] == 'vinto':
                     enrollment.status = 'exited_convert'
                     enrollment.exit_reason = 'Lead convertito'
                     enrollment.exited_at = now
+                    db.session.commit()
                     continue
 
-                steps = workflow.steps or []
+                steps = AdminAutomationService.plan(workflow).steps
                 current_idx = enrollment.current_step_index
 
                 if current_idx >= len(steps):
                     enrollment.status = 'completed'
                     enrollment.exited_at = now
+                    db.session.commit()
                     continue
 
                 step = steps[current_idx]
-                step_type = step.get('type')
-                step_config = step.get('config', {})
-
-                # Costruisci context per il lead
-                context = AdminAutomationService._build_admin_context({
-                    'entity_type': 'lead',
-                    'entity_id': lead.id,
-                })
 
-                if step_type == 'delay':
+                if step.type == 'delay':
                     # Calcola prossimo invio
-                    minutes = step_config.get('minutes', 0)
-                    hours = step_config.get('hours', 0)
-                    days = step_config.get('days', 0)
-                    total_minutes = minutes + (hours * 60) + (days * 24 * 60)
                     enrollment.current_step_index = current_idx + 1
-                    enrollment.next_send_at = now + timedelta(minutes=total_minutes)
+                    enrollment.next_send_at = now + timedelta(minutes=step.delay)
                 else:
                     # Esegui step
-                    AdminAutomationService.execute_step(step_type, step_config, context)
+                    AdminAutomationService.execute_step(step.type, step.config, context)
                     enrollment.current_step_index = current_idx + 1
 
                     # Se ci sono ancora step, controlla se il prossimo e un delay
                     next_idx = current_idx + 1
                     if next_idx < len(steps):
                         next_step = steps[next_idx]
-                        if next_step.get('type') == 'delay':
-                            cfg = next_step.get('config', {})
-                            total = cfg.get('minutes', 0) + cfg.get('hours', 0) * 60 + cfg.get('days', 0) * 1440
+                        if next_step.type == 'delay':
                             enrollment.current_step_index = next_idx + 1
-                            enrollment.next_send_at = now + timedelta(minutes=total)
+                            enrollment.next_send_at = now + timedelta(minutes=next_step.delay)
                         else:
                             enrollment.next_send_at = now  # Esegui subito
                     else:
@@ -432,6 +378,7 @@ class AutomationScheduler:
                 db.session.commit()
 
             except Exception as e:
+                db.session.rollback()
                 print(f"[AdminScheduler] Sequence processing error for enrollment {enrollment.id}: {e}")
 
     def schedule_automation(self, automation):
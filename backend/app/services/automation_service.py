@@ -1,7 +1,17 @@
 """
 Automation Service - Engine di esecuzione automazioni
+
+Gli step vengono letti dal piano compilato dell'automazione (workflow_plan),
+il context carica le entità del trigger con una query per tipo anche per più
+execution insieme e lo stato di execution/step viene scritto con un commit per
+fase (esecuzione immediata o blocco di step ritardati della stessa execution).
+Ogni step gira in un savepoint: se fallisce, solo le sue scritture vengono
+annullate.
 """
+import copy
+from collections import OrderedDict, defaultdict
 from datetime import datetime, timedelta
+from sqlalchemy import exists, func
 from app import db
 from app.models import (
     Automation, AutomationExecution, AutomationStepExecution,
@@ -9,9 +19,65 @@ from app.models import (
     Lead, Sponsor, HeadOfTerms, EmailTemplate
 )
 from app.services.email_service import EmailService
-import requests
+from app.services import rule_compiler
+from app.services.workflow_plan import workflow_compiler
+from app.lazy_imports import lazy_import
 import json
 
+requests = lazy_import('requests')
+
+
+def _lead_data(lead):
+    return {
+        'id': lead.id,
+        'ragione_sociale': lead.ragione_sociale,
+        'email': lead.email,
+        'telefono': lead.telefono,
+        'status': lead.status,
+        'nome_contatto': lead.nome_contatto,
+        'settore_merceologico': lead.settore_merceologico
+    }
+
+
+def _sponsor_data(sponsor):
+    return {
+        'id': sponsor.id,
+        'ragione_sociale': sponsor.ragione_sociale,
+        'email': sponsor.email,
+        'telefono': sponsor.telefono,
+        'referente_nome': sponsor.referente_nome,
+        'settore_merceologico': sponsor.settore_merceologico
+    }
+
+
+def _contract_data(contract):
+    return {
+        'id': contract.id,
+        'nome_contratto': contract.nome_contratto,
+        'compenso': contract.compenso,
+        'data_inizio': contract.data_inizio.isoformat() if contract.data_inizio else None,
+        'data_fine': contract.data_fine.isoformat() if contract.data_fine else None,
+        'status': contract.status
+    }
+
+
+# entity_type (anche chiave nel context) -> (modello, serializzatore)
+CONTEXT_ENTITIES = {
+    'lead': (Lead, _lead_data),
+    'sponsor': (Sponsor, _sponsor_data),
+    'contract': (HeadOfTerms, _contract_data),
+}
+
+
+def _entity_ref(trigger_data):
+    """(entity_type, entity_id) caricabile dal trigger, altrimenti None"""
+    if not trigger_data or trigger_data.get('entity_type') not in CONTEXT_ENTITIES:
+        return None
+    try:
+        return trigger_data['entity_type'], int(trigger_data.get('entity_id'))
+    except (TypeError, ValueError):
+        return None
+
 
 class AutomationService:
     """Engine principale per esecuzione automazioni"""
@@ -27,6 +93,11 @@ class AutomationService:
             return func
         return decorator
 
+    @classmethod
+    def plan(cls, automation):
+        """Piano compilato (in cache) dell'automazione"""
+        return workflow_compiler.plan('club', automation, cls.STEP_HANDLERS)
+
     @staticmethod
     def execute_automation(automation, trigger_data=None):
         """
@@ -39,6 +110,8 @@ class AutomationService:
         Returns:
             AutomationExecution
         """
+        plan = AutomationService.plan(automation)
+
         # Crea execution record
         execution = AutomationExecution(
             automation_id=automation.id,
@@ -52,52 +125,29 @@ class AutomationService:
         # Prepara context
         context = AutomationService._build_context(automation.club_id, trigger_data)
 
-        steps = automation.steps or []
         all_success = True
         has_pending = False
 
-        for idx, step in enumerate(steps):
-            step_type = step.get('type')
-            step_config = step.get('config', {})
-            delay_minutes = step.get('delay_minutes', 0)
-
+        for step in plan.steps:
             # Crea step execution
             step_exec = AutomationStepExecution(
                 execution_id=execution.id,
-                step_index=idx,
-                step_type=step_type,
-                input_data=step_config,
+                step_index=step.index,
+                step_type=step.type,
+                input_data=copy.deepcopy(step.config),
                 status='pending'
             )
             db.session.add(step_exec)
-            db.session.flush()
 
             # Se c'è delay, schedula per dopo
-            if delay_minutes > 0:
-                step_exec.scheduled_for = datetime.utcnow() + timedelta(minutes=delay_minutes)
-                step_exec.status = 'pending'
+            if step.delay > 0:
+                step_exec.scheduled_for = datetime.utcnow() + timedelta(minutes=step.delay)
                 has_pending = True
                 continue
 
             # Esegui step
-            try:
-                step_exec.status = 'running'
-                step_exec.started_at = datetime.utcnow()
-                db.session.commit()
-
-                result = AutomationService.execute_step(step_type, step_config, context)
-
-                step_exec.status = 'completed'
-                step_exec.output_data = result
-                step_exec.completed_at = datetime.utcnow()
-
-                # Aggiorna context con output
-                context['last_step_output'] = result
-
-            except Exception as e:
-                step_exec.status = 'failed'
-                step_exec.error_message = str(e)
-                step_exec.completed_at = datetime.utcnow()
+            AutomationService._run_step(step_exec, step.type, step.config, context)
+            if step_exec.status == 'failed':
                 all_success = False
 
         # Aggiorna execution status
@@ -118,6 +168,28 @@ class AutomationService:
         db.session.commit()
         return execution
 
+    @staticmethod
+    def _run_step(step_exec, step_type, config, context):
+        """Esegue uno step in un savepoint e ne registra l'esito su step_exec (il commit è del chiamante)"""
+        step_exec.status = 'running'
+        step_exec.started_at = datetime.utcnow()
+        try:
+            with db.session.begin_nested():
+                result = AutomationService.execute_step(step_type, config, context)
+        except Exception as e:
+            step_exec.status = 'failed'
+            step_exec.error_message = str(e)
+            step_exec.completed_at = datetime.utcnow()
+            return None
+
+        step_exec.status = 'completed'
+        step_exec.output_data = result
+        step_exec.completed_at = datetime.utcnow()
+
+        # Aggiorna context con output
+        context['last_step_output'] = result
+        return result
+
     @staticmethod
     def execute_step(step_type, config, context):
         """
@@ -135,76 +207,130 @@ class AutomationService:
         if not handler:
             raise ValueError(f"Handler non trovato per step type: {step_type}")
 
-        return handler(config, context)
+        # Copia per esecuzione: la config arriva dal piano in cache e gli
+        # handler possono modificarla (es. headers di handle_webhook)
+        return handler(copy.deepcopy(config), context)
 
     @staticmethod
     def execute_pending_steps():
         """
         Esegue step pendenti con delay scaduto
-        Chiamato periodicamente dallo scheduler
+        Chiamato periodicamente dallo scheduler: gli step sono raggruppati per
+        execution, con un context e un commit per execution.
         """
         now = datetime.utcnow()
         pending_steps = AutomationStepExecution.query.filter(
             AutomationStepExecution.status == 'pending',
             AutomationStepExecution.scheduled_for <= now
+        ).order_by(
+            AutomationStepExecution.execution_id, AutomationStepExecution.step_index
         ).all()
 
+        # Dati letti prima dei commit (che fanno scadere gli oggetti caricati)
+        groups = OrderedDict()
         for step_exec in pending_steps:
+            groups.setdefault(step_exec.execution_id, []).append(
+                (step_exec, step_exec.step_type, step_exec.input_data or {})
+            )
+        rows = db.session.query(AutomationExecution, Automation.club_id).join(
+            Automation, Automation.id == AutomationExecution.automation_id
+        ).filter(AutomationExecution.id.in_(list(groups))).all() if groups else []
+        executions = {execution.id: execution for execution, _ in rows}
+        statuses = {execution.id: execution.status for execution, _ in rows}
+        contexts = dict(zip(
+            [execution.id for execution, _ in rows],
+            AutomationService._build_contexts([(club_id, execution.trigger_data) for execution, club_id in rows])
+        ))
+        counts = AutomationService._step_counts(list(groups))
+
+        for execution_id, jobs in groups.items():
+            if execution_id not in executions:
+                continue
+            context = contexts[execution_id]
+            failed = 0
+            for step_exec, step_type, config in jobs:
+                AutomationService._run_step(step_exec, step_type, config, context)
+                failed += step_exec.status == 'failed'
+
+            # Chiude l'execution se questi erano gli ultimi step pendenti
+            if statuses[execution_id] == 'partial' and counts.get((execution_id, 'pending'), 0) <= len(jobs):
+                execution = executions[execution_id]
+                execution.status = 'failed' if failed or counts.get((execution_id, 'failed')) else 'completed'
+                execution.completed_at = datetime.utcnow()
             try:
-                execution = step_exec.execution
-                automation = execution.automation
-
-                # Rebuild context
-                context = AutomationService._build_context(
-                    automation.club_id,
-                    execution.trigger_data
-                )
-
-                step_exec.status = 'running'
-                step_exec.started_at = datetime.utcnow()
                 db.session.commit()
-
-                result = AutomationService.execute_step(
-                    step_exec.step_type,
-                    step_exec.input_data,
-                    context
-                )
-
-                step_exec.status = 'completed'
-                step_exec.output_data = result
-                step_exec.completed_at = datetime.utcnow()
-
             except Exception as e:
-                step_exec.status = 'failed'
-                step_exec.error_message = str(e)
-                step_exec.completed_at = datetime.utcnow()
-
-        db.session.commit()
+                db.session.rollback()
+                print(f"[Automation] Error committing execution {execution_id}: {e}")
 
         # Aggiorna execution status se tutti gli step sono completati
         AutomationService._update_execution_statuses()
 
     @staticmethod
-    def _update_execution_statuses():
-        """Aggiorna status delle execution con step pendenti completati"""
-        from sqlalchemy import func
+    def _step_counts(execution_ids):
+        """{(execution_id, status): n} degli step pending/failed (1 query)"""
+        if not execution_ids:
+            return {}
+        rows = db.session.query(
+            AutomationStepExecution.execution_id,
+            AutomationStepExecution.status,
+            func.count(AutomationStepExecution.id)
+        ).filter(
+            AutomationStepExecution.execution_id.in_(execution_ids),
+            AutomationStepExecution.status.in_(('pending', 'failed'))
+        ).group_by(AutomationStepExecution.execution_id, AutomationStepExecution.status).all()
+        return {(execution_id, status): count for execution_id, status, count in rows}
 
-        # Trova execution con status 'partial'
-        partial_executions = AutomationExecution.query.filter_by(status='partial').all()
-
-        for execution in partial_executions:
-            pending_count = execution.step_executions.filter_by(status='pending').count()
-            failed_count = execution.step_executions.filter_by(status='failed').count()
+    @staticmethod
+    def _update_execution_statuses():
+        """Aggiorna status delle execution 'partial' senza più step pendenti"""
+        has_pending = exists().where(
+            AutomationStepExecution.execution_id == AutomationExecution.id,
+            AutomationStepExecution.status == 'pending'
+        )
+        finished = AutomationExecution.query.filter(
+            AutomationExecution.status == 'partial', ~has_pending
+        ).all()
+        if not finished:
+            return
 
-            if pending_count == 0:
-                if failed_count > 0:
-                    execution.status = 'failed'
-                else:
-                    execution.status = 'completed'
-                execution.completed_at = datetime.utcnow()
+        counts = AutomationService._step_counts([execution.id for execution in finished])
+        for execution in finished:
+            execution.status = 'failed' if counts.get((execution.id, 'failed')) else 'completed'
+            execution.completed_at = datetime.utcnow()
 
         db.session.commit()
 
+    @staticmethod
+    def _build_contexts(items):
+        """
+        Context per più (club_id, trigger_data) con le entità dei trigger
+        caricate in blocco (1 query per tipo di entità)
+        """
+        refs = [_entity_ref(trigger_data) for _, trigger_data in items]
+        ids_by_type = defaultdict(set)
+        for ref in refs:
+            if ref:
+                ids_by_type[ref[0]].add(ref[1])
+
+        entities = {}
+        for entity_type, ids in ids_by_type.items():
+            model, serialize = CONTEXT_ENTITIES[entity_type]
+            for entity in model.query.filter(model.id.in_(ids)).all():
+                entities[(entity_type, entity.id)] = serialize(entity)
+
+        contexts = []
+        for (club_id, trigger_data), ref in zip(items, refs):
+            context = {
+                'club_id': club_id,
+                'trigger_data': trigger_data or {},
+                'now': datetime.utcnow()
+            }
+            if ref in entities:
+                context[ref[0]] = entities[ref]
+            contexts.append(context)
+        return contexts
+
     @staticmethod
     def _build_context(club_id, trigger_data):
         """
@@ -217,54 +343,7 @@ class AutomationService:
         Returns:
             dict: Context con tutti i dati disponibili
         """
-        context = {
-            'club_id': club_id,
-            'trigger_data': trigger_data or {},
-            'now': datetime.utcnow()
-        }
-
-        if trigger_data:
-            entity_type = trigger_data.get('entity_type')
-            entity_id = trigger_data.get('entity_id')
-
-            if entity_type == 'lead' and entity_id:
-                lead = Lead.query.get(entity_id)
-                if lead:
-                    context['lead'] = {
-                        'id': lead.id,
-                        'ragione_sociale': lead.ragione_sociale,
-                        'email': lead.email,
-                        'telefono': lead.telefono,
-                        'status': lead.status,
-                        'nome_contatto': lead.nome_contatto,
-                        'settore_merceologico': lead.settore_merceologico
-                    }
-
-            elif entity_type == 'sponsor' and entity_id:
-                sponsor = Sponsor.query.get(entity_id)
-                if sponsor:
-                    context['sponsor'] = {
-                        'id': sponsor.id,
-                        'ragione_sociale': sponsor.ragione_sociale,
-                        'email': sponsor.email,
-                        'telefono': sponsor.telefono,
-                        'referente_nome': sponsor.referente_nome,
-                        'settore_merceologico': sponsor.settore_merceologico
-                    }
-
-            elif entity_type == 'contract' and entity_id:
-                contract = HeadOfTerms.query.get(entity_id)
-                if contract:
-                    context['contract'] = {
-                        'id': contract.id,
-                        'nome_contratto': contract.nome_contratto,
-                        'compenso': contract.compenso,
-                        'data_inizio': contract.data_inizio.isoformat() if contract.data_inizio else None,
-                        'data_fine': contract.data_fine.isoformat() if contract.data_fine else None,
-                        'status': contract.status
-                    }
-
-        return context
+        return AutomationService._build_contexts([(club_id, trigger_data)])[0]
 
     @staticmethod
     def check_conditions(conditions, context):
@@ -272,84 +351,13 @@ class AutomationService:
         Verifica se le condizioni sono soddisfatte
 
         Args:
-            conditions: Lista di condizioni [{field, operator, value}]
+            conditions: {operator: AND|OR, rules: [{field, operator, value}]}
             context: Context con dati
 
         Returns:
-            bool: True se tutte le condizioni sono soddisfatte
+            bool: True se le condizioni sono soddisfatte (regole compilate in cache)
         """
-        if not conditions:
-            return True
-
-        rules = conditions.get('rules', [])
-        operator = conditions.get('operator', 'AND')
-
-        results = []
-        for rule in rules:
-            field_path = rule.get('field', '')
-            op = rule.get('operator', 'equals')
-            expected_value = rule.get('value')
-
-            # Recupera valore dal context
-            actual_value = AutomationService._get_nested_value(context, field_path)
-
-            # Valuta condizione
-            result = AutomationService._evaluate_condition(actual_value, op, expected_value)
-            results.append(result)
-
-        if operator == 'AND':
-            return all(results)
-        else:  # OR
-            return any(results)
-
-    @staticmethod
-    def _get_nested_value(obj, path):
-        """Recupera valore nested da dict usando dot notation"""
-        parts = path.split('.')
-        value = obj
-        for part in parts:
-            if isinstance(value, dict):
-                value = value.get(part)
-            else:
-                return None
-        return value
-
-    @staticmethod
-    def _evaluate_condition(actual, operator, expected):
-        """Valuta una singola condizione"""
-        if actual is None:
-            return operator == 'is_empty'
-
-        if operator == 'equals':
-            return str(actual).lower() == str(expected).lower()
-        elif operator == 'not_equals':
-            return str(actual).lower() != str(expected).lower()
-        elif operator == 'contains':
-            return str(expected).lower() in str(actual).lower()
-        elif operator == 'not_contains':
-            return str(expected).lower() not in str(actual).lower()
-        elif operator == 'starts_with':
-            return str(actual).lower().startswith(str(expected).lower())
-        elif operator == 'ends_with':
-            return str(actual).lower().endswith(str(expected).lower())
-        elif operator == 'greater_than':
-            try:
-                return float(actual) > float(expected)
-            except:
-                return False
-        elif operator == 'less_than':
-            try:
-                return float(actual) < float(expected)
-            except:
-                return False
-        elif operator == 'is_empty':
-            return not actual
-        elif operator == 'is_not_empty':
-            return bool(actual)
-        elif operator == 'in_list':
-            return actual in (expected if isinstance(expected, list) else [expected])
-
-        return False
+        return rule_compiler.check_conditions(conditions, context)
 
 
 # ==================== STEP HANDLERS ====================
@@ -381,7 +389,7 @@ def handle_send_notification(config, context):
         priorita=config.get('priorita', 'normale')
     )
     db.session.add(notification)
-    db.session.commit()
+    db.session.flush()
 
     return {'notification_id': notification.id, 'user_type': user_type, 'user_id': user_id}
 
@@ -450,7 +458,7 @@ def handle_create_task(config, context):
         scadenza=scadenza
     )
     db.session.add(checklist)
-    db.session.commit()
+    db.session.flush()
 
     return {'checklist_id': checklist.id, 'titolo': titolo}
 
@@ -477,7 +485,7 @@ def handle_update_status(config, context):
     else:
         raise ValueError(f"Entity type non supportato: {entity_type}")
 
-    db.session.commit()
+    db.session.flush()
     return {'entity_type': entity_type, 'entity_id': entity_id, 'new_status': new_status}
 
 
@@ -509,7 +517,7 @@ def handle_create_activity(config, context):
         raise ValueError(f"Entity type non supportato per attività: {entity_type}")
 
     db.session.add(activity)
-    db.session.commit()
+    db.session.flush()
 
     return {'activity_id': activity.id, 'tipo': tipo}
 
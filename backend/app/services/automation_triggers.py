@@ -56,25 +56,9 @@ class AutomationTriggers:
             entity_data: Dati dell'entità
 
         Returns:
-            bool: True se le condizioni sono soddisfatte
+            bool: True se i filtri compilati nel piano dell'automazione sono soddisfatti
         """
-        trigger_config = automation.trigger_config or {}
-
-        # Verifica filtri specifici per trigger type
-        filters = trigger_config.get('filters', {})
-
-        for field, expected_value in filters.items():
-            actual_value = entity_data.get(field)
-
-            # Se è una lista, controlla se il valore è nella lista
-            if isinstance(expected_value, list):
-                if actual_value not in expected_value:
-                    return False
-            # Altrimenti confronto diretto
-            elif actual_value != expected_value:
-                return False
-
-        return True
+        return AutomationService.plan(automation).matches_trigger(entity_data)
 
 
 # ==================== HELPER FUNCTIONS PER TRIGGER SPECIFICI ====================
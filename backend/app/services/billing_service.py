@@ -0,0 +1,186 @@
+"""
+Billing Service - numerazione fatture e generazione massiva.
+
+I numeri fattura (PP-<anno>-<NNNN>) sono allocati a blocchi da
+invoice_sequences con un UPDATE atomico nella stessa transazione delle
+fatture: due admin che generano contemporaneamente non possono ottenere lo
+stesso numero e un rollback libera il blocco. La generazione mensile carica
+in una query i contratti attivi e in una query le fatture già emesse per il
+periodo, poi inserisce tutte le nuove fatture con un solo INSERT multiplo.
+"""
+from datetime import date, datetime
+
+from sqlalchemy import insert
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import joinedload
+
+from app import db
+from app.models import AdminContract, AdminInvoice, InvoiceSequence
+
+
+INVOICE_PREFIX = 'PP'
+
+INSTALLMENTS = {'annual': 1, 'semi_annual': 2, 'quarterly': 4, 'monthly': 12}
+
+
+class InvoiceSequenceService:
+
+    @staticmethod
+    def format_number(year, number, prefix=INVOICE_PREFIX):
+        return f'{prefix}-{year}-{number:04d}'
+
+    @staticmethod
+    def _max_existing(year, prefix):
+        """Ultimo numero già usato nell'anno (inizializzazione della sequenza)"""
+        pattern = f'{prefix}-{year}-'
+        numbers = db.session.query(AdminInvoice.invoice_number).filter(
+            AdminInvoice.invoice_number.like(f'{pattern}%')
+        ).all()
+        last = 0
+        for (number,) in numbers:
+            try:
+                last = max(last, int(number[len(pattern):]))
+            except (TypeError, ValueError):
+                continue
+        return last
+
+    @classmethod
+    def _bump(cls, year, count, prefix):
+        seq = InvoiceSequence.__table__
+        result = db.session.execute(
+            seq.update()
+            .where(seq.c.prefix == prefix, seq.c.year == year)
+            .values(last_number=seq.c.last_number + count, updated_at=datetime.utcnow())
+        )
+        return result.rowcount
+
+    @classmethod
+    def allocate(cls, count=1, year=None, prefix=INVOICE_PREFIX):
+        """
+        Riserva `count` numeri consecutivi e ritorna la lista dei numeri
+        formattati. La riga della sequenza resta bloccata fino al commit del
+        chiamante, che deve avvenire nella stessa transazione delle fatture.
+        """
+        if count <= 0:
+            return []
+        year = year or datetime.now().year
+
+        if not cls._bump(year, count, prefix):
+            # Prima fattura dell'anno: crea la sequenza partendo dai numeri esistenti
+            try:
+                with db.session.begin_nested():
+                    db.session.add(InvoiceSequence(
+                        prefix=prefix, year=year, last_number=cls._max_existing(year, prefix)
+                    ))
+            except IntegrityError:
+                pass  # creata da una richiesta concorrente
+            cls._bump(year, count, prefix)
+
+        last = db.session.query(InvoiceSequence.last_number).filter_by(prefix=prefix, year=year).scalar()
+        first = last - count + 1
+        return [cls.format_number(year, n, prefix) for n in range(first, last + 1)]
+
+    @classmethod
+    def peek(cls, count=1, year=None, prefix=INVOICE_PREFIX):
+        """Numeri che verrebbero assegnati, senza riservarli (anteprima)"""
+        year = year or datetime.now().year
+        last = db.session.query(InvoiceSequence.last_number).filter_by(prefix=prefix, year=year).scalar()
+        if last is None:
+            last = cls._max_existing(year, prefix)
+        return [cls.format_number(year, n, prefix) for n in range(last + 1, last + count + 1)]
+
+
+class BillingRunService:
+
+    @staticmethod
+    def _add_months(year, month, months):
+        index = (month - 1) + months
+        return year + index // 12, index % 12 + 1
+
+    @classmethod
+    def _period_end(cls, payment_terms, year, month):
+        if payment_terms == 'annual':
+            return date(year, 12, 31)
+        if payment_terms == 'semi_annual':
+            return date(*cls._add_months(year, month, 5), 28)
+        if payment_terms == 'quarterly':
+            return date(*cls._add_months(year, month, 2), 28)
+        return date(year, month, 28)
+
+    @classmethod
+    def _build_row(cls, contract, year, month, created_by):
+        installments = INSTALLMENTS.get(contract.payment_terms, 12)
+        amount = contract.total_value / installments
+        vat_rate = 22.0
+        vat_amount = amount * (vat_rate / 100)
+        issue_date = date(year, month, 1)
+        return {
+            'contract_id': contract.id,
+            'club_id': contract.club_id,
+            'amount': amount,
+            'vat_rate': vat_rate,
+            'vat_amount': vat_amount,
+            'total_amount': amount + vat_amount,
+            'line_items': [{
+                'description': f'Piano {contract.plan_type.capitalize()} - {contract.club.nome}',
+                'amount': contract.plan_price / installments
+            }] + [{'description': addon.get('name'), 'amount': addon.get('price', 0)} for addon in (contract.addons or [])],
+            'issue_date': issue_date,
+            'due_date': date(year, month, 28),
+            'period_start': issue_date,
+            'period_end': cls._period_end(contract.payment_terms, year, month),
+            'status': 'pending',
+            'created_by': created_by,
+        }
+
+    @classmethod
+    def run(cls, year, month, created_by=None, dry_run=False):
+        """
+        Genera le fatture del periodo per i contratti attivi che non ne hanno
+        già una. Con dry_run=True ritorna l'anteprima senza scrivere nulla.
+        """
+        period_start = date(year, month, 1)
+        next_year, next_month = cls._add_months(year, month, 1)
+        period_next = date(next_year, next_month, 1)
+
+        contracts = AdminContract.query.options(
+            joinedload(AdminContract.club)
+        ).filter(AdminContract.status == 'active').order_by(AdminContract.id).all()
+
+        already_invoiced = {cid for (cid,) in db.session.query(AdminInvoice.contract_id).filter(
+            AdminInvoice.period_start >= period_start,
+            AdminInvoice.period_start < period_next
+        ).distinct().all()}
+
+        rows, generated, skipped = [], [], []
+        for contract in contracts:
+            if contract.id in already_invoiced:
+                skipped.append({
+                    'contract_id': contract.id,
+                    'club_name': contract.club.nome,
+                    'reason': 'Fattura già esistente'
+                })
+                continue
+            rows.append(cls._build_row(contract, year, month, created_by))
+            generated.append({'club_name': contract.club.nome, 'amount': rows[-1]['total_amount']})
+
+        # Numerazione sull'anno di emissione (oggi), come generate_invoice_number:
+        # le fatture di dicembre generate a gennaio usano la sequenza del nuovo anno
+        if dry_run:
+            numbers = InvoiceSequenceService.peek(len(rows))
+            db.session.rollback()
+        else:
+            numbers = InvoiceSequenceService.allocate(len(rows))
+
+        for row, item, number in zip(rows, generated, numbers):
+            row['invoice_number'] = number
+            item['invoice_number'] = number
+
+        if rows and not dry_run:
+            db.session.execute(insert(AdminInvoice), rows)
+            # L'INSERT multiplo non passa dagli eventi ORM: aggiorna i saldi qui
+            from app.services.finance_ledger_service import FinanceLedgerService
+            FinanceLedgerService.refresh_contracts(db.session.connection(), [r['contract_id'] for r in rows])
+            db.session.commit()
+
+        return {'generated': generated, 'skipped': skipped, 'dry_run': dry_run}
@@ -0,0 +1,294 @@
+"""
+Budget Analytics Service - report, previsioni e portafoglio budget.
+
+Spesa mensile, utilizzo categorie e stato pagamenti sono calcolati con query
+raggruppate per budget, quindi report singolo e vista portafoglio (tutti i
+budget di un club o di uno sponsor) costano lo stesso numero di query. La
+previsione usa la media mobile degli ultimi mesi corretta per stagionalità
+(indice per mese di calendario quando c'è almeno un anno di storico) e
+proietta la spesa mese per mese fino all'esaurimento del budget.
+"""
+import calendar
+from collections import defaultdict
+from datetime import date, timedelta
+
+from sqlalchemy import func, extract
+
+from app import db
+from app.models import Budget, BudgetCategory, Expense, Payment, HeadOfTerms, Sponsor, Club
+
+
+ROLLING_WINDOW = 3  # mesi
+FORECAST_HORIZON = 36  # mesi
+PROJECTION_MONTHS = 12  # mesi restituiti nella proiezione
+PAYMENT_STATES = ('pianificato', 'in_corso', 'completato', 'in_ritardo', 'annullato')
+
+
+def _month_index(year, month):
+    return int(year) * 12 + int(month) - 1
+
+
+def _month_label(index):
+    return f'{index // 12:04d}-{index % 12 + 1:02d}'
+
+
+class BudgetAnalyticsService:
+
+    # ------------------------------------------------------------------ query raggruppate
+    @staticmethod
+    def monthly_burn(budget_ids):
+        """{budget_id: {indice_mese: totale}} delle spese pagate (1 query)"""
+        if not budget_ids:
+            return {}
+        year = extract('year', Expense.data_spesa)
+        month = extract('month', Expense.data_spesa)
+        rows = db.session.query(
+            Expense.budget_id, year, month, func.sum(Expense.importo)
+        ).filter(
+            Expense.budget_id.in_(budget_ids),
+            Expense.stato == 'pagato'
+        ).group_by(Expense.budget_id, year, month).all()
+
+        burn = defaultdict(dict)
+        for budget_id, y, m, total in rows:
+            if y is not None and m is not None:
+                burn[budget_id][_month_index(y, m)] = float(total or 0)
+        return burn
+
+    @staticmethod
+    def category_utilization(budget_ids):
+        """{budget_id: [categorie con allocato/speso/percentuale]} (1 query)"""
+        if not budget_ids:
+            return {}
+        rows = db.session.query(
+            BudgetCategory.budget_id, BudgetCategory.id, BudgetCategory.nome,
+            BudgetCategory.importo_allocato, BudgetCategory.importo_speso
+        ).filter(BudgetCategory.budget_id.in_(budget_ids)).order_by(BudgetCategory.id).all()
+
+        categories = defaultdict(list)
+        for budget_id, category_id, nome, allocato, speso in rows:
+            allocato, speso = float(allocato or 0), float(speso or 0)
+            categories[budget_id].append({
+                'id': category_id,
+                'nome': nome,
+                'allocato': allocato,
+                'speso': speso,
+                'percentuale': (speso / allocato * 100) if allocato else 0
+            })
+        return categories
+
+    @staticmethod
+    def payment_status(budget_ids):
+        """{budget_id: {stato: {'count', 'importo'}}} (1 query GROUP BY stato)"""
+        if not budget_ids:
+            return {}
+        rows = db.session.query(
+            Payment.budget_id, Payment.stato, func.count(Payment.id), func.sum(Payment.importo)
+        ).filter(Payment.budget_id.in_(budget_ids)).group_by(Payment.budget_id, Payment.stato).all()
+
+        status = defaultdict(lambda: {s: {'count': 0, 'importo': 0.0} for s in PAYMENT_STATES})
+        for budget_id, stato, count, total in rows:
+            status[budget_id][stato or 'pianificato'] = {'count': count, 'importo': float(total or 0)}
+        return status
+
+    # ------------------------------------------------------------------ previsione
+    @staticmethod
+    def _history(monthly, current_index):
+        """Serie continua dal primo mese con spese al mese corrente (zeri nei buchi)"""
+        if not monthly:
+            return None, []
+        first = min(monthly)
+        last = max(current_index, max(monthly))
+        return first, [monthly.get(i, 0.0) for i in range(first, last + 1)]
+
+    @staticmethod
+    def _seasonal_indices(first, values):
+        """Indice per mese di calendario (media 1.0); neutro con meno di 12 mesi"""
+        if len(values) < 12:
+            return [1.0] * 12
+        sums, counts = [0.0] * 12, [0] * 12
+        for offset, value in enumerate(values):
+            sums[(first + offset) % 12] += value
+            counts[(first + offset) % 12] += 1
+        means = [s / c if c else 0.0 for s, c in zip(sums, counts)]
+        overall = sum(means) / 12
+        if overall <= 0:
+            return [1.0] * 12
+        return [m / overall for m in means]
+
+    @classmethod
+    def forecast(cls, monthly, remaining, today=None, window=ROLLING_WINDOW):
+        """Burn rate (storico e mobile), proiezione mensile e data di esaurimento"""
+        today = today or date.today()
+        current = _month_index(today.year, today.month)
+        first, values = cls._history(monthly, current)
+
+        if not values or not any(values):
+            return {
+                'burn_rate_mensile': 0,
+                'burn_rate_mobile': 0,
+                'mesi_rimanenti': 0,
+                'data_esaurimento_prevista': None,
+                'stagionalita': False,
+                'proiezione': []
+            }
+
+        # Media sui mesi con spese (definizione storica dell'endpoint)
+        spending = [v for v in values if v]
+        burn_rate = sum(spending) / len(spending)
+
+        # Media mobile sugli ultimi mesi completi (il mese corrente è parziale)
+        complete = values[:-1] if len(values) > 1 and first + len(values) - 1 == current else values
+        recent = complete[-window:] if complete else values[-window:]
+        rolling = sum(recent) / len(recent)
+        rate = rolling or burn_rate
+
+        seasonal = cls._seasonal_indices(first, complete)
+        remaining = max(0.0, float(remaining))
+
+        # Proiezione mese per mese dal mese successivo
+        months = [current + k for k in range(1, FORECAST_HORIZON + 1)]
+        expected = [rate * seasonal[m % 12] for m in months]
+        cumulative = []
+        running = 0.0
+        for value in expected:
+            running += value
+            cumulative.append(running)
+
+        exhaustion = None
+        for m, value, cum in zip(months, expected, cumulative):
+            if cum >= remaining and value > 0:
+                # Giorno del mese proporzionale alla quota residua
+                year, month = m // 12, m % 12 + 1
+                days = calendar.monthrange(year, month)[1]
+                fraction = (remaining - (cum - value)) / value
+                exhaustion = date(year, month, 1) + timedelta(days=max(0, int(round(fraction * days)) - 1))
+                break
+
+        return {
+            'burn_rate_mensile': round(burn_rate, 2),
+            'burn_rate_mobile': round(rolling, 2),
+            'mesi_rimanenti': round(remaining / rate, 1) if rate > 0 else 0,
+            'data_esaurimento_prevista': exhaustion.isoformat() if exhaustion and remaining > 0 else None,
+            'stagionalita': len(complete) >= 12,
+            'finestra_mesi': window,
+            'proiezione': [{
+                'mese': _month_label(m),
+                'previsto': round(value, 2),
+                'cumulato': round(cum, 2)
+            } for m, value, cum in list(zip(months, expected, cumulative))[:PROJECTION_MONTHS]]
+        }
+
+    # ------------------------------------------------------------------ budget singolo
+    @staticmethod
+    def _overview(budget):
+        totale = float(budget.importo_totale or 0)
+        speso = float(budget.importo_speso or 0)
+        return {
+            'totale': totale,
+            'speso': speso,
+            'rimanente': totale - speso,
+            'percentuale_utilizzo': (speso / totale * 100) if totale else 0
+        }
+
+    @classmethod
+    def budget_report(cls, budget):
+        """Report di un budget: categorie, spesa mensile e pagamenti"""
+        monthly = cls.monthly_burn([budget.id]).get(budget.id, {})
+        payments = cls.payment_status([budget.id])[budget.id]
+
+        totale_pagamenti = sum(p['importo'] for p in payments.values())
+        return {
+            'budget_overview': cls._overview(budget),
+            'categories': [
+                {k: c[k] for k in ('nome', 'allocato', 'speso', 'percentuale')}
+                for c in cls.category_utilization([budget.id]).get(budget.id, [])
+            ],
+            'monthly_expenses': [{
+                'anno': index // 12,
+                'mese': index % 12 + 1,
+                'totale': total
+            } for index, total in sorted(monthly.items())],
+            'payments_overview': {
+                'totale': sum(p['count'] for p in payments.values()),
+                'completati': payments['completato']['count'],
+                'in_ritardo': payments['in_ritardo']['count'],
+                'totale_da_pagare': totale_pagamenti,
+                'gia_pagato': payments['completato']['importo'],
+                'da_pagare': payments['pianificato']['importo'] + payments['in_corso']['importo']
+            }
+        }
+
+    @classmethod
+    def budget_forecast(cls, budget, window=ROLLING_WINDOW, today=None):
+        monthly = cls.monthly_burn([budget.id]).get(budget.id, {})
+        return cls.forecast(monthly, cls._overview(budget)['rimanente'], today=today, window=window)
+
+    # ------------------------------------------------------------------ portafoglio
+    @classmethod
+    def portfolio(cls, owner_type, owner_id, anno_fiscale=None, window=ROLLING_WINDOW, today=None):
+        """Tutti i budget di un club o sponsor con totali e previsione aggregata"""
+        today = today or date.today()
+        counterpart = Sponsor if owner_type == 'club' else Club
+        counterpart_id = HeadOfTerms.sponsor_id if owner_type == 'club' else HeadOfTerms.club_id
+        counterpart_name = Sponsor.ragione_sociale if owner_type == 'club' else Club.nome
+
+        query = db.session.query(
+            Budget, HeadOfTerms.nome_contratto, counterpart.id, counterpart_name
+        ).outerjoin(
+            HeadOfTerms, HeadOfTerms.id == Budget.contract_id
+        ).outerjoin(
+            counterpart, counterpart.id == counterpart_id
+        ).filter(Budget.owner_type == owner_type, Budget.owner_id == owner_id)
+        if anno_fiscale:
+            query = query.filter(Budget.anno_fiscale == anno_fiscale)
+        rows = query.order_by(Budget.anno_fiscale.desc(), Budget.id).all()
+
+        budget_ids = [row[0].id for row in rows]
+        burn = cls.monthly_burn(budget_ids)
+        payments = cls.payment_status(budget_ids)
+
+        combined = defaultdict(float)
+        items = []
+        for budget, contract_name, cp_id, cp_name in rows:
+            overview = cls._overview(budget)
+            monthly = burn.get(budget.id, {})
+            for index, total in monthly.items():
+                combined[index] += total
+            forecast = cls.forecast(monthly, overview['rimanente'], today=today, window=window)
+            status = payments[budget.id]
+            items.append({
+                'id': budget.id,
+                'contract_id': budget.contract_id,
+                'contract_name': contract_name,
+                'controparte': {'id': cp_id, 'nome': cp_name} if cp_id else None,
+                'anno_fiscale': budget.anno_fiscale,
+                'valuta': budget.valuta,
+                **overview,
+                'burn_rate_mobile': forecast['burn_rate_mobile'],
+                'mesi_rimanenti': forecast['mesi_rimanenti'],
+                'data_esaurimento_prevista': forecast['data_esaurimento_prevista'],
+                'pagamenti': {
+                    'completati': status['completato']['importo'],
+                    'da_pagare': status['pianificato']['importo'] + status['in_corso']['importo'],
+                    'in_ritardo': status['in_ritardo']['importo'],
+                    'in_ritardo_count': status['in_ritardo']['count']
+                }
+            })
+
+        totale = sum(i['totale'] for i in items)
+        speso = sum(i['speso'] for i in items)
+        return {
+            'budgets': items,
+            'totali': {
+                'budget': len(items),
+                'totale': totale,
+                'speso': speso,
+                'rimanente': totale - speso,
+                'percentuale_utilizzo': (speso / totale * 100) if totale else 0,
+                'pagamenti_da_pagare': sum(i['pagamenti']['da_pagare'] for i in items),
+                'pagamenti_in_ritardo': sum(i['pagamenti']['in_ritardo'] for i in items)
+            },
+            'spesa_mensile': [{'mese': _month_label(index), 'totale': total} for index, total in sorted(combined.items())],
+            'forecast': cls.forecast(dict(combined), totale - speso, today=today, window=window)
+        }
@@ -10,14 +10,16 @@ import re
 import uuid
 from datetime import datetime
 
-from weasyprint import HTML, CSS
-
 from app import db
+from app.lazy_imports import lazy_import
 from app.models import (
     AdminContract, Club, ContractTemplate,
     ContractDocument, ContractSignature
 )
 
+# WeasyPrint (cairo/pango) caricato solo alla prima generazione PDF
+weasyprint = lazy_import('weasyprint')
+
 
 class ContractDocumentService:
 
@@ -123,8 +125,8 @@ class ContractDocumentService:
         """Genera PDF bytes da HTML + CSS opzionale."""
         stylesheets = []
         if css_content:
-            stylesheets.append(CSS(string=css_content))
-        return HTML(string=html_content).write_pdf(stylesheets=stylesheets or None)
+            stylesheets.append(weasyprint.CSS(string=css_content))
+        return weasyprint.HTML(string=html_content).write_pdf(stylesheets=stylesheets or None)
 
     # ------------------------------------------------------------------
     # Hash
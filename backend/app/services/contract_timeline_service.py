@@ -0,0 +1,137 @@
+"""
+Contract Timeline Service - contratti attivi e in scadenza per club e sponsor.
+
+Per ogni club la timeline (contratti in stato 'attivo' ordinati per scadenza,
+con la ragione sociale dello sponsor) e gli insiemi di sponsor id (con un
+contratto attivo / con almeno un contratto) sono calcolati con due query
+sull'indice (club_id, status, data_fine) e tenuti nella CatalogCache
+versionata con scope 'contracts': ogni flush che scrive HeadOfTerms o Sponsor
+incrementa la versione del club in cache_versions nella stessa transazione,
+così l'invalidazione vale per tutti i processi. La cache analytics sponsor
+usa la stessa versione.
+Dashboard, Pitchy, feed press e analytics leggono "sponsor attivi del club X"
+dalla cache invece di rifare il join.
+"""
+import os
+from collections import namedtuple
+from datetime import datetime, timedelta
+from itertools import chain
+
+from app import db
+from app.models import Sponsor, HeadOfTerms
+from app.services.inventory_catalog_service import CatalogCache
+
+
+CACHE_TTL = int(os.getenv('CONTRACT_TIMELINE_CACHE_TTL', '600'))
+
+# Versione per club condivisa con la cache analytics sponsor
+CONTRACTS_SCOPE = 'contracts'
+
+timeline_cache = CatalogCache(CONTRACTS_SCOPE, ttl=CACHE_TTL, max_entries=2048)
+
+ContractRow = namedtuple('ContractRow', [
+    'id', 'club_id', 'sponsor_id', 'sponsor_name', 'nome_contratto', 'compenso', 'data_inizio', 'data_fine'
+])
+
+
+class ClubTimeline:
+    """Vista in sola lettura dei contratti di un club"""
+
+    __slots__ = ('contracts', 'active_sponsor_ids', 'sponsor_ids')
+
+    def __init__(self, contracts, sponsor_ids):
+        self.contracts = tuple(contracts)
+        self.active_sponsor_ids = frozenset(c.sponsor_id for c in self.contracts)
+        self.sponsor_ids = frozenset(sponsor_ids)
+
+    def current(self, now=None):
+        """Contratti attivi con data_inizio <= now <= data_fine"""
+        now = now or datetime.utcnow()
+        return [c for c in self.contracts if c.data_inizio <= now <= c.data_fine]
+
+    def expiring(self, days, now=None):
+        """Contratti attivi in scadenza entro `days` giorni (ordinati per scadenza)"""
+        now = now or datetime.utcnow()
+        limit = now + timedelta(days=days)
+        return [c for c in self.contracts if now <= c.data_fine <= limit]
+
+    def for_sponsor(self, sponsor_id):
+        return [c for c in self.contracts if c.sponsor_id == sponsor_id]
+
+
+class ContractTimelineService:
+
+    @staticmethod
+    def _load(club_id):
+        rows = db.session.query(
+            HeadOfTerms.id, HeadOfTerms.club_id, HeadOfTerms.sponsor_id, Sponsor.ragione_sociale,
+            HeadOfTerms.nome_contratto, HeadOfTerms.compenso, HeadOfTerms.data_inizio, HeadOfTerms.data_fine
+        ).join(Sponsor, Sponsor.id == HeadOfTerms.sponsor_id).filter(
+            HeadOfTerms.club_id == club_id,
+            HeadOfTerms.status == 'attivo'
+        ).order_by(HeadOfTerms.data_fine, HeadOfTerms.id).all()
+
+        sponsor_ids = db.session.query(HeadOfTerms.sponsor_id).filter(
+            HeadOfTerms.club_id == club_id
+        ).distinct().all()
+
+        return ClubTimeline([ContractRow(*row) for row in rows], [s[0] for s in sponsor_ids])
+
+    @classmethod
+    def for_club(cls, club_id):
+        """ClubTimeline del club (dalla cache se valida)"""
+        timeline = timeline_cache.get(club_id, 'timeline')
+        if timeline is None:
+            version = timeline_cache.version(club_id)
+            timeline = cls._load(club_id)
+            timeline_cache.set(club_id, 'timeline', timeline, version)
+        return timeline
+
+    @classmethod
+    def active_contracts(cls, club_id, sponsor_id=None, current=False):
+        """
+        Contratti in stato 'attivo' del club (o di un suo sponsor); con
+        current=True solo quelli nel periodo di validità.
+        """
+        timeline = cls.for_club(club_id)
+        contracts = timeline.current() if current else list(timeline.contracts)
+        if sponsor_id is not None:
+            contracts = [c for c in contracts if c.sponsor_id == sponsor_id]
+        return contracts
+
+    @classmethod
+    def active_sponsor_ids(cls, club_id):
+        """frozenset degli sponsor con almeno un contratto attivo"""
+        return cls.for_club(club_id).active_sponsor_ids
+
+    @classmethod
+    def sponsor_ids(cls, club_id):
+        """frozenset degli sponsor con almeno un contratto (qualsiasi stato)"""
+        return cls.for_club(club_id).sponsor_ids
+
+    @classmethod
+    def expiring_contracts(cls, club_id, days=60):
+        return cls.for_club(club_id).expiring(days)
+
+
+# ------------------------------------------------------------------ listeners
+_listeners_registered = False
+
+
+def dirty_contract_clubs(session):
+    """Club di contratti e sponsor toccati dalla flush"""
+    return {obj.club_id for obj in chain(session.new, session.dirty, session.deleted)
+            if isinstance(obj, (Sponsor, HeadOfTerms))}
+
+
+def _register_listeners():
+    global _listeners_registered
+    if _listeners_registered:
+        return
+    timeline_cache.listen(dirty_contract_clubs)
+    _listeners_registered = True
+
+
+def init_app(app):
+    """Registra il listener che incrementa la versione contratti del club (timeline e analytics sponsor)"""
+    _register_listeners()
@@ -2,12 +2,12 @@
 Email Service - Gestione invio email via SMTP
 """
 import smtplib
-import re
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
 from datetime import datetime
 from app import db
 from app.models import SMTPConfiguration
+from app.services import rule_compiler
 
 
 class EmailService:
@@ -169,26 +169,9 @@ class EmailService:
             context: Dict con valori da sostituire
 
         Returns:
-            str: Template renderizzato
+            str: Template renderizzato (compilato una volta e tenuto in cache)
         """
-        def replace_var(match):
-            var_path = match.group(1).strip()
-            parts = var_path.split('.')
-
-            value = context
-            for part in parts:
-                if isinstance(value, dict):
-                    value = value.get(part, '')
-                elif hasattr(value, part):
-                    value = getattr(value, part, '')
-                else:
-                    return ''
-
-            return str(value) if value else ''
-
-        # Pattern per {{variabile}} o {{ variabile }}
-        pattern = r'\{\{\s*([^}]+)\s*\}\}'
-        return re.sub(pattern, replace_var, template_str)
+        return rule_compiler.render_template(template_str, context, style='email')
 
     @staticmethod
     def _encrypt_password(password):
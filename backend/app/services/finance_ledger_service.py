@@ -0,0 +1,237 @@
+"""
+Finance Ledger Service - aggregati finanziari set-based per la dashboard admin.
+
+Ogni scrittura ORM su AdminInvoice (creazione, pagamento, modifica, eliminazione)
+ricalcola il saldo del contratto in admin_contract_ledgers con una singola
+query aggregata sulla stessa connessione della flush. La dashboard legge i
+saldi con un join e calcola cash-in, scaduto e previsioni con GROUP BY,
+senza caricare le fatture in memoria.
+"""
+from datetime import date, datetime, timedelta
+
+from sqlalchemy import func, case, extract, and_, event, inspect
+
+from app import db
+from app.models import AdminContract, AdminInvoice, AdminContractLedger, Club
+
+
+class FinanceLedgerService:
+
+    # ------------------------------------------------------------------ ledger
+    @staticmethod
+    def _aggregate_select(contract_ids=None):
+        """SELECT aggregato per contratto sulle fatture non annullate"""
+        inv = AdminInvoice.__table__
+        is_paid = inv.c.status == 'paid'
+        query = db.select(
+            inv.c.contract_id,
+            func.min(inv.c.club_id).label('club_id'),
+            func.count(inv.c.id).label('invoice_count'),
+            func.coalesce(func.sum(inv.c.total_amount), 0).label('invoiced_total'),
+            func.coalesce(func.sum(case((is_paid, 1), else_=0)), 0).label('paid_count'),
+            func.coalesce(func.sum(case((is_paid, inv.c.total_amount), else_=0)), 0).label('paid_total'),
+            func.max(case((is_paid, inv.c.payment_date), else_=None)).label('last_payment_date'),
+        ).where(
+            func.coalesce(inv.c.status, 'pending') != 'cancelled'
+        ).group_by(inv.c.contract_id)
+        if contract_ids is not None:
+            query = query.where(inv.c.contract_id.in_(list(contract_ids)))
+        return query
+
+    @classmethod
+    def refresh_contracts(cls, connection, contract_ids):
+        """Ricalcola i saldi dei contratti indicati (upsert portabile UPDATE/INSERT)"""
+        contract_ids = {cid for cid in contract_ids if cid is not None}
+        if not contract_ids:
+            return
+
+        ledger = AdminContractLedger.__table__
+        contracts = AdminContract.__table__
+        now = datetime.utcnow()
+
+        rows = {row.contract_id: row for row in connection.execute(cls._aggregate_select(contract_ids))}
+        club_ids = dict(connection.execute(
+            db.select(contracts.c.id, contracts.c.club_id).where(contracts.c.id.in_(contract_ids))
+        ).all())
+
+        for contract_id in contract_ids:
+            if contract_id not in club_ids:
+                # Contratto eliminato: rimuove il saldo
+                connection.execute(ledger.delete().where(ledger.c.contract_id == contract_id))
+                continue
+            row = rows.get(contract_id)
+            values = {
+                'club_id': club_ids[contract_id],
+                'invoice_count': row.invoice_count if row else 0,
+                'invoiced_total': float(row.invoiced_total) if row else 0.0,
+                'paid_count': int(row.paid_count) if row else 0,
+                'paid_total': float(row.paid_total) if row else 0.0,
+                'last_payment_date': row.last_payment_date if row else None,
+                'updated_at': now,
+            }
+            values['outstanding_total'] = round(values['invoiced_total'] - values['paid_total'], 2)
+
+            result = connection.execute(
+                ledger.update().where(ledger.c.contract_id == contract_id).values(**values)
+            )
+            if result.rowcount == 0:
+                connection.execute(ledger.insert().values(contract_id=contract_id, **values))
+
+    @classmethod
+    def rebuild(cls, contract_ids=None):
+        """Ricostruisce i saldi (tutti o solo quelli indicati) e fa commit"""
+        if contract_ids is None:
+            contract_ids = [cid for (cid,) in db.session.query(AdminContract.id).all()]
+        cls.refresh_contracts(db.session.connection(), contract_ids)
+        db.session.commit()
+
+    # ------------------------------------------------------------------ dashboard
+    @staticmethod
+    def _plan_bucket(plan_type):
+        plan = (plan_type or '').lower()
+        if plan == 'kickoff':
+            return 'basic'
+        return plan
+
+    @classmethod
+    def dashboard(cls, year, today=None):
+        """Dati della dashboard finanziaria (stessa forma di /finance/dashboard)"""
+        today = today or date.today()
+
+        # === Contratti attivi + club + saldo (1 query) ===
+        rows = db.session.query(
+            AdminContract.id, AdminContract.plan_type, AdminContract.total_value,
+            AdminContract.vat_rate, Club.id, Club.nome, Club.logo_url,
+            AdminContractLedger.paid_total, AdminContractLedger.contract_id
+        ).join(
+            Club, Club.id == AdminContract.club_id
+        ).outerjoin(
+            AdminContractLedger, AdminContractLedger.contract_id == AdminContract.id
+        ).filter(AdminContract.status == 'active').all()
+
+        # Contratti senza saldo (dati precedenti al ledger): ricalcolo mirato una tantum
+        missing = [r[0] for r in rows if r[8] is None]
+        paid_fallback = {}
+        if missing:
+            cls.rebuild(missing)
+            paid_fallback = dict(db.session.query(
+                AdminContractLedger.contract_id, AdminContractLedger.paid_total
+            ).filter(AdminContractLedger.contract_id.in_(missing)).all())
+
+        total_arr = 0
+        total_paid_from_contracts = 0
+        arr_by_plan = {'basic': 0, 'premium': 0, 'elite': 0}
+        club_stats = []
+        for (contract_id, plan_type, total_value, vat_rate, club_id, club_name,
+             club_logo_url, paid_total, _) in rows:
+            rate = vat_rate if vat_rate is not None else 22.0
+            contract_total = round(total_value + round(total_value * (rate / 100), 2), 2)
+            paid = paid_total if paid_total is not None else paid_fallback.get(contract_id, 0)
+
+            total_arr += contract_total
+            total_paid_from_contracts += paid
+            plan = cls._plan_bucket(plan_type)
+            if plan in arr_by_plan:
+                arr_by_plan[plan] += contract_total
+
+            pending = contract_total - paid
+            club_stats.append({
+                'club_id': club_id,
+                'club_name': club_name,
+                'club_logo_url': club_logo_url,
+                'plan': plan_type,
+                'contract_value': contract_total,
+                'vat_rate': rate,
+                'paid': paid,
+                'pending': max(0, pending),
+                'balance': max(0, pending)
+            })
+
+        # === Cash-in per mese (1 query GROUP BY) ===
+        month_col = extract('month', AdminInvoice.payment_date)
+        cash_in_by_month = {month: 0 for month in range(1, 13)}
+        for month, total in db.session.query(
+            month_col, func.sum(AdminInvoice.total_amount)
+        ).filter(
+            AdminInvoice.status == 'paid',
+            extract('year', AdminInvoice.payment_date) == year
+        ).group_by(month_col).all():
+            if month is not None:
+                cash_in_by_month[int(month)] = float(total or 0)
+
+        # === Scaduto e previsione 30 giorni (1 query con somme condizionali) ===
+        next_30_days = today + timedelta(days=30)
+        is_overdue = and_(AdminInvoice.status.in_(['pending', 'overdue']), AdminInvoice.due_date < today)
+        is_upcoming = and_(
+            AdminInvoice.status == 'pending',
+            AdminInvoice.due_date >= today,
+            AdminInvoice.due_date <= next_30_days
+        )
+        overdue_total, overdue_count, expected_30d = db.session.query(
+            func.coalesce(func.sum(case((is_overdue, AdminInvoice.total_amount), else_=0)), 0),
+            func.coalesce(func.sum(case((is_overdue, 1), else_=0)), 0),
+            func.coalesce(func.sum(case((is_upcoming, AdminInvoice.total_amount), else_=0)), 0),
+        ).filter(AdminInvoice.status.in_(['pending', 'overdue'])).one()
+
+        # Aggiorna status fatture scadute (UPDATE set-based: il saldo non cambia)
+        AdminInvoice.query.filter(
+            AdminInvoice.status == 'pending',
+            AdminInvoice.due_date < today
+        ).update({'status': 'overdue'}, synchronize_session=False)
+        db.session.commit()
+
+        total_pending = total_arr - total_paid_from_contracts
+        return {
+            'arr': {
+                'total': total_arr,
+                'mrr': total_arr / 12,
+                'by_plan': arr_by_plan,
+                'active_contracts': len(rows)
+            },
+            'cash_in': {
+                'year_total': sum(cash_in_by_month.values()),
+                'this_month': cash_in_by_month.get(today.month, 0),
+                'by_month': cash_in_by_month
+            },
+            'pending': {
+                'total': max(0, total_pending),
+                'count': len(rows),
+                'overdue_total': float(overdue_total),
+                'overdue_count': int(overdue_count)
+            },
+            'forecast': {
+                'expected_30_days': float(expected_30d)
+            },
+            'by_club': sorted(club_stats, key=lambda x: x['contract_value'], reverse=True),
+            'year': year
+        }
+
+
+# ------------------------------------------------------------------ listeners
+_listeners_registered = False
+
+
+def _contract_ids_for(target):
+    """contract_id corrente e, se cambiato nella flush, quello precedente"""
+    ids = {target.contract_id}
+    history = inspect(target).attrs.contract_id.history
+    ids.update(cid for cid in (history.deleted or ()) if cid is not None)
+    return ids
+
+
+def _on_invoice_write(mapper, connection, target):
+    FinanceLedgerService.refresh_contracts(connection, _contract_ids_for(target))
+
+
+def _register_listeners():
+    global _listeners_registered
+    if _listeners_registered:
+        return
+    for event_name in ('after_insert', 'after_update', 'after_delete'):
+        event.listen(AdminInvoice, event_name, _on_invoice_write)
+    _listeners_registered = True
+
+
+def init_app(app):
+    """Registra i listener che mantengono admin_contract_ledgers"""
+    _register_listeners()
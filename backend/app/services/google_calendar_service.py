@@ -1,28 +1,226 @@
+"""
+Google Calendar Service - OAuth, client API e backend eventi.
+
+Il client `calendar v3` (documento di discovery + credenziali con access
+token) viene costruito una sola volta per admin e riusato finché il refresh
+token non cambia. Le operazioni sugli eventi passano da un backend con due
+metodi, `list_changes` (syncToken/updatedMin) e `write_batch` (endpoint batch):
+GoogleCalendarBackend usa le API reali, LocalCalendarBackend è uno stand-in in
+memoria selezionabile con GOOGLE_CALENDAR_BACKEND=local (test e sviluppo).
+La sincronizzazione vera e propria è in google_calendar_sync.
+
+Le librerie Google (googleapiclient, google.oauth2, google_auth_oauthlib)
+sono importate in modo differito al primo client/flow costruito: all'avvio
+si verifica solo che siano installate.
+"""
+import importlib.util
+import itertools
 import os
-import json
+import threading
 import uuid
-from datetime import datetime, timedelta
+from collections import OrderedDict, defaultdict
+from datetime import datetime
+
+from app.lazy_imports import lazy_import
+
+google_discovery = lazy_import('googleapiclient.discovery')
+google_errors = lazy_import('googleapiclient.errors')
+google_credentials = lazy_import('google.oauth2.credentials')
+google_oauth_flow = lazy_import('google_auth_oauthlib.flow')
+
+GOOGLE_AVAILABLE = all(
+    importlib.util.find_spec(name) is not None
+    for name in ('googleapiclient', 'google_auth_oauthlib')
+)
+
+
+BACKEND = os.getenv('GOOGLE_CALENDAR_BACKEND', 'google')  # google, local
+CLIENT_CACHE_SIZE = int(os.getenv('GOOGLE_CLIENT_CACHE_SIZE', '64'))
+PAGE_SIZE = 250
+
+
+class SyncTokenExpired(Exception):
+    """Il syncToken non è più valido (HTTP 410): serve una sync completa"""
+
+
+def error_status(exc):
+    """Status HTTP di un errore API (None se non disponibile)"""
+    return getattr(getattr(exc, 'resp', None), 'status', None)
+
+
+def extract_meet_link(event):
+    link = event.get('hangoutLink')
+    if link:
+        return link
+    for ep in event.get('conferenceData', {}).get('entryPoints', []):
+        if ep.get('entryPointType') == 'video':
+            return ep.get('uri')
+    return None
+
+
+class GoogleCalendarBackend:
+    """Operazioni sugli eventi del calendario primario via googleapiclient"""
+
+    def __init__(self, service):
+        self.service = service
+
+    def list_changes(self, sync_token=None, updated_min=None, time_min=None):
+        """
+        Eventi modificati (inclusi i cancellati). Con sync_token ritorna solo
+        le modifiche successive; ritorna (items, next_sync_token).
+        """
+        params = {'calendarId': 'primary', 'singleEvents': True, 'showDeleted': True, 'maxResults': PAGE_SIZE}
+        if sync_token:
+            params['syncToken'] = sync_token
+        else:
+            if time_min:
+                params['timeMin'] = time_min.isoformat() + 'Z'
+            if updated_min:
+                params['updatedMin'] = updated_min.isoformat() + 'Z'
+
+        items = []
+        while True:
+            try:
+                result = self.service.events().list(**params).execute()
+            except google_errors.HttpError as e:
+                if error_status(e) == 410:
+                    raise SyncTokenExpired()
+                raise
+            items.extend(result.get('items', []))
+            params['pageToken'] = result.get('nextPageToken')
+            if not params['pageToken']:
+                return items, result.get('nextSyncToken')
+
+    def write_batch(self, ops):
+        """Esegue le operazioni in una sola richiesta batch. Ritorna [(op, risposta, errore)]"""
+        responses = {}
+
+        def callback(request_id, response, exception):
+            responses[int(request_id)] = (response, exception)
 
-try:
-    from google.oauth2.credentials import Credentials
-    from google_auth_oauthlib.flow import Flow
-    from googleapiclient.discovery import build
-    GOOGLE_AVAILABLE = True
-except ImportError:
-    GOOGLE_AVAILABLE = False
+        events = self.service.events()
+        batch = self.service.new_batch_http_request(callback=callback)
+        for index, op in enumerate(ops):
+            if op['action'] == 'insert':
+                request = events.insert(calendarId='primary', body=op['body'],
+                                        conferenceDataVersion=1 if op.get('meet') else 0)
+            elif op['action'] == 'update':
+                request = events.patch(calendarId='primary', eventId=op['google_event_id'], body=op['body'])
+            else:
+                request = events.delete(calendarId='primary', eventId=op['google_event_id'])
+            batch.add(request, request_id=str(index))
+        batch.execute()
+
+        return [(op, *responses.get(index, (None, RuntimeError('Nessuna risposta dal batch'))))
+                for index, op in enumerate(ops)]
+
+
+class LocalCalendarBackend:
+    """
+    Stand-in in memoria di Google Calendar: stessi metodi e stesso formato
+    eventi del backend reale, un calendario per admin, syncToken numerici.
+    """
+    _lock = threading.Lock()
+    _calendars = defaultdict(dict)  # admin_id -> {event_id: evento}
+    _floor = defaultdict(int)  # admin_id -> primo syncToken ancora valido
+    _seq = itertools.count(1)
+
+    def __init__(self, admin_id):
+        self.admin_id = admin_id
+
+    @classmethod
+    def reset(cls):
+        with cls._lock:
+            cls._calendars.clear()
+            cls._floor.clear()
+
+    @classmethod
+    def expire_tokens(cls, admin_id):
+        """Invalida i syncToken emessi finora (simula HTTP 410)"""
+        with cls._lock:
+            cls._floor[admin_id] = next(cls._seq)
+
+    def events(self):
+        with self._lock:
+            return [self._public(e) for e in self._calendars[self.admin_id].values()]
+
+    def put(self, event):
+        """Crea/modifica un evento come farebbe un altro client Google"""
+        with self._lock:
+            return self._public(self._store(dict(event)))
+
+    def _store(self, event):
+        event.setdefault('id', f'local-{uuid.uuid4().hex[:12]}')
+        event.setdefault('status', 'confirmed')
+        event['updated'] = datetime.utcnow().isoformat() + 'Z'
+        event['_seq'] = next(self._seq)
+        self._calendars[self.admin_id][event['id']] = event
+        return event
+
+    @staticmethod
+    def _public(event):
+        return {k: v for k, v in event.items() if k != '_seq'}
+
+    def list_changes(self, sync_token=None, updated_min=None, time_min=None):
+        with self._lock:
+            events = list(self._calendars[self.admin_id].values())
+            if sync_token:
+                token = int(sync_token)
+                if token < self._floor[self.admin_id]:
+                    raise SyncTokenExpired()
+                events = [e for e in events if e['_seq'] > token]
+            else:
+                if updated_min:
+                    events = [e for e in events if e['updated'] >= updated_min.isoformat()]
+                if time_min:
+                    bound = time_min.date().isoformat()
+                    events = [e for e in events if e.get('status') == 'cancelled' or
+                              (e.get('end', {}).get('dateTime') or e.get('end', {}).get('date') or '')[:10] >= bound]
+            next_token = str(max([e['_seq'] for e in self._calendars[self.admin_id].values()] + [self._floor[self.admin_id]]))
+            return [self._public(e) for e in sorted(events, key=lambda e: e['_seq'])], next_token
+
+    def write_batch(self, ops):
+        results = []
+        with self._lock:
+            calendar = self._calendars[self.admin_id]
+            for op in ops:
+                current = calendar.get(op.get('google_event_id'))
+                if op['action'] == 'insert':
+                    event = self._store({k: v for k, v in op['body'].items() if k != 'conferenceData'})
+                    if op.get('meet'):
+                        event['hangoutLink'] = f"https://meet.local/{event['id']}"
+                    results.append((op, self._public(event), None))
+                elif current is None or current.get('status') == 'cancelled':
+                    results.append((op, None, LookupError('Evento non trovato')))
+                elif op['action'] == 'update':
+                    current.update(op['body'])
+                    results.append((op, self._public(self._store(current)), None))
+                else:
+                    current['status'] = 'cancelled'
+                    self._store(current)
+                    results.append((op, {}, None))
+        return results
 
 
 class GoogleCalendarService:
     SCOPES = ['https://www.googleapis.com/auth/calendar']
 
+    _clients = OrderedDict()  # admin_id -> (refresh_token, service)
+    _clients_lock = threading.Lock()
+    _discovery_doc = None
+
     def __init__(self):
         self.client_id = os.getenv('GOOGLE_CLIENT_ID')
         self.client_secret = os.getenv('GOOGLE_CLIENT_SECRET')
         self.redirect_uri = os.getenv('GOOGLE_REDIRECT_URI', 'http://localhost:5003/api/admin/calendar/google/callback')
 
+    @property
+    def is_local(self):
+        return BACKEND == 'local'
+
     @property
     def is_configured(self):
-        return GOOGLE_AVAILABLE and bool(self.client_id and self.client_secret)
+        return self.is_local or (GOOGLE_AVAILABLE and bool(self.client_id and self.client_secret))
 
     def _get_flow(self):
         if not self.is_configured:
@@ -36,14 +234,14 @@ class GoogleCalendarService:
                 "redirect_uris": [self.redirect_uri]
             }
         }
-        flow = Flow.from_client_config(client_config, scopes=self.SCOPES)
+        flow = google_oauth_flow.Flow.from_client_config(client_config, scopes=self.SCOPES)
         flow.redirect_uri = self.redirect_uri
         return flow
 
     def _get_credentials(self, admin):
         if not admin.google_refresh_token or not self.is_configured:
             return None
-        creds = Credentials(
+        creds = google_credentials.Credentials(
             token=None,
             refresh_token=admin.google_refresh_token,
             token_uri='https://oauth2.googleapis.com/token',
@@ -53,13 +251,54 @@ class GoogleCalendarService:
         )
         return creds
 
+    @classmethod
+    def _build(cls, creds):
+        """Client calendar v3 dal documento di discovery in cache (nessun fetch per admin)"""
+        if cls._discovery_doc is None:
+            try:
+                from googleapiclient.discovery_cache import get_static_doc
+                cls._discovery_doc = get_static_doc('calendar', 'v3')
+            except ImportError:
+                pass
+        if cls._discovery_doc:
+            return google_discovery.build_from_document(cls._discovery_doc, credentials=creds)
+        return google_discovery.build('calendar', 'v3', credentials=creds, cache_discovery=False)
+
     def _get_service(self, admin):
+        """Client per admin in cache LRU: credenziali e access token restano validi tra le chiamate"""
+        with self._clients_lock:
+            cached = self._clients.get(admin.id)
+            if cached and cached[0] == admin.google_refresh_token:
+                self._clients.move_to_end(admin.id)
+                return cached[1]
+
         creds = self._get_credentials(admin)
         if not creds:
             return None
-        return build('calendar', 'v3', credentials=creds)
+        service = self._build(creds)
+        with self._clients_lock:
+            self._clients[admin.id] = (admin.google_refresh_token, service)
+            self._clients.move_to_end(admin.id)
+            while len(self._clients) > CLIENT_CACHE_SIZE:
+                self._clients.popitem(last=False)
+        return service
+
+    def invalidate(self, admin_id):
+        with self._clients_lock:
+            self._clients.pop(admin_id, None)
+
+    def backend(self, admin):
+        """Backend eventi per l'admin (None se non connesso)"""
+        if not self.is_connected(admin):
+            return None
+        if self.is_local:
+            return LocalCalendarBackend(admin.id)
+        service = self._get_service(admin)
+        return GoogleCalendarBackend(service) if service else None
 
     def get_auth_url(self, admin_id):
+        if self.is_local:
+            return f'{self.redirect_uri}?code=local&state={admin_id}'
         flow = self._get_flow()
         if not flow:
             return None
@@ -73,6 +312,10 @@ class GoogleCalendarService:
 
     def handle_callback(self, admin, code):
         from app import db
+        if self.is_local:
+            admin.google_refresh_token = f'local:{code}'
+            db.session.commit()
+            return True
         flow = self._get_flow()
         if not flow:
             return False
@@ -81,6 +324,7 @@ class GoogleCalendarService:
             credentials = flow.credentials
             admin.google_refresh_token = credentials.refresh_token
             db.session.commit()
+            self.invalidate(admin.id)
             return True
         except Exception as e:
             print(f"Google OAuth callback error: {e}")
@@ -89,172 +333,41 @@ class GoogleCalendarService:
     def is_connected(self, admin):
         return bool(admin.google_refresh_token) and self.is_configured
 
-    def create_event(self, admin, event_data, genera_meet=False):
-        """Crea evento su Google Calendar. Se genera_meet=True, aggiunge Google Meet.
-        Ritorna dict con 'google_event_id' e 'meet_link' (None se non richiesto)."""
-        service = self._get_service(admin)
-        if not service:
-            return None
-        try:
-            body = {
-                'summary': event_data.get('titolo', ''),
-                'description': event_data.get('descrizione', ''),
-                'start': {
-                    'dateTime': event_data['data_inizio'],
-                    'timeZone': 'Europe/Rome',
-                },
-                'end': {
-                    'dateTime': event_data['data_fine'],
-                    'timeZone': 'Europe/Rome',
-                },
-            }
-            if event_data.get('tutto_il_giorno'):
-                body['start'] = {'date': event_data['data_inizio'][:10]}
-                body['end'] = {'date': event_data['data_fine'][:10]}
-
-            if genera_meet:
-                body['conferenceData'] = {
-                    'createRequest': {
-                        'requestId': str(uuid.uuid4()),
-                        'conferenceSolutionKey': {
-                            'type': 'hangoutsMeet'
-                        }
+    @staticmethod
+    def event_body(event_data, genera_meet=False):
+        """Corpo evento Google da un dict con titolo/descrizione/date ISO"""
+        body = {
+            'summary': event_data.get('titolo', ''),
+            'description': event_data.get('descrizione') or '',
+            'start': {
+                'dateTime': event_data['data_inizio'],
+                'timeZone': 'Europe/Rome',
+            },
+            'end': {
+                'dateTime': event_data['data_fine'],
+                'timeZone': 'Europe/Rome',
+            },
+        }
+        if event_data.get('tutto_il_giorno'):
+            body['start'] = {'date': event_data['data_inizio'][:10]}
+            body['end'] = {'date': event_data['data_fine'][:10]}
+
+        if genera_meet:
+            body['conferenceData'] = {
+                'createRequest': {
+                    'requestId': str(uuid.uuid4()),
+                    'conferenceSolutionKey': {
+                        'type': 'hangoutsMeet'
                     }
                 }
-
-            result = service.events().insert(
-                calendarId='primary',
-                body=body,
-                conferenceDataVersion=1 if genera_meet else 0
-            ).execute()
-
-            meet_link = None
-            if genera_meet:
-                meet_link = result.get('hangoutLink')
-                if not meet_link:
-                    entry_points = result.get('conferenceData', {}).get('entryPoints', [])
-                    for ep in entry_points:
-                        if ep.get('entryPointType') == 'video':
-                            meet_link = ep.get('uri')
-                            break
-
-            return {
-                'google_event_id': result.get('id'),
-                'meet_link': meet_link
-            }
-        except Exception as e:
-            print(f"Google create event error: {e}")
-            return None
-
-    def update_event(self, admin, google_event_id, event_data):
-        service = self._get_service(admin)
-        if not service or not google_event_id:
-            return False
-        try:
-            body = {
-                'summary': event_data.get('titolo', ''),
-                'description': event_data.get('descrizione', ''),
-                'start': {
-                    'dateTime': event_data['data_inizio'],
-                    'timeZone': 'Europe/Rome',
-                },
-                'end': {
-                    'dateTime': event_data['data_fine'],
-                    'timeZone': 'Europe/Rome',
-                },
             }
-            service.events().update(calendarId='primary', eventId=google_event_id, body=body).execute()
-            return True
-        except Exception as e:
-            print(f"Google update event error: {e}")
-            return False
-
-    def delete_event(self, admin, google_event_id):
-        service = self._get_service(admin)
-        if not service or not google_event_id:
-            return False
-        try:
-            service.events().delete(calendarId='primary', eventId=google_event_id).execute()
-            return True
-        except Exception as e:
-            print(f"Google delete event error: {e}")
-            return False
-
-    def sync_events(self, admin, start, end):
-        from app import db
-        from app.models import AdminCalendarEvent
-
-        service = self._get_service(admin)
-        if not service:
-            return {'created': 0, 'updated': 0, 'deleted': 0}
-
-        stats = {'created': 0, 'updated': 0, 'deleted': 0}
-        try:
-            events_result = service.events().list(
-                calendarId='primary',
-                timeMin=start.isoformat() + 'Z',
-                timeMax=end.isoformat() + 'Z',
-                singleEvents=True,
-                orderBy='startTime',
-                maxResults=250
-            ).execute()
-            google_events = events_result.get('items', [])
-
-            existing_ids = {e.google_event_id: e for e in
-                           AdminCalendarEvent.query.filter(
-                               AdminCalendarEvent.admin_id == admin.id,
-                               AdminCalendarEvent.google_event_id.isnot(None)
-                           ).all()}
-
-            for ge in google_events:
-                ge_id = ge['id']
-                start_dt = ge.get('start', {})
-                end_dt = ge.get('end', {})
-
-                if 'dateTime' in start_dt:
-                    data_inizio = datetime.fromisoformat(start_dt['dateTime'].replace('Z', '+00:00')).replace(tzinfo=None)
-                    data_fine = datetime.fromisoformat(end_dt['dateTime'].replace('Z', '+00:00')).replace(tzinfo=None)
-                    tutto_il_giorno = False
-                elif 'date' in start_dt:
-                    data_inizio = datetime.strptime(start_dt['date'], '%Y-%m-%d')
-                    data_fine = datetime.strptime(end_dt['date'], '%Y-%m-%d')
-                    tutto_il_giorno = True
-                else:
-                    continue
-
-                if ge_id in existing_ids:
-                    ev = existing_ids[ge_id]
-                    ev.titolo = ge.get('summary', 'Senza titolo')
-                    ev.descrizione = ge.get('description', '')
-                    ev.data_inizio = data_inizio
-                    ev.data_fine = data_fine
-                    ev.tutto_il_giorno = tutto_il_giorno
-                    stats['updated'] += 1
-                else:
-                    new_event = AdminCalendarEvent(
-                        admin_id=admin.id,
-                        titolo=ge.get('summary', 'Senza titolo'),
-                        descrizione=ge.get('description', ''),
-                        tipo='appuntamento',
-                        data_inizio=data_inizio,
-                        data_fine=data_fine,
-                        tutto_il_giorno=tutto_il_giorno,
-                        google_event_id=ge_id
-                    )
-                    db.session.add(new_event)
-                    stats['created'] += 1
-
-            db.session.commit()
-        except Exception as e:
-            print(f"Google sync error: {e}")
-            db.session.rollback()
-
-        return stats
+        return body
 
     def disconnect(self, admin):
         from app import db
         admin.google_refresh_token = None
         db.session.commit()
+        self.invalidate(admin.id)
         return True
 
 
@@ -0,0 +1,545 @@
+"""
+Google Calendar Sync - outbox persistente e sincronizzazione incrementale.
+
+Le viste calendario leggono solo admin_calendar_events: nessuna richiesta
+attende Google. Le scritture (crea/modifica/elimina) sono righe di
+google_calendar_outbox aggiunte nella stessa transazione della modifica
+locale: un crash non le perde e ogni worker vede la stessa coda. Dopo il
+commit la richiesta avvia l'invio della coda dell'admin in un thread, che la
+compatta per evento e la invia con l'endpoint batch; id Google e link Meet
+vengono salvati sull'evento (e sulla prenotazione demo collegata) all'arrivo
+della risposta. Le scritture che servono subito alla risposta (prenotazione
+demo, evento con Meet) sono consegnate inline. Il job (AutomationScheduler)
+riprova le righe rimaste in coda (lease occupato, errori Google).
+
+Ogni GOOGLE_SYNC_INTERVAL secondi, o su richiesta, le modifiche remote sono
+lette con il syncToken salvato in google_calendar_sync_state. Se Google non
+restituisce un token si usa updatedMin dall'ultima sync; con token scaduto
+(HTTP 410) si riparte da una sync completa della finestra. Gli eventi remoti
+sono scritti con upsert su (admin_id, google_event_id), indice unico.
+
+Invio e sync di un admin avvengono sotto un lease su google_calendar_sync_state
+(lease_owner/lease_until): un solo processo alla volta, anche con più worker.
+
+Con GOOGLE_SYNC_ENABLED=false scritture e sync sono eseguite subito (es. test).
+"""
+import os
+import socket
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager, nullcontext
+from datetime import datetime, timedelta
+
+from flask import has_app_context
+from sqlalchemy import or_
+
+from app.services.google_calendar_service import (
+    google_calendar_service, SyncTokenExpired, error_status, extract_meet_link
+)
+from app.sql_upsert import upsert
+
+
+SYNC_INTERVAL = float(os.getenv('GOOGLE_SYNC_INTERVAL', '300'))
+LEASE_SECONDS = int(os.getenv('GOOGLE_SYNC_LEASE', '120'))
+BATCH_SIZE = 50  # richieste per batch (limite consigliato Calendar API)
+OUTBOX_CHUNK = 500  # righe outbox lette per admin a ogni giro
+MAX_ATTEMPTS = 3
+FULL_SYNC_DAYS = 30  # giorni passati importati dalla sync completa
+UPDATED_MIN_MARGIN = timedelta(minutes=5)
+LOOKUP_CHUNK = 500
+
+
+def parse_event_times(ge):
+    """(data_inizio, data_fine, tutto_il_giorno) di un evento Google; None se senza date"""
+    start_dt = ge.get('start', {})
+    end_dt = ge.get('end', {})
+    if 'dateTime' in start_dt:
+        return (
+            datetime.fromisoformat(start_dt['dateTime'].replace('Z', '+00:00')).replace(tzinfo=None),
+            datetime.fromisoformat(end_dt['dateTime'].replace('Z', '+00:00')).replace(tzinfo=None),
+            False
+        )
+    if 'date' in start_dt:
+        return (
+            datetime.strptime(start_dt['date'], '%Y-%m-%d'),
+            datetime.strptime(end_dt['date'], '%Y-%m-%d'),
+            True
+        )
+    return None
+
+
+def _event_data(event):
+    return {
+        'titolo': event.titolo,
+        'descrizione': event.descrizione,
+        'data_inizio': event.data_inizio.isoformat(),
+        'data_fine': event.data_fine.isoformat(),
+        'tutto_il_giorno': event.tutto_il_giorno,
+    }
+
+
+class GoogleCalendarSyncEngine:
+
+    def __init__(self):
+        self.app = None
+        self._enabled = os.getenv('GOOGLE_SYNC_ENABLED', 'true').lower() == 'true'
+
+    def init_app(self, app):
+        self.app = app
+
+    def _context(self):
+        return nullcontext() if has_app_context() else self.app.app_context()
+
+    # ------------------------------------------------------------------ outbox
+    def push_create(self, admin, event, genera_meet=False):
+        """
+        Accoda la creazione su Google di un evento locale. La riga entra nella
+        transazione corrente: il chiamante fa commit insieme all'evento.
+        """
+        if admin and google_calendar_service.is_connected(admin):
+            self._enqueue(admin.id, event, 'insert',
+                          body=google_calendar_service.event_body(_event_data(event), genera_meet=genera_meet),
+                          meet=genera_meet)
+
+    def push_update(self, admin, event):
+        if admin and google_calendar_service.is_connected(admin):
+            self._enqueue(admin.id, event, 'update',
+                          google_event_id=event.google_event_id,
+                          body=google_calendar_service.event_body(_event_data(event)))
+
+    def push_delete(self, admin, event_id, google_event_id):
+        if admin and google_calendar_service.is_connected(admin):
+            self._enqueue(admin.id, None, 'delete', event_id=event_id, google_event_id=google_event_id)
+
+    @staticmethod
+    def _enqueue(admin_id, event, action, event_id=None, google_event_id=None, body=None, meet=False):
+        from app import db
+        from app.models import GoogleCalendarOutbox
+
+        if event is not None and event.id is None:
+            db.session.flush()  # id dell'evento appena creato
+        db.session.add(GoogleCalendarOutbox(
+            admin_id=admin_id,
+            event_id=event.id if event is not None else event_id,
+            google_event_id=google_event_id,
+            action=action,
+            body=body,
+            meet=meet,
+        ))
+
+    def pending_count(self, admin_id):
+        from app.models import GoogleCalendarOutbox
+        return GoogleCalendarOutbox.query.filter_by(admin_id=admin_id).count()
+
+    def deliver(self, admin_id, urgent=False):
+        """
+        Da chiamare dopo il commit della modifica: invia la coda dell'admin.
+        Con urgent (id Google o link Meet servono nella risposta) o sync
+        disattivata l'invio è inline, altrimenti in un thread. Se un altro
+        processo la sta già inviando, o Google non risponde, le righe restano
+        in outbox e il job le riprova.
+        """
+        if admin_id is None:
+            return False
+        if urgent or not self._enabled:
+            return self.process_admin(admin_id) is not None
+        self._in_background(admin_id)
+        return True
+
+    def _in_background(self, admin_id, sync=False, full=False):
+        """process_admin in un thread con il proprio app context (e sessione)"""
+        if self.app is None:
+            return
+        threading.Thread(target=self.process_admin, args=(admin_id,),
+                         kwargs={'sync': sync, 'full': full}, daemon=True).start()
+
+    @staticmethod
+    def _fold(rows):
+        """
+        Compatta le righe per evento, in ordine di inserimento. Ritorna
+        (operazioni da inviare, righe da scartare senza invio).
+        """
+        ops = OrderedDict()
+        dropped = []
+        for row in rows:
+            key = row.event_id or f"g:{row.google_event_id}"
+            op = {
+                'action': row.action,
+                'event_id': row.event_id,
+                'google_event_id': row.google_event_id,
+                'body': row.body,
+                'meet': row.meet,
+                'rows': [row],
+            }
+            previous = ops.get(key)
+            if previous is not None:
+                op['rows'] = previous['rows'] + op['rows']
+                if previous['action'] == 'insert':
+                    if row.action == 'delete':
+                        # Creato ed eliminato prima dell'invio: niente da fare su Google
+                        dropped.extend(op['rows'])
+                        del ops[key]
+                        continue
+                    # La modifica si fonde nella creazione non ancora inviata
+                    conference = (previous['body'] or {}).get('conferenceData')
+                    op.update(action='insert', google_event_id=None, meet=previous['meet'],
+                              body=dict(row.body or {}, **({'conferenceData': conference} if conference else {})))
+                else:
+                    op['google_event_id'] = row.google_event_id or previous['google_event_id']
+            if op['action'] == 'delete' and not op['google_event_id'] and previous is None:
+                dropped.extend(op['rows'])  # mai arrivato su Google
+                continue
+            ops[key] = op
+        return list(ops.values()), dropped
+
+    @staticmethod
+    def _resolve_ids(ops):
+        """
+        Id Google per modifiche accodate prima che la creazione tornasse.
+        Ritorna (operazioni inviabili, righe senza evento Google da scartare).
+        """
+        from app.models import AdminCalendarEvent
+        missing = [op['event_id'] for op in ops if op['action'] != 'insert' and not op['google_event_id']]
+        if missing:
+            ids = dict(AdminCalendarEvent.query.with_entities(
+                AdminCalendarEvent.id, AdminCalendarEvent.google_event_id
+            ).filter(AdminCalendarEvent.id.in_(missing)).all())
+            for op in ops:
+                if op['action'] != 'insert' and not op['google_event_id']:
+                    op['google_event_id'] = ids.get(op['event_id'])
+        ready, dropped = [], []
+        for op in ops:
+            if op['action'] == 'insert' or op['google_event_id']:
+                ready.append(op)
+            else:
+                dropped.extend(op['rows'])
+        return ready, dropped
+
+    def _flush_outbox(self, admin_id, backend):
+        """Invia un blocco di outbox dell'admin (sotto lease). Ritorna il numero di operazioni inviate."""
+        from app import db
+        from app.models import GoogleCalendarOutbox
+
+        rows = GoogleCalendarOutbox.query.filter_by(admin_id=admin_id).order_by(
+            GoogleCalendarOutbox.id
+        ).limit(OUTBOX_CHUNK).all()
+        if not rows:
+            return 0
+
+        ops, dropped = self._fold(rows)
+        ops, unresolved = self._resolve_ids(ops)
+        for row in dropped + unresolved:
+            db.session.delete(row)
+
+        for i in range(0, len(ops), BATCH_SIZE):
+            chunk = ops[i:i + BATCH_SIZE]
+            try:
+                results = backend.write_batch(chunk)
+            except Exception as e:
+                print(f"[GoogleSync] Batch fallito per admin {admin_id}: {e}")
+                results = [(op, None, e) for op in chunk]
+            self._apply_results(admin_id, results)
+        db.session.commit()
+        return len(ops)
+
+    @staticmethod
+    def _apply_results(admin_id, results):
+        """Salva id Google e link Meet delle creazioni; toglie dall'outbox le righe concluse"""
+        from app import db
+        from app.models import AdminCalendarEvent, GoogleCalendarOutbox
+
+        created = {}
+        for op, response, error in results:
+            if error is None or (op['action'] in ('update', 'delete') and (
+                    isinstance(error, LookupError) or error_status(error) in (404, 410))):
+                # Inviata, o già eliminata su Google
+                if error is None and op['action'] == 'insert':
+                    created[op['event_id']] = response
+                for row in op['rows']:
+                    db.session.delete(row)
+                continue
+
+            print(f"[GoogleSync] {op['action']} evento {op['event_id']} fallito: {error}")
+            for row in op['rows']:
+                row.tentativi = (row.tentativi or 0) + 1
+                row.last_error = str(error)[:1000]
+            if max(row.tentativi for row in op['rows']) >= MAX_ATTEMPTS:
+                print(f"[GoogleSync] Operazione {op['action']} evento {op['event_id']} scartata dopo {MAX_ATTEMPTS} tentativi")
+                for row in op['rows']:
+                    db.session.delete(row)
+
+        if created:
+            events = {e.id: e for e in AdminCalendarEvent.query.filter(AdminCalendarEvent.id.in_(created)).all()}
+            for event_id, response in created.items():
+                event = events.get(event_id)
+                if event is None:
+                    # Eliminato in locale mentre la creazione era in volo
+                    db.session.add(GoogleCalendarOutbox(
+                        admin_id=admin_id, action='delete', google_event_id=response.get('id')
+                    ))
+                    continue
+                event.google_event_id = response.get('id')
+                meet_link = extract_meet_link(response)
+                if meet_link:
+                    event.meet_link = meet_link
+                if event.booking:
+                    event.booking.google_event_id = event.google_event_id
+                    if meet_link:
+                        event.booking.meet_link = meet_link
+
+    # ------------------------------------------------------------------ lease
+    @staticmethod
+    def _owner():
+        return f"{socket.gethostname()}:{os.getpid()}:{threading.get_ident()}"
+
+    def _acquire(self, admin_id):
+        """Prende il lease dell'admin se libero o scaduto (UPDATE condizionale + commit)"""
+        from app import db
+        from app.models import GoogleCalendarSyncState
+
+        table = GoogleCalendarSyncState.__table__
+        now = datetime.utcnow()
+        owner = self._owner()
+        upsert(db.session.connection(), table,
+               keys={'admin_id': admin_id},
+               insert_values={'updated_at': now},
+               update_values={'admin_id': table.c.admin_id})
+        result = db.session.execute(table.update().where(
+            table.c.admin_id == admin_id,
+            or_(table.c.lease_until.is_(None), table.c.lease_until < now, table.c.lease_owner == owner)
+        ).values(lease_owner=owner, lease_until=now + timedelta(seconds=LEASE_SECONDS)))
+        db.session.commit()
+        return result.rowcount == 1
+
+    def _release(self, admin_id):
+        from app import db
+        from app.models import GoogleCalendarSyncState
+
+        table = GoogleCalendarSyncState.__table__
+        db.session.rollback()
+        db.session.execute(table.update().where(
+            table.c.admin_id == admin_id, table.c.lease_owner == self._owner()
+        ).values(lease_owner=None, lease_until=None))
+        db.session.commit()
+
+    @contextmanager
+    def _lease(self, admin_id):
+        acquired = self._acquire(admin_id)
+        try:
+            yield acquired
+        finally:
+            if acquired:
+                try:
+                    self._release(admin_id)
+                except Exception as e:
+                    print(f"[GoogleSync] Rilascio lease admin {admin_id} fallito: {e}")
+
+    # ------------------------------------------------------------------ job
+    def process_admin(self, admin_id, sync=False, full=False):
+        """
+        Sotto lease: invia l'outbox dell'admin e, con sync, legge le modifiche
+        remote. Ritorna le statistiche della sync ({} senza sync) o None se
+        il lease è di un altro processo o l'admin non è connesso.
+        """
+        from app import db
+        from app.models import Admin
+
+        with self._context():
+            try:
+                admin = Admin.query.get(admin_id)
+                backend = google_calendar_service.backend(admin) if admin else None
+                if backend is None:
+                    return None
+                with self._lease(admin_id) as acquired:
+                    if not acquired:
+                        return None
+                    try:
+                        self._flush_outbox(admin_id, backend)
+                    except Exception as e:
+                        db.session.rollback()
+                        print(f"[GoogleSync] Invio outbox admin {admin_id} fallito: {e}")
+                    if not sync:
+                        return {}
+                    return self._sync(admin_id, backend, full)
+            except Exception as e:
+                db.session.rollback()
+                print(f"[GoogleSync] Admin {admin_id}: {e}")
+                return None
+
+    def run(self):
+        """
+        Giro del job (AutomationScheduler): outbox in attesa e sync scadute o
+        richieste, un admin alla volta sotto lease.
+        """
+        from app import db
+        from app.models import Admin, GoogleCalendarOutbox, GoogleCalendarSyncState
+
+        if self.app is None or not google_calendar_service.is_configured:
+            return
+        with self._context():
+            due = datetime.utcnow() - timedelta(seconds=SYNC_INTERVAL)
+            states = {s.admin_id: s for s in GoogleCalendarSyncState.query.all()}
+            with_outbox = {admin_id for (admin_id,) in db.session.query(GoogleCalendarOutbox.admin_id).distinct()}
+            admin_ids = [row.id for row in Admin.query.with_entities(Admin.id).filter(
+                Admin.google_refresh_token.isnot(None)
+            ).all()]
+            plan = []
+            for admin_id in admin_ids:
+                state = states.get(admin_id)
+                full = bool(state and state.sync_completa_richiesta)
+                sync = (state is None or full or bool(state.sync_richiesta)
+                        or state.last_sync_at is None or state.last_sync_at <= due)
+                if sync or admin_id in with_outbox:
+                    plan.append((admin_id, sync, full))
+            db.session.rollback()
+
+        for admin_id, sync, full in plan:
+            self.process_admin(admin_id, sync=sync, full=full)
+
+    # ------------------------------------------------------------------ lettura incrementale
+    def request_sync(self, admin_id, full=False):
+        """
+        Sync su richiesta. L'incrementale (o qualunque sync con sync
+        disattivata) è eseguita subito e ritorna le statistiche. La completa,
+        o se un altro processo ha il lease, è segnata sullo stato, avviata in
+        un thread e ritorna None: se il lease è ancora occupato la esegue il
+        job al giro successivo.
+        """
+        if not full or not self._enabled:
+            stats = self.process_admin(admin_id, sync=True, full=full)
+            if stats is not None:
+                return stats
+        self._mark_requested(admin_id, full)
+        self._in_background(admin_id, sync=True, full=full)
+        return None
+
+    def _mark_requested(self, admin_id, full):
+        from app import db
+        from app.models import GoogleCalendarSyncState
+
+        table = GoogleCalendarSyncState.__table__
+        values = {'sync_richiesta': True}
+        if full:
+            values['sync_completa_richiesta'] = True
+        with self._context():
+            upsert(db.session.connection(), table,
+                   keys={'admin_id': admin_id},
+                   insert_values=dict(values, updated_at=datetime.utcnow()),
+                   update_values=values)
+            db.session.commit()
+
+    def _sync(self, admin_id, backend, full=False):
+        """Applica le modifiche remote dall'ultima sync (sotto lease). Ritorna le statistiche o None."""
+        from app import db
+        from app.models import GoogleCalendarSyncState
+
+        state = GoogleCalendarSyncState.query.get(admin_id)
+        now = datetime.utcnow()
+        full = full or bool(state.sync_completa_richiesta) or not (state.sync_token or state.last_sync_at)
+        window_start = now - timedelta(days=FULL_SYNC_DAYS)
+
+        try:
+            try:
+                if full:
+                    items, token = backend.list_changes(time_min=window_start)
+                elif state.sync_token:
+                    items, token = backend.list_changes(sync_token=state.sync_token)
+                else:
+                    items, token = backend.list_changes(updated_min=state.last_sync_at - UPDATED_MIN_MARGIN)
+            except SyncTokenExpired:
+                print(f"[GoogleSync] syncToken scaduto per admin {admin_id}, sync completa")
+                full = True
+                items, token = backend.list_changes(time_min=window_start)
+
+            stats = self._apply_changes(admin_id, items)
+            state.sync_token = token
+            state.last_sync_at = now
+            if full:
+                state.last_full_sync_at = now
+            state.sync_richiesta = False
+            state.sync_completa_richiesta = False
+            state.last_error = None
+            state.creati, state.aggiornati, state.eliminati = stats['created'], stats['updated'], stats['deleted']
+            db.session.commit()
+            return stats
+        except Exception as e:
+            db.session.rollback()
+            print(f"[GoogleSync] Sync admin {admin_id} fallita: {e}")
+            try:
+                state = GoogleCalendarSyncState.query.get(admin_id)
+                state.last_error = str(e)[:1000]
+                db.session.commit()
+            except Exception:
+                db.session.rollback()
+            return None
+
+    @staticmethod
+    def _apply_changes(admin_id, items):
+        from app import db
+        from app.models import AdminCalendarEvent
+
+        stats = {'created': 0, 'updated': 0, 'deleted': 0}
+        latest = {}
+        for ge in items:
+            latest[ge['id']] = ge  # ultima versione per evento
+
+        google_ids = list(latest)
+        existing = {}
+        for i in range(0, len(google_ids), LOOKUP_CHUNK):
+            for event in AdminCalendarEvent.query.filter(
+                AdminCalendarEvent.admin_id == admin_id,
+                AdminCalendarEvent.google_event_id.in_(google_ids[i:i + LOOKUP_CHUNK])
+            ).all():
+                existing[event.google_event_id] = event
+
+        events = AdminCalendarEvent.__table__
+        for ge_id, ge in latest.items():
+            event = existing.get(ge_id)
+            if ge.get('status') == 'cancelled':
+                if event is not None:
+                    db.session.delete(event)
+                    stats['deleted'] += 1
+                continue
+
+            times = parse_event_times(ge)
+            if times is None:
+                continue
+            values = {
+                'titolo': ge.get('summary', 'Senza titolo'),
+                'descrizione': ge.get('description', ''),
+                'data_inizio': times[0],
+                'data_fine': times[1],
+                'tutto_il_giorno': times[2],
+            }
+
+            if event is None:
+                # Upsert sull'indice unico: un evento importato altrove nel
+                # frattempo viene aggiornato, non duplicato
+                upsert(db.session.connection(), events,
+                       keys={'admin_id': admin_id, 'google_event_id': ge_id},
+                       insert_values=dict(values, tipo='appuntamento'),
+                       update_values=dict(values, updated_at=datetime.utcnow()))
+                stats['created'] += 1
+            elif any(getattr(event, field) != value for field, value in values.items()):
+                # Le nostre stesse scritture tornano indietro invariate e non contano
+                for field, value in values.items():
+                    setattr(event, field, value)
+                stats['updated'] += 1
+        return stats
+
+    def forget(self, admin_id):
+        """Scarta scritture in coda e stato sync di un admin disconnesso"""
+        from app import db
+        from app.models import GoogleCalendarOutbox, GoogleCalendarSyncState
+        with self._context():
+            GoogleCalendarOutbox.query.filter_by(admin_id=admin_id).delete()
+            GoogleCalendarSyncState.query.filter_by(admin_id=admin_id).delete()
+            db.session.commit()
+
+
+# Istanza globale
+google_calendar_sync = GoogleCalendarSyncEngine()
+
+
+def init_app(app):
+    google_calendar_sync.init_app(app)
@@ -0,0 +1,387 @@
+"""
+Inventory Catalog Service - read model del catalogo asset del club.
+
+La lista asset è paginata a keyset (ordine, nome, id) con cursore opaco, i
+pricing tier sono caricati con una sola query per pagina e le statistiche
+(totali, disponibili, valore) sono calcolate in SQL sull'intero filtro. La
+ricerca usa la colonna normalizzata inventory_assets.search_text, mantenuta
+dagli eventi ORM. Senza ?limit la lista usa INVENTORY_PAGE_SIZE.
+
+Le risposte sono in cache per club con un numero di versione salvato in
+cache_versions: ogni flush che scrive asset, categorie, pricing, allocazioni,
+package o esclusività del club incrementa la versione nella stessa
+transazione, e ogni lettura dalla cache la confronta con quella nel database
+(lookup per chiave primaria). Una modifica fatta su un worker rende quindi
+subito non valide le copie in cache degli altri worker.
+"""
+import base64
+import json
+import os
+import re
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from datetime import datetime
+from itertools import chain
+
+from sqlalchemy import func, case, or_, and_, event
+from sqlalchemy.orm import selectinload
+
+from app import db
+from app.models import (
+    InventoryCategory, InventoryAsset, AssetPricingTier, AssetAllocation,
+    AssetPackage, CategoryExclusivity, CacheVersion
+)
+from app.sql_upsert import upsert
+
+
+CACHE_TTL = int(os.getenv('INVENTORY_CACHE_TTL', '60'))
+CACHE_MAX_ENTRIES = 512
+DEFAULT_PAGE_SIZE = int(os.getenv('INVENTORY_PAGE_SIZE', '100'))
+MAX_PAGE_SIZE = 200
+SEARCH_TEXT_MAX = 4000
+
+
+def normalize_search(text):
+    """Minuscolo, senza accenti e spazi multipli (stessa forma di search_text)"""
+    text = unicodedata.normalize('NFKD', text or '')
+    text = ''.join(c for c in text if not unicodedata.combining(c))
+    return re.sub(r'\s+', ' ', text.lower()).strip()
+
+
+def build_search_text(asset):
+    parts = [asset.nome, asset.descrizione_breve, asset.posizione, asset.tags, asset.descrizione]
+    return normalize_search(' '.join(p for p in parts if p))[:SEARCH_TEXT_MAX]
+
+
+class CatalogCache:
+    """
+    Cache LRU per club invalidata per versione (thread-safe).
+
+    Con `scope` la versione del club è la riga (scope, club_id) di
+    cache_versions: bump() la incrementa nella transazione della scrittura e
+    get()/version() la rileggono dal database, così l'invalidazione vale per
+    tutti i processi. Senza scope la versione è solo locale al processo
+    (invalidate() dopo il commit). Il TTL limita la memoria e, per le cache
+    locali, la durata delle copie non aggiornate negli altri processi.
+    """
+
+    def __init__(self, scope=None, ttl=CACHE_TTL, max_entries=CACHE_MAX_ENTRIES):
+        self.scope = scope
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._versions = {}
+        self._entries = OrderedDict()
+
+    def version(self, club_id):
+        """Versione corrente del club (0 se mai modificato)"""
+        if self.scope is None:
+            with self._lock:
+                return self._versions.get(club_id, 0)
+        versions = CacheVersion.__table__
+        return db.session.execute(
+            db.select(versions.c.version).where(
+                versions.c.scope == self.scope, versions.c.club_id == club_id
+            )
+        ).scalar() or 0
+
+    def get(self, club_id, key):
+        current = self.version(club_id)
+        with self._lock:
+            entry = self._entries.get((club_id, key))
+            if entry is None:
+                return None
+            version, ts, data = entry
+            if version != current or time.time() - ts >= self.ttl:
+                del self._entries[(club_id, key)]
+                return None
+            self._entries.move_to_end((club_id, key))
+            return data
+
+    def set(self, club_id, key, data, version):
+        """Salva `data` calcolato dopo aver letto `version` (una scrittura successiva la rende non valida)"""
+        with self._lock:
+            if self.scope is None and version != self._versions.get(club_id, 0):
+                return  # scrittura avvenuta durante il calcolo: non salvare
+            self._entries[(club_id, key)] = (version, time.time(), data)
+            self._entries.move_to_end((club_id, key))
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, club_ids):
+        """Invalida i club in questo processo (cache senza scope, dopo il commit)"""
+        with self._lock:
+            for club_id in club_ids:
+                self._versions[club_id] = self._versions.get(club_id, 0) + 1
+            for key in [k for k in self._entries if k[0] in club_ids]:
+                del self._entries[key]
+
+    def bump(self, connection, club_ids):
+        """Incrementa la versione dei club nella transazione corrente (visibile al commit)"""
+        versions = CacheVersion.__table__
+        now = datetime.utcnow()
+        for club_id in sorted(club_ids):
+            upsert(
+                connection, versions,
+                keys={'scope': self.scope, 'club_id': club_id},
+                insert_values={'version': 1, 'updated_at': now},
+                update_values={'version': versions.c.version + 1, 'updated_at': now},
+            )
+
+    def listen(self, collect_club_ids):
+        """
+        Registra un after_flush che incrementa la versione dei club restituiti
+        da collect_club_ids(session): una rollback annulla anche l'incremento.
+        """
+        def _bump_after_flush(session, flush_context):
+            club_ids = set(collect_club_ids(session))
+            club_ids.discard(None)
+            if club_ids:
+                self.bump(session.connection(), club_ids)
+
+        event.listen(db.session, 'after_flush', _bump_after_flush)
+
+
+catalog_cache = CatalogCache('inventory')
+
+
+class InventoryCatalogService:
+
+    # ------------------------------------------------------------------ cursor
+    @staticmethod
+    def encode_cursor(asset):
+        raw = json.dumps([asset.ordine or 0, asset.nome, asset.id])
+        return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii')
+
+    @staticmethod
+    def decode_cursor(cursor):
+        """Ritorna (ordine, nome, id); ValueError se il cursore non è valido"""
+        try:
+            ordine, nome, asset_id = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+            return int(ordine), str(nome), int(asset_id)
+        except Exception:
+            raise ValueError('Cursore non valido')
+
+    # ------------------------------------------------------------------ query
+    @staticmethod
+    def _filtered_query(club_id, filters):
+        query = InventoryAsset.query.filter_by(club_id=club_id, attivo=True)
+
+        archived = filters.get('archived', 'exclude')
+        if archived == 'only':
+            query = query.filter_by(archiviato=True)
+        elif archived != 'include':
+            query = query.filter(or_(InventoryAsset.archiviato == False, InventoryAsset.archiviato == None))
+
+        if filters.get('category_id'):
+            query = query.filter_by(category_id=filters['category_id'])
+        if filters.get('tipo'):
+            query = query.filter_by(tipo=filters['tipo'])
+        for flag in ('disponibile', 'in_evidenza', 'visibile_marketplace'):
+            if filters.get(flag) is not None:
+                query = query.filter(getattr(InventoryAsset, flag) == filters[flag])
+
+        # Ogni parola deve comparire nel testo normalizzato
+        for term in normalize_search(filters.get('search')).split()[:5]:
+            escaped = term.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+            query = query.filter(InventoryAsset.search_text.like(f'%{escaped}%', escape='\\'))
+        return query
+
+    @staticmethod
+    def _category_dicts(club_id):
+        """Categorie del club con conteggio asset (1 query + 1 GROUP BY)"""
+        counts = dict(db.session.query(
+            InventoryAsset.category_id, func.count(InventoryAsset.id)
+        ).filter(InventoryAsset.club_id == club_id).group_by(InventoryAsset.category_id).all())
+        categories = InventoryCategory.query.filter_by(club_id=club_id).order_by(InventoryCategory.ordine).all()
+        return {c.id: c.to_dict(assets_count=counts.get(c.id, 0)) for c in categories}
+
+    # ------------------------------------------------------------------ assets
+    @classmethod
+    def list_assets(cls, club_id, filters, limit=None, cursor=None):
+        """
+        Pagina di asset (limit, default DEFAULT_PAGE_SIZE) con il cursore
+        successivo e le statistiche sull'intero filtro.
+        """
+        position = cls.decode_cursor(cursor) if cursor else None
+        limit = max(1, min(limit or DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE))
+
+        cache_key = ('assets', tuple(sorted(filters.items())), limit, cursor)
+        cached = catalog_cache.get(club_id, cache_key)
+        if cached is not None:
+            return cached
+        version = catalog_cache.version(club_id)
+
+        query = cls._filtered_query(club_id, filters)
+
+        total, available, total_value = query.with_entities(
+            func.count(InventoryAsset.id),
+            func.coalesce(func.sum(case((InventoryAsset.disponibile == True, 1), else_=0)), 0),
+            func.coalesce(func.sum(InventoryAsset.prezzo_listino), 0),
+        ).order_by(None).one()
+
+        ordine = func.coalesce(InventoryAsset.ordine, 0)
+        page = query.options(selectinload(InventoryAsset.pricing_tiers)).order_by(
+            ordine, InventoryAsset.nome, InventoryAsset.id
+        )
+        if position:
+            last_ordine, last_nome, last_id = position
+            page = page.filter(or_(
+                ordine > last_ordine,
+                and_(ordine == last_ordine, InventoryAsset.nome > last_nome),
+                and_(ordine == last_ordine, InventoryAsset.nome == last_nome, InventoryAsset.id > last_id)
+            ))
+
+        assets = page.limit(limit + 1).all()
+        has_more = len(assets) > limit
+        assets = assets[:limit]
+
+        categories = cls._category_dicts(club_id) if assets else {}
+        result = {
+            'assets': [a.to_dict(include_pricing=True, category=categories.get(a.category_id)) for a in assets],
+            'stats': {
+                'total': int(total),
+                'available': int(available),
+                'total_value': float(total_value)
+            },
+            'pagination': {
+                'limit': limit,
+                'has_more': has_more,
+                'next_cursor': cls.encode_cursor(assets[-1]) if has_more else None
+            }
+        }
+        catalog_cache.set(club_id, cache_key, result, version)
+        return result
+
+    # ------------------------------------------------------------------ stats
+    @classmethod
+    def stats(cls, club_id):
+        """Statistiche inventario (stessa forma di /inventory/stats) con aggregati SQL"""
+        cached = catalog_cache.get(club_id, ('stats',))
+        if cached is not None:
+            return cached
+        version = catalog_cache.version(club_id)
+
+        not_archived = or_(InventoryAsset.archiviato == False, InventoryAsset.archiviato == None)
+        available = and_(not_archived, InventoryAsset.disponibile == True)
+        price = func.coalesce(InventoryAsset.prezzo_listino, 0)
+
+        total_assets, available_assets, archived_assets, total_value, available_value = db.session.query(
+            func.coalesce(func.sum(case((not_archived, 1), else_=0)), 0),
+            func.coalesce(func.sum(case((available, 1), else_=0)), 0),
+            func.coalesce(func.sum(case((InventoryAsset.archiviato == True, 1), else_=0)), 0),
+            func.coalesce(func.sum(case((not_archived, price), else_=0)), 0),
+            func.coalesce(func.sum(case((available, price), else_=0)), 0),
+        ).filter(InventoryAsset.club_id == club_id, InventoryAsset.attivo == True).one()
+        total_assets, available_assets = int(total_assets), int(available_assets)
+
+        active_allocations, allocation_value = db.session.query(
+            func.count(AssetAllocation.id),
+            func.coalesce(func.sum(AssetAllocation.prezzo_concordato), 0)
+        ).filter(AssetAllocation.club_id == club_id, AssetAllocation.status == 'attiva').one()
+
+        # Per categoria (archiviati inclusi, come in precedenza)
+        is_available = InventoryAsset.disponibile == True
+        per_category = {
+            row.category_id: row for row in db.session.query(
+                InventoryAsset.category_id.label('category_id'),
+                func.count(InventoryAsset.id).label('total'),
+                func.coalesce(func.sum(case((is_available, 1), else_=0)), 0).label('available'),
+                func.coalesce(func.sum(price), 0).label('total_value'),
+                func.coalesce(func.sum(case((is_available, price), else_=0)), 0).label('available_value'),
+            ).filter(
+                InventoryAsset.club_id == club_id, InventoryAsset.attivo == True
+            ).group_by(InventoryAsset.category_id).all()
+        }
+        categories = cls._category_dicts(club_id)
+        by_category = []
+        for category in InventoryCategory.query.filter_by(club_id=club_id, attivo=True).all():
+            row = per_category.get(category.id)
+            by_category.append({
+                'category': categories.get(category.id) or category.to_dict(),
+                'total_assets': int(row.total) if row else 0,
+                'available_assets': int(row.available) if row else 0,
+                'total_value': float(row.total_value) if row else 0,
+                'available_value': float(row.available_value) if row else 0
+            })
+
+        total_exclusivities, assigned_exclusivities = db.session.query(
+            func.count(CategoryExclusivity.id),
+            func.coalesce(func.sum(case((CategoryExclusivity.attiva == True, 1), else_=0)), 0)
+        ).filter(CategoryExclusivity.club_id == club_id).one()
+
+        total_packages, packages_sold = db.session.query(
+            func.count(AssetPackage.id),
+            func.coalesce(func.sum(AssetPackage.vendite_attuali), 0)
+        ).filter(AssetPackage.club_id == club_id, AssetPackage.attivo == True).one()
+
+        result = {
+            'inventory': {
+                'total_assets': total_assets,
+                'available_assets': available_assets,
+                'archived_assets': int(archived_assets),
+                'occupancy_rate': round((total_assets - available_assets) / total_assets * 100, 1) if total_assets > 0 else 0,
+                'total_value': float(total_value),
+                'available_value': float(available_value),
+                'allocated_value': float(allocation_value)
+            },
+            'allocations': {
+                'active': active_allocations,
+                'total_value': float(allocation_value)
+            },
+            'exclusivities': {
+                'total': total_exclusivities,
+                'assigned': int(assigned_exclusivities),
+                'available': total_exclusivities - int(assigned_exclusivities)
+            },
+            'packages': {
+                'total': total_packages,
+                'sold': int(packages_sold)
+            },
+            'by_category': by_category
+        }
+        catalog_cache.set(club_id, ('stats',), result, version)
+        return result
+
+
+# ------------------------------------------------------------------ listeners
+_listeners_registered = False
+_CLUB_SCOPED = (InventoryAsset, InventoryCategory, AssetAllocation, AssetPackage, CategoryExclusivity)
+
+
+def _set_search_text(mapper, connection, target):
+    target.search_text = build_search_text(target)
+
+
+def _dirty_clubs(session):
+    """Club toccati dalla flush (i pricing tier risalgono al club dall'asset)"""
+    club_ids = set()
+    asset_ids = set()
+    for obj in chain(session.new, session.dirty, session.deleted):
+        if isinstance(obj, _CLUB_SCOPED):
+            club_ids.add(obj.club_id)
+        elif isinstance(obj, AssetPricingTier):
+            asset_ids.add(obj.asset_id)
+    if asset_ids:
+        assets = InventoryAsset.__table__
+        club_ids.update(cid for (cid,) in session.connection().execute(
+            db.select(assets.c.club_id).where(assets.c.id.in_(asset_ids))
+        ))
+    return club_ids
+
+
+def _register_listeners():
+    global _listeners_registered
+    if _listeners_registered:
+        return
+    event.listen(InventoryAsset, 'before_insert', _set_search_text)
+    event.listen(InventoryAsset, 'before_update', _set_search_text)
+    catalog_cache.listen(_dirty_clubs)
+    _listeners_registered = True
+
+
+def init_app(app):
+    """Registra i listener per search_text e per l'invalidazione della cache catalogo"""
+    _register_listeners()
@@ -5,17 +5,28 @@ Servizio notifiche automatiche per Marketplace Opportunità
 - Reminder collaborazioni
 """
 
+from sqlalchemy import and_, exists, select
+
 from app import db
 from app.models import (
     MarketplaceOpportunity, OpportunityApplication, OpportunityCollaboration,
     Sponsor, Club, Notification
 )
+from app.services.notification_fanout import NotificationFanout
 from datetime import datetime, timedelta
 
 
 class MarketplaceNotificationService:
     """Gestione notifiche automatiche marketplace"""
 
+    @staticmethod
+    def _sponsor_audience(opportunity):
+        """Select degli sponsor destinatari (il creator sponsor è escluso)"""
+        audience = select(Sponsor.id)
+        if opportunity.creator_type == 'sponsor':
+            audience = audience.where(Sponsor.id != opportunity.creator_id)
+        return audience
+
     @staticmethod
     def notify_new_opportunity(opportunity_id):
         """
@@ -24,7 +35,7 @@ class MarketplaceNotificationService:
         """
         opportunity = MarketplaceOpportunity.query.get(opportunity_id)
         if not opportunity or opportunity.stato != 'pubblicata':
-            return
+            return 0
 
         # Trova sponsor potenzialmente interessati
         # TODO: Implementare matching algorithm basato su:
@@ -32,23 +43,18 @@ class MarketplaceNotificationService:
         # - Location vs area geografica sponsor
         # - Budget range compatibile
 
-        # Per ora: notifica tutti gli sponsor (broadcast)
-        sponsors = Sponsor.query.all()
-
-        for sponsor in sponsors:
-            # Skip se è il creator
-            if opportunity.creator_type == 'sponsor' and opportunity.creator_id == sponsor.id:
-                continue
-
-            Notification.create_notification(
-                user_type='sponsor',
-                user_id=sponsor.id,
-                tipo='nuova_opportunita',
-                titolo='Nuova opportunità disponibile',
-                messaggio=f'Nuova opportunità "{opportunity.titolo}" - {opportunity.tipo_opportunita}',
-                link_url=f'/marketplace/discover/{opportunity.id}',
-                priorita='normale'
-            )
+        # Per ora: notifica tutti gli sponsor (broadcast), una sola volta per opportunità
+        return NotificationFanout.send(
+            MarketplaceNotificationService._sponsor_audience(opportunity),
+            user_type='sponsor',
+            tipo='nuova_opportunita',
+            titolo='Nuova opportunità disponibile',
+            messaggio=f'Nuova opportunità "{opportunity.titolo}" - {opportunity.tipo_opportunita}',
+            link_url=f'/marketplace/discover/{opportunity.id}',
+            oggetto_type='opportunity',
+            oggetto_id=opportunity.id,
+            priorita='normale'
+        )
 
     @staticmethod
     def notify_deadline_approaching(days_before=3):
@@ -56,44 +62,44 @@ class MarketplaceNotificationService:
         Notifica per deadline candidature in scadenza
         Args:
             days_before: giorni prima della deadline per notificare
+
+        Ogni sponsor non ancora candidato riceve al più una notifica per
+        opportunità dentro la finestra di days_before giorni dalla deadline.
         """
-        threshold_date = datetime.utcnow() + timedelta(days=days_before)
+        now = datetime.utcnow()
+        threshold_date = now + timedelta(days=days_before)
 
         # Trova opportunità con deadline tra oggi e threshold_date
         opportunities = MarketplaceOpportunity.query.filter(
             MarketplaceOpportunity.stato == 'pubblicata',
             MarketplaceOpportunity.deadline_candidature.isnot(None),
             MarketplaceOpportunity.deadline_candidature <= threshold_date,
-            MarketplaceOpportunity.deadline_candidature > datetime.utcnow()
+            MarketplaceOpportunity.deadline_candidature > now
         ).all()
 
+        sent = 0
         for opp in opportunities:
-            # Notifica sponsor che hanno visualizzato ma non candidato
-            # Per semplicità: notifica tutti gli sponsor
-            sponsors = Sponsor.query.all()
-
-            for sponsor in sponsors:
-                # Skip se è il creator
-                if opp.creator_type == 'sponsor' and opp.creator_id == sponsor.id:
-                    continue
-
-                # Check se già candidato
-                existing_app = OpportunityApplication.query.filter_by(
-                    opportunity_id=opp.id,
-                    applicant_id=sponsor.id
-                ).first()
-
-                if not existing_app:
-                    days_left = (opp.deadline_candidature - datetime.utcnow()).days
-                    Notification.create_notification(
-                        user_type='sponsor',
-                        user_id=sponsor.id,
-                        tipo='deadline_candidature',
-                        titolo=f'Deadline in scadenza: {opp.titolo}',
-                        messaggio=f'Mancano solo {days_left} giorni per candidarti!',
-                        link_url=f'/marketplace/discover/{opp.id}',
-                        priorita='alta' if days_left <= 1 else 'normale'
-                    )
+            # Per semplicità: tutti gli sponsor che non si sono già candidati (anti-join)
+            applied = exists().where(and_(
+                OpportunityApplication.opportunity_id == opp.id,
+                OpportunityApplication.applicant_id == Sponsor.id
+            ))
+            audience = MarketplaceNotificationService._sponsor_audience(opp).where(~applied)
+
+            days_left = (opp.deadline_candidature - now).days
+            sent += NotificationFanout.send(
+                audience,
+                user_type='sponsor',
+                tipo='deadline_candidature',
+                titolo=f'Deadline in scadenza: {opp.titolo}',
+                messaggio=f'Mancano solo {days_left} giorni per candidarti!',
+                link_url=f'/marketplace/discover/{opp.id}',
+                oggetto_type='opportunity',
+                oggetto_id=opp.id,
+                priorita='alta' if days_left <= 1 else 'normale',
+                since=opp.deadline_candidature - timedelta(days=days_before)
+            )
+        return sent
 
     @staticmethod
     def notify_application_update(application_id, stato):
@@ -236,7 +242,8 @@ class MarketplaceNotificationService:
         """
         Cron job: Controlla deadline in scadenza (da eseguire giornalmente)
         """
-        # Notifiche 7, 3, 1 giorni prima
+        # Notifiche 7, 3, 1 giorni prima (una per finestra: il dedup salta i
+        # destinatari già notificati dall'inizio della finestra)
         MarketplaceNotificationService.notify_deadline_approaching(days_before=7)
         MarketplaceNotificationService.notify_deadline_approaching(days_before=3)
         MarketplaceNotificationService.notify_deadline_approaching(days_before=1)
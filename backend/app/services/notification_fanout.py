@@ -0,0 +1,186 @@
+"""
+Notification Fanout - invio di una stessa notifica ad audience numerose.
+
+L'audience è una select di id destinatari (es. sponsor non candidati a
+un'opportunità) risolta con un'unica query; nella stessa query un anti-join
+esclude chi ha già ricevuto la notifica (stesso tipo e oggetto, opzionalmente
+a partire da una data), coperto dall'indice ix_notifications_dedup. Le righe
+Notification sono inserite a blocchi con INSERT multipli e ogni blocco, dopo
+il commit, è pubblicato in un solo passaggio sui canali real-time in processo
+(notification_hub) da cui legge lo stream SSE.
+"""
+import os
+import queue
+import threading
+from collections import defaultdict
+from datetime import datetime
+
+from sqlalchemy import and_, exists, insert
+
+from app import db
+from app.models import Notification
+
+
+CHUNK_SIZE = int(os.getenv('NOTIFICATION_FANOUT_CHUNK', '500'))
+SUBSCRIBER_QUEUE_SIZE = 100
+
+
+class NotificationHub:
+    """Canali real-time in processo: (user_type, user_id) -> code dei subscriber SSE"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._channels = defaultdict(set)
+
+    def subscribe(self, user_type, user_id):
+        channel = queue.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+        with self._lock:
+            self._channels[(user_type, user_id)].add(channel)
+        return channel
+
+    def unsubscribe(self, user_type, user_id, channel):
+        with self._lock:
+            subscribers = self._channels.get((user_type, user_id))
+            if subscribers:
+                subscribers.discard(channel)
+                if not subscribers:
+                    del self._channels[(user_type, user_id)]
+
+    def publish_batch(self, items):
+        """
+        items: [(user_type, user_id, payload)]. Ogni subscriber riceve un'unica
+        lista con i propri payload; se la sua coda è piena il batch viene scartato
+        (lo stream lo recupera con il polling sul database).
+        """
+        grouped = defaultdict(list)
+        for user_type, user_id, payload in items:
+            grouped[(user_type, user_id)].append(payload)
+
+        with self._lock:
+            targets = [(list(self._channels[key]), payloads)
+                       for key, payloads in grouped.items() if key in self._channels]
+
+        delivered = 0
+        for subscribers, payloads in targets:
+            for channel in subscribers:
+                try:
+                    channel.put_nowait(payloads)
+                    delivered += 1
+                except queue.Full:
+                    pass
+        return delivered
+
+
+notification_hub = NotificationHub()
+
+
+def stream_payload(notification_id, values):
+    """Payload di una notifica (id + dict delle colonne inserite) per lo stream SSE"""
+    return {
+        'id': notification_id,
+        'tipo': values['tipo'],
+        'titolo': values['titolo'],
+        'messaggio': values['messaggio'],
+        'link': values.get('link'),
+        'priorita': values.get('priorita') or 'normale',
+        'created_at': values['created_at'].isoformat(),
+    }
+
+
+class NotificationFanout:
+    """Calcolo audience, dedup, insert a blocchi e pubblicazione real-time"""
+
+    @staticmethod
+    def already_notified(user_type, user_id, tipo, oggetto_type, oggetto_id, since=None):
+        """
+        Condizione EXISTS: il destinatario ha già la notifica (tipo, oggetto)
+        [da `since`]. user_id e oggetto_id possono essere valori o colonne
+        della query esterna (anti-join con ~).
+        """
+        conditions = [
+            Notification.oggetto_type == oggetto_type,
+            Notification.oggetto_id == oggetto_id,
+            Notification.tipo == tipo,
+            Notification.user_type == user_type,
+            Notification.user_id == user_id,
+        ]
+        if since is not None:
+            conditions.append(Notification.created_at >= since)
+        return exists().where(and_(*conditions))
+
+    @staticmethod
+    def insert_rows(rows, chunk_size=None):
+        """
+        Inserisce righe Notification (dict di colonne) con un INSERT multiplo
+        per blocco, senza commit. Ritorna [(id, riga)] da pubblicare dopo il commit.
+        """
+        chunk_size = chunk_size or CHUNK_SIZE
+        statement = insert(Notification).returning(Notification.id, sort_by_parameter_order=True)
+        inserted = []
+        for start in range(0, len(rows), chunk_size):
+            chunk = rows[start:start + chunk_size]
+            ids = db.session.execute(statement, chunk).scalars().all()
+            inserted.extend(zip(ids, chunk))
+        return inserted
+
+    @staticmethod
+    def publish(inserted):
+        """Pubblica sui canali real-time notifiche già committate ([(id, riga)])"""
+        if inserted:
+            notification_hub.publish_batch([
+                (values['user_type'], values['user_id'], stream_payload(notification_id, values))
+                for notification_id, values in inserted
+            ])
+
+    @classmethod
+    def send(cls, audience, user_type, tipo, titolo, messaggio, link_url=None,
+             oggetto_type=None, oggetto_id=None, priorita='normale', since=None, chunk_size=None):
+        """
+        Invia la notifica agli id restituiti da `audience` (select di una colonna
+        id destinatario). Con oggetto_type/oggetto_id valorizzati i destinatari
+        già notificati (da `since`, se indicato) sono esclusi nella stessa query.
+        Ogni blocco è committato e pubblicato separatamente.
+        Ritorna il numero di notifiche create.
+        """
+        if oggetto_type is not None and oggetto_id is not None:
+            column = audience.selected_columns[0]
+            audience = audience.where(~cls.already_notified(
+                user_type, column, tipo, oggetto_type, oggetto_id, since
+            ))
+        recipient_ids = db.session.execute(audience.distinct()).scalars().all()
+        if not recipient_ids:
+            return 0
+
+        chunk_size = chunk_size or CHUNK_SIZE
+        common = {
+            'user_type': user_type,
+            'tipo': tipo,
+            'titolo': titolo,
+            'messaggio': messaggio,
+            'link': link_url,
+            'oggetto_type': oggetto_type,
+            'oggetto_id': oggetto_id,
+            'priorita': priorita,
+            'letta': False,
+        }
+
+        created = 0
+        for start in range(0, len(recipient_ids), chunk_size):
+            chunk = recipient_ids[start:start + chunk_size]
+            # created_at per blocco, vicino al suo commit: il poll SSE sul
+            # database (created_at con finestra di overlap) non salta i blocchi successivi
+            created_at = datetime.utcnow()
+            try:
+                inserted = cls.insert_rows([dict(common, user_id=user_id, created_at=created_at) for user_id in chunk],
+                                           chunk_size)
+                db.session.commit()
+            except Exception as e:
+                db.session.rollback()
+                # I blocchi già inviati restano: un nuovo invio li esclude col dedup
+                print(f"[NotificationFanout] {tipo}: errore nel blocco {start}-{start + len(chunk)}: {e}")
+                break
+            created += len(inserted)
+            cls.publish(inserted)
+
+        print(f"[NotificationFanout] {tipo}: {created} notifiche inviate")
+        return created
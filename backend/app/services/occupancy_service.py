@@ -0,0 +1,286 @@
+"""
+Occupancy Service - disponibilità e occupazione di asset inventario e diritti.
+
+Per un club e un intervallo di date carica con una query gli asset (o diritti),
+con una query le allocazioni attive che si sovrappongono all'intervallo e con
+una query i periodi non disponibili. Per ogni elemento costruisce una timeline
+a segmenti (sweep line sui giorni) da cui ricava libero/occupato, percentuale
+di utilizzo, giorni pieni, primo periodo libero e disponibilità per giornata
+di gara, senza query per singolo elemento.
+"""
+from bisect import bisect_right
+from collections import defaultdict
+from datetime import date, datetime, timedelta
+
+from sqlalchemy import or_
+
+from app.models import (
+    InventoryAsset, AssetAvailability, AssetAllocation,
+    Right, RightAvailability, RightAllocation, Match
+)
+
+
+MAX_RANGE_DAYS = 1100  # ~3 stagioni
+
+
+def season_range(stagione):
+    """'2024-2025' -> (1 luglio 2024, 30 giugno 2025)"""
+    try:
+        first = int(str(stagione).split('-')[0])
+    except (TypeError, ValueError):
+        raise ValueError('Stagione non valida')
+    return date(first, 7, 1), date(first + 1, 6, 30)
+
+
+class OccupancyTimeline:
+    """Carico giornaliero di un elemento come lista di segmenti [inizio, fine, carico]"""
+
+    def __init__(self, capacity, start, end):
+        self.capacity = max(1, capacity or 1)
+        self.start = start.toordinal()
+        self.end = end.toordinal()
+        self._deltas = defaultdict(int)
+        self._segments = None
+
+    def add(self, start, end, quantity=1):
+        s = max(start.toordinal(), self.start)
+        e = min(end.toordinal(), self.end)
+        if s > e or not quantity:
+            return
+        self._deltas[s] += quantity
+        self._deltas[e + 1] -= quantity
+        self._segments = None
+
+    def block(self, start, end):
+        """Periodo non disponibile: occupa tutta la capacità"""
+        self.add(start, end, self.capacity)
+
+    @property
+    def segments(self):
+        if self._segments is None:
+            segments = []
+            load = 0
+            cursor = self.start
+            for day in sorted(self._deltas):
+                if day > cursor:
+                    segments.append((cursor, min(day - 1, self.end), load))
+                    cursor = day
+                load += self._deltas[day]
+                if cursor > self.end:
+                    break
+            if cursor <= self.end:
+                segments.append((cursor, self.end, load))
+            self._segments = segments
+        return self._segments
+
+    @property
+    def days(self):
+        return self.end - self.start + 1
+
+    @property
+    def max_load(self):
+        return max(load for _, _, load in self.segments)
+
+    def is_free(self, quantity=1):
+        return self.max_load + quantity <= self.capacity
+
+    def utilization(self):
+        used = sum(min(load, self.capacity) * (e - s + 1) for s, e, load in self.segments)
+        return round(used / (self.capacity * self.days) * 100, 1)
+
+    def full_days(self):
+        return sum(e - s + 1 for s, e, load in self.segments if load >= self.capacity)
+
+    def first_free_window(self, quantity=1, min_days=1):
+        """Primo periodo continuo di almeno min_days giorni con `quantity` unità libere"""
+        segments = self.segments
+        run_start = None
+        for index, (s, e, load) in enumerate(segments):
+            if load + quantity > self.capacity:
+                run_start = None
+                continue
+            if run_start is None:
+                run_start = s
+            if e - run_start + 1 >= min_days:
+                # Estende il periodo fin dove resta libero
+                run_end = e
+                for _, e2, load2 in segments[index + 1:]:
+                    if load2 + quantity > self.capacity:
+                        break
+                    run_end = e2
+                return date.fromordinal(run_start), date.fromordinal(run_end)
+        return None
+
+    def free_on(self, days, quantity=1):
+        """Bitset ('1' libero, '0' occupato) per le date indicate"""
+        starts = [s for s, _, _ in self.segments]
+        bits = []
+        for day in days:
+            ordinal = day.toordinal()
+            if ordinal < self.start or ordinal > self.end:
+                bits.append('0')
+                continue
+            load = self.segments[bisect_right(starts, ordinal) - 1][2]
+            bits.append('1' if load + quantity <= self.capacity else '0')
+        return ''.join(bits)
+
+
+class OccupancyService:
+
+    @staticmethod
+    def match_days(club_id, start, end):
+        """Giornate di gara in casa del club nell'intervallo"""
+        rows = Match.query.with_entities(Match.data_ora).filter(
+            Match.club_id == club_id,
+            Match.luogo == 'casa',
+            or_(Match.status == None, Match.status != 'annullata'),
+            Match.data_ora >= datetime.combine(start, datetime.min.time()),
+            Match.data_ora < datetime.combine(end + timedelta(days=1), datetime.min.time())
+        ).order_by(Match.data_ora).all()
+        return sorted({row.data_ora.date() for row in rows})
+
+    @staticmethod
+    def _load_assets(club_id, start, end, ids=None, category_id=None):
+        query = InventoryAsset.query.with_entities(
+            InventoryAsset.id, InventoryAsset.nome, InventoryAsset.category_id,
+            InventoryAsset.quantita_totale, InventoryAsset.disponibile
+        ).filter(
+            InventoryAsset.club_id == club_id,
+            InventoryAsset.attivo == True,
+            or_(InventoryAsset.archiviato == False, InventoryAsset.archiviato == None)
+        )
+        if ids:
+            query = query.filter(InventoryAsset.id.in_(ids))
+        if category_id:
+            query = query.filter(InventoryAsset.category_id == category_id)
+        items = {
+            row.id: {'id': row.id, 'nome': row.nome, 'category_id': row.category_id,
+                     'capacita': row.quantita_totale or 1, 'disponibile': row.disponibile}
+            for row in query.order_by(InventoryAsset.ordine, InventoryAsset.nome).all()
+        }
+        if not items:
+            return items, [], []
+
+        allocations = AssetAllocation.query.with_entities(
+            AssetAllocation.asset_id, AssetAllocation.data_inizio, AssetAllocation.data_fine,
+            AssetAllocation.quantita
+        ).filter(
+            AssetAllocation.club_id == club_id,
+            AssetAllocation.asset_id.in_(items.keys()),
+            AssetAllocation.status == 'attiva',
+            AssetAllocation.data_inizio <= end,
+            AssetAllocation.data_fine >= start
+        ).all()
+        blocked = AssetAvailability.query.with_entities(
+            AssetAvailability.asset_id, AssetAvailability.data_inizio, AssetAvailability.data_fine
+        ).filter(
+            AssetAvailability.club_id == club_id,
+            AssetAvailability.asset_id.in_(items.keys()),
+            AssetAvailability.disponibile == False,
+            AssetAvailability.data_inizio <= end,
+            AssetAvailability.data_fine >= start
+        ).all()
+        return items, [(a.asset_id, a.data_inizio, a.data_fine, a.quantita or 1) for a in allocations], blocked
+
+    @staticmethod
+    def _load_rights(club_id, start, end, ids=None, category_id=None):
+        query = Right.query.with_entities(
+            Right.id, Right.nome, Right.category_id, Right.esclusivo,
+            Right.max_allocazioni, Right.disponibile
+        ).filter(Right.club_id == club_id, Right.attivo == True)
+        if ids:
+            query = query.filter(Right.id.in_(ids))
+        if category_id:
+            query = query.filter(Right.category_id == category_id)
+        items = {
+            row.id: {'id': row.id, 'nome': row.nome, 'category_id': row.category_id,
+                     'capacita': 1 if row.esclusivo else (row.max_allocazioni or 1),
+                     'disponibile': row.disponibile}
+            for row in query.order_by(Right.ordine, Right.nome).all()
+        }
+        if not items:
+            return items, [], []
+
+        allocations = RightAllocation.query.with_entities(
+            RightAllocation.right_id, RightAllocation.data_inizio, RightAllocation.data_fine
+        ).filter(
+            RightAllocation.club_id == club_id,
+            RightAllocation.right_id.in_(items.keys()),
+            RightAllocation.status == 'attiva',
+            RightAllocation.data_inizio <= end,
+            RightAllocation.data_fine >= start
+        ).all()
+        blocked = RightAvailability.query.with_entities(
+            RightAvailability.right_id, RightAvailability.data_inizio, RightAvailability.data_fine
+        ).filter(
+            RightAvailability.club_id == club_id,
+            RightAvailability.right_id.in_(items.keys()),
+            RightAvailability.disponibile == False,
+            RightAvailability.data_inizio <= end,
+            RightAvailability.data_fine >= start
+        ).all()
+        return items, [(a.right_id, a.data_inizio, a.data_fine, 1) for a in allocations], blocked
+
+    @classmethod
+    def occupancy(cls, club_id, start, end, kind='assets', ids=None, category_id=None,
+                  quantity=1, min_days=None, include_match_days=False):
+        """
+        Occupazione degli asset (kind='assets') o diritti (kind='rights') del
+        club tra start ed end inclusi.
+        """
+        if end < start:
+            raise ValueError('Intervallo date non valido')
+        if (end - start).days + 1 > MAX_RANGE_DAYS:
+            raise ValueError(f'Intervallo massimo {MAX_RANGE_DAYS} giorni')
+        quantity = max(1, quantity or 1)
+        min_days = max(1, min_days or (end - start).days + 1)
+
+        loader = cls._load_rights if kind == 'rights' else cls._load_assets
+        items, allocations, blocked = loader(club_id, start, end, ids=ids, category_id=category_id)
+
+        timelines = {item_id: OccupancyTimeline(item['capacita'], start, end) for item_id, item in items.items()}
+        for item_id, data_inizio, data_fine, qty in allocations:
+            timelines[item_id].add(data_inizio, data_fine, qty)
+        for item_id, data_inizio, data_fine in blocked:
+            timelines[item_id].block(data_inizio, data_fine)
+
+        match_days = cls.match_days(club_id, start, end) if include_match_days else None
+
+        results = []
+        for item_id, item in items.items():
+            timeline = timelines[item_id]
+            window = timeline.first_free_window(quantity, min_days)
+            entry = dict(item)
+            entry.update({
+                'libero': timeline.is_free(quantity),
+                'carico_massimo': timeline.max_load,
+                'utilizzo_percentuale': timeline.utilization(),
+                'giorni_pieni': timeline.full_days(),
+                'primo_periodo_libero': {
+                    'data_inizio': window[0].isoformat(),
+                    'data_fine': window[1].isoformat()
+                } if window else None
+            })
+            if match_days is not None:
+                entry['giornate_libere'] = timeline.free_on(match_days, quantity)
+            results.append(entry)
+
+        free_count = sum(1 for r in results if r['libero'])
+        return {
+            'kind': 'rights' if kind == 'rights' else 'assets',
+            'periodo': {
+                'data_inizio': start.isoformat(),
+                'data_fine': end.isoformat(),
+                'giorni': (end - start).days + 1
+            },
+            'quantita': quantity,
+            'durata_minima_giorni': min_days,
+            'giornate': [d.isoformat() for d in match_days] if match_days is not None else None,
+            'items': results,
+            'summary': {
+                'totale': len(results),
+                'liberi': free_count,
+                'occupati': len(results) - free_count,
+                'utilizzo_medio': round(sum(r['utilizzo_percentuale'] for r in results) / len(results), 1) if results else 0
+            }
+        }
@@ -0,0 +1,235 @@
+"""
+Phone Directory Service - rubrica dei telefoni CRM per WhatsApp.
+
+I telefoni di Club, Lead e ContactPerson sono normalizzati in E.164
+(normalize_phone) e tenuti in phone_directory (numero -> entità) dai listener
+ORM: a ogni insert/update/delete di un'entità la sua riga viene riscritta
+sulla connessione della flush. Il proprietario di un numero WhatsApp si trova
+con una lookup sull'indice del numero, una lista di chat si risolve con una
+sola query IN e l'elenco contatti è paginato a keyset (nome, id) senza
+caricare le tre tabelle sorgente.
+"""
+import base64
+import json
+import os
+import re
+from collections import defaultdict
+from datetime import datetime
+
+from sqlalchemy import and_, event, inspect, or_
+
+from app import db
+from app.models import Club, Lead, ContactPerson, PhoneDirectoryEntry
+
+
+DEFAULT_COUNTRY_CODE = os.getenv('PHONE_DEFAULT_COUNTRY_CODE', '39')
+MAX_PAGE_SIZE = 500
+
+_NON_DIGITS = re.compile(r'\D')
+_ITALIAN_MOBILE = re.compile(r'^3\d{8,9}$')
+
+
+def normalize_phone(raw, default_country=DEFAULT_COUNTRY_CODE):
+    """
+    Numero (o chat id WhatsApp '39333...@c.us') in E.164 ('+39333...'); None
+    se non valido. Senza prefisso internazionale: i cellulari italiani
+    (3xxxxxxxxx) e i numeri che iniziano con 0 ricevono il prefisso di default,
+    le altre cifre sono considerate già complete di prefisso (come i chat id).
+    """
+    if not raw:
+        return None
+    text = str(raw).strip().split('@', 1)[0]
+    international = text.startswith('+') or text.startswith('00')
+    digits = _NON_DIGITS.sub('', text)
+    if text.startswith('00'):
+        digits = digits[2:]
+    if not international and (_ITALIAN_MOBILE.match(digits) or digits.startswith('0')):
+        digits = default_country + digits
+    if not 8 <= len(digits) <= 15 or digits.startswith('0'):
+        return None
+    return '+' + digits
+
+
+# Sorgenti indicizzate: modello -> (tipo, campi osservati, valori della riga)
+SOURCES = {
+    Club: ('club', ('telefono', 'nome', 'email'),
+           lambda c: {'nome': c.nome, 'email': c.email, 'ruolo': None}),
+    Lead: ('lead', ('telefono', 'ragione_sociale', 'email'),
+           lambda l: {'nome': l.ragione_sociale, 'email': l.email, 'ruolo': None}),
+    ContactPerson: ('contatto', ('telefono', 'nome', 'cognome', 'email', 'ruolo'),
+                    lambda cp: {'nome': f'{cp.nome} {cp.cognome}', 'email': cp.email, 'ruolo': cp.ruolo}),
+}
+# Ordine dei proprietari di uno stesso numero (il contatto è il più specifico)
+OWNER_PRIORITY = {'contatto': 0, 'lead': 1, 'club': 2}
+
+
+def _entry_values(entity_type, entity_id, telefono, values):
+    return {
+        'entity_type': entity_type,
+        'entity_id': entity_id,
+        'telefono': telefono.strip(),
+        'phone_e164': normalize_phone(telefono),
+        'nome': (values['nome'] or '')[:300],
+        'email': values['email'],
+        'ruolo': values['ruolo'],
+        'updated_at': datetime.utcnow(),
+    }
+
+
+class PhoneDirectoryService:
+
+    # ------------------------------------------------------------------ scrittura
+    @staticmethod
+    def sync_entity(connection, entity_type, entity_id, telefono=None, values=None):
+        """Riscrive la riga di un'entità (telefono vuoto o entità eliminata = nessuna riga)"""
+        entries = PhoneDirectoryEntry.__table__
+        connection.execute(entries.delete().where(and_(
+            entries.c.entity_type == entity_type, entries.c.entity_id == entity_id
+        )))
+        if telefono and telefono.strip():
+            connection.execute(entries.insert().values(**_entry_values(entity_type, entity_id, telefono, values)))
+
+    @staticmethod
+    def rebuild():
+        """Ricostruisce da zero la rubrica dalle tabelle sorgente e fa commit"""
+        PhoneDirectoryEntry.query.delete(synchronize_session=False)
+        rows = []
+        for model, (entity_type, _, values) in SOURCES.items():
+            for obj in model.query.filter(model.telefono.isnot(None), model.telefono != '').all():
+                rows.append(_entry_values(entity_type, obj.id, obj.telefono, values(obj)))
+        if rows:
+            db.session.execute(PhoneDirectoryEntry.__table__.insert(), rows)
+        db.session.commit()
+        return len(rows)
+
+    # ------------------------------------------------------------------ lettura
+    @staticmethod
+    def to_dict(entry):
+        data = {
+            'tipo': entry.entity_type,
+            'id': entry.entity_id,
+            'nome': entry.nome,
+            'telefono': entry.telefono,
+            'phone_e164': entry.phone_e164,
+            'email': entry.email or '',
+        }
+        if entry.entity_type == 'contatto':
+            data['ruolo'] = entry.ruolo or ''
+        return data
+
+    @classmethod
+    def owners(cls, phone):
+        """Entità CRM con questo numero (contatti, poi lead, poi club)"""
+        normalized = normalize_phone(phone)
+        if not normalized:
+            return []
+        entries = PhoneDirectoryEntry.query.filter_by(phone_e164=normalized).all()
+        entries.sort(key=lambda e: (OWNER_PRIORITY.get(e.entity_type, 9), e.entity_id))
+        return [cls.to_dict(e) for e in entries]
+
+    @classmethod
+    def resolve_chats(cls, chat_ids):
+        """{chat_id: [proprietari]} per una lista di chat/numeri, con una sola query"""
+        by_phone = defaultdict(list)
+        for chat_id in chat_ids:
+            normalized = normalize_phone(chat_id)
+            if normalized:
+                by_phone[normalized].append(chat_id)
+        resolved = {chat_id: [] for chat_id in chat_ids}
+        if not by_phone:
+            return resolved
+
+        entries = PhoneDirectoryEntry.query.filter(PhoneDirectoryEntry.phone_e164.in_(list(by_phone))).all()
+        entries.sort(key=lambda e: (OWNER_PRIORITY.get(e.entity_type, 9), e.entity_id))
+        for entry in entries:
+            owner = cls.to_dict(entry)
+            for chat_id in by_phone[entry.phone_e164]:
+                resolved[chat_id].append(owner)
+        return resolved
+
+    @staticmethod
+    def encode_cursor(entry):
+        raw = json.dumps([entry.nome, entry.id])
+        return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii')
+
+    @staticmethod
+    def decode_cursor(cursor):
+        """Ritorna (nome, id); ValueError se il cursore non è valido"""
+        try:
+            nome, entry_id = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+            return str(nome), int(entry_id)
+        except Exception:
+            raise ValueError('Cursore non valido')
+
+    @classmethod
+    def list_contacts(cls, tipo=None, search=None, limit=None, cursor=None):
+        """
+        Contatti con telefono ordinati per (nome, id). Senza limit ritorna tutto
+        l'elenco; con limit una pagina e il cursore della successiva.
+        """
+        query = PhoneDirectoryEntry.query
+        if tipo:
+            query = query.filter(PhoneDirectoryEntry.entity_type == tipo)
+        if search:
+            term = search.strip()
+            escaped = term.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+            conditions = [PhoneDirectoryEntry.nome.ilike(f'%{escaped}%', escape='\\'),
+                          PhoneDirectoryEntry.telefono.like(f'%{escaped}%', escape='\\')]
+            digits = _NON_DIGITS.sub('', term)
+            if len(digits) >= 3:
+                conditions.append(PhoneDirectoryEntry.phone_e164.like(f'%{digits}%'))
+            query = query.filter(or_(*conditions))
+        if cursor:
+            nome, entry_id = cls.decode_cursor(cursor)
+            query = query.filter(or_(
+                PhoneDirectoryEntry.nome > nome,
+                and_(PhoneDirectoryEntry.nome == nome, PhoneDirectoryEntry.id > entry_id)
+            ))
+        query = query.order_by(PhoneDirectoryEntry.nome, PhoneDirectoryEntry.id)
+
+        if not limit:
+            return [cls.to_dict(e) for e in query.all()], None
+
+        limit = max(1, min(int(limit), MAX_PAGE_SIZE))
+        entries = query.limit(limit + 1).all()
+        next_cursor = cls.encode_cursor(entries[limit - 1]) if len(entries) > limit else None
+        return [cls.to_dict(e) for e in entries[:limit]], next_cursor
+
+
+# ------------------------------------------------------------------ listeners
+_listeners_registered = False
+
+
+def _make_listeners(model):
+    entity_type, fields, values = SOURCES[model]
+
+    def on_insert(mapper, connection, target):
+        if target.telefono:
+            PhoneDirectoryService.sync_entity(connection, entity_type, target.id, target.telefono, values(target))
+
+    def on_update(mapper, connection, target):
+        attrs = inspect(target).attrs
+        if any(attrs[field].history.has_changes() for field in fields):
+            PhoneDirectoryService.sync_entity(connection, entity_type, target.id, target.telefono, values(target))
+
+    def on_delete(mapper, connection, target):
+        PhoneDirectoryService.sync_entity(connection, entity_type, target.id)
+
+    return on_insert, on_update, on_delete
+
+
+def _register_listeners():
+    global _listeners_registered
+    if _listeners_registered:
+        return
+    for model in SOURCES:
+        on_insert, on_update, on_delete = _make_listeners(model)
+        event.listen(model, 'after_insert', on_insert)
+        event.listen(model, 'after_update', on_update)
+        event.listen(model, 'after_delete', on_delete)
+    _listeners_registered = True
+
+
+def init_app(app):
+    """Registra i listener che mantengono phone_directory"""
+    _register_listeners()
@@ -0,0 +1,250 @@
+"""
+Principal Service - risoluzione unificata dell'identità JWT.
+
+Risolve una sola volta per richiesta ruolo, tenant (club_id) e account
+dell'utente autenticato e li memorizza in flask.g. I dati risolti sono
+mantenuti in una cache LRU con TTL breve, chiave (role, id, iat), invalidata
+dagli eventi SQLAlchemy quando l'account (o il club) cambia.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+from flask import g, has_request_context
+from flask_jwt_extended import get_jwt, decode_token
+
+
+class Principal:
+    """Identità dell'utente corrente: dati risolti + oggetti caricati on-demand"""
+
+    def __init__(self, data, objects=None):
+        self.role = data.get('role')
+        self.identity = data.get('identity')
+        self.user_id = data.get('user_id')
+        self.club_id = data.get('club_id')
+        self.membership_id = data.get('membership_id')
+        self.auth_type = data.get('auth_type')
+        self.name = data.get('name')
+        self.email = data.get('email')
+        self.is_active = data.get('is_active', False)
+        self._objects = dict(objects or {})
+
+    @property
+    def is_admin(self):
+        return self.role == 'admin'
+
+    @property
+    def is_club(self):
+        return self.role == 'club'
+
+    @property
+    def is_sponsor(self):
+        return self.role == 'sponsor'
+
+    def _load(self, key, model, pk):
+        if pk is None:
+            return None
+        if key not in self._objects:
+            from app import db
+            self._objects[key] = db.session.get(model, pk)
+        return self._objects[key]
+
+    @property
+    def account(self):
+        """Admin, ClubUser, SponsorAccount o Sponsor legacy in base al ruolo"""
+        from app.models import Admin, ClubUser, SponsorAccount
+        if self.role == 'admin':
+            return self._load('account', Admin, self.user_id)
+        if self.role == 'club':
+            return self._load('account', ClubUser, self.user_id)
+        if self.role == 'sponsor':
+            if self.auth_type == 'legacy':
+                return self.membership
+            return self._load('account', SponsorAccount, self.user_id)
+        return None
+
+    @property
+    def club(self):
+        from app.models import Club
+        return self._load('club', Club, self.club_id)
+
+    @property
+    def membership(self):
+        """Membership Sponsor (relazione club-sponsor) per il ruolo sponsor"""
+        from app.models import Sponsor
+        if self.role != 'sponsor':
+            return None
+        return self._load('membership', Sponsor, self.membership_id)
+
+
+class PrincipalService:
+    _cache = OrderedDict()
+    _cache_lock = threading.Lock()
+    _CACHE_TTL = 60  # secondi
+    _CACHE_MAX = 4096
+
+    # ------------------------------------------------------------------ cache
+    @classmethod
+    def _cache_get(cls, cache_key):
+        with cls._cache_lock:
+            entry = cls._cache.get(cache_key)
+            if not entry:
+                return None
+            if (time.time() - entry['ts']) >= cls._CACHE_TTL:
+                del cls._cache[cache_key]
+                return None
+            cls._cache.move_to_end(cache_key)
+            return entry['data']
+
+    @classmethod
+    def _cache_set(cls, cache_key, data, deps):
+        with cls._cache_lock:
+            cls._cache[cache_key] = {'data': data, 'deps': deps, 'ts': time.time()}
+            cls._cache.move_to_end(cache_key)
+            while len(cls._cache) > cls._CACHE_MAX:
+                cls._cache.popitem(last=False)
+
+    @classmethod
+    def invalidate(cls, table=None, pk=None):
+        """Invalida le entry che dipendono da (table, pk); senza argomenti svuota la cache"""
+        with cls._cache_lock:
+            if table is None:
+                cls._cache.clear()
+                return
+            dep = (table, pk)
+            for key in [k for k, e in cls._cache.items() if dep in e['deps']]:
+                del cls._cache[key]
+
+    # ------------------------------------------------------------------ resolve
+    @staticmethod
+    def _resolve_data(claims):
+        """Risolve i dati dell'identità dal DB. Ritorna (data, deps, objects)."""
+        from app import db
+        from app.models import Admin, Club, ClubUser, SponsorAccount, Sponsor
+
+        role = claims.get('role')
+        identity = int(claims['sub']) if claims.get('sub') is not None else None
+        data = {'role': role, 'identity': identity}
+        deps = set()
+        objects = {}
+
+        if role == 'admin':
+            admin = db.session.get(Admin, identity)
+            objects['account'] = admin
+            deps.add(('admins', identity))
+            data.update({
+                'user_id': identity,
+                'name': admin.full_name if admin else None,
+                'email': admin.email if admin else None,
+                'is_active': bool(admin and admin.is_active),
+            })
+
+        elif role == 'club':
+            # Token club: identity = ClubUser.id, il tenant è nella claim club_id
+            user_id = claims.get('user_id', identity)
+            club_id = claims.get('club_id', identity)
+            user = db.session.get(ClubUser, user_id)
+            club = db.session.get(Club, club_id)
+            objects.update({'account': user, 'club': club})
+            deps.update({('club_users', user_id), ('clubs', club_id)})
+            data.update({
+                'user_id': user_id,
+                'club_id': club_id,
+                'name': club.nome if club else None,
+                'email': club.email if club else None,
+                'is_active': bool(club and club.account_attivo and (user is None or user.is_active)),
+            })
+
+        elif role == 'sponsor':
+            auth_type = claims.get('auth_type', 'legacy')
+            membership_id = claims.get('membership_id', identity if auth_type == 'legacy' else None)
+            membership = db.session.get(Sponsor, membership_id) if membership_id else None
+            objects['membership'] = membership
+            deps.add(('sponsors', membership_id))
+
+            if auth_type == 'legacy':
+                club_id = membership.club_id if membership else claims.get('current_club_id')
+                is_active = bool(membership and membership.account_attivo)
+            else:
+                account = db.session.get(SponsorAccount, identity)
+                objects['account'] = account
+                deps.add(('sponsor_accounts', identity))
+                club_id = claims.get('current_club_id')
+                is_active = bool(account and account.account_attivo)
+
+            deps.add(('clubs', club_id))
+            data.update({
+                'user_id': identity,
+                'club_id': club_id,
+                'membership_id': membership_id,
+                'auth_type': auth_type,
+                'name': membership.get_display_name() if membership else None,
+                'email': membership.get_email() if membership else None,
+                'is_active': is_active and membership is not None,
+            })
+
+        return data, deps, objects
+
+    @classmethod
+    def resolve(cls, claims):
+        """Ritorna il Principal per le claim date, usando la cache LRU"""
+        if not claims or not claims.get('role') or claims.get('sub') is None:
+            return None
+
+        cache_key = (claims.get('role'), str(claims.get('sub')), claims.get('iat'))
+        data = cls._cache_get(cache_key)
+        if data is not None:
+            return Principal(data)
+
+        data, deps, objects = cls._resolve_data(claims)
+        cls._cache_set(cache_key, data, deps)
+        return Principal(data, objects)
+
+    @classmethod
+    def current(cls):
+        """Principal della richiesta corrente (richiede un JWT già verificato)"""
+        if has_request_context() and 'principal' in g:
+            return g.principal
+        principal = cls.resolve(get_jwt())
+        if has_request_context():
+            g.principal = principal
+        return principal
+
+    @classmethod
+    def from_token(cls, token):
+        """Decodifica un token raw (es. query param SSE) e risolve il Principal"""
+        principal = cls.resolve(decode_token(token))
+        if has_request_context():
+            g.principal = principal
+        return principal
+
+
+def current_principal():
+    return PrincipalService.current()
+
+
+# ------------------------------------------------------------------ invalidation
+_listeners_registered = False
+
+
+def _register_listeners():
+    global _listeners_registered
+    if _listeners_registered:
+        return
+
+    from sqlalchemy import event
+    from app.models import Admin, Club, ClubUser, SponsorAccount, Sponsor
+
+    def _invalidate(mapper, connection, target):
+        PrincipalService.invalidate(target.__tablename__, target.id)
+
+    for model in (Admin, Club, ClubUser, SponsorAccount, Sponsor):
+        event.listen(model, 'after_update', _invalidate)
+        event.listen(model, 'after_delete', _invalidate)
+
+    _listeners_registered = True
+
+
+def init_app(app):
+    """Registra i listener di invalidazione della cache"""
+    _register_listeners()
@@ -0,0 +1,374 @@
+"""
+Project Metrics Service - contatori di task e milestone per progetto.
+
+Ogni scrittura ORM su ProjectTask, ProjectMilestone o ProjectUpdate che
+cambia stato, scadenza o progetto applica alla riga di project_metrics la
+differenza tra il contributo precedente e quello nuovo della riga (totali,
+completati, in corso, in ritardo, aggiornamenti) con un upsert incrementale
+sulla connessione della flush, nella stessa transazione della scrittura; il
+progresso_percentuale del progetto è ricalcolato dai contatori in SQL. I
+conteggi in ritardo restano validi fino alla prima scadenza futura ancora
+aperta (ritardi_*_fino): superata quella, refresh_stale li ricalcola e
+salva. Lo esegue il job dello scheduler e, se una lettura trova contatori
+scaduti, un thread avviato da ensure_fresh (al più uno ogni
+STALE_REFRESH_THROTTLE secondi per processo), che intanto li corregge in
+lettura senza scrivere. Liste e statistiche leggono i contatori caricati in
+join col progetto.
+"""
+import threading
+import time
+from datetime import date, datetime
+
+from flask import current_app
+from sqlalchemy import case, func, event, inspect, or_
+from sqlalchemy.orm.attributes import set_committed_value
+
+from app import db
+from app.models import Project, ProjectMilestone, ProjectTask, ProjectUpdate, ProjectMetrics
+from app.sql_upsert import upsert
+
+
+# Campi che cambiano i contatori
+WATCHED_FIELDS = {
+    ProjectTask: ('project_id', 'stato', 'data_scadenza'),
+    ProjectMilestone: ('project_id', 'stato', 'data_scadenza'),
+    ProjectUpdate: ('project_id',),
+}
+
+
+STALE_REFRESH_THROTTLE = 60  # secondi tra due refresh_stale avviati dalle letture
+
+_stale_refresh_lock = threading.Lock()
+_last_stale_refresh = None
+
+
+def _open(column):
+    return func.coalesce(column, '') != 'completato'
+
+
+class ProjectMetricsService:
+
+    # ------------------------------------------------------------------ aggregati
+    @staticmethod
+    def _task_select(project_ids, now):
+        t = ProjectTask.__table__
+        is_open = _open(t.c.stato)
+        return db.select(
+            t.c.project_id,
+            func.count(t.c.id).label('total'),
+            func.coalesce(func.sum(case((t.c.stato == 'completato', 1), else_=0)), 0).label('completati'),
+            func.coalesce(func.sum(case((t.c.stato == 'in_corso', 1), else_=0)), 0).label('in_corso'),
+            func.coalesce(func.sum(case((is_open & (t.c.data_scadenza < now), 1), else_=0)), 0).label('in_ritardo'),
+            func.min(case((is_open & (t.c.data_scadenza >= now), t.c.data_scadenza), else_=None)).label('fino'),
+        ).where(t.c.project_id.in_(project_ids)).group_by(t.c.project_id)
+
+    @staticmethod
+    def _milestone_select(project_ids, today):
+        m = ProjectMilestone.__table__
+        is_open = _open(m.c.stato)
+        return db.select(
+            m.c.project_id,
+            func.count(m.c.id).label('total'),
+            func.coalesce(func.sum(case((m.c.stato == 'completato', 1), else_=0)), 0).label('completati'),
+            func.coalesce(func.sum(case((is_open & (m.c.data_scadenza < today), 1), else_=0)), 0).label('in_ritardo'),
+            func.min(case((is_open & (m.c.data_scadenza >= today), m.c.data_scadenza), else_=None)).label('fino'),
+        ).where(m.c.project_id.in_(project_ids)).group_by(m.c.project_id)
+
+    @classmethod
+    def refresh_projects(cls, connection, project_ids):
+        """Ricalcola da zero contatori e progresso dei progetti indicati"""
+        project_ids = {pid for pid in project_ids if pid is not None}
+        if not project_ids:
+            return
+
+        metrics = ProjectMetrics.__table__
+        projects = Project.__table__
+        updates = ProjectUpdate.__table__
+        now = datetime.utcnow()
+        today = date.today()
+
+        existing = {pid for (pid,) in connection.execute(
+            db.select(projects.c.id).where(projects.c.id.in_(project_ids)))}
+        tasks = {row.project_id: row for row in connection.execute(cls._task_select(existing, now))} if existing else {}
+        milestones = {row.project_id: row for row in connection.execute(cls._milestone_select(existing, today))} if existing else {}
+        update_counts = dict(connection.execute(
+            db.select(updates.c.project_id, func.count(updates.c.id))
+            .where(updates.c.project_id.in_(existing)).group_by(updates.c.project_id)
+        ).all()) if existing else {}
+
+        for project_id in project_ids:
+            if project_id not in existing:
+                # Progetto eliminato: rimuove i contatori
+                connection.execute(metrics.delete().where(metrics.c.project_id == project_id))
+                continue
+            t = tasks.get(project_id)
+            m = milestones.get(project_id)
+            values = {
+                'tasks_total': t.total if t else 0,
+                'tasks_completati': int(t.completati) if t else 0,
+                'tasks_in_corso': int(t.in_corso) if t else 0,
+                'tasks_in_ritardo': int(t.in_ritardo) if t else 0,
+                'milestones_total': m.total if m else 0,
+                'milestones_completati': int(m.completati) if m else 0,
+                'milestones_in_ritardo': int(m.in_ritardo) if m else 0,
+                'updates_total': update_counts.get(project_id, 0),
+                'ritardi_task_fino': t.fino if t else None,
+                'ritardi_milestone_fino': m.fino if m else None,
+                'updated_at': now,
+            }
+            upsert(connection, metrics, keys={'project_id': project_id},
+                   insert_values=values, update_values=values)
+
+            # Stesso calcolo di Project.calculate_progress; scrive solo se cambia
+            progress = int(values['tasks_completati'] / values['tasks_total'] * 100) if values['tasks_total'] else 0
+            connection.execute(projects.update().where(
+                projects.c.id == project_id,
+                func.coalesce(projects.c.progresso_percentuale, -1) != progress
+            ).values(progresso_percentuale=progress))
+
+    @classmethod
+    def rebuild(cls, project_ids=None):
+        """Ricostruisce i contatori (tutti o solo quelli indicati) e fa commit"""
+        if project_ids is None:
+            project_ids = [pid for (pid,) in db.session.query(Project.id).all()]
+        cls.refresh_projects(db.session.connection(), project_ids)
+        db.session.commit()
+
+    @classmethod
+    def refresh_stale(cls):
+        """
+        Ricalcola e salva i progetti con una scadenza passata dall'ultimo
+        conteggio dei ritardi (job dello scheduler). Ritorna quanti.
+        """
+        now, today = datetime.utcnow(), date.today()
+        stale = [pid for (pid,) in db.session.query(ProjectMetrics.project_id).filter(or_(
+            ProjectMetrics.ritardi_task_fino < now,
+            ProjectMetrics.ritardi_milestone_fino < today
+        )).all()]
+        if stale:
+            cls.rebuild(stale)
+        return len(stale)
+
+    # ------------------------------------------------------------------ lettura
+    @classmethod
+    def ensure_fresh(cls, projects):
+        """
+        Corregge in lettura i ritardi dei progetti con una scadenza passata
+        dall'ultimo conteggio (di norma nessuno: zero query). La richiesta non
+        scrive: i valori sono impostati come caricati dal database e il
+        salvataggio è avviato in un thread, così le letture successive trovano
+        i contatori aggiornati anche senza scheduler.
+        """
+        now, today = datetime.utcnow(), date.today()
+        stale = {p.id: p.metrics for p in projects if p.metrics is not None and p.metrics.is_stale(now, today)}
+        if not stale:
+            return projects
+        cls._refresh_stale_in_background()
+
+        connection = db.session.connection()
+        tasks = {row.project_id: row for row in connection.execute(cls._task_select(list(stale), now))}
+        milestones = {row.project_id: row for row in connection.execute(cls._milestone_select(list(stale), today))}
+        for project_id, metrics in stale.items():
+            t = tasks.get(project_id)
+            m = milestones.get(project_id)
+            set_committed_value(metrics, 'tasks_in_ritardo', int(t.in_ritardo) if t else 0)
+            set_committed_value(metrics, 'milestones_in_ritardo', int(m.in_ritardo) if m else 0)
+            set_committed_value(metrics, 'ritardi_task_fino', t.fino if t else None)
+            set_committed_value(metrics, 'ritardi_milestone_fino', m.fino if m else None)
+        return projects
+
+    @classmethod
+    def _refresh_stale_in_background(cls):
+        global _last_stale_refresh
+        with _stale_refresh_lock:
+            if _last_stale_refresh is not None and time.monotonic() - _last_stale_refresh < STALE_REFRESH_THROTTLE:
+                return
+            _last_stale_refresh = time.monotonic()
+        app = current_app._get_current_object()
+
+        def run():
+            with app.app_context():
+                try:
+                    refreshed = cls.refresh_stale()
+                    if refreshed:
+                        print(f"[ProjectMetrics] Ritardi ricalcolati per {refreshed} progetti")
+                except Exception as e:
+                    db.session.rollback()
+                    print(f"[ProjectMetrics] Refresh contatori fallito: {e}")
+
+        threading.Thread(target=run, daemon=True).start()
+
+    @staticmethod
+    def counters(project):
+        """Contatori del progetto (tutti a zero se non ha task, milestone o aggiornamenti)"""
+        m = project.metrics
+        total = m.tasks_total if m else 0
+        completed = m.tasks_completati if m else 0
+        return {
+            'total_tasks': total,
+            'completed_tasks': completed,
+            'in_progress_tasks': m.tasks_in_corso if m else 0,
+            'late_tasks': m.tasks_in_ritardo if m else 0,
+            'completion_rate': (completed / total * 100) if total > 0 else 0,
+            'total_milestones': m.milestones_total if m else 0,
+            'completed_milestones': m.milestones_completati if m else 0,
+            'late_milestones': m.milestones_in_ritardo if m else 0,
+            'total_updates': m.updates_total if m else 0,
+        }
+
+
+# ------------------------------------------------------------------ listeners
+_listeners_registered = False
+
+# Colonna di project_metrics della prima scadenza futura aperta, per modello
+FINO_COLUMNS = {
+    ProjectTask: 'ritardi_task_fino',
+    ProjectMilestone: 'ritardi_milestone_fino',
+}
+
+
+def _contribution(model, values, now, today):
+    """
+    Contributo di una riga ai contatori del suo progetto:
+    (project_id, {colonna: valore}, scadenza futura aperta o None).
+    """
+    if values is None or values.get('project_id') is None:
+        return None, {}, None
+    if model is ProjectUpdate:
+        return values['project_id'], {'updates_total': 1}, None
+
+    is_open = (values.get('stato') or '') != 'completato'
+    deadline = values.get('data_scadenza')
+    if model is ProjectTask:
+        limit = now
+        if deadline is not None and not isinstance(deadline, datetime):
+            deadline = datetime.combine(deadline, datetime.min.time())
+    else:
+        limit = today
+        if isinstance(deadline, datetime):
+            deadline = deadline.date()
+    late = is_open and deadline is not None and deadline < limit
+    upcoming = deadline if is_open and deadline is not None and deadline >= limit else None
+    if model is ProjectTask:
+        counts = {
+            'tasks_total': 1,
+            'tasks_completati': int(not is_open),
+            'tasks_in_corso': int(values.get('stato') == 'in_corso'),
+            'tasks_in_ritardo': int(late),
+        }
+    else:
+        counts = {
+            'milestones_total': 1,
+            'milestones_completati': int(not is_open),
+            'milestones_in_ritardo': int(late),
+        }
+    return values['project_id'], counts, upcoming
+
+
+def _values(target, fields, previous=False):
+    """Valori correnti dei campi osservati o, con previous, quelli prima della flush"""
+    attrs = inspect(target).attrs
+    values = {}
+    for field in fields:
+        history = attrs[field].history
+        if previous and history.has_changes():
+            values[field] = history.deleted[0] if history.deleted else None
+        else:
+            values[field] = getattr(target, field)
+    return values
+
+
+def _apply_deltas(connection, model, before, after):
+    """Applica ai contatori la differenza tra due stati di una riga (None = assente)"""
+    now, today = datetime.utcnow(), date.today()
+    old_project, old_counts, _ = _contribution(model, before, now, today)
+    new_project, new_counts, upcoming = _contribution(model, after, now, today)
+
+    deltas = {}
+    for project_id, counts, sign in ((old_project, old_counts, -1), (new_project, new_counts, 1)):
+        if project_id is None:
+            continue
+        project_deltas = deltas.setdefault(project_id, {})
+        for column, value in counts.items():
+            project_deltas[column] = project_deltas.get(column, 0) + sign * value
+
+    metrics = ProjectMetrics.__table__
+    projects = Project.__table__
+    fino_column = FINO_COLUMNS.get(model)
+    for project_id, project_deltas in deltas.items():
+        changed = {column: delta for column, delta in project_deltas.items() if delta}
+        is_new = project_id == new_project and upcoming is not None
+        if not changed and not is_new:
+            continue
+
+        insert_values = {column: max(0, delta) for column, delta in changed.items()}
+        update_values = {column: metrics.c[column] + delta for column, delta in changed.items()}
+        if is_new:
+            # Una nuova scadenza futura aperta può anticipare il prossimo ricalcolo dei ritardi
+            current = metrics.c[fino_column]
+            insert_values[fino_column] = upcoming
+            update_values[fino_column] = case(
+                (or_(current.is_(None), current > upcoming), upcoming), else_=current
+            )
+        insert_values['updated_at'] = update_values['updated_at'] = now
+        upsert(connection, metrics, keys={'project_id': project_id},
+               insert_values=insert_values, update_values=update_values)
+
+        if 'tasks_total' in changed or 'tasks_completati' in changed:
+            # Stesso calcolo di Project.calculate_progress; scrive solo se cambia
+            progress = db.select(case(
+                (metrics.c.tasks_total > 0, metrics.c.tasks_completati * 100 // metrics.c.tasks_total), else_=0
+            )).where(metrics.c.project_id == project_id).scalar_subquery()
+            connection.execute(projects.update().where(
+                projects.c.id == project_id,
+                func.coalesce(projects.c.progresso_percentuale, -1) != progress
+            ).values(progresso_percentuale=progress))
+
+
+def _load_previous(target, value, oldvalue, initiator):
+    """
+    No-op: registrato come listener 'set' con active_history, fa caricare
+    all'ORM il valore precedente anche di un attributo scaduto (es. dopo un
+    commit), che altrimenti mancherebbe in history.deleted per _values.
+    """
+
+
+def _make_listeners(model):
+    fields = WATCHED_FIELDS[model]
+
+    def on_insert(mapper, connection, target):
+        _apply_deltas(connection, model, None, _values(target, fields))
+
+    def on_update(mapper, connection, target):
+        attrs = inspect(target).attrs
+        if any(attrs[field].history.has_changes() for field in fields):
+            _apply_deltas(connection, model, _values(target, fields, previous=True), _values(target, fields))
+
+    def on_delete(mapper, connection, target):
+        _apply_deltas(connection, model, _values(target, fields), None)
+
+    return on_insert, on_update, on_delete
+
+
+def _on_project_delete(mapper, connection, target):
+    connection.execute(ProjectMetrics.__table__.delete().where(ProjectMetrics.__table__.c.project_id == target.id))
+
+
+def _register_listeners():
+    global _listeners_registered
+    if _listeners_registered:
+        return
+    for model, fields in WATCHED_FIELDS.items():
+        for field in fields:
+            event.listen(getattr(model, field), 'set', _load_previous, active_history=True)
+        on_insert, on_update, on_delete = _make_listeners(model)
+        event.listen(model, 'after_insert', on_insert)
+        event.listen(model, 'after_update', on_update)
+        event.listen(model, 'after_delete', on_delete)
+    event.listen(Project, 'after_delete', _on_project_delete)
+    _listeners_registered = True
+
+
+def init_app(app):
+    """Registra i listener che mantengono project_metrics"""
+    _register_listeners()
@@ -0,0 +1,308 @@
+"""
+Proposal Analytics Service - rollup incrementale del tracking proposte.
+
+Le righe grezze di proposal_tracking vengono aggregate per proposta/giorno,
+per sezione e per visitatore unico (fingerprint IP + User-Agent). Il rollup
+riparte dall'ultima coppia (created_at, id) elaborata (analytics_rollup_state)
+e considera solo le righe più vecchie di PROPOSAL_ROLLUP_LAG secondi: gli id
+sono assegnati prima del commit, quindi una riga con id basso può diventare
+visibile dopo una con id più alto; il ritardo copre l'intervallo di flush del
+tracking buffer e la durata della transazione, così nessuna riga resta dietro
+il watermark. Il rollup gira nel thread del tracking buffer; gli endpoint di
+analytics leggono esclusivamente le tabelle aggregate.
+"""
+import os
+import threading
+from collections import defaultdict
+from datetime import date, datetime, timedelta
+
+from sqlalchemy import and_, case, func, or_
+
+from app import db
+from app.models import (
+    Proposal, ProposalTracking, ProposalDailyStat, ProposalSectionStat,
+    ProposalVisitor, AnalyticsRollupState
+)
+from app.services.tracking_buffer import is_bot, visitor_fingerprint
+
+
+ROLLUP_NAME = 'proposal_tracking'
+ROLLUP_LAG = int(os.getenv('PROPOSAL_ROLLUP_LAG', '300'))  # secondi
+
+
+class ProposalAnalyticsService:
+    _rollup_lock = threading.Lock()
+
+    # ------------------------------------------------------------------ rollup
+    @staticmethod
+    def _lock_watermark():
+        """
+        Blocca la riga del watermark (serializza i rollup tra processi) e
+        ritorna (last_created_at, last_id).
+        """
+        state = AnalyticsRollupState.__table__
+        result = db.session.execute(
+            state.update().where(state.c.nome == ROLLUP_NAME).values(updated_at=datetime.utcnow())
+        )
+        if result.rowcount == 0:
+            db.session.add(AnalyticsRollupState(nome=ROLLUP_NAME, last_id=0))
+            db.session.flush()
+            return None, 0
+        row = db.session.query(
+            AnalyticsRollupState.last_created_at, AnalyticsRollupState.last_id
+        ).filter_by(nome=ROLLUP_NAME).one()
+        return row.last_created_at, row.last_id or 0
+
+    @staticmethod
+    def _after_watermark(last_created_at, last_id):
+        """Righe successive a (last_created_at, last_id) nell'ordine (created_at, id)"""
+        if last_created_at is None:
+            return ProposalTracking.id > last_id
+        return or_(
+            ProposalTracking.created_at > last_created_at,
+            and_(ProposalTracking.created_at == last_created_at, ProposalTracking.id > last_id)
+        )
+
+    @classmethod
+    def rollup(cls, batch_size=5000, max_batches=20):
+        """Aggrega le nuove righe di tracking. Ritorna il numero di righe elaborate."""
+        if not cls._rollup_lock.acquire(blocking=False):
+            return 0  # rollup già in corso in questo processo
+        processed = 0
+        cutoff = datetime.utcnow() - timedelta(seconds=ROLLUP_LAG)
+        try:
+            for _ in range(max_batches):
+                last_created_at, last_id = cls._lock_watermark()
+                rows = db.session.query(
+                    ProposalTracking.id, ProposalTracking.proposal_id, ProposalTracking.evento,
+                    ProposalTracking.sezione, ProposalTracking.durata_secondi,
+                    ProposalTracking.ip_address, ProposalTracking.user_agent, ProposalTracking.created_at
+                ).filter(
+                    ProposalTracking.created_at <= cutoff,
+                    cls._after_watermark(last_created_at, last_id)
+                ).order_by(ProposalTracking.created_at, ProposalTracking.id).limit(batch_size).all()
+
+                if not rows:
+                    db.session.commit()
+                    break
+
+                cls._apply(rows)
+                db.session.query(AnalyticsRollupState).filter_by(nome=ROLLUP_NAME).update(
+                    {'last_created_at': rows[-1].created_at, 'last_id': rows[-1].id}, synchronize_session=False
+                )
+                db.session.commit()
+                processed += len(rows)
+                if len(rows) < batch_size:
+                    break
+        except Exception:
+            db.session.rollback()
+            raise
+        finally:
+            cls._rollup_lock.release()
+        return processed
+
+    @staticmethod
+    def _apply(rows):
+        daily = defaultdict(lambda: {'eventi': 0, 'visualizzazioni': 0, 'download': 0, 'tempo_totale': 0, 'nuovi_visitatori': 0})
+        sections = defaultdict(lambda: {'eventi': 0, 'tempo_totale': 0, 'eventi_con_durata': 0})
+        visitors = {}
+
+        for row in rows:
+            if is_bot(row.user_agent):
+                continue
+            created = row.created_at or datetime.utcnow()
+            durata = row.durata_secondi or 0
+
+            day = daily[(row.proposal_id, created.date())]
+            day['eventi'] += 1
+            day['tempo_totale'] += durata
+            if row.evento == 'view':
+                day['visualizzazioni'] += 1
+            elif row.evento == 'download':
+                day['download'] += 1
+
+            if row.sezione:
+                section = sections[(row.proposal_id, row.sezione[:100])]
+                section['eventi'] += 1
+                section['tempo_totale'] += durata
+                if durata:
+                    section['eventi_con_durata'] += 1
+
+            key = (row.proposal_id, visitor_fingerprint(row.ip_address, row.user_agent))
+            visitor = visitors.setdefault(key, {'prima': created, 'ultima': created, 'views': 0, 'tempo': 0, 'download': False})
+            visitor['ultima'] = max(visitor['ultima'], created)
+            visitor['views'] += 1 if row.evento == 'view' else 0
+            visitor['tempo'] += durata
+            visitor['download'] = visitor['download'] or row.evento == 'download'
+
+        if not daily:
+            return
+        proposal_ids = {pid for pid, _ in daily}
+
+        # --- Visitatori (un SELECT per le chiavi del batch) ---
+        existing = {
+            (v.proposal_id, v.fingerprint): v
+            for v in ProposalVisitor.query.filter(
+                ProposalVisitor.proposal_id.in_(proposal_ids),
+                ProposalVisitor.fingerprint.in_({fp for _, fp in visitors})
+            ).all()
+        }
+        for (pid, fp), data in visitors.items():
+            visitor = existing.get((pid, fp))
+            if visitor is None:
+                db.session.add(ProposalVisitor(
+                    proposal_id=pid, fingerprint=fp, prima_visita=data['prima'], ultima_visita=data['ultima'],
+                    visualizzazioni=data['views'], tempo_totale=data['tempo'], ha_scaricato=data['download']
+                ))
+                daily[(pid, data['prima'].date())]['nuovi_visitatori'] += 1
+            else:
+                visitor.ultima_visita = max(visitor.ultima_visita or data['ultima'], data['ultima'])
+                visitor.visualizzazioni += data['views']
+                visitor.tempo_totale += data['tempo']
+                visitor.ha_scaricato = visitor.ha_scaricato or data['download']
+
+        # --- Giornaliero ---
+        existing_days = {
+            (d.proposal_id, d.giorno): d
+            for d in ProposalDailyStat.query.filter(
+                ProposalDailyStat.proposal_id.in_(proposal_ids),
+                ProposalDailyStat.giorno.in_({g for _, g in daily})
+            ).all()
+        }
+        for (pid, giorno), data in daily.items():
+            stat = existing_days.get((pid, giorno))
+            if stat is None:
+                db.session.add(ProposalDailyStat(proposal_id=pid, giorno=giorno, **data))
+            else:
+                for field, value in data.items():
+                    setattr(stat, field, (getattr(stat, field) or 0) + value)
+
+        # --- Sezioni ---
+        if sections:
+            existing_sections = {
+                (s.proposal_id, s.sezione): s
+                for s in ProposalSectionStat.query.filter(
+                    ProposalSectionStat.proposal_id.in_({pid for pid, _ in sections})
+                ).all()
+            }
+            for (pid, sezione), data in sections.items():
+                stat = existing_sections.get((pid, sezione))
+                if stat is None:
+                    db.session.add(ProposalSectionStat(proposal_id=pid, sezione=sezione, **data))
+                else:
+                    for field, value in data.items():
+                        setattr(stat, field, (getattr(stat, field) or 0) + value)
+
+    # ------------------------------------------------------------------ read
+    @staticmethod
+    def _rate(part, total):
+        return round(part / total * 100, 1) if total else 0
+
+    @classmethod
+    def proposal_analytics(cls, proposal, days=30):
+        """Analytics di una proposta: totali, funnel, sezioni e serie giornaliera"""
+        views, downloads, tempo, eventi = db.session.query(
+            func.coalesce(func.sum(ProposalDailyStat.visualizzazioni), 0),
+            func.coalesce(func.sum(ProposalDailyStat.download), 0),
+            func.coalesce(func.sum(ProposalDailyStat.tempo_totale), 0),
+            func.coalesce(func.sum(ProposalDailyStat.eventi), 0),
+        ).filter(ProposalDailyStat.proposal_id == proposal.id).one()
+
+        unique_visitors, downloaders = db.session.query(
+            func.count(ProposalVisitor.fingerprint),
+            func.coalesce(func.sum(case((ProposalVisitor.ha_scaricato, 1), else_=0)), 0),
+        ).filter(ProposalVisitor.proposal_id == proposal.id).one()
+
+        sections = ProposalSectionStat.query.filter_by(proposal_id=proposal.id).order_by(
+            ProposalSectionStat.tempo_totale.desc()
+        ).all()
+
+        since = date.today() - timedelta(days=days - 1)
+        daily = ProposalDailyStat.query.filter(
+            ProposalDailyStat.proposal_id == proposal.id,
+            ProposalDailyStat.giorno >= since
+        ).order_by(ProposalDailyStat.giorno).all()
+
+        accepted = proposal.stato == 'accettata'
+        return {
+            'proposal_id': proposal.id,
+            'totali': {
+                'eventi': int(eventi),
+                'visualizzazioni': int(views),
+                'visitatori_unici': int(unique_visitors),
+                'download': int(downloads),
+                'tempo_totale': int(tempo),
+                'tempo_medio_visitatore': round(tempo / unique_visitors, 1) if unique_visitors else 0
+            },
+            'funnel': {
+                'visitatori': int(unique_visitors),
+                'download': int(downloaders),
+                'accettata': accepted,
+                'tasso_download': cls._rate(downloaders, unique_visitors)
+            },
+            'sezioni': [s.to_dict() for s in sections],
+            'giornaliero': [d.to_dict() for d in daily],
+            'giorni': days
+        }
+
+    @classmethod
+    def club_comparison(cls, club_id, limit=100):
+        """Confronto engagement tra le proposte di un club (solo tabelle aggregate)"""
+        daily = db.session.query(
+            ProposalDailyStat.proposal_id.label('proposal_id'),
+            func.sum(ProposalDailyStat.visualizzazioni).label('views'),
+            func.sum(ProposalDailyStat.download).label('downloads'),
+            func.sum(ProposalDailyStat.tempo_totale).label('tempo'),
+        ).join(Proposal, Proposal.id == ProposalDailyStat.proposal_id).filter(
+            Proposal.club_id == club_id
+        ).group_by(ProposalDailyStat.proposal_id).subquery()
+
+        visitors = db.session.query(
+            ProposalVisitor.proposal_id.label('proposal_id'),
+            func.count(ProposalVisitor.fingerprint).label('unique_visitors'),
+            func.sum(case((ProposalVisitor.ha_scaricato, 1), else_=0)).label('downloaders'),
+        ).join(Proposal, Proposal.id == ProposalVisitor.proposal_id).filter(
+            Proposal.club_id == club_id
+        ).group_by(ProposalVisitor.proposal_id).subquery()
+
+        rows = db.session.query(
+            Proposal.id, Proposal.codice, Proposal.titolo, Proposal.stato, Proposal.valore_finale,
+            Proposal.data_invio, daily.c.views, daily.c.downloads, daily.c.tempo,
+            visitors.c.unique_visitors, visitors.c.downloaders
+        ).outerjoin(daily, daily.c.proposal_id == Proposal.id).outerjoin(
+            visitors, visitors.c.proposal_id == Proposal.id
+        ).filter(
+            Proposal.club_id == club_id,
+            Proposal.stato != 'bozza'
+        ).order_by(Proposal.data_invio.desc()).limit(limit).all()
+
+        proposals = []
+        for r in rows:
+            uv = int(r.unique_visitors or 0)
+            tempo = int(r.tempo or 0)
+            proposals.append({
+                'id': r.id,
+                'codice': r.codice,
+                'titolo': r.titolo,
+                'stato': r.stato,
+                'valore_finale': r.valore_finale,
+                'data_invio': r.data_invio.isoformat() if r.data_invio else None,
+                'visualizzazioni': int(r.views or 0),
+                'visitatori_unici': uv,
+                'download': int(r.downloads or 0),
+                'tempo_totale': tempo,
+                'tempo_medio_visitatore': round(tempo / uv, 1) if uv else 0,
+                'tasso_download': cls._rate(int(r.downloaders or 0), uv)
+            })
+
+        viewed = [p for p in proposals if p['visitatori_unici']]
+        accepted = [p for p in proposals if p['stato'] == 'accettata']
+        return {
+            'proposte': proposals,
+            'medie': {
+                'visitatori_unici': round(sum(p['visitatori_unici'] for p in proposals) / len(proposals), 1) if proposals else 0,
+                'tempo_medio_visitatore': round(sum(p['tempo_medio_visitatore'] for p in viewed) / len(viewed), 1) if viewed else 0,
+                'tasso_download': round(sum(p['tasso_download'] for p in viewed) / len(viewed), 1) if viewed else 0,
+                'tasso_accettazione': cls._rate(len(accepted), len(proposals))
+            }
+        }
@@ -0,0 +1,181 @@
+"""
+QR Service - QR code degli inviti Business Box generati su richiesta.
+
+I QR sono prodotti dal codice invito (PNG o SVG) e tenuti in una cache LRU di
+byte limitata per dimensione totale (QR_CACHE_MAX_BYTES): nessun file su disco
+è necessario. Il singolo QR è generato inline (pochi ms); i lotti degli inviti
+in blocco sono generati in un process pool limitato (QR_WORKERS), con fallback
+inline se il pool non è disponibile o si rompe.
+"""
+import io
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeout
+from concurrent.futures.process import BrokenProcessPool
+import multiprocessing
+
+
+QR_WORKERS = int(os.getenv('QR_WORKERS', str(min(2, os.cpu_count() or 1))))
+QR_CACHE_MAX_BYTES = int(os.getenv('QR_CACHE_MAX_BYTES', str(32 * 1024 * 1024)))
+BATCH_TIMEOUT = 30  # secondi
+BATCH_MIN_SIZE = 4  # sotto questa soglia il pool non conviene
+
+FORMATS = {
+    'png': 'image/png',
+    'svg': 'image/svg+xml',
+}
+
+# Stessi parametri del QR generato finora in box_routes
+BOX_SIZE = 10
+BORDER = 5
+
+
+def _render_worker(data, fmt):
+    """Genera il QR di `data` nel formato richiesto (eseguibile nel process pool)"""
+    import qrcode
+
+    qr = qrcode.QRCode(version=1, box_size=BOX_SIZE, border=BORDER)
+    qr.add_data(data)
+    qr.make(fit=True)
+    if fmt == 'svg':
+        from qrcode.image.svg import SvgPathImage
+        img = qr.make_image(image_factory=SvgPathImage)
+    else:
+        img = qr.make_image(fill_color="black", back_color="white")
+    buf = io.BytesIO()
+    img.save(buf)
+    return buf.getvalue()
+
+
+def _render_batch_worker(items):
+    return [_render_worker(data, fmt) for data, fmt in items]
+
+
+class ByteLRUCache:
+    """Cache LRU limitata dalla somma delle dimensioni dei valori (thread-safe)"""
+
+    def __init__(self, max_bytes=QR_CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._size = 0
+
+    def get(self, key):
+        with self._lock:
+            value = self._entries.get(key)
+            if value is not None:
+                self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        if len(value) > self.max_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._size -= len(old)
+            self._entries[key] = value
+            self._size += len(value)
+            while self._size > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._size -= len(evicted)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+
+    def stats(self):
+        with self._lock:
+            return {'entries': len(self._entries), 'bytes': self._size, 'max_bytes': self.max_bytes}
+
+
+class QRService:
+    _pool = None
+    _pool_lock = threading.Lock()
+    _cache = ByteLRUCache()
+
+    # ------------------------------------------------------------------ pool
+    @classmethod
+    def _get_pool(cls):
+        if QR_WORKERS <= 0:
+            return None
+        with cls._pool_lock:
+            if cls._pool is None:
+                try:
+                    # spawn: il processo web è multi-thread, fork non è sicuro
+                    cls._pool = ProcessPoolExecutor(
+                        max_workers=QR_WORKERS,
+                        mp_context=multiprocessing.get_context('spawn')
+                    )
+                except Exception as e:
+                    print(f"[QR] Process pool non disponibile, generazione inline: {e}")
+                    return None
+            return cls._pool
+
+    @classmethod
+    def _reset_pool(cls):
+        with cls._pool_lock:
+            if cls._pool is not None:
+                cls._pool.shutdown(wait=False, cancel_futures=True)
+            cls._pool = None
+
+    @classmethod
+    def shutdown(cls):
+        cls._reset_pool()
+
+    # ------------------------------------------------------------------ render
+    @staticmethod
+    def mimetype(fmt):
+        return FORMATS[fmt]
+
+    @classmethod
+    def render(cls, data, fmt='png'):
+        """Byte del QR di `data` (dalla cache se presente)"""
+        if fmt not in FORMATS:
+            raise ValueError(f'Formato QR non supportato: {fmt}')
+        key = (fmt, data)
+        cached = cls._cache.get(key)
+        if cached is not None:
+            return cached
+        content = _render_worker(data, fmt)
+        cls._cache.set(key, content)
+        return content
+
+    @classmethod
+    def render_many(cls, codes, fmt='png'):
+        """
+        Byte dei QR di più codici, nello stesso ordine. I mancanti in cache sono
+        generati nel process pool a blocchi di un lotto per worker.
+        """
+        if fmt not in FORMATS:
+            raise ValueError(f'Formato QR non supportato: {fmt}')
+        codes = list(codes)
+        results = [cls._cache.get((fmt, code)) for code in codes]
+        missing = [i for i, content in enumerate(results) if content is None]
+        if not missing:
+            return results
+
+        pool = cls._get_pool() if len(missing) >= BATCH_MIN_SIZE else None
+        rendered = None
+        if pool is not None:
+            size = -(-len(missing) // QR_WORKERS)
+            chunks = [missing[i:i + size] for i in range(0, len(missing), size)]
+            try:
+                futures = [pool.submit(_render_batch_worker, [(codes[i], fmt) for i in chunk]) for chunk in chunks]
+                rendered = [content for future in futures for content in future.result(timeout=BATCH_TIMEOUT)]
+            except (BrokenProcessPool, FutureTimeout) as e:
+                print(f"[QR] Errore process pool ({type(e).__name__}), generazione inline")
+                cls._reset_pool()
+        if rendered is None:
+            rendered = [_render_worker(codes[i], fmt) for i in missing]
+
+        for i, content in zip(missing, rendered):
+            results[i] = content
+            cls._cache.set((fmt, codes[i]), content)
+        return results
+
+    @classmethod
+    def cache_stats(cls):
+        return cls._cache.stats()
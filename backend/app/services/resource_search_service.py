@@ -0,0 +1,274 @@
+"""
+Resource Search Service - ricerca con ranking e faccette per il portale risorse.
+
+Le risorse pubblicate sono tenute in un indice invertito in memoria (termine ->
+{risorsa: frequenza pesata}) costruito da titolo, descrizione, autore, tag e
+settori. Le query sono valutate in AND sui termini (con espansione per
+prefisso, così "sponsor" trova anche "sponsorizzazione") e ordinate con BM25
+sui campi pesati. Nello stesso passaggio sui risultati vengono contati i
+valori delle faccette categoria, tipo_risorsa e settore, ciascuna calcolata
+con tutti i filtri tranne il proprio.
+
+L'indice viene ricostruito al primo uso dopo il commit di una modifica ai
+campi indicizzati di risorse e categorie, e comunque dopo RESOURCE_INDEX_TTL
+secondi (modifiche fatte da altri processi).
+"""
+import math
+import os
+import re
+import threading
+import time
+from bisect import bisect_left
+from collections import Counter, defaultdict
+from itertools import chain
+
+from sqlalchemy import event, inspect
+
+from app import db
+from app.models import Resource, ResourceCategory
+from app.services.inventory_catalog_service import normalize_search
+
+
+INDEX_TTL = int(os.getenv('RESOURCE_INDEX_TTL', '300'))
+FIELD_WEIGHTS = {'titolo': 3.0, 'tags': 2.0, 'autore': 1.5, 'settori': 1.5, 'descrizione': 1.0}
+BM25_K1 = 1.2
+BM25_B = 0.75
+PREFIX_WEIGHT = 0.7  # peso di un termine trovato per prefisso rispetto al match esatto
+MAX_PREFIX_EXPANSION = 50
+MAX_QUERY_TERMS = 8
+STOPWORDS = frozenset(
+    'a ad al alla alle agli ai col con da dal dalla dalle dei del della delle di e ed '
+    'gli i il in la le lo nel nella nelle o per su sul sulla tra fra un una uno the of and'.split()
+)
+FACETS = ('category_id', 'tipo_risorsa', 'settore')
+VISIBILITY = {
+    'sponsor': ('public', 'sponsor-only'),
+    'club': ('public', 'club-only'),
+}
+
+_TOKEN_RE = re.compile(r'\w+')
+
+
+def tokenize(text):
+    return [t for t in _TOKEN_RE.findall(normalize_search(text)) if t not in STOPWORDS]
+
+
+class ResourceSearchIndex:
+    """Indice invertito delle risorse pubblicate (thread-safe, ricostruzione pigra)"""
+
+    def __init__(self, ttl=INDEX_TTL):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._version = 0
+        self._built = None  # (versione, timestamp)
+        self._docs = {}
+        self._postings = {}
+        self._vocabulary = []
+        self._avg_length = 1.0
+
+    def invalidate(self):
+        with self._lock:
+            self._version += 1
+
+    # ------------------------------------------------------------------ build
+    def _ensure_fresh(self):
+        with self._lock:
+            version = self._version
+            if self._built and self._built[0] == version and time.time() - self._built[1] < self.ttl:
+                return
+        docs, postings, avg_length = self._build()
+        with self._lock:
+            self._docs, self._postings, self._avg_length = docs, postings, avg_length
+            self._vocabulary = sorted(postings)
+            self._built = (version, time.time())
+
+    @staticmethod
+    def _build():
+        rows = db.session.query(
+            Resource.id, Resource.titolo, Resource.descrizione, Resource.autore, Resource.tags,
+            Resource.settori, Resource.tipo_risorsa, Resource.category_id, Resource.visibilita,
+            Resource.in_evidenza, Resource.consigliata, Resource.created_at, ResourceCategory.nome
+        ).outerjoin(ResourceCategory, ResourceCategory.id == Resource.category_id).filter(
+            Resource.pubblicata == True
+        ).all()
+
+        docs = {}
+        postings = defaultdict(dict)
+        total_length = 0.0
+        for row in rows:
+            tags = [str(t) for t in (row.tags or [])]
+            settori = [str(s) for s in (row.settori or [])]
+            fields = {
+                'titolo': row.titolo, 'descrizione': row.descrizione, 'autore': row.autore,
+                'tags': ' '.join(tags), 'settori': ' '.join(settori)
+            }
+            weighted = Counter()
+            length = 0.0
+            for field, text in fields.items():
+                tokens = tokenize(text)
+                length += FIELD_WEIGHTS[field] * len(tokens)
+                for token in tokens:
+                    weighted[token] += FIELD_WEIGHTS[field]
+            for token, tf in weighted.items():
+                postings[token][row.id] = tf
+            total_length += length
+
+            docs[row.id] = {
+                'length': length or 1.0,
+                'visibilita': row.visibilita or 'public',
+                'category_id': row.category_id,
+                'category_nome': row.nome,
+                'tipo_risorsa': row.tipo_risorsa,
+                'tags': set(tags),
+                'settori': set(settori),
+                'in_evidenza': bool(row.in_evidenza),
+                'consigliata': bool(row.consigliata),
+                'created_at': row.created_at.timestamp() if row.created_at else 0,
+            }
+        return docs, dict(postings), (total_length / len(docs)) if docs else 1.0
+
+    # ------------------------------------------------------------------ query
+    def _expand(self, term):
+        """[(termine indice, peso)] per un termine di query: esatto + prefissi"""
+        matches = [(term, 1.0)] if term in self._postings else []
+        start = bisect_left(self._vocabulary, term)
+        for candidate in self._vocabulary[start:start + MAX_PREFIX_EXPANSION + 1]:
+            if not candidate.startswith(term):
+                break
+            if candidate != term:
+                matches.append((candidate, PREFIX_WEIGHT))
+        return matches
+
+    def _score(self, terms):
+        """{risorsa: punteggio BM25} delle risorse che contengono tutti i termini"""
+        n_docs = len(self._docs)
+        scores = None
+        for term in terms:
+            term_scores = defaultdict(float)
+            for index_term, weight in self._expand(term):
+                posting = self._postings[index_term]
+                idf = math.log(1 + (n_docs - len(posting) + 0.5) / (len(posting) + 0.5))
+                for doc_id, tf in posting.items():
+                    norm = BM25_K1 * (1 - BM25_B + BM25_B * self._docs[doc_id]['length'] / self._avg_length)
+                    term_scores[doc_id] = max(term_scores[doc_id], weight * idf * tf * (BM25_K1 + 1) / (tf + norm))
+            if scores is None:
+                scores = term_scores
+            else:
+                scores = {doc_id: s + term_scores[doc_id] for doc_id, s in scores.items() if doc_id in term_scores}
+            if not scores:
+                return {}
+        return scores or {}
+
+    @staticmethod
+    def _checks(doc, filters):
+        """Esito di ogni filtro (le faccette escludono il proprio)"""
+        return {
+            'category_id': not filters.get('category_id') or doc['category_id'] == filters['category_id'],
+            'tipo_risorsa': not filters.get('tipo_risorsa') or doc['tipo_risorsa'] == filters['tipo_risorsa'],
+            'settore': not filters.get('settore') or filters['settore'] in doc['settori'],
+            'tag': not filters.get('tag') or filters['tag'] in doc['tags'],
+            'in_evidenza': not filters.get('in_evidenza') or doc['in_evidenza'],
+            'consigliata': not filters.get('consigliata') or doc['consigliata'],
+        }
+
+    def search(self, user_type, query=None, filters=None):
+        """
+        Ritorna {'ids': [...] ordinati per rilevanza (o data se senza query),
+        'scores': {id: punteggio}, 'facets': {...}}.
+        """
+        self._ensure_fresh()
+        filters = filters or {}
+        terms = list(dict.fromkeys(tokenize(query)))[:MAX_QUERY_TERMS]
+        allowed = VISIBILITY.get(user_type)
+
+        with self._lock:
+            docs = self._docs
+            scores = self._score(terms) if terms else {doc_id: 0.0 for doc_id in docs}
+
+        facet_counts = {name: Counter() for name in FACETS}
+        category_names = {}
+        matched = []
+        for doc_id, score in scores.items():
+            doc = docs[doc_id]
+            if allowed and doc['visibilita'] not in allowed:
+                continue
+            checks = self._checks(doc, filters)
+            failed = [name for name, ok in checks.items() if not ok]
+            if not failed:
+                matched.append(doc_id)
+            # Una faccetta conta i documenti che passano tutti gli altri filtri
+            if len(failed) > 1 or (failed and failed[0] not in FACETS):
+                continue
+            if not failed or failed[0] == 'category_id':
+                facet_counts['category_id'][doc['category_id']] += 1
+                category_names[doc['category_id']] = doc['category_nome']
+            if not failed or failed[0] == 'tipo_risorsa':
+                facet_counts['tipo_risorsa'][doc['tipo_risorsa']] += 1
+            if not failed or failed[0] == 'settore':
+                facet_counts['settore'].update(doc['settori'])
+
+        matched.sort(key=lambda doc_id: (-scores[doc_id], -docs[doc_id]['created_at'], -doc_id))
+        return {
+            'ids': matched,
+            'scores': {doc_id: round(scores[doc_id], 4) for doc_id in matched} if terms else {},
+            'facets': {
+                'categorie': [{'id': cid, 'nome': category_names.get(cid), 'count': count}
+                              for cid, count in facet_counts['category_id'].most_common() if cid is not None],
+                'tipi_risorsa': [{'valore': value, 'count': count}
+                                 for value, count in facet_counts['tipo_risorsa'].most_common() if value],
+                'settori': [{'valore': value, 'count': count}
+                            for value, count in facet_counts['settore'].most_common()],
+            }
+        }
+
+
+resource_search = ResourceSearchIndex()
+
+
+# ------------------------------------------------------------------ listeners
+_listeners_registered = False
+_INDEXED_FIELDS = {
+    Resource: ('titolo', 'descrizione', 'autore', 'tags', 'settori', 'tipo_risorsa', 'category_id',
+               'visibilita', 'pubblicata', 'in_evidenza', 'consigliata'),
+    ResourceCategory: ('nome',),
+}
+_DIRTY_KEY = 'resource_index_dirty'
+
+
+def _collect_changes(session, flush_context):
+    """Segna la sessione se la flush tocca campi indicizzati (contatori esclusi)"""
+    for obj in chain(session.new, session.deleted):
+        if isinstance(obj, (Resource, ResourceCategory)):
+            session.info[_DIRTY_KEY] = True
+            return
+    for obj in session.dirty:
+        fields = _INDEXED_FIELDS.get(type(obj))
+        if fields:
+            attrs = inspect(obj).attrs
+            if any(attrs[field].history.has_changes() for field in fields):
+                session.info[_DIRTY_KEY] = True
+                return
+
+
+def _invalidate_after_commit(session):
+    if session.info.pop(_DIRTY_KEY, None):
+        resource_search.invalidate()
+
+
+def _discard_after_rollback(session):
+    session.info.pop(_DIRTY_KEY, None)
+
+
+def _register_listeners():
+    global _listeners_registered
+    if _listeners_registered:
+        return
+    event.listen(db.session, 'after_flush', _collect_changes)
+    event.listen(db.session, 'after_commit', _invalidate_after_commit)
+    event.listen(db.session, 'after_rollback', _discard_after_rollback)
+    _listeners_registered = True
+
+
+def init_app(app):
+    """Registra i listener che invalidano l'indice risorse"""
+    _register_listeners()
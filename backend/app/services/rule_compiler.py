@@ -0,0 +1,218 @@
+"""
+Rule Compiler - condizioni e template delle automazioni precompilati.
+
+Condizioni ({operator, rules: [{field, operator, value}]}) e template con
+variabili {{ percorso.puntato }} vengono analizzati una sola volta: i percorsi
+diventano tuple di chiavi, i valori attesi sono già normalizzati (minuscolo,
+float, lista) e ogni regola è una closure. I template diventano una lista di
+parti letterali e percorsi, renderizzata con un join senza regex.
+
+I compilati sono in cache: i template per testo, le condizioni per contenuto
+(JSON con chiavi ordinate).
+Per valutare la stessa regola su molti context ci sono evaluate_many e
+render_many.
+"""
+import json
+import re
+from functools import lru_cache
+
+
+CACHE_SIZE = 4096
+
+# Sintassi dei template: 'admin' = {{percorso}} (solo dict, None -> ''),
+# 'email' = {{ percorso }} di EmailService (dict o attributi, falsy -> '')
+_TEMPLATE_PATTERNS = {
+    'admin': re.compile(r'\{\{(.+?)\}\}'),
+    'email': re.compile(r'\{\{\s*([^}]+)\s*\}\}'),
+}
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def compile_path(path):
+    """'lead.stage' -> ('lead', 'stage')"""
+    return tuple(path.split('.'))
+
+
+def get_path(obj, parts):
+    """Valore nested da dict (None se il percorso attraversa un non-dict)"""
+    value = obj
+    for part in parts:
+        if isinstance(value, dict):
+            value = value.get(part)
+        else:
+            return None
+    return value
+
+
+def _get_email_path(obj, parts):
+    value = obj
+    for part in parts:
+        if isinstance(value, dict):
+            value = value.get(part, '')
+        elif hasattr(value, part):
+            value = getattr(value, part, '')
+        else:
+            return ''
+    return value
+
+
+# ==================== CONDIZIONI ====================
+
+def _to_float(value):
+    try:
+        return float(value)
+    except (ValueError, TypeError):
+        return None
+
+
+def _compile_operator(operator, expected):
+    """Test sul valore attuale (non None) con l'atteso già normalizzato"""
+    text = str(expected).lower()
+
+    if operator == 'equals':
+        return lambda actual: str(actual).lower() == text
+    if operator == 'not_equals':
+        return lambda actual: str(actual).lower() != text
+    if operator == 'contains':
+        return lambda actual: text in str(actual).lower()
+    if operator == 'not_contains':
+        return lambda actual: text not in str(actual).lower()
+    if operator == 'starts_with':
+        return lambda actual: str(actual).lower().startswith(text)
+    if operator == 'ends_with':
+        return lambda actual: str(actual).lower().endswith(text)
+    if operator in ('greater_than', 'less_than'):
+        bound = _to_float(expected)
+        if bound is None:
+            return lambda actual: False
+
+        def compare(actual):
+            number = _to_float(actual)
+            if number is None:
+                return False
+            return number > bound if operator == 'greater_than' else number < bound
+        return compare
+    if operator == 'is_empty':
+        return lambda actual: not actual
+    if operator == 'is_not_empty':
+        return bool
+    if operator == 'in_list':
+        values = expected if isinstance(expected, list) else [expected]
+        return lambda actual: actual in values
+    return lambda actual: False
+
+
+def compile_rule(rule):
+    """Closure context -> bool per una regola {field, operator, value}"""
+    parts = compile_path(rule.get('field', ''))
+    operator = rule.get('operator', 'equals')
+    test = _compile_operator(operator, rule.get('value'))
+    when_none = operator == 'is_empty'
+
+    def evaluate(context):
+        actual = get_path(context, parts)
+        if actual is None:
+            return when_none
+        return test(actual)
+    return evaluate
+
+
+class CompiledCondition:
+    """Condizioni {operator: AND|OR, rules: [...]} compilate"""
+
+    def __init__(self, conditions):
+        conditions = conditions or {}
+        self.rules = [compile_rule(rule) for rule in conditions.get('rules', [])]
+        self.any = conditions.get('operator', 'AND') != 'AND'
+
+    def evaluate(self, context):
+        if self.any:
+            for rule in self.rules:
+                if rule(context):
+                    return True
+            return not self.rules
+        for rule in self.rules:
+            if not rule(context):
+                return False
+        return True
+
+    def evaluate_many(self, contexts):
+        """Esito per ciascun context (stesso ordine)"""
+        return [self.evaluate(context) for context in contexts]
+
+
+# ==================== TEMPLATE ====================
+
+class CompiledTemplate:
+    """Template con variabili {{ ... }} pre-analizzato in parti letterali e percorsi"""
+
+    def __init__(self, template, style='admin'):
+        self.style = style
+        self._value = self._email_value if style == 'email' else self._admin_value
+        self.literals = []
+        self.paths = []
+        position = 0
+        for match in _TEMPLATE_PATTERNS[style].finditer(template):
+            self.literals.append(template[position:match.start()])
+            self.paths.append(compile_path(match.group(1).strip()))
+            position = match.end()
+        self.tail = template[position:]
+
+    @staticmethod
+    def _admin_value(context, parts):
+        value = get_path(context, parts)
+        return str(value) if value is not None else ''
+
+    @staticmethod
+    def _email_value(context, parts):
+        value = _get_email_path(context, parts)
+        return str(value) if value else ''
+
+    def render(self, context):
+        if not self.paths:
+            return self.tail
+        chunks = []
+        for literal, parts in zip(self.literals, self.paths):
+            chunks.append(literal)
+            chunks.append(self._value(context, parts))
+        chunks.append(self.tail)
+        return ''.join(chunks)
+
+    def render_many(self, contexts):
+        """Render per ciascun context (stesso ordine)"""
+        return [self.render(context) for context in contexts]
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def compile_template(template, style='admin'):
+    return CompiledTemplate(template, style)
+
+
+def render_template(template, context, style='admin'):
+    """Render con template in cache; testo vuoto/None restituito invariato"""
+    if not template:
+        return template
+    return compile_template(template, style).render(context)
+
+
+# ==================== CACHE CONDIZIONI ====================
+
+@lru_cache(maxsize=CACHE_SIZE)
+def _compile_conditions_json(key):
+    return CompiledCondition(json.loads(key))
+
+
+def compile_conditions(conditions):
+    """
+    Condizioni compilate in cache per contenuto (JSON con chiavi ordinate):
+    config uguali, anche se copiate per ogni esecuzione, condividono il
+    compilato e una config modificata non riusa quello vecchio.
+    """
+    return _compile_conditions_json(json.dumps(conditions or {}, sort_keys=True, default=str))
+
+
+def check_conditions(conditions, context):
+    """True se le condizioni sono soddisfatte (vuote = sempre vere)"""
+    if not conditions:
+        return True
+    return compile_conditions(conditions).evaluate(context)
@@ -0,0 +1,155 @@
+"""
+Sponsor Analytics Service - analytics sponsor della dashboard club.
+
+La timeline di acquisizione sponsor per mese e le coorti (tasso di rinnovo per
+stagione, valore per settore merceologico) sono calcolate con query aggregate
+su sponsors e head_of_terms, senza caricare le righe in Python; valore attivo e
+contratti in scadenza vengono dalla timeline contratti del club. I risultati
+sono in cache per club con la CatalogCache versionata, sulla stessa versione
+'contracts' della timeline contratti: ogni scrittura su Sponsor o HeadOfTerms
+la incrementa in cache_versions e invalida il club in tutti i processi.
+"""
+import os
+from datetime import datetime, timedelta
+
+from sqlalchemy import and_, case, distinct, exists, extract, func
+from sqlalchemy.orm import aliased
+
+from app import db
+from app.models import Sponsor, HeadOfTerms
+from app.services.inventory_catalog_service import CatalogCache
+from app.services.contract_timeline_service import ContractTimelineService, CONTRACTS_SCOPE
+
+
+CACHE_TTL = int(os.getenv('SPONSOR_ANALYTICS_CACHE_TTL', '300'))
+SEASON_START_MONTH = int(os.getenv('SEASON_START_MONTH', '7'))  # stagione sportiva luglio-giugno
+TIMELINE_DAYS = 365
+EXPIRING_DAYS = 60
+COHORT_SEASONS = 6
+
+analytics_cache = CatalogCache(CONTRACTS_SCOPE, ttl=CACHE_TTL, max_entries=1024)
+
+
+def season_label(start_year):
+    return f'{start_year}/{str(start_year + 1)[-2:]}'
+
+
+def _season_year(column):
+    """Anno di inizio della stagione sportiva di una data (SQL)"""
+    return extract('year', column) - case((extract('month', column) < SEASON_START_MONTH, 1), else_=0)
+
+
+class SponsorAnalyticsService:
+
+    # ------------------------------------------------------------------ riepilogo
+    @staticmethod
+    def _sponsors_timeline(club_id, now):
+        """Sponsor acquisiti per mese negli ultimi 12 mesi, raggruppati in SQL"""
+        year = extract('year', Sponsor.created_at)
+        month = extract('month', Sponsor.created_at)
+        rows = db.session.query(year, month, func.count(Sponsor.id)).filter(
+            Sponsor.club_id == club_id,
+            Sponsor.created_at >= now - timedelta(days=TIMELINE_DAYS)
+        ).group_by(year, month).order_by(year, month).all()
+        return [{'month': f'{int(y):04d}-{int(m):02d}', 'count': count} for y, m, count in rows]
+
+    @classmethod
+    def summary(cls, club_id):
+        """Valore attivo, timeline acquisizioni e contratti in scadenza del club"""
+        now = datetime.utcnow()
+        timeline = analytics_cache.get(club_id, ('sponsors_timeline',))
+        if timeline is None:
+            version = analytics_cache.version(club_id)
+            timeline = cls._sponsors_timeline(club_id, now)
+            analytics_cache.set(club_id, ('sponsors_timeline',), timeline, version)
+
+        # Contratti attivi e in scadenza dalla timeline contratti (sponsor già in join)
+        contracts = ContractTimelineService.for_club(club_id)
+        return {
+            'total_active_value': float(sum(c.compenso or 0 for c in contracts.contracts)),
+            'sponsors_timeline': timeline,
+            'expiring_contracts': [{
+                'contract_id': c.id,
+                'contract_name': c.nome_contratto,
+                'sponsor_id': c.sponsor_id,
+                'sponsor_name': c.sponsor_name,
+                'expiry_date': c.data_fine.isoformat(),
+                'days_left': (c.data_fine - now).days,
+                'value': c.compenso
+            } for c in contracts.expiring(EXPIRING_DAYS, now)]
+        }
+
+    # ------------------------------------------------------------------ coorti
+    @staticmethod
+    def _renewal_by_season(club_id, seasons):
+        """
+        Per stagione di scadenza: sponsor con un contratto scaduto e quanti
+        hanno un contratto successivo con il club (una sola query aggregata).
+        Solo contratti già scaduti: quelli ancora in corso non hanno avuto
+        occasione di rinnovo e abbasserebbero il tasso della stagione corrente.
+        """
+        later = aliased(HeadOfTerms)
+        season = _season_year(HeadOfTerms.data_fine)
+        renewed = exists().where(and_(
+            later.club_id == HeadOfTerms.club_id,
+            later.sponsor_id == HeadOfTerms.sponsor_id,
+            later.id != HeadOfTerms.id,
+            later.status != 'bozza',
+            later.data_inizio > HeadOfTerms.data_inizio
+        ))
+        rows = db.session.query(
+            season,
+            func.count(distinct(HeadOfTerms.sponsor_id)),
+            func.count(distinct(case((renewed, HeadOfTerms.sponsor_id)))),
+            func.sum(HeadOfTerms.compenso)
+        ).filter(
+            HeadOfTerms.club_id == club_id,
+            HeadOfTerms.status != 'bozza',
+            HeadOfTerms.data_fine < datetime.utcnow()
+        ).group_by(season).order_by(season.desc()).limit(seasons).all()
+
+        return [{
+            'stagione': season_label(int(start_year)),
+            'sponsor': cohort,
+            'rinnovati': renewed_count,
+            'tasso_rinnovo': round(renewed_count / cohort * 100, 1) if cohort else 0,
+            'valore': float(value or 0)
+        } for start_year, cohort, renewed_count, value in reversed(rows)]
+
+    @staticmethod
+    def _value_by_sector(club_id):
+        """Valore, contratti e sponsor dei contratti attivi per settore merceologico"""
+        sector = func.coalesce(func.nullif(Sponsor.settore_merceologico, ''), 'Non specificato')
+        rows = db.session.query(
+            sector,
+            func.count(distinct(Sponsor.id)),
+            func.count(HeadOfTerms.id),
+            func.sum(HeadOfTerms.compenso)
+        ).join(Sponsor, Sponsor.id == HeadOfTerms.sponsor_id).filter(
+            HeadOfTerms.club_id == club_id,
+            HeadOfTerms.status == 'attivo'
+        ).group_by(sector).order_by(func.sum(HeadOfTerms.compenso).desc()).all()
+
+        return [{
+            'settore': name,
+            'sponsor': sponsors,
+            'contratti': contracts,
+            'valore': float(value or 0),
+            'valore_medio_sponsor': round(float(value or 0) / sponsors, 2) if sponsors else 0
+        } for name, sponsors, contracts, value in rows]
+
+    @classmethod
+    def cohorts(cls, club_id, seasons=COHORT_SEASONS):
+        """Tasso di rinnovo per stagione e valore per settore"""
+        key = ('cohorts', seasons)
+        cached = analytics_cache.get(club_id, key)
+        if cached is not None:
+            return cached
+        version = analytics_cache.version(club_id)
+        result = {
+            'rinnovi_per_stagione': cls._renewal_by_season(club_id, seasons),
+            'valore_per_settore': cls._value_by_sector(club_id),
+        }
+        analytics_cache.set(club_id, key, result, version)
+        return result
+
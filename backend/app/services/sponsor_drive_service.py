@@ -0,0 +1,379 @@
+"""
+Sponsor Drive Service - indice metadati del drive condiviso club/sponsor.
+
+Ogni scrittura ORM su SponsorDriveFile applica la differenza tra stato
+precedente e nuovo ai contatori in sponsor_drive_counters (totale, cartella,
+categoria, collegamento), con UPDATE incrementali sulla connessione della
+flush. Le righe 'cartella' includono tutti gli antenati e formano l'albero
+cartelle: struttura, statistiche e conteggi per categoria si leggono dai
+contatori (costo proporzionale alle cartelle, non ai file). La lista file è
+paginata a keyset (created_at, id) con cursore opaco e la ricerca per nome
+usa la colonna normalizzata nome_search.
+"""
+import base64
+import json
+import re
+from datetime import datetime
+
+from sqlalchemy import or_, and_, event, inspect
+from sqlalchemy.orm import joinedload
+
+from app import db
+from app.models import SponsorDriveFile, SponsorDriveCounter
+from app.services.inventory_catalog_service import normalize_search
+from app.sql_upsert import upsert
+
+
+MAX_PAGE_SIZE = 200
+_FIELDS = ('club_id', 'sponsor_id', 'stato', 'cartella', 'categoria', 'file_size', 'visibile_sponsor',
+           'contract_id', 'activation_id', 'event_activation_id', 'inventory_asset_id')
+
+
+def normalize_folder(path):
+    """'Contratti//2024/' -> '/Contratti/2024'; vuoto -> '/'"""
+    parts = [p.strip() for p in re.split(r'/+', (path or '').strip()) if p.strip()]
+    return '/' + '/'.join(parts)
+
+
+def folder_ancestors(path):
+    """Antenati di una cartella, radice inclusa ('/A/B' -> ['/', '/A'])"""
+    parts = [p for p in path.split('/') if p]
+    return ['/'] + ['/' + '/'.join(parts[:i]) for i in range(1, len(parts))] if parts else []
+
+
+def parent_folder(path):
+    return None if path == '/' else (path.rsplit('/', 1)[0] or '/')
+
+
+def parse_tags(raw):
+    if not raw:
+        return []
+    try:
+        return json.loads(raw)
+    except (TypeError, ValueError):
+        return []
+
+
+class SponsorDriveService:
+
+    # ------------------------------------------------------------------ contatori (scrittura)
+    @staticmethod
+    def _contributions(values):
+        """{(club, sponsor, dimensione, valore): (file, byte, file_sponsor, byte_sponsor)} di un file"""
+        if not values or (values['stato'] or 'attivo') != 'attivo':
+            return {}, set()
+        size = values['file_size'] or 0
+        visible = values['visibile_sponsor'] is not False
+        delta = (1, size, 1 if visible else 0, size if visible else 0)
+        scope = (values['club_id'], values['sponsor_id'])
+        folder = normalize_folder(values['cartella'])
+
+        keys = [('totale', '*'), ('cartella', folder), ('categoria', values['categoria'] or 'altro')]
+        if values['contract_id']:
+            keys.append(('collegamento', 'contract'))
+        if values['activation_id'] or values['event_activation_id']:
+            keys.append(('collegamento', 'activation'))
+        if values['inventory_asset_id']:
+            keys.append(('collegamento', 'asset'))
+
+        ancestors = {scope + ('cartella', path) for path in folder_ancestors(folder)}
+        return {scope + key: delta for key in keys}, ancestors
+
+    @classmethod
+    def apply_change(cls, connection, before, after):
+        """Applica ai contatori la differenza tra due stati di un file (None = assente)"""
+        old, _ = cls._contributions(before)
+        new, ensure = cls._contributions(after)
+
+        deltas = {}
+        for key in set(old) | set(new):
+            a = new.get(key, (0, 0, 0, 0))
+            b = old.get(key, (0, 0, 0, 0))
+            deltas[key] = tuple(x - y for x, y in zip(a, b))
+        for key in ensure:
+            deltas.setdefault(key, (0, 0, 0, 0))
+
+        counters = SponsorDriveCounter.__table__
+        now = datetime.utcnow()
+        for (club_id, sponsor_id, dimensione, valore), (files, size, s_files, s_size) in deltas.items():
+            if club_id is None or sponsor_id is None:
+                continue
+            if not any((files, size, s_files, s_size)) and (club_id, sponsor_id, dimensione, valore) not in ensure:
+                continue
+            # Upsert atomico sulla chiave composta: due flush concorrenti che
+            # creano la stessa riga non falliscono sulla PK
+            upsert(connection, counters,
+                   keys={'club_id': club_id, 'sponsor_id': sponsor_id, 'dimensione': dimensione, 'valore': valore},
+                   insert_values={
+                       'files_count': max(0, files), 'bytes_total': max(0, size),
+                       'sponsor_files_count': max(0, s_files), 'sponsor_bytes_total': max(0, s_size),
+                       'updated_at': now,
+                   },
+                   update_values={
+                       'files_count': counters.c.files_count + files,
+                       'bytes_total': counters.c.bytes_total + size,
+                       'sponsor_files_count': counters.c.sponsor_files_count + s_files,
+                       'sponsor_bytes_total': counters.c.sponsor_bytes_total + s_size,
+                       'updated_at': now,
+                   })
+
+    @classmethod
+    def rebuild(cls, club_id=None, sponsor_id=None):
+        """Ricalcola da zero i contatori (tutti o di un club/sponsor) e fa commit"""
+        counters = SponsorDriveCounter.query
+        files = db.session.query(*[getattr(SponsorDriveFile, f) for f in _FIELDS]).filter(
+            SponsorDriveFile.stato == 'attivo'
+        )
+        if club_id is not None:
+            counters = counters.filter_by(club_id=club_id)
+            files = files.filter(SponsorDriveFile.club_id == club_id)
+        if sponsor_id is not None:
+            counters = counters.filter_by(sponsor_id=sponsor_id)
+            files = files.filter(SponsorDriveFile.sponsor_id == sponsor_id)
+        counters.delete(synchronize_session=False)
+
+        connection = db.session.connection()
+        for row in files.all():
+            cls.apply_change(connection, None, dict(zip(_FIELDS, row)))
+        db.session.commit()
+
+    # ------------------------------------------------------------------ contatori (lettura)
+    @staticmethod
+    def _counter_rows(club_id, sponsor_id, dimensione=None):
+        query = SponsorDriveCounter.query.filter_by(club_id=club_id, sponsor_id=sponsor_id)
+        if dimensione:
+            query = query.filter_by(dimensione=dimensione)
+        return query.all()
+
+    @staticmethod
+    def _count(row, sponsor_view):
+        if row is None:
+            return 0, 0
+        if sponsor_view:
+            return row.sponsor_files_count or 0, row.sponsor_bytes_total or 0
+        return row.files_count or 0, row.bytes_total or 0
+
+    @classmethod
+    def folder_tree(cls, club_id, sponsor_id, sponsor_view=False):
+        """Cartelle con file diretti e totali di sottoalbero (ordinate per path)"""
+        nodes = {}
+        for row in cls._counter_rows(club_id, sponsor_id, 'cartella'):
+            files, size = cls._count(row, sponsor_view)
+            nodes[row.valore] = {
+                'path': row.valore,
+                'name': row.valore.split('/')[-1] if row.valore != '/' else 'Root',
+                'parent': parent_folder(row.valore),
+                'depth': row.valore.count('/') if row.valore != '/' else 0,
+                'files_count': files,
+                'size_bytes': size,
+                'subtree_files_count': files,
+                'subtree_size_bytes': size,
+            }
+
+        # Totali di sottoalbero risalendo dalle cartelle più profonde
+        for path in sorted(nodes, key=lambda p: nodes[p]['depth'], reverse=True):
+            parent = nodes.get(nodes[path]['parent'])
+            if parent is not None:
+                parent['subtree_files_count'] += nodes[path]['subtree_files_count']
+                parent['subtree_size_bytes'] += nodes[path]['subtree_size_bytes']
+
+        return [
+            node for path, node in sorted(nodes.items())
+            if node['files_count'] or (path != '/' and node['subtree_files_count'])
+        ]
+
+    @classmethod
+    def categories(cls, club_id, sponsor_id, sponsor_view=False):
+        result = []
+        for row in cls._counter_rows(club_id, sponsor_id, 'categoria'):
+            files, _ = cls._count(row, sponsor_view)
+            if files:
+                result.append({'categoria': row.valore, 'count': files})
+        return sorted(result, key=lambda c: c['categoria'])
+
+    @classmethod
+    def total_files(cls, club_id, sponsor_id, sponsor_view=False):
+        row = SponsorDriveCounter.query.get((club_id, sponsor_id, 'totale', '*'))
+        return cls._count(row, sponsor_view)[0]
+
+    @classmethod
+    def stats(cls, club_id, sponsor_id):
+        """Statistiche drive (stessa forma di /drive/stats) dai contatori"""
+        rows = cls._counter_rows(club_id, sponsor_id)
+        by_key = {(r.dimensione, r.valore): r for r in rows}
+        total_files, total_size = cls._count(by_key.get(('totale', '*')), False)
+        return {
+            'total_files': total_files,
+            'total_size_bytes': total_size,
+            'by_category': [
+                {'categoria': r.valore, 'count': r.files_count}
+                for r in sorted(rows, key=lambda r: r.valore) if r.dimensione == 'categoria' and r.files_count
+            ],
+            'files_with_contract': cls._count(by_key.get(('collegamento', 'contract')), False)[0],
+            'files_with_activation': cls._count(by_key.get(('collegamento', 'activation')), False)[0],
+            'files_with_asset': cls._count(by_key.get(('collegamento', 'asset')), False)[0],
+            'folders_count': sum(1 for r in rows if r.dimensione == 'cartella' and r.files_count),
+        }
+
+    # ------------------------------------------------------------------ lista file
+    @staticmethod
+    def encode_cursor(file):
+        raw = json.dumps([file.created_at.isoformat() if file.created_at else None, file.id])
+        return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii')
+
+    @staticmethod
+    def decode_cursor(cursor):
+        """Ritorna (created_at, id); ValueError se il cursore non è valido"""
+        try:
+            created_at, file_id = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+            return (datetime.fromisoformat(created_at) if created_at else None), int(file_id)
+        except Exception:
+            raise ValueError('Cursore non valido')
+
+    @staticmethod
+    def serialize(f, sponsor_view=False):
+        data = {
+            'id': f.id,
+            'nome': f.nome,
+            'file_url': f.file_url,
+            'file_size': f.file_size,
+            'file_type': f.file_type,
+            'estensione': f.estensione,
+            'descrizione': f.descrizione,
+            'categoria': f.categoria,
+            'cartella': f.cartella,
+            'tags': parse_tags(f.tags),
+            'contract_id': f.contract_id,
+            'contract_nome': f.contract.nome_contratto if f.contract else None,
+        }
+        if not sponsor_view:
+            data.update({
+                'activation_id': f.activation_id,
+                'event_activation_id': f.event_activation_id,
+                'inventory_asset_id': f.inventory_asset_id,
+                'inventory_asset_nome': f.inventory_asset.nome if f.inventory_asset else None,
+            })
+        data.update({
+            'caricato_da': f.caricato_da,
+            'caricato_da_nome': f.caricato_da_nome,
+            'thumbnail_url': f.thumbnail_url,
+            'created_at': f.created_at.isoformat() if f.created_at else None,
+        })
+        if not sponsor_view:
+            data['updated_at'] = f.updated_at.isoformat() if f.updated_at else None
+        return data
+
+    @classmethod
+    def list_files(cls, club_id, sponsor_id, filters, limit=None, cursor=None, sponsor_view=False):
+        """
+        File attivi del drive, più recenti prima. Senza limit ritorna tutti i
+        file (compatibilità), altrimenti una pagina e il cursore successivo.
+        """
+        position = cls.decode_cursor(cursor) if cursor else None
+        if limit is not None:
+            limit = max(1, min(limit, MAX_PAGE_SIZE))
+
+        query = SponsorDriveFile.query.filter_by(club_id=club_id, sponsor_id=sponsor_id, stato='attivo')
+        if sponsor_view:
+            query = query.filter_by(visibile_sponsor=True)
+        for field in ('contract_id', 'activation_id', 'event_activation_id', 'inventory_asset_id', 'categoria'):
+            if filters.get(field):
+                query = query.filter(getattr(SponsorDriveFile, field) == filters[field])
+        if filters.get('cartella'):
+            query = query.filter(SponsorDriveFile.cartella == normalize_folder(filters['cartella']))
+        for term in normalize_search(filters.get('search')).split()[:5]:
+            escaped = term.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+            query = query.filter(SponsorDriveFile.nome_search.like(f'%{escaped}%', escape='\\'))
+
+        total = query.order_by(None).count() if limit is not None else None
+
+        query = query.options(joinedload(SponsorDriveFile.contract))
+        if not sponsor_view:
+            query = query.options(joinedload(SponsorDriveFile.inventory_asset))
+        query = query.order_by(SponsorDriveFile.created_at.desc(), SponsorDriveFile.id.desc())
+        if position:
+            created_at, last_id = position
+            query = query.filter(or_(
+                SponsorDriveFile.created_at < created_at,
+                and_(SponsorDriveFile.created_at == created_at, SponsorDriveFile.id < last_id)
+            ))
+
+        if limit is not None:
+            files = query.limit(limit + 1).all()
+            has_more = len(files) > limit
+            files = files[:limit]
+        else:
+            files = query.all()
+            has_more = False
+            total = len(files)
+
+        return {
+            'total': total,
+            'files': [cls.serialize(f, sponsor_view) for f in files],
+            'pagination': {
+                'limit': limit,
+                'has_more': has_more,
+                'next_cursor': cls.encode_cursor(files[-1]) if has_more else None
+            }
+        }
+
+
+# ------------------------------------------------------------------ listeners
+_listeners_registered = False
+
+
+def _snapshot(target, previous=False):
+    """Valori dei campi indicizzati; previous=True per quelli prima della flush"""
+    attrs = inspect(target).attrs
+    values = {}
+    for field in _FIELDS:
+        history = attrs[field].history
+        if previous and history.has_changes():
+            values[field] = history.deleted[0] if history.deleted else None
+        else:
+            values[field] = getattr(target, field)
+    return values
+
+
+def _keep_previous(target, value, oldvalue, initiator):
+    """
+    Listener 'set' registrato con active_history: l'ORM carica il valore
+    precedente anche se l'attributo era scaduto (es. dopo un commit), così
+    history.deleted in _snapshot non resta vuoto e i contatori non derivano.
+    """
+
+
+def _normalize_fields(mapper, connection, target):
+    target.cartella = normalize_folder(target.cartella)
+    target.nome_search = normalize_search(target.nome)[:300]
+
+
+def _on_insert(mapper, connection, target):
+    SponsorDriveService.apply_change(connection, None, _snapshot(target))
+
+
+def _on_update(mapper, connection, target):
+    SponsorDriveService.apply_change(connection, _snapshot(target, previous=True), _snapshot(target))
+
+
+def _on_delete(mapper, connection, target):
+    SponsorDriveService.apply_change(connection, _snapshot(target, previous=True), None)
+
+
+def _register_listeners():
+    global _listeners_registered
+    if _listeners_registered:
+        return
+    for field in _FIELDS:
+        event.listen(getattr(SponsorDriveFile, field), 'set', _keep_previous, active_history=True)
+    event.listen(SponsorDriveFile, 'before_insert', _normalize_fields)
+    event.listen(SponsorDriveFile, 'before_update', _normalize_fields)
+    event.listen(SponsorDriveFile, 'after_insert', _on_insert)
+    event.listen(SponsorDriveFile, 'after_update', _on_update)
+    event.listen(SponsorDriveFile, 'after_delete', _on_delete)
+    _listeners_registered = True
+
+
+def init_app(app):
+    """Registra i listener che mantengono sponsor_drive_counters e nome_search"""
+    _register_listeners()
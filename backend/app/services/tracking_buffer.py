@@ -0,0 +1,351 @@
+"""
+Tracking Buffer - ingestione write-behind degli eventi di tracking pubblici.
+
+Le visualizzazioni/interazioni su proposte pubbliche e risorse non scrivono
+più sul DB a ogni richiesta: gli eventi vengono accodati in memoria e un
+thread li scrive ogni TRACKING_FLUSH_INTERVAL secondi con INSERT multipli.
+I contatori (visualizzazioni, tempo_visualizzazione_totale, download_pdf,
+views_count, downloads_count) sono accumulati per entità e applicati con un
+solo UPDATE incrementale per entità. Bot/crawler e visualizzazioni ripetute
+dallo stesso visitatore entro TRACKING_DEDUP_WINDOW vengono scartati. Lo
+stesso thread esegue ogni TRACKING_ROLLUP_INTERVAL secondi il rollup degli
+analytics proposte.
+
+Con TRACKING_BUFFER_ENABLED=false ogni evento viene scritto subito (es. test).
+"""
+import atexit
+import hashlib
+import os
+import re
+import threading
+import time
+from collections import defaultdict
+from datetime import datetime
+
+from sqlalchemy import bindparam, func, insert
+
+
+FLUSH_INTERVAL = float(os.getenv('TRACKING_FLUSH_INTERVAL', '5'))
+MAX_BUFFERED = int(os.getenv('TRACKING_MAX_BUFFERED', '5000'))
+DEDUP_WINDOW = int(os.getenv('TRACKING_DEDUP_WINDOW', '1800'))  # 30 minuti
+ROLLUP_INTERVAL = float(os.getenv('TRACKING_ROLLUP_INTERVAL', '60'))
+MAX_DURATION = 3600  # durata massima accettata per singolo evento (secondi)
+
+BOT_PATTERN = re.compile(
+    r'bot|crawl|spider|slurp|preview|fetch|facebookexternalhit|whatsapp|telegram|'
+    r'slack|discord|skype|curl|wget|python-requests|httpclient|headless|lighthouse|monitor',
+    re.IGNORECASE
+)
+
+
+def is_bot(user_agent):
+    """True per user agent vuoti o riconducibili a bot, crawler e link preview"""
+    return not user_agent or bool(BOT_PATTERN.search(user_agent))
+
+
+def visitor_fingerprint(ip_address, user_agent):
+    raw = f"{ip_address or ''}|{user_agent or ''}"
+    return hashlib.sha1(raw.encode('utf-8', 'ignore')).hexdigest()
+
+
+class TrackingBuffer:
+
+    def __init__(self):
+        self.app = None
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._thread = None
+        self._early_flush = False  # flush anticipato (buffer pieno) già avviato
+        self._enabled = os.getenv('TRACKING_BUFFER_ENABLED', 'true').lower() == 'true'
+        self._reset_buffers()
+        self._seen = {}  # chiave dedup -> scadenza (monotonic)
+
+    def _reset_buffers(self):
+        self._proposal_rows = []
+        self._resource_rows = []
+        self._proposal_deltas = defaultdict(lambda: {'views': 0, 'seconds': 0, 'downloads': 0, 'last_view': None})
+        self._resource_deltas = defaultdict(lambda: {'views': 0, 'downloads': 0})
+
+    def init_app(self, app):
+        self.app = app
+        atexit.register(self.flush)
+
+    # ------------------------------------------------------------------ dedup
+    def _is_duplicate(self, key):
+        now = time.monotonic()
+        expires = self._seen.get(key)
+        if expires and expires > now:
+            return True
+        self._seen[key] = now + DEDUP_WINDOW
+        return False
+
+    def _prune_seen(self):
+        now = time.monotonic()
+        with self._lock:
+            for key in [k for k, exp in self._seen.items() if exp <= now]:
+                del self._seen[key]
+
+    # ------------------------------------------------------------------ record
+    def record_proposal_event(self, proposal_id, evento, ip_address=None, user_agent=None,
+                              referrer=None, sezione=None, dettaglio=None, durata_secondi=None):
+        """
+        Accoda un evento su proposta pubblica. Ritorna False se scartato
+        (bot o visualizzazione duplicata).
+        """
+        user_agent = (user_agent or '')[:500]
+        if is_bot(user_agent):
+            return False
+
+        try:
+            durata = max(0, min(int(durata_secondi), MAX_DURATION)) if durata_secondi else None
+        except (TypeError, ValueError):
+            durata = None
+
+        now = datetime.utcnow()
+        with self._lock:
+            if evento == 'view' and self._is_duplicate(
+                    ('proposal', proposal_id, visitor_fingerprint(ip_address, user_agent))):
+                return False
+
+            self._proposal_rows.append({
+                'proposal_id': proposal_id,
+                'evento': evento,
+                'sezione': sezione,
+                'dettaglio': dettaglio,
+                'durata_secondi': durata,
+                'ip_address': ip_address,
+                'user_agent': user_agent,
+                'referrer': (referrer or '')[:500] or None,
+                'created_at': now,
+            })
+            delta = self._proposal_deltas[proposal_id]
+            if evento == 'view':
+                delta['views'] += 1
+                delta['last_view'] = now
+            elif evento == 'download':
+                delta['downloads'] += 1
+            if durata:
+                delta['seconds'] += durata
+            pending = len(self._proposal_rows) + len(self._resource_rows)
+
+        self._after_record(pending)
+        return True
+
+    def record_resource_action(self, resource_id, user_type, user_id, action_type,
+                               ip_address=None, user_agent=None):
+        """Accoda view/download di una risorsa. Ritorna False se scartato."""
+        user_agent = (user_agent or '')[:500]
+        if is_bot(user_agent):
+            return False
+
+        visitor = f'{user_type}:{user_id}' if user_id else visitor_fingerprint(ip_address, user_agent)
+        with self._lock:
+            if action_type == 'view' and self._is_duplicate(('resource', resource_id, visitor)):
+                return False
+
+            self._resource_rows.append({
+                'resource_id': resource_id,
+                'user_type': user_type,
+                'user_id': user_id,
+                'tipo_azione': action_type,
+                'ip_address': ip_address,
+                'user_agent': user_agent,
+                'created_at': datetime.utcnow(),
+            })
+            delta = self._resource_deltas[resource_id]
+            if action_type == 'view':
+                delta['views'] += 1
+            elif action_type == 'download':
+                delta['downloads'] += 1
+            pending = len(self._proposal_rows) + len(self._resource_rows)
+
+        self._after_record(pending)
+        return True
+
+    def _after_record(self, pending):
+        self._ensure_thread()  # flush periodico e rollup analytics
+        if not self._enabled:
+            self.flush()
+            return
+        if pending >= MAX_BUFFERED:
+            with self._lock:
+                if self._early_flush:
+                    return
+                self._early_flush = True
+            threading.Thread(target=self._early_flush_run, daemon=True).start()
+
+    def _early_flush_run(self):
+        """Flush anticipato a buffer pieno: al massimo uno alla volta"""
+        try:
+            self.flush()
+        finally:
+            with self._lock:
+                self._early_flush = False
+
+    # ------------------------------------------------------------------ flush
+    def _ensure_thread(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._thread = threading.Thread(target=self._run_loop, daemon=True)
+            self._thread.start()
+            print(f"[TrackingBuffer] Started (flush ogni {FLUSH_INTERVAL}s)")
+
+    def _run_loop(self):
+        last_rollup = time.monotonic()
+        while True:
+            time.sleep(FLUSH_INTERVAL)
+            try:
+                self.flush()
+                self._prune_seen()
+            except Exception as e:
+                print(f"[TrackingBuffer] Errore flush: {e}")
+            if time.monotonic() - last_rollup >= ROLLUP_INTERVAL:
+                last_rollup = time.monotonic()
+                try:
+                    self._rollup()
+                except Exception as e:
+                    print(f"[TrackingBuffer] Errore rollup analytics: {e}")
+
+    def _rollup(self):
+        """
+        Aggiorna gli aggregati analytics proposte. Gira a intervallo fisso e
+        non dopo ogni flush: le righe entrano nel rollup solo dopo
+        PROPOSAL_ROLLUP_LAG secondi.
+        """
+        with self.app.app_context():
+            from app.services.proposal_analytics_service import ProposalAnalyticsService
+            ProposalAnalyticsService.rollup()
+
+    def _swap(self):
+        with self._lock:
+            batch = (self._proposal_rows, self._resource_rows,
+                     dict(self._proposal_deltas), dict(self._resource_deltas))
+            self._reset_buffers()
+        return batch
+
+    def flush(self):
+        """Scrive gli eventi accodati: INSERT multipli + un UPDATE per entità"""
+        if self.app is None:
+            return 0
+        with self._flush_lock:
+            proposal_rows, resource_rows, proposal_deltas, resource_deltas = self._swap()
+            if not proposal_rows and not resource_rows:
+                return 0
+
+            with self.app.app_context():
+                from app import db
+                try:
+                    proposal_rows, resource_rows, proposal_deltas, resource_deltas = self._existing_only(
+                        db, proposal_rows, resource_rows, proposal_deltas, resource_deltas)
+                    self._write(db, proposal_rows, resource_rows, proposal_deltas, resource_deltas)
+                    db.session.commit()
+                except Exception as e:
+                    db.session.rollback()
+                    print(f"[TrackingBuffer] Flush in blocco fallito, riprovo per entità: {e}")
+                    return self._write_per_entity(db, proposal_rows, resource_rows, proposal_deltas, resource_deltas)
+            return len(proposal_rows) + len(resource_rows)
+
+    @staticmethod
+    def _existing_only(db, proposal_rows, resource_rows, proposal_deltas, resource_deltas):
+        """
+        Scarta gli eventi di proposte/risorse eliminate dopo l'accodamento: una
+        sola riga con FK non valida farebbe fallire l'intero INSERT multiplo.
+        """
+        from app.models import Proposal, Resource
+
+        def existing(model, ids):
+            if not ids:
+                return set()
+            return {row[0] for row in db.session.query(model.id).filter(model.id.in_(ids)).all()}
+
+        proposal_ids = existing(Proposal, set(proposal_deltas))
+        resource_ids = existing(Resource, set(resource_deltas))
+        dropped = (len(proposal_deltas) - len(proposal_ids)) + (len(resource_deltas) - len(resource_ids))
+        if dropped:
+            print(f"[TrackingBuffer] Scartati eventi di {dropped} entità non più esistenti")
+        return (
+            [r for r in proposal_rows if r['proposal_id'] in proposal_ids],
+            [r for r in resource_rows if r['resource_id'] in resource_ids],
+            {pid: d for pid, d in proposal_deltas.items() if pid in proposal_ids},
+            {rid: d for rid, d in resource_deltas.items() if rid in resource_ids},
+        )
+
+    def _write_per_entity(self, db, proposal_rows, resource_rows, proposal_deltas, resource_deltas):
+        """
+        Fallback dopo un flush in blocco fallito: righe e contatori di ogni
+        entità vengono scritti in un savepoint separato, così un'entità non
+        valida perde solo i propri eventi e non l'intero batch.
+        """
+        groups = [
+            ([r for r in proposal_rows if r['proposal_id'] == pid], [], {pid: d}, {})
+            for pid, d in proposal_deltas.items()
+        ] + [
+            ([], [r for r in resource_rows if r['resource_id'] == rid], {}, {rid: d})
+            for rid, d in resource_deltas.items()
+        ]
+        written = lost = 0
+        for group in groups:
+            count = len(group[0]) + len(group[1])
+            try:
+                with db.session.begin_nested():
+                    self._write(db, *group)
+                written += count
+            except Exception as e:
+                lost += count
+                print(f"[TrackingBuffer] {count} eventi persi per {list(group[2] or group[3])}: {e}")
+        try:
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            print(f"[TrackingBuffer] Flush fallito, {written + lost} eventi persi: {e}")
+            return 0
+        return written
+
+    @staticmethod
+    def _write(db, proposal_rows, resource_rows, proposal_deltas, resource_deltas):
+        from app.models import Proposal, ProposalTracking, Resource, ResourceView
+
+        if proposal_rows:
+            db.session.execute(insert(ProposalTracking), proposal_rows)
+        if resource_rows:
+            db.session.execute(insert(ResourceView), resource_rows)
+
+        if proposal_deltas:
+            proposals = Proposal.__table__
+            db.session.execute(
+                proposals.update()
+                .where(proposals.c.id == bindparam('b_id'))
+                .values(
+                    visualizzazioni=func.coalesce(proposals.c.visualizzazioni, 0) + bindparam('b_views'),
+                    tempo_visualizzazione_totale=func.coalesce(proposals.c.tempo_visualizzazione_totale, 0) + bindparam('b_seconds'),
+                    download_pdf=func.coalesce(proposals.c.download_pdf, 0) + bindparam('b_downloads'),
+                    ultima_visualizzazione=func.coalesce(bindparam('b_last_view'), proposals.c.ultima_visualizzazione),
+                ),
+                [{'b_id': pid, 'b_views': d['views'], 'b_seconds': d['seconds'],
+                  'b_downloads': d['downloads'], 'b_last_view': d['last_view']}
+                 for pid, d in proposal_deltas.items()]
+            )
+
+        if resource_deltas:
+            resources = Resource.__table__
+            db.session.execute(
+                resources.update()
+                .where(resources.c.id == bindparam('b_id'))
+                .values(
+                    views_count=func.coalesce(resources.c.views_count, 0) + bindparam('b_views'),
+                    downloads_count=func.coalesce(resources.c.downloads_count, 0) + bindparam('b_downloads'),
+                ),
+                [{'b_id': rid, 'b_views': d['views'], 'b_downloads': d['downloads']}
+                 for rid, d in resource_deltas.items()]
+            )
+
+
+# Istanza globale
+tracking_buffer = TrackingBuffer()
+
+
+def init_app(app):
+    tracking_buffer.init_app(app)
@@ -0,0 +1,214 @@
+"""
+WhatsApp Client - gateway HTTP verso il sidecar Node.js (whatsapp-service).
+
+Una requests.Session condivisa tiene le connessioni keep-alive verso il
+sidecar e ogni endpoint ha un timeout (connessione, lettura) breve e proprio.
+Un circuit breaker apre il circuito dopo BREAKER_FAILURES errori consecutivi
+di connessione o timeout: per BREAKER_COOLDOWN secondi le chiamate falliscono
+subito con SidecarUnavailable invece di occupare un worker, poi una sola
+richiesta di prova decide se richiuderlo. Le liste di chat e contatti sono in
+cache per pochi secondi; i media sono inoltrati in streaming, senza
+decodificare il JSON del sidecar.
+"""
+import os
+import threading
+import time
+
+from app.lazy_imports import lazy_import
+
+requests = lazy_import('requests')
+
+
+SIDECAR_URL = os.getenv('WHATSAPP_SIDECAR_URL', 'http://localhost:3200')
+POOL_SIZE = int(os.getenv('WHATSAPP_SIDECAR_POOL', '10'))
+BREAKER_FAILURES = int(os.getenv('WHATSAPP_BREAKER_FAILURES', '3'))
+BREAKER_COOLDOWN = int(os.getenv('WHATSAPP_BREAKER_COOLDOWN', '30'))
+STREAM_CHUNK = 64 * 1024
+
+# Timeout (connessione, lettura) in secondi per endpoint
+TIMEOUTS = {
+    'status': (1, 3),
+    'qr': (1, 3),
+    'chats': (1, 5),
+    'contacts': (1, 5),
+    'search': (0.5, 1.5),
+    'messages': (1, 10),
+    'messages_by_phone': (1, 10),
+    'media': (1, 20),
+    'send': (1, 15),
+    'disconnect': (1, 10),
+}
+DEFAULT_TIMEOUT = (1, 10)
+
+# Secondi di validità delle risposte in cache
+CACHE_TTL = {
+    'chats': 10,
+    'contacts': 60,
+}
+
+
+class SidecarUnavailable(Exception):
+    """Sidecar non raggiungibile (errore di rete, timeout o circuito aperto)"""
+
+
+class CircuitBreaker:
+    """Circuit breaker: closed -> open dopo `threshold` errori -> half-open dopo `cooldown`"""
+
+    def __init__(self, threshold=BREAKER_FAILURES, cooldown=BREAKER_COOLDOWN):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self._lock = threading.Lock()
+        self._failures = 0
+        self._opened_at = None
+        self._probing = False
+
+    @property
+    def state(self):
+        with self._lock:
+            if self._opened_at is None:
+                return 'closed'
+            if time.monotonic() - self._opened_at >= self.cooldown:
+                return 'half_open'
+            return 'open'
+
+    def allow(self):
+        """True se la richiesta può partire (in half-open passa solo la richiesta di prova)"""
+        with self._lock:
+            if self._opened_at is None:
+                return True
+            if self._probing or time.monotonic() - self._opened_at < self.cooldown:
+                return False
+            self._probing = True
+            return True
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._probing = False
+
+    def release_probe(self):
+        """Chiude una richiesta di prova senza esito (nessun errore contato)"""
+        with self._lock:
+            self._probing = False
+
+    def record_failure(self):
+        """Registra un errore; True se il circuito si è appena aperto"""
+        with self._lock:
+            self._failures += 1
+            self._probing = False
+            if self._opened_at is not None:
+                self._opened_at = time.monotonic()
+                return False
+            if self._failures >= self.threshold:
+                self._opened_at = time.monotonic()
+                return True
+            return False
+
+
+class WhatsAppSidecarClient:
+    """Client del sidecar con sessione condivisa, breaker e cache TTL (thread-safe)"""
+
+    def __init__(self, base_url=None, breaker=None):
+        self.base_url = (base_url or SIDECAR_URL).rstrip('/')
+        self.breaker = breaker or CircuitBreaker()
+        self._session = None
+        self._session_lock = threading.Lock()
+        self._cache_lock = threading.Lock()
+        self._cache = {}  # chiave -> (scadenza, dati, status)
+
+    def _get_session(self):
+        if self._session is None:
+            with self._session_lock:
+                if self._session is None:
+                    session = requests.Session()
+                    adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=POOL_SIZE)
+                    session.mount('http://', adapter)
+                    session.mount('https://', adapter)
+                    self._session = session
+        return self._session
+
+    def request(self, method, path, endpoint, stream=False, **kwargs):
+        """Richiesta al sidecar. Ritorna la Response (qualunque status HTTP) o solleva SidecarUnavailable."""
+        if not self.breaker.allow():
+            raise SidecarUnavailable('circuito aperto')
+        recorded = False
+        try:
+            try:
+                resp = self._get_session().request(
+                    method, f'{self.base_url}{path}',
+                    timeout=TIMEOUTS.get(endpoint, DEFAULT_TIMEOUT), stream=stream, **kwargs
+                )
+            except requests.RequestException as e:
+                recorded = True
+                if self.breaker.record_failure():
+                    print(f"[WhatsAppClient] Sidecar non raggiungibile, circuito aperto per {self.breaker.cooldown}s: {e}")
+                raise SidecarUnavailable(str(e)) from e
+            recorded = True
+            self.breaker.record_success()
+            return resp
+        finally:
+            if not recorded:
+                # Errore inatteso: libera la richiesta di prova del half-open
+                self.breaker.release_probe()
+
+    # ------------------------------------------------------------------ cache
+    def _cached(self, key):
+        with self._cache_lock:
+            entry = self._cache.get(key)
+            if entry and entry[0] > time.monotonic():
+                return entry[1], entry[2]
+        return None
+
+    def invalidate(self, key=None):
+        with self._cache_lock:
+            if key is None:
+                self._cache.clear()
+            else:
+                self._cache.pop(key, None)
+
+    # ------------------------------------------------------------------ API
+    def get_json(self, path, endpoint, params=None, cache_key=None):
+        """GET con risposta JSON -> (dati, status). Con cache_key le risposte 200 restano in cache per CACHE_TTL."""
+        if cache_key:
+            cached = self._cached(cache_key)
+            if cached:
+                return cached
+
+        resp = self.request('GET', path, endpoint, params=params)
+        data = resp.json()
+        if cache_key and resp.status_code == 200:
+            with self._cache_lock:
+                self._cache[cache_key] = (time.monotonic() + CACHE_TTL.get(cache_key, 10), data, resp.status_code)
+        return data, resp.status_code
+
+    def post_json(self, path, endpoint, data=None):
+        """POST JSON -> (dati, status)"""
+        resp = self.request('POST', path, endpoint, json=data or {})
+        return resp.json(), resp.status_code
+
+    def stream(self, path, endpoint, chunk_size=STREAM_CHUNK):
+        """GET inoltrato a blocchi -> (iteratore di bytes, status, content type)"""
+        resp = self.request('GET', path, endpoint, stream=True)
+
+        def body():
+            try:
+                for chunk in resp.iter_content(chunk_size=chunk_size):
+                    if chunk:
+                        yield chunk
+            finally:
+                resp.close()
+
+        return body(), resp.status_code, resp.headers.get('Content-Type', 'application/json')
+
+    def send_message(self, to, message, media=None):
+        """Invia un messaggio (la lista chat in cache viene invalidata)"""
+        payload = {'to': to, 'message': message}
+        if media:
+            payload['media'] = media
+        data, status = self.post_json('/send', 'send', payload)
+        self.invalidate('chats')
+        return data, status
+
+
+whatsapp_client = WhatsAppSidecarClient()
@@ -0,0 +1,203 @@
+"""
+Workflow Plan - compilazione di steps/trigger_config in piani di esecuzione.
+
+Automazioni club e workflow admin salvano steps e trigger_config come JSON
+libero. Il compilatore li trasforma una volta in un WorkflowPlan validato:
+step normalizzati con tipo verificato e delay in minuti, primo delay
+(sequenze email), filtri del trigger pronti da confrontare ed eventuali errori
+di configurazione. I piani sono in cache LRU per (tipo, id) e restano validi
+finché updated_at non cambia; se cambia ma steps e trigger_config sono
+identici (es. aggiornamento di last_run o next_run) il piano viene riusato.
+"""
+import json
+import os
+import threading
+from collections import OrderedDict
+
+
+PLAN_CACHE_SIZE = int(os.getenv('WORKFLOW_PLAN_CACHE_SIZE', '512'))
+
+# Filtri di transizione per trigger admin: trigger_type -> [(chiave config, campo entity_data)]
+TRANSITION_FILTERS = {
+    'lead_stage_changed': [('from_stage', 'old_stage'), ('to_stage', 'new_stage')],
+    'contract_status_changed': [('from_status', 'old_status'), ('to_status', 'new_status')],
+}
+
+
+def delay_minutes(config):
+    """Minuti totali di uno step delay ({minutes, hours, days})"""
+    config = config or {}
+    return int(config.get('minutes') or 0) + int(config.get('hours') or 0) * 60 + int(config.get('days') or 0) * 1440
+
+
+class PlanStep:
+    """Step normalizzato di un piano"""
+
+    def __init__(self, index, step_id, step_type, config, delay=0, branch=None, parent_condition_id=None):
+        self.index = index
+        self.id = step_id
+        self.type = step_type
+        self.config = config
+        self.delay = delay
+        self.branch = branch
+        self.parent_condition_id = parent_condition_id
+
+    @property
+    def branch_key(self):
+        if self.parent_condition_id and self.branch:
+            return f"{self.parent_condition_id}:{self.branch}"
+        return None
+
+
+class WorkflowPlan:
+    """Piano compilato di un'automazione/workflow"""
+
+    def __init__(self, steps, trigger_checks, errors):
+        self.steps = steps
+        self.trigger_checks = trigger_checks
+        self.errors = errors
+        self.first_delay = next((s.delay for s in steps if s.type == 'delay'), 0)
+
+    @property
+    def valid(self):
+        return not self.errors
+
+    def matches_trigger(self, entity_data):
+        """True se entity_data soddisfa i filtri del trigger (mai se la config non è valida)"""
+        if self.trigger_checks is None:
+            return False
+        for field, expected, is_list in self.trigger_checks:
+            actual = entity_data.get(field)
+            if is_list:
+                if actual not in expected:
+                    return False
+            elif actual != expected:
+                return False
+        return True
+
+
+class WorkflowCompiler:
+    """Compila e mette in cache i piani (thread-safe)"""
+
+    def __init__(self, max_size=PLAN_CACHE_SIZE):
+        self.max_size = max_size
+        self._lock = threading.Lock()
+        self._plans = OrderedDict()  # (tipo, id) -> (updated_at, fingerprint, piano)
+
+    def clear(self):
+        with self._lock:
+            self._plans.clear()
+
+    @staticmethod
+    def _fingerprint(workflow):
+        return json.dumps([workflow.steps, workflow.trigger_config], sort_keys=True, default=str)
+
+    def plan(self, kind, workflow, handlers):
+        """Piano di `workflow` (Automation o AdminWorkflow); kind = 'club' | 'admin'"""
+        key = (kind, workflow.id)
+        updated_at = workflow.updated_at
+        fingerprint = None
+        with self._lock:
+            cached = self._plans.get(key)
+            if cached and workflow.id is not None:
+                if cached[0] == updated_at:
+                    self._plans.move_to_end(key)
+                    return cached[2]
+        if cached:
+            fingerprint = self._fingerprint(workflow)
+            if cached[1] == fingerprint:
+                with self._lock:
+                    self._plans[key] = (updated_at, fingerprint, cached[2])
+                return cached[2]
+
+        plan = self.compile(kind, workflow.steps, workflow.trigger_config, handlers, workflow.trigger_type)
+        if plan.errors:
+            print(f"[WorkflowPlan] {kind} {workflow.id}: {'; '.join(plan.errors)}")
+        if workflow.id is not None:
+            with self._lock:
+                self._plans[key] = (updated_at, fingerprint or self._fingerprint(workflow), plan)
+                self._plans.move_to_end(key)
+                while len(self._plans) > self.max_size:
+                    self._plans.popitem(last=False)
+        return plan
+
+    @classmethod
+    def compile(cls, kind, steps, trigger_config, handlers, trigger_type=None):
+        errors = []
+        compiled = cls._compile_steps(kind, steps, handlers, errors)
+        return WorkflowPlan(compiled, cls._compile_trigger(kind, trigger_config, trigger_type, errors), errors)
+
+    @staticmethod
+    def _compile_steps(kind, steps, handlers, errors):
+        if steps is None:
+            steps = []
+        if not isinstance(steps, list):
+            errors.append('steps deve essere una lista')
+            return []
+
+        compiled = []
+        for index, step in enumerate(steps):
+            if not isinstance(step, dict):
+                errors.append(f'step {index}: formato non valido')
+                step = {}
+            step_type = step.get('type')
+            config = step.get('config') or {}
+            if not isinstance(config, dict):
+                errors.append(f'step {index}: config non valida')
+                config = {}
+
+            if step_type not in handlers:
+                errors.append(f'step {index}: tipo {step_type!r} sconosciuto')
+
+            try:
+                if kind == 'admin':
+                    delay = delay_minutes(config) if step_type == 'delay' else 0
+                else:
+                    delay = int(step.get('delay_minutes') or 0)
+            except (TypeError, ValueError):
+                errors.append(f'step {index}: delay non numerico')
+                delay = 0
+
+            compiled.append(PlanStep(
+                index=index,
+                step_id=str(step.get('id', index)),
+                step_type=step_type,
+                config=config,
+                delay=max(0, delay),
+                branch=step.get('branch'),
+                parent_condition_id=step.get('parent_condition_id')
+            ))
+
+        conditions = {s.id for s in compiled if s.type == 'condition'}
+        for s in compiled:
+            if s.parent_condition_id and str(s.parent_condition_id) not in conditions:
+                errors.append(f'step {s.index}: condizione {s.parent_condition_id} inesistente')
+        return compiled
+
+    @staticmethod
+    def _compile_trigger(kind, trigger_config, trigger_type, errors):
+        """[(campo, valore atteso, è_lista)]; None se la configurazione non è valida"""
+        trigger_config = trigger_config or {}
+        if not isinstance(trigger_config, dict):
+            errors.append('trigger_config non valida')
+            return None
+
+        checks = []
+        transitions = TRANSITION_FILTERS.get(trigger_type, ()) if kind == 'admin' else ()
+        for config_key, field in transitions:
+            if trigger_config.get(config_key):
+                checks.append((field, trigger_config[config_key], False))
+
+        filters = trigger_config.get('filters') or {}
+        if not isinstance(filters, dict):
+            errors.append('trigger_config.filters non valido')
+            return None
+        for field, expected in filters.items():
+            if isinstance(expected, list):
+                checks.append((field, tuple(expected), True))
+            else:
+                checks.append((field, expected, False))
+        return checks
+
+
+workflow_compiler = WorkflowCompiler()
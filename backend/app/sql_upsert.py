@@ -0,0 +1,48 @@
+"""
+Upsert atomico per contatori e righe di stato (chiave composta).
+
+    upsert(connection, table,
+           keys={'scope': 'inventory', 'club_id': 7},
+           insert_values={'version': 1},
+           update_values={'version': table.c.version + 1})
+
+Su PostgreSQL e SQLite è un solo INSERT ... ON CONFLICT DO UPDATE: due
+transazioni che creano la stessa riga non falliscono con IntegrityError, la
+seconda applica l'update. Sugli altri dialetti: UPDATE, poi INSERT in un
+savepoint e, se un'altra transazione ha inserito la riga nel frattempo,
+di nuovo UPDATE.
+"""
+from sqlalchemy import and_
+from sqlalchemy.exc import IntegrityError
+
+
+def _dialect_insert(connection):
+    name = connection.dialect.name
+    if name == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert
+        return insert
+    if name == 'sqlite':
+        from sqlalchemy.dialects.sqlite import insert
+        return insert
+    return None
+
+
+def upsert(connection, table, keys, insert_values, update_values):
+    """
+    Inserisce la riga `keys` + `insert_values` o, se esiste già, applica
+    `update_values` (espressioni sulle colonne di `table` ammesse).
+    """
+    insert = _dialect_insert(connection)
+    if insert is not None:
+        stmt = insert(table).values(**keys, **insert_values)
+        connection.execute(stmt.on_conflict_do_update(index_elements=list(keys), set_=update_values))
+        return
+
+    where = and_(*(table.c[name] == value for name, value in keys.items()))
+    if connection.execute(table.update().where(where).values(**update_values)).rowcount:
+        return
+    try:
+        with connection.begin_nested():
+            connection.execute(table.insert().values(**keys, **insert_values))
+    except IntegrityError:
+        connection.execute(table.update().where(where).values(**update_values))
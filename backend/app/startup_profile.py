@@ -0,0 +1,127 @@
+"""
+Profilo dei tempi di avvio di create_app().
+
+    flask --app run profile-startup [--top 25] [--json]
+
+Avvia un interprete separato con `python -X importtime`, esegue create_app()
+e riporta: tempo totale, memoria (max RSS), costo di import per pacchetto
+di primo livello e per modulo dell'app (cumulativo), e le dipendenze
+caricate in modo differito (app.lazy_imports) che l'avvio ha comunque
+importato.
+"""
+import json
+import os
+import subprocess
+import sys
+from collections import defaultdict
+
+
+_MARKER = '__STARTUP_PROFILE__'
+
+_CHILD_SCRIPT = f'''
+import json, resource, time
+started = time.perf_counter()
+from app import create_app
+create_app()
+elapsed = (time.perf_counter() - started) * 1000
+from app.lazy_imports import loaded_modules
+print({_MARKER!r} + json.dumps({{
+    'create_app_ms': round(elapsed, 2),
+    'max_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+    'lazy_modules': loaded_modules(),
+}}))
+'''
+
+
+def parse_importtime(stderr):
+    """Ritorna [(modulo, self_us, cumulative_us)] dall'output di -X importtime"""
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:'):
+            continue
+        parts = line[len('import time:'):].split('|')
+        if len(parts) != 3:
+            continue
+        try:
+            self_us = int(parts[0].strip())
+            cumulative_us = int(parts[1].strip())
+        except ValueError:
+            continue  # riga di intestazione
+        rows.append((parts[2].strip(), self_us, cumulative_us))
+    return rows
+
+
+def summarize(rows, top=25):
+    packages = defaultdict(int)
+    app_modules = []
+    for name, self_us, cumulative_us in rows:
+        packages[name.split('.')[0]] += self_us
+        if name == 'app' or name.startswith('app.'):
+            app_modules.append((name, cumulative_us))
+
+    return {
+        'total_import_ms': round(sum(self_us for _, self_us, _ in rows) / 1000, 2),
+        'packages': [
+            {'name': name, 'self_ms': round(us / 1000, 2)}
+            for name, us in sorted(packages.items(), key=lambda x: -x[1])[:top]
+        ],
+        'app_modules': [
+            {'name': name, 'cumulative_ms': round(us / 1000, 2)}
+            for name, us in sorted(app_modules, key=lambda x: -x[1])[:top]
+        ],
+    }
+
+
+def profile_startup(top=25):
+    """Esegue create_app() in un processo figlio e ritorna il report"""
+    env = dict(os.environ)
+    env.setdefault('WHATSAPP_SIDECAR_ENABLED', 'false')
+    env.setdefault('FLASK_ENV', 'production')
+    backend_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', _CHILD_SCRIPT],
+        cwd=backend_dir, env=env, capture_output=True, text=True
+    )
+
+    child = None
+    for line in result.stdout.splitlines():
+        if line.startswith(_MARKER):
+            child = json.loads(line[len(_MARKER):])
+    if result.returncode != 0 or child is None:
+        raise RuntimeError(f'create_app() fallita nel processo di profiling:\n{result.stderr[-2000:]}')
+
+    report = summarize(parse_importtime(result.stderr), top=top)
+    report.update(child)
+    return report
+
+
+def print_report(report):
+    print(f"create_app(): {report['create_app_ms']} ms - import totali {report['total_import_ms']} ms"
+          f" - max RSS {report['max_rss_kb'] / 1024:.1f} MB")
+    print('\nPacchetti (self time):')
+    for row in report['packages']:
+        print(f"  {row['name']:<40}{row['self_ms']:>10.2f} ms")
+    print('\nModuli app (cumulativo):')
+    for row in report['app_modules']:
+        print(f"  {row['name']:<40}{row['cumulative_ms']:>10.2f} ms")
+    eager = {name: ms for name, ms in report['lazy_modules'].items() if ms is not None}
+    if eager:
+        print('\nDipendenze differite importate durante l\'avvio:')
+        for name, ms in eager.items():
+            print(f"  {name:<40}{ms:>10.2f} ms")
+
+
+def register_cli(app):
+    import click
+
+    @app.cli.command('profile-startup')
+    @click.option('--top', default=25, help='Numero di righe per sezione')
+    @click.option('--json', 'as_json', is_flag=True, help='Output JSON')
+    def profile_startup_command(top, as_json):
+        """Profila i tempi di import di create_app()"""
+        report = profile_startup(top=top)
+        if as_json:
+            click.echo(json.dumps(report, indent=2))
+        else:
+            print_report(report)
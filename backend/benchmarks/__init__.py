@@ -0,0 +1,22 @@
+"""
+Benchmark harness - dataset sintetico multi-tenant e runner per gli endpoint più pesanti.
+
+Uso tipico (dalla cartella backend/):
+
+    python -m benchmarks.seed --database-url sqlite:////tmp/pp_bench.db --scale 0.25
+    python -m benchmarks.runner --database-url sqlite:////tmp/pp_bench.db --save-baseline
+    python -m benchmarks.runner --database-url sqlite:////tmp/pp_bench.db   # confronta con la baseline
+    python -m benchmarks.rules   # micro-benchmark condizioni/template automazioni
+    python -m benchmarks.whatsapp_sidecar bench   # client sidecar WhatsApp contro il sidecar finto
+"""
+import os
+
+
+def prepare_environment(database_url):
+    """
+    Imposta le variabili d'ambiente lette da create_app() prima di importarla:
+    database dedicato ai benchmark e sidecar WhatsApp disabilitato.
+    """
+    os.environ['DATABASE_URL'] = database_url
+    os.environ['WHATSAPP_SIDECAR_ENABLED'] = 'false'
+    os.environ.setdefault('FLASK_ENV', 'production')
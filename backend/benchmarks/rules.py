@@ -0,0 +1,244 @@
+"""
+Micro-benchmark delle regole automazioni: condizioni e template.
+
+Confronta l'implementazione precedente (percorsi con split a ogni chiamata,
+re.sub per render, anche nello stile di EmailService) con rule_compiler su un
+insieme di context sintetici, dopo aver verificato che i risultati coincidano.
+
+    python -m benchmarks.rules --contexts 2000 --repeat 5
+"""
+import argparse
+import random
+import re
+import sys
+import time
+from types import SimpleNamespace
+
+
+# ==================== IMPLEMENTAZIONE PRECEDENTE (riferimento) ====================
+
+def legacy_get_nested_value(obj, path):
+    value = obj
+    for part in path.split('.'):
+        if isinstance(value, dict):
+            value = value.get(part)
+        else:
+            return None
+    return value
+
+
+def legacy_evaluate_condition(actual, operator, expected):
+    if actual is None:
+        return operator == 'is_empty'
+    if operator == 'equals':
+        return str(actual).lower() == str(expected).lower()
+    elif operator == 'not_equals':
+        return str(actual).lower() != str(expected).lower()
+    elif operator == 'contains':
+        return str(expected).lower() in str(actual).lower()
+    elif operator == 'not_contains':
+        return str(expected).lower() not in str(actual).lower()
+    elif operator == 'greater_than':
+        try:
+            return float(actual) > float(expected)
+        except (ValueError, TypeError):
+            return False
+    elif operator == 'less_than':
+        try:
+            return float(actual) < float(expected)
+        except (ValueError, TypeError):
+            return False
+    elif operator == 'is_empty':
+        return not actual
+    elif operator == 'is_not_empty':
+        return bool(actual)
+    elif operator == 'in_list':
+        return actual in (expected if isinstance(expected, list) else [expected])
+    return False
+
+
+def legacy_check_conditions(conditions, context):
+    if not conditions:
+        return True
+    rules = conditions.get('rules', [])
+    if not rules:
+        return True
+    results = [
+        legacy_evaluate_condition(legacy_get_nested_value(context, r.get('field', '')),
+                                  r.get('operator', 'equals'), r.get('value'))
+        for r in rules
+    ]
+    return all(results) if conditions.get('operator', 'AND') == 'AND' else any(results)
+
+
+def legacy_render_template(template_str, context):
+    if not template_str:
+        return template_str
+
+    def replacer(match):
+        value = legacy_get_nested_value(context, match.group(1).strip())
+        return str(value) if value is not None else ''
+
+    return re.sub(r'\{\{(.+?)\}\}', replacer, template_str)
+
+
+def legacy_email_render_template(template_str, context):
+    """EmailService.render_template prima di rule_compiler (style='email')"""
+    def replace_var(match):
+        var_path = match.group(1).strip()
+        parts = var_path.split('.')
+
+        value = context
+        for part in parts:
+            if isinstance(value, dict):
+                value = value.get(part, '')
+            elif hasattr(value, part):
+                value = getattr(value, part, '')
+            else:
+                return ''
+
+        return str(value) if value else ''
+
+    pattern = r'\{\{\s*([^}]+)\s*\}\}'
+    return re.sub(pattern, replace_var, template_str)
+
+
+# ==================== DATI SINTETICI ====================
+
+CONDITIONS = {
+    'operator': 'AND',
+    'rules': [
+        {'field': 'lead.stage', 'operator': 'not_equals', 'value': 'perso'},
+        {'field': 'lead.temperatura', 'operator': 'in_list', 'value': ['hot', 'warm']},
+        {'field': 'lead.valore_stimato', 'operator': 'greater_than', 'value': '5000'},
+        {'field': 'lead.contatto_email', 'operator': 'contains', 'value': '@'},
+        {'field': 'lead.note', 'operator': 'is_empty'},
+    ]
+}
+
+TEMPLATE = (
+    '<p>Ciao {{lead.contatto_nome}} {{ lead.contatto_cognome }},</p>'
+    '<p>abbiamo preparato una proposta per {{lead.nome_club}} ({{lead.citta}}) '
+    'del valore di {{lead.valore_stimato}} EUR.</p>'
+    '<p>Fase attuale: {{lead.stage}} - priorita {{lead.priorita}}.</p>'
+    '<p>Scrivici a {{trigger_data.reply_to}} entro il {{lead.data_prossima_azione}}.</p>'
+)
+
+# Stile email: attributi di oggetti, valori falsy resi vuoti, percorsi mancanti
+EMAIL_TEMPLATE = (
+    '<p>Gentile {{ lead.contatto_nome }} {{lead.contatto_cognome}},</p>'
+    '<p>{{ club.nome }} ({{club.citta}}) ha aggiornato la proposta: '
+    '{{ lead.valore_stimato }} EUR, sconto {{club.sconto}}%.</p>'
+    '<p>Note: {{ lead.note }} {{ lead.inesistente.campo }} {{club.manca}}</p>'
+    '<p>Contatto: {{ club.referente.email }} - {{trigger_data.reply_to}}</p>'
+)
+
+
+def build_email_contexts(contexts, seed=7):
+    """Context email: i context base più un oggetto club con attributi annidati"""
+    rng = random.Random(seed)
+    return [
+        dict(c, club=SimpleNamespace(
+            nome=f'Club {i}',
+            citta=rng.choice(['Milano', 'Roma', None]),
+            sconto=rng.choice([0, 5, 10]),
+            referente=SimpleNamespace(email=rng.choice(['ref@club.it', '']))
+        ))
+        for i, c in enumerate(contexts)
+    ]
+
+
+def build_contexts(count, seed=42):
+    rng = random.Random(seed)
+    stages = ['nuovo', 'contattato', 'qualificato', 'proposta', 'vinto', 'perso']
+    contexts = []
+    for i in range(count):
+        contexts.append({
+            'trigger_data': {'entity_type': 'lead', 'entity_id': i, 'reply_to': 'sales@pitchpartner.it'},
+            'lead': {
+                'id': i,
+                'nome_club': f'ASD Club {i}',
+                'contatto_nome': rng.choice(['Marco', 'Giulia', 'Luca', 'Sara']),
+                'contatto_cognome': rng.choice(['Rossi', 'Bianchi', 'Verdi']),
+                'contatto_email': f'contatto{i}@club{i}.it' if rng.random() > 0.1 else None,
+                'stage': rng.choice(stages),
+                'temperatura': rng.choice(['hot', 'warm', 'cold']),
+                'valore_stimato': rng.randint(500, 20000),
+                'citta': rng.choice(['Milano', 'Roma', 'Torino', 'Napoli']),
+                'priorita': rng.randint(1, 5),
+                'note': None if rng.random() > 0.3 else 'da richiamare',
+                'data_prossima_azione': None,
+            },
+        })
+    return contexts
+
+
+# ==================== MISURA ====================
+
+def best_of(fn, repeat):
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def run(count=2000, repeat=5):
+    from app.services import rule_compiler
+
+    contexts = build_contexts(count)
+    email_contexts = build_email_contexts(contexts)
+
+    legacy_conditions = [legacy_check_conditions(CONDITIONS, c) for c in contexts]
+    legacy_templates = [legacy_render_template(TEMPLATE, c) for c in contexts]
+    assert legacy_conditions == [rule_compiler.check_conditions(CONDITIONS, c) for c in contexts]
+    assert legacy_templates == [rule_compiler.render_template(TEMPLATE, c) for c in contexts]
+    assert legacy_conditions == rule_compiler.compile_conditions(CONDITIONS).evaluate_many(contexts)
+    assert legacy_templates == rule_compiler.compile_template(TEMPLATE).render_many(contexts)
+    legacy_emails = [legacy_email_render_template(EMAIL_TEMPLATE, c) for c in email_contexts]
+    assert legacy_emails == [rule_compiler.render_template(EMAIL_TEMPLATE, c, style='email') for c in email_contexts]
+    assert ([legacy_email_render_template(TEMPLATE, c) for c in contexts]
+            == [rule_compiler.render_template(TEMPLATE, c, style='email') for c in contexts])
+
+    cases = [
+        ('conditions', lambda: [legacy_check_conditions(CONDITIONS, c) for c in contexts],
+         lambda: [rule_compiler.check_conditions(CONDITIONS, c) for c in contexts]),
+        ('conditions_bulk', lambda: [legacy_check_conditions(CONDITIONS, c) for c in contexts],
+         lambda: rule_compiler.compile_conditions(CONDITIONS).evaluate_many(contexts)),
+        ('template', lambda: [legacy_render_template(TEMPLATE, c) for c in contexts],
+         lambda: [rule_compiler.render_template(TEMPLATE, c) for c in contexts]),
+        ('template_bulk', lambda: [legacy_render_template(TEMPLATE, c) for c in contexts],
+         lambda: rule_compiler.compile_template(TEMPLATE).render_many(contexts)),
+        ('template_email', lambda: [legacy_email_render_template(EMAIL_TEMPLATE, c) for c in email_contexts],
+         lambda: [rule_compiler.render_template(EMAIL_TEMPLATE, c, style='email') for c in email_contexts]),
+    ]
+
+    results = {}
+    for name, legacy, compiled in cases:
+        legacy_s = best_of(legacy, repeat)
+        compiled_s = best_of(compiled, repeat)
+        results[name] = {
+            'legacy_us': round(legacy_s / count * 1e6, 3),
+            'compiled_us': round(compiled_s / count * 1e6, 3),
+            'speedup': round(legacy_s / compiled_s, 2) if compiled_s else None,
+        }
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Micro-benchmark condizioni/template delle automazioni')
+    parser.add_argument('--contexts', type=int, default=2000)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args(argv)
+
+    results = run(args.contexts, args.repeat)
+    print(f"{'caso':<18}{'legacy us':>12}{'compilato us':>14}{'speedup':>10}")
+    for name, r in results.items():
+        print(f"{name:<18}{r['legacy_us']:>12.3f}{r['compiled_us']:>14.3f}{r['speedup']:>9.2f}x")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
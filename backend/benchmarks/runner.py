@@ -0,0 +1,238 @@
+"""
+Benchmark runner per gli endpoint più pesanti.
+
+Esegue ogni endpoint con il test client Flask, misura latenza (p50/p95) e numero
+di query SQL per richiesta, e confronta i risultati con una baseline salvata in
+JSON. Esce con codice 1 se un endpoint regredisce oltre la tolleranza.
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+from datetime import datetime, timedelta
+
+from benchmarks import prepare_environment
+
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baseline.json')
+
+
+def _calendar_range():
+    now = datetime.utcnow()
+    start = (now - timedelta(days=15)).strftime('%Y-%m-%dT%H:%M:%S')
+    end = (now + timedelta(days=15)).strftime('%Y-%m-%dT%H:%M:%S')
+    return f'start={start}&end={end}'
+
+
+# (nome, ruolo, path) - il path può essere una callable valutata a ogni run
+ENDPOINTS = [
+    ('admin_kpi_dashboard', 'admin', lambda: f'/api/admin/kpi/dashboard?year={datetime.utcnow().year}'),
+    ('admin_analytics', 'admin', '/api/admin/analytics?period=90'),
+    ('club_leads', 'club', '/api/club/leads'),
+    ('inventory_assets', 'club', '/api/club/inventory/assets?limit=50'),
+    ('inventory_stats', 'club', '/api/club/inventory/stats'),
+    ('press_feed', 'club', '/api/press-feed'),
+    ('resources_search', 'club', '/api/resources?search=sponsor'),
+    ('calendar_aggregate', 'club', lambda: f'/api/club/calendar/aggregate?{_calendar_range()}'),
+    ('marketplace_geo', 'club', '/api/club/marketplace/discover/geo?lat=45.4642&lng=9.19&radius=300'),
+    ('sponsor_dashboard', 'sponsor', '/api/sponsor/dashboard'),
+]
+
+
+class QueryCounter:
+    """Conta le query eseguite sull'engine tramite gli eventi SQLAlchemy"""
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.count = 0
+
+    def _on_execute(self, conn, cursor, statement, parameters, context, executemany):
+        self.count += 1
+
+    def __enter__(self):
+        from sqlalchemy import event
+        self.count = 0
+        event.listen(self.engine, 'before_cursor_execute', self._on_execute)
+        return self
+
+    def __exit__(self, *exc):
+        from sqlalchemy import event
+        event.remove(self.engine, 'before_cursor_execute', self._on_execute)
+        return False
+
+
+def percentile(values, pct):
+    """Percentile con interpolazione lineare (values non vuota)"""
+    ordered = sorted(values)
+    if len(ordered) == 1:
+        return ordered[0]
+    k = (len(ordered) - 1) * (pct / 100.0)
+    lower = int(k)
+    upper = min(lower + 1, len(ordered) - 1)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (k - lower)
+
+
+def build_tokens(app):
+    """Crea un token JWT per ciascun ruolo usando le stesse claim dei login reali"""
+    from flask_jwt_extended import create_access_token
+    from app.models import Admin, ClubUser, Sponsor
+
+    with app.app_context():
+        admin = Admin.query.order_by(Admin.id).first()
+        club_user = ClubUser.query.order_by(ClubUser.id).first()
+        membership = Sponsor.query.filter(
+            Sponsor.sponsor_account_id.isnot(None),
+            Sponsor.membership_status == 'active'
+        ).order_by(Sponsor.id).first()
+
+        if not admin or not club_user or not membership:
+            raise RuntimeError('Database vuoto: eseguire prima python -m benchmarks.seed')
+
+        return {
+            'admin': create_access_token(
+                identity=str(admin.id),
+                additional_claims={'role': 'admin'}
+            ),
+            'club': create_access_token(
+                identity=str(club_user.id),
+                additional_claims={'role': 'club', 'user_id': club_user.id, 'club_id': club_user.club_id}
+            ),
+            'sponsor': create_access_token(
+                identity=str(membership.sponsor_account_id),
+                additional_claims={
+                    'role': 'sponsor',
+                    'auth_type': 'account',
+                    'current_club_id': membership.club_id,
+                    'membership_id': membership.id
+                }
+            ),
+        }
+
+
+def run_benchmarks(app, iterations=20, warmup=2, only=None):
+    """Esegue gli endpoint e ritorna {nome: {p50_ms, p95_ms, queries, status}}"""
+    from app import db
+
+    tokens = build_tokens(app)
+    client = app.test_client()
+    results = {}
+
+    with app.app_context():
+        engine = db.engine
+
+    for name, role, path in ENDPOINTS:
+        if only and name not in only:
+            continue
+        headers = {'Authorization': f'Bearer {tokens[role]}'}
+        timings = []
+        queries = []
+        status = None
+
+        for i in range(warmup + iterations):
+            url = path() if callable(path) else path
+            with QueryCounter(engine) as counter:
+                started = time.perf_counter()
+                response = client.get(url, headers=headers)
+                elapsed = (time.perf_counter() - started) * 1000
+            status = response.status_code
+            if i >= warmup:
+                timings.append(elapsed)
+                queries.append(counter.count)
+
+        results[name] = {
+            'p50_ms': round(percentile(timings, 50), 2),
+            'p95_ms': round(percentile(timings, 95), 2),
+            'queries': int(statistics.median(queries)),
+            'status': status,
+        }
+    return results
+
+
+def compare_with_baseline(results, baseline, tolerance=0.25, query_tolerance=0):
+    """
+    Ritorna la lista delle regressioni: p95 oltre baseline * (1 + tolerance)
+    oppure numero di query oltre baseline + query_tolerance.
+    """
+    regressions = []
+    for name, current in results.items():
+        reference = baseline.get(name)
+        if not reference:
+            continue
+        if current['p95_ms'] > reference['p95_ms'] * (1 + tolerance):
+            regressions.append(
+                f"{name}: p95 {current['p95_ms']}ms > baseline {reference['p95_ms']}ms (+{int(tolerance * 100)}%)"
+            )
+        if current['queries'] > reference['queries'] + query_tolerance:
+            regressions.append(
+                f"{name}: {current['queries']} query > baseline {reference['queries']}"
+            )
+    return regressions
+
+
+def print_report(results, baseline=None):
+    baseline = baseline or {}
+    print(f"{'endpoint':<24}{'status':>8}{'p50 ms':>10}{'p95 ms':>10}{'queries':>9}{'base p95':>10}{'base q':>8}")
+    for name, r in results.items():
+        ref = baseline.get(name, {})
+        print(f"{name:<24}{r['status']:>8}{r['p50_ms']:>10.2f}{r['p95_ms']:>10.2f}{r['queries']:>9}"
+              f"{ref.get('p95_ms', '-'):>10}{ref.get('queries', '-'):>8}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark degli endpoint più pesanti')
+    parser.add_argument('--database-url', default='sqlite:////tmp/pitch_partner_bench.db')
+    parser.add_argument('--iterations', type=int, default=20)
+    parser.add_argument('--warmup', type=int, default=2)
+    parser.add_argument('--endpoint', action='append', help='Esegui solo questi endpoint (ripetibile)')
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE, help='File JSON della baseline')
+    parser.add_argument('--save-baseline', action='store_true', help='Sovrascrive la baseline con i risultati')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='Tolleranza relativa sul p95')
+    parser.add_argument('--query-tolerance', type=int, default=0, help='Query extra tollerate per endpoint')
+    parser.add_argument('--seed', action='store_true', help='Popola il database se vuoto')
+    parser.add_argument('--scale', type=float, default=0.25, help='Scala del seed (con --seed)')
+    args = parser.parse_args(argv)
+
+    prepare_environment(args.database_url)
+    from app import create_app, db
+    from app import models  # noqa: F401 - registra le tabelle
+
+    app = create_app()
+    if args.seed:
+        from benchmarks.seed import seed, resolve_factors
+        with app.app_context():
+            db.create_all()
+            if not models.Club.query.first():
+                seed(resolve_factors(args.scale))
+
+    results = run_benchmarks(app, iterations=args.iterations, warmup=args.warmup, only=args.endpoint)
+
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f).get('endpoints', {})
+
+    print_report(results, baseline)
+
+    if args.save_baseline:
+        with open(args.baseline, 'w') as f:
+            json.dump({
+                'generated_at': datetime.utcnow().isoformat(),
+                'iterations': args.iterations,
+                'endpoints': results,
+            }, f, indent=2, sort_keys=True)
+        print(f'[Benchmark] Baseline salvata in {args.baseline}')
+        return 0
+
+    failed = [name for name, r in results.items() if r['status'] >= 400]
+    regressions = compare_with_baseline(results, baseline, args.tolerance, args.query_tolerance)
+    for name in failed:
+        print(f'[Benchmark] ERRORE: {name} ha risposto {results[name]["status"]}')
+    for line in regressions:
+        print(f'[Benchmark] REGRESSIONE: {line}')
+    return 1 if (failed or regressions) else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,525 @@
+"""
+Generatore di dataset sintetico multi-tenant per i benchmark.
+
+Costruisce club, utenti club, sponsor (account + membership), contratti, lead,
+messaggi, notifiche, inventario con allocazioni, post press, eventi calendario,
+opportunità marketplace e dati admin (CRM lead, contratti, fatture) sopra lo
+schema di app/models.py.
+
+Le quantità sono espresse per club (o globali) e moltiplicate per --scale;
+ogni fattore può essere sovrascritto con --factor nome=valore.
+"""
+import argparse
+import random
+from datetime import datetime, date, timedelta
+
+from benchmarks import prepare_environment
+
+
+# Quantità di riferimento a scale=1.0
+DEFAULT_FACTORS = {
+    'clubs': 200,
+    'sponsors_per_club': 15,
+    'leads_per_club': 20,
+    'lead_activities_per_lead': 3,
+    'messages_per_sponsor': 5,
+    'notifications_per_club': 30,
+    'assets_per_club': 20,
+    'allocations_per_club': 30,
+    'press_posts_per_club': 10,
+    'calendar_events_per_club': 20,
+    'matches_per_club': 19,
+    'opportunities': 300,
+    'crm_leads': 500,
+    'invoices_per_contract': 6,
+}
+
+# Fattori che non vengono scalati (sono già "per entità")
+PER_ENTITY_FACTORS = {'lead_activities_per_lead', 'invoices_per_contract'}
+
+BENCH_PASSWORD = 'benchmark'
+
+SPORTS = ['calcio', 'volley', 'basket', 'rugby', 'pallanuoto']
+SECTORS = ['bevande', 'automotive', 'banche', 'assicurazioni', 'energia', 'food', 'tech', 'abbigliamento']
+PLANS = ['basic', 'premium', 'elite', 'kickoff']
+LEAD_STATUSES = ['nuovo', 'contattato', 'in_trattativa', 'proposta_inviata', 'negoziazione', 'vinto', 'perso']
+CRM_STAGES = ['nuovo', 'contattato', 'qualificato', 'demo', 'proposta', 'negoziazione', 'vinto', 'perso']
+CITIES = [
+    ('Milano', 'MI', 'Lombardia', 45.4642, 9.1900),
+    ('Torino', 'TO', 'Piemonte', 45.0703, 7.6869),
+    ('Bologna', 'BO', 'Emilia-Romagna', 44.4949, 11.3426),
+    ('Firenze', 'FI', 'Toscana', 43.7696, 11.2558),
+    ('Roma', 'RM', 'Lazio', 41.9028, 12.4964),
+    ('Napoli', 'NA', 'Campania', 40.8518, 14.2681),
+    ('Bari', 'BA', 'Puglia', 41.1171, 16.8719),
+    ('Verona', 'VR', 'Veneto', 45.4384, 10.9916),
+]
+
+
+def resolve_factors(scale=1.0, overrides=None):
+    """Applica scala e override ai fattori di default"""
+    factors = {}
+    for name, value in DEFAULT_FACTORS.items():
+        if name in PER_ENTITY_FACTORS:
+            factors[name] = value
+        else:
+            factors[name] = max(1, int(round(value * scale)))
+    for name, value in (overrides or {}).items():
+        if name not in DEFAULT_FACTORS:
+            raise ValueError(f'Fattore sconosciuto: {name}')
+        factors[name] = int(value)
+    return factors
+
+
+def _flush_every(session, items, size=500):
+    """Aggiunge gli oggetti in blocchi per contenere la memoria della sessione"""
+    for i in range(0, len(items), size):
+        session.add_all(items[i:i + size])
+        session.flush()
+
+
+def seed(factors, rng_seed=42, verbose=True):
+    """
+    Popola il database corrente (richiede app context) e ritorna un dizionario
+    con i conteggi per tabella.
+    """
+    from werkzeug.security import generate_password_hash
+    from app import db
+    from app.models import (
+        Admin, Club, ClubUser, SponsorAccount, Sponsor, HeadOfTerms, Lead, LeadActivity,
+        Message, Notification, InventoryCategory, InventoryAsset, AssetAllocation,
+        PressPublication, CalendarEvent, Match, MarketplaceOpportunity, CRMLead,
+        CRMLeadActivity, AdminContract, AdminInvoice
+    )
+
+    rng = random.Random(rng_seed)
+    session = db.session
+    now = datetime.utcnow()
+    today = now.date()
+    counts = {}
+
+    # Un solo hash riutilizzato: pbkdf2 su migliaia di account renderebbe il seed lentissimo
+    password_hash = generate_password_hash(BENCH_PASSWORD, method='pbkdf2:sha256')
+
+    def log(msg):
+        if verbose:
+            print(f'[BenchSeed] {msg}')
+
+    # ---------- Admin ----------
+    admin = Admin(email='bench-admin@pitchpartner.it', password_hash=password_hash,
+                  nome='Bench', cognome='Admin')
+    session.add(admin)
+    session.flush()
+    counts['admins'] = 1
+
+    # ---------- Club + utenti ----------
+    clubs = []
+    for i in range(factors['clubs']):
+        city = rng.choice(CITIES)
+        clubs.append(Club(
+            nome=f'Bench Club {i + 1}',
+            tipologia=rng.choice(SPORTS),
+            email=f'club{i + 1}@bench.pitchpartner.it',
+            telefono=f'+39 02 {rng.randint(1000000, 9999999)}',
+            indirizzo_sede_legale=f'Via Stadio {i + 1}, {city[0]}',
+            nome_abbonamento=rng.choice(PLANS).capitalize(),
+            account_attivo=True,
+            is_activated=True,
+            created_at=now - timedelta(days=rng.randint(0, 720)),
+        ))
+    _flush_every(session, clubs)
+
+    # Un ClubUser per club creato nello stesso ordine: alcuni blueprint leggono
+    # il club_id dall'identity del token, così user.id == club.id
+    club_users = [ClubUser(
+        club_id=club.id,
+        email=f'owner@club{club.id}.bench.pitchpartner.it',
+        password_hash=password_hash,
+        nome='Owner',
+        cognome=f'Club {club.id}',
+    ) for club in clubs]
+    _flush_every(session, club_users)
+    counts['clubs'] = len(clubs)
+    log(f'{len(clubs)} club creati')
+
+    # ---------- Sponsor (account globali + membership) ----------
+    sponsors = []
+    accounts = []
+    for club in clubs:
+        for j in range(factors['sponsors_per_club']):
+            sector = rng.choice(SECTORS)
+            name = f'Sponsor {club.id}-{j + 1}'
+            account = None
+            if j % 3 == 0:
+                account = SponsorAccount(
+                    email=f'sponsor{club.id}-{j + 1}@bench.pitchpartner.it',
+                    password_hash=password_hash,
+                    ragione_sociale=name,
+                    settore_merceologico=sector,
+                )
+                accounts.append(account)
+            sponsors.append(Sponsor(
+                club_id=club.id,
+                sponsor_account=account,
+                membership_status='active',
+                ragione_sociale=name,
+                settore_merceologico=sector,
+                email=f'contatti{club.id}-{j + 1}@bench.pitchpartner.it',
+                telefono=f'+39 3{rng.randint(100000000, 999999999)}',
+                created_at=now - timedelta(days=rng.randint(0, 540)),
+            ))
+    _flush_every(session, sponsors)
+    counts['sponsor_accounts'] = len(accounts)
+    counts['sponsors'] = len(sponsors)
+    log(f'{len(sponsors)} sponsor creati')
+
+    sponsors_by_club = {}
+    for sponsor in sponsors:
+        sponsors_by_club.setdefault(sponsor.club_id, []).append(sponsor)
+
+    # ---------- Contratti sponsor (HeadOfTerms) ----------
+    contracts = []
+    for sponsor in sponsors:
+        start = now - timedelta(days=rng.randint(30, 700))
+        end = start + timedelta(days=rng.choice([365, 730]))
+        contracts.append(HeadOfTerms(
+            club_id=sponsor.club_id,
+            sponsor_id=sponsor.id,
+            nome_contratto=f'Contratto {sponsor.ragione_sociale}',
+            compenso=rng.randint(5, 200) * 1000,
+            data_inizio=start,
+            data_fine=end,
+            status='attivo' if end > now else 'scaduto',
+        ))
+    _flush_every(session, contracts)
+    counts['head_of_terms'] = len(contracts)
+
+    contracts_by_club = {}
+    for contract in contracts:
+        contracts_by_club.setdefault(contract.club_id, []).append(contract)
+
+    # ---------- Lead + attività ----------
+    leads = []
+    for club in clubs:
+        for j in range(factors['leads_per_club']):
+            leads.append(Lead(
+                club_id=club.id,
+                ragione_sociale=f'Prospect {club.id}-{j + 1}',
+                settore_merceologico=rng.choice(SECTORS),
+                status=rng.choice(LEAD_STATUSES),
+                valore_stimato=rng.randint(1, 100) * 1000,
+                probabilita_chiusura=rng.randint(0, 100),
+                fonte=rng.choice(['referral', 'evento', 'social', 'cold_call', 'website']),
+                priorita=rng.randint(1, 3),
+                telefono=f'+39 3{rng.randint(100000000, 999999999)}',
+                data_prossimo_contatto=now + timedelta(days=rng.randint(-10, 30)),
+            ))
+    _flush_every(session, leads)
+    counts['leads'] = len(leads)
+
+    lead_activities = []
+    for lead in leads:
+        for k in range(factors['lead_activities_per_lead']):
+            when = now - timedelta(days=rng.randint(0, 120))
+            lead_activities.append(LeadActivity(
+                lead_id=lead.id,
+                club_id=lead.club_id,
+                tipo=rng.choice(['chiamata', 'meeting', 'email', 'nota']),
+                titolo=f'Attività {k + 1}',
+                data_attivita=when,
+                data_followup=when + timedelta(days=rng.randint(1, 40)) if k == 0 else None,
+            ))
+    _flush_every(session, lead_activities)
+    counts['lead_activities'] = len(lead_activities)
+    log(f'{len(leads)} lead e {len(lead_activities)} attività create')
+
+    # ---------- Messaggi ----------
+    messages = []
+    for sponsor in sponsors:
+        for k in range(factors['messages_per_sponsor']):
+            from_club = k % 2 == 0
+            messages.append(Message(
+                club_id=sponsor.club_id,
+                sponsor_id=sponsor.id,
+                sender_type='club' if from_club else 'sponsor',
+                sender_id=sponsor.club_id if from_club else sponsor.id,
+                sender_name=f'Bench Club {sponsor.club_id}' if from_club else sponsor.ragione_sociale,
+                testo=f'Messaggio di benchmark {k + 1}',
+                letto=rng.random() < 0.7,
+                data_invio=now - timedelta(minutes=rng.randint(0, 60 * 24 * 90)),
+            ))
+    _flush_every(session, messages, size=2000)
+    counts['messages'] = len(messages)
+
+    # ---------- Notifiche ----------
+    notifications = []
+    for club in clubs:
+        for k in range(factors['notifications_per_club']):
+            notifications.append(Notification(
+                user_type='club',
+                user_id=club.id,
+                tipo=rng.choice(['task_assegnato', 'project_update', 'scadenza_imminente', 'commento']),
+                titolo=f'Notifica {k + 1}',
+                messaggio='Notifica generata dal seed di benchmark',
+                letta=rng.random() < 0.5,
+                created_at=now - timedelta(hours=rng.randint(0, 24 * 60)),
+            ))
+    _flush_every(session, notifications, size=2000)
+    counts['notifications'] = len(notifications)
+    log(f'{len(messages)} messaggi e {len(notifications)} notifiche create')
+
+    # ---------- Inventario + allocazioni ----------
+    categories = []
+    for club in clubs:
+        for code, name in [('led', 'LED'), ('jersey', 'Maglia'), ('hospitality', 'Hospitality'), ('digital', 'Digital')]:
+            categories.append(InventoryCategory(club_id=club.id, nome=name, codice=code))
+    _flush_every(session, categories)
+    categories_by_club = {}
+    for category in categories:
+        categories_by_club.setdefault(category.club_id, []).append(category)
+
+    assets = []
+    for club in clubs:
+        for j in range(factors['assets_per_club']):
+            category = rng.choice(categories_by_club[club.id])
+            quantity = rng.choice([1, 1, 1, 10, 50])
+            assets.append(InventoryAsset(
+                club_id=club.id,
+                category_id=category.id,
+                nome=f'{category.nome} {j + 1}',
+                descrizione=f'Asset {category.nome.lower()} numero {j + 1} del club {club.id}',
+                tipo=rng.choice(['fisico', 'digitale', 'esperienza']),
+                quantita_totale=quantity,
+                quantita_disponibile=quantity,
+                prezzo_listino=rng.randint(1, 50) * 1000,
+            ))
+    _flush_every(session, assets)
+    counts['inventory_assets'] = len(assets)
+
+    assets_by_club = {}
+    for asset in assets:
+        assets_by_club.setdefault(asset.club_id, []).append(asset)
+
+    allocations = []
+    for club in clubs:
+        club_contracts = contracts_by_club.get(club.id, [])
+        if not club_contracts:
+            continue
+        for _ in range(factors['allocations_per_club']):
+            asset = rng.choice(assets_by_club[club.id])
+            contract = rng.choice(club_contracts)
+            start = today - timedelta(days=rng.randint(0, 300))
+            allocations.append(AssetAllocation(
+                asset_id=asset.id,
+                club_id=club.id,
+                contract_id=contract.id,
+                sponsor_id=contract.sponsor_id,
+                stagione=f'{start.year}-{(start.year + 1) % 100:02d}',
+                data_inizio=start,
+                data_fine=start + timedelta(days=rng.choice([30, 90, 180, 365])),
+                quantita=1,
+                prezzo_concordato=asset.prezzo_listino,
+                status='attiva',
+            ))
+    _flush_every(session, allocations)
+    counts['asset_allocations'] = len(allocations)
+    log(f'{len(assets)} asset e {len(allocations)} allocazioni create')
+
+    # ---------- Partite ----------
+    matches = []
+    for club in clubs:
+        for k in range(factors['matches_per_club']):
+            matches.append(Match(
+                club_id=club.id,
+                data_ora=now + timedelta(days=7 * (k - factors['matches_per_club'] // 2)),
+                avversario=f'Avversario {k + 1}',
+                competizione='Campionato',
+            ))
+    _flush_every(session, matches)
+    counts['matches'] = len(matches)
+
+    # ---------- Press ----------
+    posts = []
+    for club in clubs:
+        club_sponsors = sponsors_by_club.get(club.id, [])
+        for k in range(factors['press_posts_per_club']):
+            by_sponsor = club_sponsors and k % 3 == 2
+            author = rng.choice(club_sponsors) if by_sponsor else club
+            posts.append(PressPublication(
+                author_type='sponsor' if by_sponsor else 'club',
+                author_id=author.id,
+                author_name=author.ragione_sociale if by_sponsor else club.nome,
+                club_id=club.id,
+                sponsor_id=author.id if by_sponsor else None,
+                tipo=rng.choice(['comunicato', 'social', 'articolo', 'photo']),
+                titolo=f'Post {k + 1} di {club.nome}',
+                testo='Contenuto di benchmark per il feed press. ' * 5,
+                data_pubblicazione=now - timedelta(hours=rng.randint(0, 24 * 120)),
+                visibility='community' if rng.random() < 0.3 else 'interna',
+                hashtags=['benchmark', rng.choice(SECTORS)],
+            ))
+    _flush_every(session, posts)
+    counts['press_publications'] = len(posts)
+
+    # ---------- Calendario ----------
+    events = []
+    for club in clubs:
+        for k in range(factors['calendar_events_per_club']):
+            start = now + timedelta(hours=rng.randint(-24 * 30, 24 * 30))
+            events.append(CalendarEvent(
+                club_id=club.id,
+                tipo=rng.choice(['appuntamento', 'task', 'promemoria']),
+                titolo=f'Evento {k + 1}',
+                data_inizio=start,
+                data_fine=start + timedelta(hours=1),
+                priorita=rng.randint(1, 3),
+            ))
+    _flush_every(session, events)
+    counts['calendar_events'] = len(events)
+
+    # ---------- Marketplace ----------
+    opportunities = []
+    for k in range(factors['opportunities']):
+        city = rng.choice(CITIES)
+        club = rng.choice(clubs)
+        opportunities.append(MarketplaceOpportunity(
+            creator_type='club',
+            creator_id=club.id,
+            titolo=f'Opportunità {k + 1}',
+            descrizione='Opportunità generata dal seed di benchmark',
+            tipo_opportunita=rng.choice(['evento_speciale', 'campagna_promozionale', 'progetto_csr', 'co_branding']),
+            categoria=rng.choice(['sport', 'sociale', 'business', 'digital']),
+            budget_richiesto=rng.randint(1, 100) * 1000,
+            location=city[0],
+            location_city=city[0],
+            location_province=city[1],
+            location_region=city[2],
+            location_lat=city[3] + rng.uniform(-0.2, 0.2),
+            location_lng=city[4] + rng.uniform(-0.2, 0.2),
+            stato='pubblicata',
+            data_inizio=today + timedelta(days=rng.randint(10, 120)),
+            deadline_candidature=now + timedelta(days=rng.randint(1, 60)),
+            pubblicata_at=now - timedelta(days=rng.randint(0, 30)),
+        ))
+    _flush_every(session, opportunities)
+    counts['marketplace_opportunities'] = len(opportunities)
+    log(f'{len(posts)} post, {len(events)} eventi, {len(opportunities)} opportunità create')
+
+    # ---------- Admin: CRM lead, contratti, fatture ----------
+    crm_leads = []
+    for k in range(factors['crm_leads']):
+        city = rng.choice(CITIES)
+        crm_leads.append(CRMLead(
+            nome_club=f'Club prospect {k + 1}',
+            tipologia_sport=rng.choice(SPORTS),
+            citta=city[0],
+            provincia=city[1],
+            regione=city[2],
+            stage=rng.choice(CRM_STAGES),
+            valore_stimato=rng.randint(1, 30) * 1000,
+            fonte=rng.choice(['website', 'referral', 'evento', 'cold_call']),
+            contatto_email=f'prospect{k + 1}@bench.pitchpartner.it',
+            created_at=now - timedelta(days=rng.randint(0, 365)),
+            updated_at=now - timedelta(days=rng.randint(0, 60)),
+        ))
+    _flush_every(session, crm_leads)
+    crm_activities = [CRMLeadActivity(
+        lead_id=lead.id,
+        tipo=rng.choice(['call', 'email', 'meeting', 'demo']),
+        titolo='Attività CRM',
+        created_at=now - timedelta(days=rng.randint(0, 90)),
+    ) for lead in crm_leads for _ in range(2)]
+    _flush_every(session, crm_activities)
+    counts['crm_leads'] = len(crm_leads)
+    counts['crm_lead_activities'] = len(crm_activities)
+
+    admin_contracts = []
+    for club in clubs:
+        plan = rng.choice(PLANS)
+        price = {'basic': 3000, 'kickoff': 2000, 'premium': 8000, 'elite': 15000}[plan]
+        start = today - timedelta(days=rng.randint(0, 300))
+        admin_contracts.append(AdminContract(
+            club_id=club.id,
+            plan_type=plan,
+            plan_price=price,
+            addons=[{'id': 'setup', 'name': 'Setup', 'price': 500}] if rng.random() < 0.3 else [],
+            total_value=price,
+            start_date=start,
+            end_date=start + timedelta(days=365),
+            status='active',
+            payment_terms=rng.choice(['annual', 'semi_annual', 'quarterly', 'monthly']),
+            created_by=admin.id,
+        ))
+    _flush_every(session, admin_contracts)
+    counts['admin_contracts'] = len(admin_contracts)
+
+    invoices = []
+    invoice_seq = 0
+    for contract in admin_contracts:
+        for k in range(factors['invoices_per_contract']):
+            invoice_seq += 1
+            issue = contract.start_date + timedelta(days=30 * k)
+            amount = contract.total_value / factors['invoices_per_contract']
+            paid = issue < today - timedelta(days=30) and rng.random() < 0.8
+            invoices.append(AdminInvoice(
+                contract_id=contract.id,
+                club_id=contract.club_id,
+                invoice_number=f'BENCH-{issue.year}-{invoice_seq:06d}',
+                amount=amount,
+                vat_rate=22.0,
+                vat_amount=amount * 0.22,
+                total_amount=amount * 1.22,
+                issue_date=issue,
+                due_date=issue + timedelta(days=30),
+                payment_date=issue + timedelta(days=rng.randint(1, 30)) if paid else None,
+                status='paid' if paid else 'pending',
+                period_start=issue,
+                period_end=issue + timedelta(days=29),
+                created_by=admin.id,
+            ))
+    _flush_every(session, invoices, size=2000)
+    counts['admin_invoices'] = len(invoices)
+
+    session.commit()
+    log(f'Seed completato: {sum(counts.values())} righe')
+    return counts
+
+
+def parse_factor_overrides(values):
+    overrides = {}
+    for item in values or []:
+        if '=' not in item:
+            raise argparse.ArgumentTypeError(f'Formato fattore non valido: {item} (atteso nome=valore)')
+        name, value = item.split('=', 1)
+        overrides[name.strip()] = int(value)
+    return overrides
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Genera un dataset sintetico per i benchmark')
+    parser.add_argument('--database-url', default='sqlite:////tmp/pitch_partner_bench.db')
+    parser.add_argument('--scale', type=float, default=1.0, help='Moltiplicatore dei fattori di default')
+    parser.add_argument('--factor', action='append', metavar='NOME=VALORE',
+                        help=f'Override di un fattore ({", ".join(DEFAULT_FACTORS)})')
+    parser.add_argument('--seed', type=int, default=42, help='Seed del generatore casuale')
+    parser.add_argument('--reset', action='store_true', help='Svuota e ricrea lo schema prima del seed')
+    args = parser.parse_args(argv)
+
+    prepare_environment(args.database_url)
+    from app import create_app, db
+    from app import models  # noqa: F401 - registra le tabelle
+
+    factors = resolve_factors(args.scale, parse_factor_overrides(args.factor))
+    app = create_app()
+    with app.app_context():
+        if args.reset:
+            db.drop_all()
+        db.create_all()
+        counts = seed(factors, rng_seed=args.seed)
+
+    for table, count in sorted(counts.items()):
+        print(f'  {table:<28} {count:>8}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,220 @@
+"""
+Sidecar WhatsApp finto e micro-benchmark del client.
+
+FakeSidecar espone gli stessi endpoint di whatsapp-service (status, qr, chats,
+messaggi, media, ricerca, invio) con dati sintetici, latenza configurabile e
+possibilità di fermarlo per simulare un sidecar giù. Si può avviare da solo
+(WHATSAPP_SIDECAR_URL=http://localhost:3299 per puntarci il backend) o usare
+dal benchmark, che confronta richieste con connessione nuova e con la sessione
+del client, e misura il fail-fast del circuit breaker a sidecar spento.
+
+    python -m benchmarks.whatsapp_sidecar serve --port 3299 --latency-ms 20
+    python -m benchmarks.whatsapp_sidecar bench --requests 200
+"""
+import argparse
+import base64
+import json
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, unquote, urlparse
+
+
+def _chats(count):
+    return [{
+        'id': f'39333{i:07d}@c.us',
+        'name': f'Contatto {i}',
+        'isGroup': i % 10 == 0,
+        'unreadCount': i % 3,
+        'timestamp': 1700000000 + i,
+        'lastMessage': {'body': f'Messaggio di prova {i}', 'fromMe': i % 2 == 0, 'timestamp': 1700000000 + i},
+    } for i in range(count)]
+
+
+def _messages(chat_id, count=50):
+    return [{
+        'id': f'{chat_id}_{i}',
+        'body': f'Testo {i}',
+        'timestamp': 1700000000 + i,
+        'fromMe': i % 2 == 0,
+        'from': chat_id,
+        'to': 'me@c.us',
+        'type': 'image' if i % 10 == 0 else 'chat',
+        'hasMedia': i % 10 == 0,
+        'mediaType': 'image' if i % 10 == 0 else None,
+    } for i in range(count)]
+
+
+class FakeSidecar:
+    """Server HTTP in un thread con le risposte del sidecar Node.js"""
+
+    def __init__(self, port=0, latency_ms=0, chats=200, media_kb=512, connected=True):
+        self.latency = latency_ms / 1000
+        self.connected = connected
+        self.chats = _chats(chats)
+        self.media = base64.b64encode(b'\x89PNG' + b'\0' * (media_kb * 1024)).decode()
+        self.sent = []
+        self.requests = 0
+        self._server = ThreadingHTTPServer(('127.0.0.1', port), self._handler())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._server.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def route(self, method, path, query, body):
+        """(status, payload) per una richiesta"""
+        if path == '/status':
+            return 200, {'connected': self.connected, 'info': {'pushname': 'Fake', 'wid': '390000000000'}}
+        if path == '/qr':
+            return 200, {'qr': None if self.connected else 'data:image/png;base64,'}
+        if method == 'POST' and path == '/disconnect':
+            self.connected = False
+            return 200, {'success': True, 'message': 'Disconnesso'}
+        if not self.connected:
+            return 503, {'error': 'WhatsApp non connesso'}
+
+        if path == '/chats':
+            return 200, {'chats': self.chats, 'syncing': False, 'syncedAt': 1700000000000}
+        if path == '/contacts':
+            return 200, {'contacts': [{'id': c['id'], 'name': c['name']} for c in self.chats if not c['isGroup']]}
+        if path.startswith('/chats/') and path.endswith('/messages'):
+            return 200, {'messages': _messages(unquote(path[len('/chats/'):-len('/messages')]))}
+        if path.startswith('/media/'):
+            return 200, {'data': self.media, 'mimetype': 'image/png', 'filename': None}
+        if path.startswith('/messages-by-phone/'):
+            chat_id = unquote(path[len('/messages-by-phone/'):]) + '@c.us'
+            return 200, {'found': True, 'chatId': chat_id, 'chatName': chat_id, 'messages': _messages(chat_id)}
+        if path == '/search':
+            q = (query.get('q') or [''])[0].lower()
+            results = [{'chatId': c['id'], 'title': c['name'], 'subtitle': c['lastMessage']['body'],
+                        'isGroup': c['isGroup']} for c in self.chats if q and q in c['name'].lower()]
+            return 200, {'results': results[:10]}
+        if method == 'POST' and path == '/send':
+            if not body.get('to') or not (body.get('message') or body.get('media')):
+                return 400, {'error': 'Parametri "to" e "message" (o "media") obbligatori'}
+            self.sent.append(body)
+            return 200, {'success': True, 'messageId': f'fake_{len(self.sent)}', 'to': body['to']}
+        return 404, {'error': 'Not found'}
+
+    def _handler(self):
+        sidecar = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'  # keep-alive come Express
+
+            def _respond(self, method):
+                sidecar.requests += 1
+                if sidecar.latency:
+                    time.sleep(sidecar.latency)
+                parsed = urlparse(self.path)
+                body = {}
+                length = int(self.headers.get('Content-Length') or 0)
+                if length:
+                    body = json.loads(self.rfile.read(length) or b'{}')
+                status, payload = sidecar.route(method, parsed.path, parse_qs(parsed.query), body)
+                data = json.dumps(payload).encode()
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json; charset=utf-8')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_GET(self):
+                self._respond('GET')
+
+            def do_POST(self):
+                self._respond('POST')
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+
+# ==================== BENCHMARK ====================
+
+def _timed(fn, n):
+    started = time.perf_counter()
+    for _ in range(n):
+        fn()
+    return (time.perf_counter() - started) / n * 1000
+
+
+def run(n_requests, latency_ms):
+    import requests
+    from app.services.whatsapp_client import WhatsAppSidecarClient, CircuitBreaker, SidecarUnavailable
+
+    sidecar = FakeSidecar(latency_ms=latency_ms).start()
+    client = WhatsAppSidecarClient(sidecar.url, breaker=CircuitBreaker(threshold=3, cooldown=60))
+    results = {}
+    try:
+        results['status_nuova_connessione'] = _timed(
+            lambda: requests.get(f'{sidecar.url}/status', timeout=15).json(), n_requests)
+        results['status_sessione'] = _timed(lambda: client.get_json('/status', 'status'), n_requests)
+        results['chats_nuova_connessione'] = _timed(
+            lambda: requests.get(f'{sidecar.url}/chats', timeout=15).json(), n_requests)
+        results['chats_cache'] = _timed(lambda: client.get_json('/chats', 'chats', cache_key='chats'), n_requests)
+
+        def media():
+            body, _, _ = client.stream('/media/x', 'media')
+            for _ in body:
+                pass
+        results['media_stream'] = _timed(media, max(1, n_requests // 10))
+    finally:
+        sidecar.stop()
+
+    def down():
+        try:
+            client.get_json('/status', 'status')
+        except SidecarUnavailable:
+            pass
+    results['sidecar_giu_fail_fast'] = _timed(down, n_requests)
+    results['_breaker'] = client.breaker.state
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Sidecar WhatsApp finto e benchmark del client')
+    sub = parser.add_subparsers(dest='command', required=True)
+    serve = sub.add_parser('serve', help='avvia il sidecar finto')
+    serve.add_argument('--port', type=int, default=3299)
+    serve.add_argument('--latency-ms', type=int, default=0)
+    serve.add_argument('--disconnected', action='store_true')
+    bench = sub.add_parser('bench', help='confronta connessioni nuove, sessione, cache e breaker')
+    bench.add_argument('--requests', type=int, default=200)
+    bench.add_argument('--latency-ms', type=int, default=0)
+    args = parser.parse_args(argv)
+
+    if args.command == 'serve':
+        sidecar = FakeSidecar(port=args.port, latency_ms=args.latency_ms, connected=not args.disconnected)
+        print(f"Sidecar finto su {sidecar.url} (Ctrl+C per fermarlo)")
+        try:
+            sidecar._server.serve_forever()
+        except KeyboardInterrupt:
+            sidecar.stop()
+        return 0
+
+    results = run(args.requests, args.latency_ms)
+    breaker = results.pop('_breaker')
+    print(f"{'caso':<28}{'ms/richiesta':>14}")
+    for name, ms in results.items():
+        print(f"{name:<28}{ms:>14.3f}")
+    print(f"stato breaker a sidecar spento: {breaker}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,26 @@
+"""Add HeadOfTerms contract timeline indexes
+
+Revision ID: a2f7c3e8d516
+Revises: e9b6d2f4a718
+Create Date: 2026-10-19 22:00:00.000000
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = 'a2f7c3e8d516'
+down_revision = 'e9b6d2f4a718'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Contratti per stato e scadenza, per club e per sponsor
+    op.create_index('ix_head_of_terms_club_timeline', 'head_of_terms', ['club_id', 'status', 'data_fine'], unique=False)
+    op.create_index('ix_head_of_terms_sponsor_timeline', 'head_of_terms', ['sponsor_id', 'status', 'data_fine'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_head_of_terms_sponsor_timeline', table_name='head_of_terms')
+    op.drop_index('ix_head_of_terms_club_timeline', table_name='head_of_terms')
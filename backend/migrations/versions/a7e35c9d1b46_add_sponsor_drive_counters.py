@@ -0,0 +1,143 @@
+"""Add sponsor drive counters, nome_search and listing index
+
+Revision ID: a7e35c9d1b46
+Revises: f1c6a8d3b295
+Create Date: 2026-10-19 17:00:00.000000
+
+"""
+import re
+import unicodedata
+from collections import defaultdict
+from datetime import datetime
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a7e35c9d1b46'
+down_revision = 'f1c6a8d3b295'
+branch_labels = None
+depends_on = None
+
+
+def _normalize(text):
+    # Stessa normalizzazione di inventory_catalog_service.normalize_search
+    text = unicodedata.normalize('NFKD', text or '')
+    text = ''.join(c for c in text if not unicodedata.combining(c))
+    return re.sub(r'\s+', ' ', text.lower()).strip()
+
+
+def _normalize_folder(path):
+    # Stessa forma di sponsor_drive_service.normalize_folder
+    parts = [p.strip() for p in re.split(r'/+', (path or '').strip()) if p.strip()]
+    return '/' + '/'.join(parts)
+
+
+def upgrade():
+    op.create_table('sponsor_drive_counters',
+        sa.Column('club_id', sa.Integer(), nullable=False),
+        sa.Column('sponsor_id', sa.Integer(), nullable=False),
+        sa.Column('dimensione', sa.String(length=20), nullable=False),
+        sa.Column('valore', sa.String(length=500), nullable=False),
+        sa.Column('files_count', sa.Integer(), nullable=False, server_default='0'),
+        sa.Column('bytes_total', sa.BigInteger(), nullable=False, server_default='0'),
+        sa.Column('sponsor_files_count', sa.Integer(), nullable=False, server_default='0'),
+        sa.Column('sponsor_bytes_total', sa.BigInteger(), nullable=False, server_default='0'),
+        sa.Column('updated_at', sa.DateTime(), nullable=True),
+        sa.ForeignKeyConstraint(['club_id'], ['clubs.id'], ondelete='CASCADE'),
+        sa.ForeignKeyConstraint(['sponsor_id'], ['sponsors.id'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('club_id', 'sponsor_id', 'dimensione', 'valore')
+    )
+    with op.batch_alter_table('sponsor_drive_files', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('nome_search', sa.String(length=300), nullable=True))
+    op.create_index('ix_sponsor_drive_files_listing', 'sponsor_drive_files',
+                    ['club_id', 'sponsor_id', 'stato', 'created_at', 'id'], unique=False)
+
+    # Backfill: nome normalizzato, cartelle canoniche e contatori
+    bind = op.get_bind()
+    files = sa.table(
+        'sponsor_drive_files',
+        sa.column('id', sa.Integer), sa.column('club_id', sa.Integer), sa.column('sponsor_id', sa.Integer),
+        sa.column('nome', sa.String), sa.column('nome_search', sa.String), sa.column('cartella', sa.String),
+        sa.column('categoria', sa.String), sa.column('stato', sa.String), sa.column('file_size', sa.Integer),
+        sa.column('visibile_sponsor', sa.Boolean), sa.column('contract_id', sa.Integer),
+        sa.column('activation_id', sa.Integer), sa.column('event_activation_id', sa.Integer),
+        sa.column('inventory_asset_id', sa.Integer)
+    )
+    rows = bind.execute(sa.select(
+        files.c.id, files.c.club_id, files.c.sponsor_id, files.c.nome, files.c.cartella, files.c.categoria,
+        files.c.stato, files.c.file_size, files.c.visibile_sponsor, files.c.contract_id,
+        files.c.activation_id, files.c.event_activation_id, files.c.inventory_asset_id
+    )).all()
+
+    updates = []
+    counters = defaultdict(lambda: [0, 0, 0, 0])
+    for row in rows:
+        folder = _normalize_folder(row.cartella)
+        updates.append({'b_id': row.id, 'b_nome': _normalize(row.nome)[:300], 'b_cartella': folder})
+        if (row.stato or 'attivo') != 'attivo':
+            continue
+        size = row.file_size or 0
+        visible = row.visibile_sponsor is not False
+        keys = [('totale', '*'), ('cartella', folder), ('categoria', row.categoria or 'altro')]
+        if row.contract_id:
+            keys.append(('collegamento', 'contract'))
+        if row.activation_id or row.event_activation_id:
+            keys.append(('collegamento', 'activation'))
+        if row.inventory_asset_id:
+            keys.append(('collegamento', 'asset'))
+        parts = [p for p in folder.split('/') if p]
+        ancestors = ['/'] + ['/' + '/'.join(parts[:i]) for i in range(1, len(parts))] if parts else []
+        for path in ancestors:
+            counters[(row.club_id, row.sponsor_id, 'cartella', path)]
+        for key in keys:
+            counter = counters[(row.club_id, row.sponsor_id) + key]
+            counter[0] += 1
+            counter[1] += size
+            counter[2] += 1 if visible else 0
+            counter[3] += size if visible else 0
+
+    if updates:
+        bind.execute(
+            files.update().where(files.c.id == sa.bindparam('b_id')).values(
+                nome_search=sa.bindparam('b_nome'), cartella=sa.bindparam('b_cartella')
+            ),
+            updates
+        )
+    if counters:
+        now = datetime.utcnow()
+        counters_table = sa.table(
+            'sponsor_drive_counters',
+            sa.column('club_id', sa.Integer), sa.column('sponsor_id', sa.Integer),
+            sa.column('dimensione', sa.String), sa.column('valore', sa.String),
+            sa.column('files_count', sa.Integer), sa.column('bytes_total', sa.BigInteger),
+            sa.column('sponsor_files_count', sa.Integer), sa.column('sponsor_bytes_total', sa.BigInteger),
+            sa.column('updated_at', sa.DateTime)
+        )
+        op.bulk_insert(counters_table, [{
+            'club_id': club_id, 'sponsor_id': sponsor_id, 'dimensione': dimensione, 'valore': valore,
+            'files_count': c[0], 'bytes_total': c[1], 'sponsor_files_count': c[2], 'sponsor_bytes_total': c[3],
+            'updated_at': now
+        } for (club_id, sponsor_id, dimensione, valore), c in counters.items()])
+
+    # Su PostgreSQL un indice trigram rende indicizzabile LIKE '%termine%' sul nome
+    if bind.dialect.name == 'postgresql':
+        try:
+            with bind.begin_nested():
+                bind.execute(sa.text('CREATE EXTENSION IF NOT EXISTS pg_trgm'))
+                bind.execute(sa.text(
+                    'CREATE INDEX IF NOT EXISTS ix_sponsor_drive_files_nome_trgm '
+                    'ON sponsor_drive_files USING gin (nome_search gin_trgm_ops)'
+                ))
+        except sa.exc.SQLAlchemyError as e:
+            print(f"[Migration] Indice trigram non creato: {e}")
+
+
+def downgrade():
+    if op.get_bind().dialect.name == 'postgresql':
+        op.execute('DROP INDEX IF EXISTS ix_sponsor_drive_files_nome_trgm')
+    op.drop_index('ix_sponsor_drive_files_listing', table_name='sponsor_drive_files')
+    with op.batch_alter_table('sponsor_drive_files', schema=None) as batch_op:
+        batch_op.drop_column('nome_search')
+    op.drop_table('sponsor_drive_counters')
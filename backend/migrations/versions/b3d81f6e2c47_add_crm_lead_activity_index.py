@@ -0,0 +1,24 @@
+"""Add crm lead activity (lead_id, created_at) index
+
+Revision ID: b3d81f6e2c47
+Revises: a7e35c9d1b46
+Create Date: 2026-10-19 18:00:00.000000
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = 'b3d81f6e2c47'
+down_revision = 'a7e35c9d1b46'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Ultima attività per lead (GROUP BY lead_id, MAX(created_at)) nei trigger temporali
+    op.create_index('ix_crm_lead_activities_lead_created', 'crm_lead_activities', ['lead_id', 'created_at'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_crm_lead_activities_lead_created', table_name='crm_lead_activities')
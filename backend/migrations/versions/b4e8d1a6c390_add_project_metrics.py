@@ -0,0 +1,81 @@
+"""Add project_metrics (contatori task/milestone per progetto)
+
+Revision ID: b4e8d1a6c390
+Revises: a2f7c3e8d516
+Create Date: 2026-10-19 23:00:00.000000
+
+"""
+from datetime import date, datetime
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b4e8d1a6c390'
+down_revision = 'a2f7c3e8d516'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('project_metrics',
+        sa.Column('project_id', sa.Integer(), nullable=False),
+        sa.Column('tasks_total', sa.Integer(), nullable=False, server_default='0'),
+        sa.Column('tasks_completati', sa.Integer(), nullable=False, server_default='0'),
+        sa.Column('tasks_in_corso', sa.Integer(), nullable=False, server_default='0'),
+        sa.Column('tasks_in_ritardo', sa.Integer(), nullable=False, server_default='0'),
+        sa.Column('milestones_total', sa.Integer(), nullable=False, server_default='0'),
+        sa.Column('milestones_completati', sa.Integer(), nullable=False, server_default='0'),
+        sa.Column('milestones_in_ritardo', sa.Integer(), nullable=False, server_default='0'),
+        sa.Column('updates_total', sa.Integer(), nullable=False, server_default='0'),
+        sa.Column('ritardi_task_fino', sa.DateTime(), nullable=True),
+        sa.Column('ritardi_milestone_fino', sa.Date(), nullable=True),
+        sa.Column('updated_at', sa.DateTime(), nullable=True),
+        sa.ForeignKeyConstraint(['project_id'], ['projects.id'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('project_id')
+    )
+    # Conteggi in ritardo e prossima scadenza per progetto
+    op.create_index('ix_project_tasks_due', 'project_tasks', ['project_id', 'stato', 'data_scadenza'], unique=False)
+    op.create_index('ix_project_milestones_due', 'project_milestones', ['project_id', 'stato', 'data_scadenza'], unique=False)
+
+    # Backfill dai dati esistenti (stessi criteri di ProjectMetricsService.refresh_projects)
+    bind = op.get_bind()
+    bind.execute(sa.text("""
+        INSERT INTO project_metrics
+            (project_id, tasks_total, tasks_completati, tasks_in_corso, tasks_in_ritardo,
+             milestones_total, milestones_completati, milestones_in_ritardo, updates_total,
+             ritardi_task_fino, ritardi_milestone_fino, updated_at)
+        SELECT p.id,
+               COALESCE(t.total, 0), COALESCE(t.completati, 0), COALESCE(t.in_corso, 0), COALESCE(t.in_ritardo, 0),
+               COALESCE(m.total, 0), COALESCE(m.completati, 0), COALESCE(m.in_ritardo, 0),
+               COALESCE(u.total, 0),
+               t.fino, m.fino, :now
+        FROM projects p
+        LEFT JOIN (
+            SELECT project_id,
+                   COUNT(id) AS total,
+                   SUM(CASE WHEN stato = 'completato' THEN 1 ELSE 0 END) AS completati,
+                   SUM(CASE WHEN stato = 'in_corso' THEN 1 ELSE 0 END) AS in_corso,
+                   SUM(CASE WHEN COALESCE(stato, '') <> 'completato' AND data_scadenza < :now THEN 1 ELSE 0 END) AS in_ritardo,
+                   MIN(CASE WHEN COALESCE(stato, '') <> 'completato' AND data_scadenza >= :now THEN data_scadenza END) AS fino
+            FROM project_tasks GROUP BY project_id
+        ) t ON t.project_id = p.id
+        LEFT JOIN (
+            SELECT project_id,
+                   COUNT(id) AS total,
+                   SUM(CASE WHEN stato = 'completato' THEN 1 ELSE 0 END) AS completati,
+                   SUM(CASE WHEN COALESCE(stato, '') <> 'completato' AND data_scadenza < :today THEN 1 ELSE 0 END) AS in_ritardo,
+                   MIN(CASE WHEN COALESCE(stato, '') <> 'completato' AND data_scadenza >= :today THEN data_scadenza END) AS fino
+            FROM project_milestones GROUP BY project_id
+        ) m ON m.project_id = p.id
+        LEFT JOIN (
+            SELECT project_id, COUNT(id) AS total FROM project_updates GROUP BY project_id
+        ) u ON u.project_id = p.id
+    """), {'now': datetime.utcnow(), 'today': date.today()})
+
+
+def downgrade():
+    op.drop_index('ix_project_milestones_due', table_name='project_milestones')
+    op.drop_index('ix_project_tasks_due', table_name='project_tasks')
+    op.drop_table('project_metrics')
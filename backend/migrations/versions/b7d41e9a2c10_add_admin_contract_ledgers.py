@@ -0,0 +1,59 @@
+"""Add admin_contract_ledgers (saldo progressivo per contratto)
+
+Revision ID: b7d41e9a2c10
+Revises: af2638d9c9f1
+Create Date: 2026-10-19 10:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b7d41e9a2c10'
+down_revision = 'af2638d9c9f1'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('admin_contract_ledgers',
+        sa.Column('contract_id', sa.Integer(), nullable=False),
+        sa.Column('club_id', sa.Integer(), nullable=False),
+        sa.Column('invoice_count', sa.Integer(), nullable=False, server_default='0'),
+        sa.Column('invoiced_total', sa.Float(), nullable=False, server_default='0'),
+        sa.Column('paid_count', sa.Integer(), nullable=False, server_default='0'),
+        sa.Column('paid_total', sa.Float(), nullable=False, server_default='0'),
+        sa.Column('outstanding_total', sa.Float(), nullable=False, server_default='0'),
+        sa.Column('last_payment_date', sa.Date(), nullable=True),
+        sa.Column('updated_at', sa.DateTime(), nullable=True),
+        sa.ForeignKeyConstraint(['contract_id'], ['admin_contracts.id'], ondelete='CASCADE'),
+        sa.ForeignKeyConstraint(['club_id'], ['clubs.id'], ),
+        sa.PrimaryKeyConstraint('contract_id')
+    )
+    op.create_index('ix_admin_contract_ledgers_club_id', 'admin_contract_ledgers', ['club_id'], unique=False)
+
+    # Backfill dai dati esistenti (fatture annullate escluse)
+    op.execute("""
+        INSERT INTO admin_contract_ledgers
+            (contract_id, club_id, invoice_count, invoiced_total, paid_count, paid_total,
+             outstanding_total, last_payment_date, updated_at)
+        SELECT c.id, c.club_id,
+               COUNT(i.id),
+               COALESCE(SUM(i.total_amount), 0),
+               COALESCE(SUM(CASE WHEN i.status = 'paid' THEN 1 ELSE 0 END), 0),
+               COALESCE(SUM(CASE WHEN i.status = 'paid' THEN i.total_amount ELSE 0 END), 0),
+               COALESCE(SUM(i.total_amount), 0)
+                 - COALESCE(SUM(CASE WHEN i.status = 'paid' THEN i.total_amount ELSE 0 END), 0),
+               MAX(CASE WHEN i.status = 'paid' THEN i.payment_date END),
+               CURRENT_TIMESTAMP
+        FROM admin_contracts c
+        LEFT JOIN admin_invoices i
+               ON i.contract_id = c.id AND COALESCE(i.status, 'pending') <> 'cancelled'
+        GROUP BY c.id, c.club_id
+    """)
+
+
+def downgrade():
+    op.drop_index('ix_admin_contract_ledgers_club_id', table_name='admin_contract_ledgers')
+    op.drop_table('admin_contract_ledgers')
@@ -0,0 +1,32 @@
+"""Add invoice_sequences (numerazione fatture per anno)
+
+Revision ID: c3a9f27e5b84
+Revises: b7d41e9a2c10
+Create Date: 2026-10-19 11:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c3a9f27e5b84'
+down_revision = 'b7d41e9a2c10'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # La sequenza di ogni anno viene inizializzata dal primo numero allocato
+    # (massimo PP-<anno>-NNNN già presente in admin_invoices)
+    op.create_table('invoice_sequences',
+        sa.Column('prefix', sa.String(length=20), nullable=False),
+        sa.Column('year', sa.Integer(), nullable=False),
+        sa.Column('last_number', sa.Integer(), nullable=False, server_default='0'),
+        sa.Column('updated_at', sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint('prefix', 'year')
+    )
+
+
+def downgrade():
+    op.drop_table('invoice_sequences')
@@ -0,0 +1,28 @@
+"""Add notification fan-out dedup index
+
+Revision ID: c5e2a9f4d813
+Revises: b3d81f6e2c47
+Create Date: 2026-10-19 19:00:00.000000
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = 'c5e2a9f4d813'
+down_revision = 'b3d81f6e2c47'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Anti-join del fan-out: notifica (tipo, oggetto) già inviata al destinatario [da una data]
+    op.create_index(
+        'ix_notifications_dedup', 'notifications',
+        ['oggetto_type', 'oggetto_id', 'tipo', 'user_type', 'user_id', 'created_at'],
+        unique=False
+    )
+
+
+def downgrade():
+    op.drop_index('ix_notifications_dedup', table_name='notifications')
@@ -0,0 +1,40 @@
+"""Add created_at watermark to analytics_rollup_state
+
+Revision ID: c7f2a9d4e861
+Revises: b4e8d1a6c390
+Create Date: 2026-10-20 09:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c7f2a9d4e861'
+down_revision = 'b4e8d1a6c390'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('analytics_rollup_state', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('last_created_at', sa.DateTime(), nullable=True))
+
+    # Il watermark riparte dal created_at dell'ultima riga già elaborata
+    op.execute(sa.text("""
+        UPDATE analytics_rollup_state
+        SET last_created_at = (
+            SELECT created_at FROM proposal_tracking
+            WHERE proposal_tracking.id = analytics_rollup_state.last_id
+        )
+        WHERE nome = 'proposal_tracking'
+    """))
+
+    # Scansione del rollup in ordine (created_at, id)
+    op.create_index('ix_proposal_tracking_created', 'proposal_tracking', ['created_at', 'id'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_proposal_tracking_created', table_name='proposal_tracking')
+    with op.batch_alter_table('analytics_rollup_state', schema=None) as batch_op:
+        batch_op.drop_column('last_created_at')
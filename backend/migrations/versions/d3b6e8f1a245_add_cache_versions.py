@@ -0,0 +1,30 @@
+"""Add cache_versions (versione per club delle cache in memoria)
+
+Revision ID: d3b6e8f1a245
+Revises: c7f2a9d4e861
+Create Date: 2026-10-20 10:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd3b6e8f1a245'
+down_revision = 'c7f2a9d4e861'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('cache_versions',
+        sa.Column('scope', sa.String(length=50), nullable=False),
+        sa.Column('club_id', sa.Integer(), nullable=False),
+        sa.Column('version', sa.Integer(), nullable=False, server_default='0'),
+        sa.Column('updated_at', sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint('scope', 'club_id')
+    )
+
+
+def downgrade():
+    op.drop_table('cache_versions')
@@ -0,0 +1,66 @@
+"""Add proposal analytics rollup tables
+
+Revision ID: d58e1c0b7a32
+Revises: c3a9f27e5b84
+Create Date: 2026-10-19 12:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd58e1c0b7a32'
+down_revision = 'c3a9f27e5b84'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('proposal_daily_stats',
+        sa.Column('proposal_id', sa.Integer(), nullable=False),
+        sa.Column('giorno', sa.Date(), nullable=False),
+        sa.Column('eventi', sa.Integer(), nullable=False, server_default='0'),
+        sa.Column('visualizzazioni', sa.Integer(), nullable=False, server_default='0'),
+        sa.Column('nuovi_visitatori', sa.Integer(), nullable=False, server_default='0'),
+        sa.Column('download', sa.Integer(), nullable=False, server_default='0'),
+        sa.Column('tempo_totale', sa.Integer(), nullable=False, server_default='0'),
+        sa.ForeignKeyConstraint(['proposal_id'], ['proposals.id'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('proposal_id', 'giorno')
+    )
+    op.create_table('proposal_section_stats',
+        sa.Column('proposal_id', sa.Integer(), nullable=False),
+        sa.Column('sezione', sa.String(length=100), nullable=False),
+        sa.Column('eventi', sa.Integer(), nullable=False, server_default='0'),
+        sa.Column('tempo_totale', sa.Integer(), nullable=False, server_default='0'),
+        sa.Column('eventi_con_durata', sa.Integer(), nullable=False, server_default='0'),
+        sa.ForeignKeyConstraint(['proposal_id'], ['proposals.id'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('proposal_id', 'sezione')
+    )
+    op.create_table('proposal_visitors',
+        sa.Column('proposal_id', sa.Integer(), nullable=False),
+        sa.Column('fingerprint', sa.String(length=40), nullable=False),
+        sa.Column('prima_visita', sa.DateTime(), nullable=True),
+        sa.Column('ultima_visita', sa.DateTime(), nullable=True),
+        sa.Column('visualizzazioni', sa.Integer(), nullable=False, server_default='0'),
+        sa.Column('tempo_totale', sa.Integer(), nullable=False, server_default='0'),
+        sa.Column('ha_scaricato', sa.Boolean(), nullable=False, server_default=sa.false()),
+        sa.ForeignKeyConstraint(['proposal_id'], ['proposals.id'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('proposal_id', 'fingerprint')
+    )
+    op.create_table('analytics_rollup_state',
+        sa.Column('nome', sa.String(length=100), nullable=False),
+        sa.Column('last_id', sa.Integer(), nullable=False, server_default='0'),
+        sa.Column('updated_at', sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint('nome')
+    )
+    # Ultimi eventi per proposta (dettaglio proposta con include_tracking)
+    op.create_index('ix_proposal_tracking_proposal_created', 'proposal_tracking', ['proposal_id', 'created_at'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_proposal_tracking_proposal_created', table_name='proposal_tracking')
+    op.drop_table('analytics_rollup_state')
+    op.drop_table('proposal_visitors')
+    op.drop_table('proposal_section_stats')
+    op.drop_table('proposal_daily_stats')
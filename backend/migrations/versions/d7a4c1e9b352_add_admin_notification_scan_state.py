@@ -0,0 +1,30 @@
+"""Add admin notification scan state (watermarks)
+
+Revision ID: d7a4c1e9b352
+Revises: c5e2a9f4d813
+Create Date: 2026-10-19 20:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd7a4c1e9b352'
+down_revision = 'c5e2a9f4d813'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('admin_notification_scan_state',
+        sa.Column('generatore', sa.String(length=50), nullable=False),
+        sa.Column('watermark', sa.DateTime(), nullable=True),
+        sa.Column('creati', sa.Integer(), nullable=False, server_default='0'),
+        sa.Column('updated_at', sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint('generatore')
+    )
+
+
+def downgrade():
+    op.drop_table('admin_notification_scan_state')
@@ -0,0 +1,75 @@
+"""Add inventory asset search_text and catalog ordering index
+
+Revision ID: e4b7c2d91f05
+Revises: d58e1c0b7a32
+Create Date: 2026-10-19 14:00:00.000000
+
+"""
+import re
+import unicodedata
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e4b7c2d91f05'
+down_revision = 'd58e1c0b7a32'
+branch_labels = None
+depends_on = None
+
+
+def _normalize(text):
+    # Stessa normalizzazione di inventory_catalog_service.normalize_search
+    text = unicodedata.normalize('NFKD', text or '')
+    text = ''.join(c for c in text if not unicodedata.combining(c))
+    return re.sub(r'\s+', ' ', text.lower()).strip()
+
+
+def upgrade():
+    with op.batch_alter_table('inventory_assets', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('search_text', sa.Text(), nullable=True))
+    op.create_index('ix_inventory_assets_club_order', 'inventory_assets', ['club_id', 'ordine', 'nome', 'id'], unique=False)
+
+    # Backfill del testo di ricerca per gli asset esistenti
+    bind = op.get_bind()
+    assets = sa.table(
+        'inventory_assets',
+        sa.column('id', sa.Integer), sa.column('nome', sa.String), sa.column('descrizione', sa.Text),
+        sa.column('descrizione_breve', sa.String), sa.column('posizione', sa.String),
+        sa.column('tags', sa.String), sa.column('search_text', sa.Text)
+    )
+    rows = bind.execute(sa.select(
+        assets.c.id, assets.c.nome, assets.c.descrizione_breve, assets.c.posizione,
+        assets.c.tags, assets.c.descrizione
+    )).all()
+    updates = [
+        {'b_id': row[0], 'b_text': _normalize(' '.join(p for p in row[1:] if p))[:4000]}
+        for row in rows
+    ]
+    if updates:
+        bind.execute(
+            assets.update().where(assets.c.id == sa.bindparam('b_id')).values(search_text=sa.bindparam('b_text')),
+            updates
+        )
+
+    # Su PostgreSQL un indice trigram rende indicizzabile LIKE '%termine%'
+    # (facoltativo: senza permessi per l'estensione resta la scansione per club)
+    if bind.dialect.name == 'postgresql':
+        try:
+            with bind.begin_nested():
+                bind.execute(sa.text('CREATE EXTENSION IF NOT EXISTS pg_trgm'))
+                bind.execute(sa.text(
+                    'CREATE INDEX IF NOT EXISTS ix_inventory_assets_search_trgm '
+                    'ON inventory_assets USING gin (search_text gin_trgm_ops)'
+                ))
+        except sa.exc.SQLAlchemyError as e:
+            print(f"[Migration] Indice trigram non creato: {e}")
+
+
+def downgrade():
+    if op.get_bind().dialect.name == 'postgresql':
+        op.execute('DROP INDEX IF EXISTS ix_inventory_assets_search_trgm')
+    op.drop_index('ix_inventory_assets_club_order', table_name='inventory_assets')
+    with op.batch_alter_table('inventory_assets', schema=None) as batch_op:
+        batch_op.drop_column('search_text')
@@ -0,0 +1,70 @@
+"""Add google_calendar_outbox, lease sync Google e indice unico (admin, evento Google)
+
+Revision ID: e8a4c2f6b913
+Revises: d3b6e8f1a245
+Create Date: 2026-10-21 10:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e8a4c2f6b913'
+down_revision = 'd3b6e8f1a245'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('google_calendar_outbox',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('admin_id', sa.Integer(), nullable=False),
+        sa.Column('event_id', sa.Integer(), nullable=True),
+        sa.Column('google_event_id', sa.String(length=255), nullable=True),
+        sa.Column('action', sa.String(length=10), nullable=False),
+        sa.Column('body', sa.JSON(), nullable=True),
+        sa.Column('meet', sa.Boolean(), nullable=True),
+        sa.Column('tentativi', sa.Integer(), nullable=True),
+        sa.Column('last_error', sa.Text(), nullable=True),
+        sa.Column('created_at', sa.DateTime(), nullable=True),
+        sa.ForeignKeyConstraint(['admin_id'], ['admins.id'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_google_calendar_outbox_admin', 'google_calendar_outbox', ['admin_id', 'id'], unique=False)
+
+    with op.batch_alter_table('google_calendar_sync_state', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('sync_richiesta', sa.Boolean(), nullable=True))
+        batch_op.add_column(sa.Column('sync_completa_richiesta', sa.Boolean(), nullable=True))
+        batch_op.add_column(sa.Column('lease_owner', sa.String(length=100), nullable=True))
+        batch_op.add_column(sa.Column('lease_until', sa.DateTime(), nullable=True))
+
+    # Duplicati creati da sync concorrenti: resta il primo evento importato
+    op.execute("""
+        DELETE FROM admin_calendar_events
+        WHERE google_event_id IS NOT NULL
+          AND id NOT IN (
+              SELECT keep_id FROM (
+                  SELECT MIN(id) AS keep_id
+                  FROM admin_calendar_events
+                  WHERE google_event_id IS NOT NULL
+                  GROUP BY admin_id, google_event_id
+              ) AS keep
+          )
+    """)
+    op.drop_index('ix_admin_calendar_events_admin_google', table_name='admin_calendar_events')
+    op.create_index('ix_admin_calendar_events_admin_google', 'admin_calendar_events', ['admin_id', 'google_event_id'], unique=True)
+
+
+def downgrade():
+    op.drop_index('ix_admin_calendar_events_admin_google', table_name='admin_calendar_events')
+    op.create_index('ix_admin_calendar_events_admin_google', 'admin_calendar_events', ['admin_id', 'google_event_id'], unique=False)
+
+    with op.batch_alter_table('google_calendar_sync_state', schema=None) as batch_op:
+        batch_op.drop_column('lease_until')
+        batch_op.drop_column('lease_owner')
+        batch_op.drop_column('sync_completa_richiesta')
+        batch_op.drop_column('sync_richiesta')
+
+    op.drop_index('ix_google_calendar_outbox_admin', table_name='google_calendar_outbox')
+    op.drop_table('google_calendar_outbox')
@@ -0,0 +1,87 @@
+"""Add phone directory (E.164 CRM phone index)
+
+Revision ID: e9b6d2f4a718
+Revises: d7a4c1e9b352
+Create Date: 2026-10-19 21:00:00.000000
+
+"""
+import re
+from datetime import datetime
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e9b6d2f4a718'
+down_revision = 'd7a4c1e9b352'
+branch_labels = None
+depends_on = None
+
+
+def _normalize_phone(raw, default_country='39'):
+    # Stessa normalizzazione di phone_directory_service.normalize_phone
+    if not raw:
+        return None
+    text = str(raw).strip().split('@', 1)[0]
+    international = text.startswith('+') or text.startswith('00')
+    digits = re.sub(r'\D', '', text)
+    if text.startswith('00'):
+        digits = digits[2:]
+    if not international and (re.match(r'^3\d{8,9}$', digits) or digits.startswith('0')):
+        digits = default_country + digits
+    if not 8 <= len(digits) <= 15 or digits.startswith('0'):
+        return None
+    return '+' + digits
+
+
+def upgrade():
+    op.create_table('phone_directory',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('entity_type', sa.String(length=20), nullable=False),
+        sa.Column('entity_id', sa.Integer(), nullable=False),
+        sa.Column('telefono', sa.String(length=30), nullable=False),
+        sa.Column('phone_e164', sa.String(length=16), nullable=True),
+        sa.Column('nome', sa.String(length=300), nullable=False, server_default=''),
+        sa.Column('email', sa.String(length=120), nullable=True),
+        sa.Column('ruolo', sa.String(length=150), nullable=True),
+        sa.Column('updated_at', sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('entity_type', 'entity_id', name='uq_phone_directory_entity')
+    )
+    op.create_index('ix_phone_directory_phone', 'phone_directory', ['phone_e164'], unique=False)
+    op.create_index('ix_phone_directory_listing', 'phone_directory', ['nome', 'id'], unique=False)
+
+    # Backfill dai telefoni di club, lead e contatti
+    bind = op.get_bind()
+    now = datetime.utcnow()
+    sources = [
+        ('club', "SELECT id, telefono, nome, email, NULL FROM clubs"),
+        ('lead', "SELECT id, telefono, ragione_sociale, email, NULL FROM leads"),
+        ('contatto', "SELECT id, telefono, nome || ' ' || cognome, email, ruolo FROM contact_persons"),
+    ]
+    directory = sa.table(
+        'phone_directory',
+        sa.column('entity_type', sa.String), sa.column('entity_id', sa.Integer),
+        sa.column('telefono', sa.String), sa.column('phone_e164', sa.String),
+        sa.column('nome', sa.String), sa.column('email', sa.String),
+        sa.column('ruolo', sa.String), sa.column('updated_at', sa.DateTime),
+    )
+    for entity_type, sql in sources:
+        rows = []
+        for entity_id, telefono, nome, email, ruolo in bind.execute(sa.text(sql + " WHERE telefono IS NOT NULL AND telefono != ''")):
+            if not telefono.strip():
+                continue
+            rows.append({
+                'entity_type': entity_type, 'entity_id': entity_id, 'telefono': telefono.strip(),
+                'phone_e164': _normalize_phone(telefono), 'nome': (nome or '')[:300],
+                'email': email, 'ruolo': ruolo, 'updated_at': now,
+            })
+        if rows:
+            op.bulk_insert(directory, rows)
+
+
+def downgrade():
+    op.drop_index('ix_phone_directory_listing', table_name='phone_directory')
+    op.drop_index('ix_phone_directory_phone', table_name='phone_directory')
+    op.drop_table('phone_directory')
@@ -0,0 +1,39 @@
+"""Add google calendar sync state and event lookup index
+
+Revision ID: f1c6a8d3b295
+Revises: e4b7c2d91f05
+Create Date: 2026-10-19 16:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f1c6a8d3b295'
+down_revision = 'e4b7c2d91f05'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('google_calendar_sync_state',
+        sa.Column('admin_id', sa.Integer(), nullable=False),
+        sa.Column('sync_token', sa.Text(), nullable=True),
+        sa.Column('last_sync_at', sa.DateTime(), nullable=True),
+        sa.Column('last_full_sync_at', sa.DateTime(), nullable=True),
+        sa.Column('last_error', sa.Text(), nullable=True),
+        sa.Column('creati', sa.Integer(), nullable=True),
+        sa.Column('aggiornati', sa.Integer(), nullable=True),
+        sa.Column('eliminati', sa.Integer(), nullable=True),
+        sa.Column('updated_at', sa.DateTime(), nullable=True),
+        sa.ForeignKeyConstraint(['admin_id'], ['admins.id'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('admin_id')
+    )
+    # Lookup eventi locali per id Google durante la sync incrementale
+    op.create_index('ix_admin_calendar_events_admin_google', 'admin_calendar_events', ['admin_id', 'google_event_id'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_admin_calendar_events_admin_google', table_name='admin_calendar_events')
+    op.drop_table('google_calendar_sync_state')
@@ -0,0 +1,52 @@
+"""Fix club_id di proposte e template salvati con l'id ClubUser
+
+Con i token club multi-utente l'identity JWT è ClubUser.id: le route proposte
+la usavano come club_id, ora leggono il tenant dalla claim club_id. Le righe
+già scritte con l'id utente vengono riportate al club dell'utente quando il
+club corretto è certo:
+- club_id che non corrisponde ad alcun club (possibile senza vincoli FK);
+- proposte collegate a lead o sponsor di un altro club, il cui club ha un
+  utente con id uguale al club_id salvato.
+
+Revision ID: f5b9d3a7c182
+Revises: e8a4c2f6b913
+Create Date: 2026-10-22 10:00:00.000000
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = 'f5b9d3a7c182'
+down_revision = 'e8a4c2f6b913'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    for table in ('proposals', 'proposal_templates'):
+        op.execute(f"""
+            UPDATE {table}
+            SET club_id = (SELECT cu.club_id FROM club_users cu WHERE cu.id = {table}.club_id)
+            WHERE NOT EXISTS (SELECT 1 FROM clubs c WHERE c.id = {table}.club_id)
+              AND EXISTS (SELECT 1 FROM club_users cu WHERE cu.id = {table}.club_id)
+        """)
+
+    for column, target in (('lead_id', 'leads'), ('sponsor_id', 'sponsors')):
+        op.execute(f"""
+            UPDATE proposals
+            SET club_id = (SELECT t.club_id FROM {target} t WHERE t.id = proposals.{column})
+            WHERE proposals.{column} IS NOT NULL
+              AND EXISTS (
+                  SELECT 1 FROM {target} t
+                  JOIN club_users cu ON cu.club_id = t.club_id
+                  WHERE t.id = proposals.{column}
+                    AND t.club_id != proposals.club_id
+                    AND cu.id = proposals.club_id
+              )
+        """)
+
+
+def downgrade():
+    # Correzione dati: non reversibile
+    pass
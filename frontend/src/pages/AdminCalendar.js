@@ -326,8 +326,13 @@ function AdminCalendar() {
       });
       if (res.ok) {
         const data = await res.json();
-        showToast(`Sync: ${data.stats.created} creati, ${data.stats.updated} aggiornati`);
-        fetchEvents();
+        if (res.status === 202) {
+          showToast('Sincronizzazione avviata');
+          setTimeout(fetchEvents, 5000);
+        } else {
+          showToast(`Sync: ${data.stats.created} creati, ${data.stats.updated} aggiornati`);
+          fetchEvents();
+        }
       }
     } catch (e) {
       showToast('Errore sync', 'error');
@@ -3,6 +3,7 @@ import { useNavigate, useSearchParams } from 'react-router-dom';
 import axios from 'axios';
 import { getAuth } from '../utils/auth';
 import { getImageUrl } from '../utils/imageUtils';
+import { fetchAllInventoryAssets } from '../utils/inventoryAssets';
 import Modal from '../components/Modal';
 import SupportWidget from '../components/SupportWidget';
 import GuidedTour from '../components/GuidedTour';
@@ -131,9 +132,10 @@ function AssetCompare() {
     try {
       setLoading(true);
       const [assetsRes, categoriesRes] = await Promise.all([
-        axios.get(`${API_URL}/club/inventory/assets`, {
-          headers: { Authorization: `Bearer ${token}` }
-        }),
+        fetchAllInventoryAssets((params) => axios.get(`${API_URL}/club/inventory/assets`, {
+          headers: { Authorization: `Bearer ${token}` },
+          params
+        })),
         axios.get(`${API_URL}/club/inventory/categories`, {
           headers: { Authorization: `Bearer ${token}` }
         })
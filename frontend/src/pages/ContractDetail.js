@@ -25,6 +25,7 @@ function ContractDetail() {
   const [contract, setContract] = useState(null);
   const [allocations, setAllocations] = useState([]); // Inventory allocations
   const [availableAssets, setAvailableAssets] = useState([]); // Available inventory assets
+  const [assetOccupancy, setAssetOccupancy] = useState({}); // Occupazione asset nel periodo del contratto
   const [checklist, setChecklist] = useState([]);
   const [documents, setDocuments] = useState([]);
   const [media, setMedia] = useState([]);
@@ -76,6 +77,7 @@ function ContractDetail() {
         })
       ]);
       setContract(contractRes.data.contract);
+      loadAssetOccupancy(contractRes.data.contract);
       setAllocations(allocationsRes.data.allocations || []);
       setAvailableAssets(inventoryRes.data.assets || []);
       setChecklist(checklistRes.data.checklists || []);
@@ -150,6 +152,26 @@ function ContractDetail() {
     }
   };
 
+  // Occupazione per il periodo del contratto: un asset può essere libero
+  // oggi ma già pieno nelle date del contratto
+  const loadAssetOccupancy = async (contractData) => {
+    if (!isClub || !contractData?.data_inizio || !contractData?.data_fine) return;
+    try {
+      const res = await clubAPI.getInventoryOccupancy({
+        start: contractData.data_inizio.slice(0, 10),
+        end: contractData.data_fine.slice(0, 10)
+      });
+      setAssetOccupancy(Object.fromEntries((res.data.items || []).map(item => [item.id, item])));
+    } catch (error) {
+      setAssetOccupancy({});
+    }
+  };
+
+  const isAssetAllocable = (asset) => {
+    const occupancy = assetOccupancy[asset.id];
+    return asset.disponibile && (occupancy ? occupancy.libero : asset.quantita_disponibile > 0);
+  };
+
   const handleAllocateAsset = async () => {
     if (!selectedAssetId) {
       setToast({ message: 'Seleziona un asset dall\'inventario', type: 'error' });
@@ -1272,15 +1294,16 @@ function ContractDetail() {
               style={{ width: '100%', padding: '12px', borderRadius: '8px', border: '1px solid #E5E7EB', fontSize: '14px' }}
             >
               <option value="">Seleziona un asset...</option>
-              {availableAssets.filter(a => a.disponibile && a.quantita_disponibile > 0).map(asset => (
+              {availableAssets.filter(isAssetAllocable).map(asset => (
                 <option key={asset.id} value={asset.id}>
                   {asset.nome} - {asset.codice} (€{asset.prezzo_listino?.toLocaleString() || 0}) - Disp: {asset.quantita_disponibile}
+                  {assetOccupancy[asset.id] ? ` - Occupato nel periodo: ${assetOccupancy[asset.id].utilizzo_percentuale}%` : ''}
                 </option>
               ))}
             </select>
-            {availableAssets.filter(a => a.disponibile && a.quantita_disponibile > 0).length === 0 && (
+            {availableAssets.filter(isAssetAllocable).length === 0 && (
               <p style={{ color: '#D97706', fontSize: '12px', marginTop: '8px' }}>
-                Nessun asset disponibile nell'inventario. Vai all'inventario per aggiungerne.
+                Nessun asset libero nel periodo del contratto. Vai all'inventario per aggiungerne.
               </p>
             )}
           </div>
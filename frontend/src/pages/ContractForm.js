@@ -3,6 +3,7 @@ import { useParams, useNavigate } from 'react-router-dom';
 import axios from 'axios';
 import { contractAPI, clubAPI } from '../services/api';
 import { getAuth } from '../utils/auth';
+import { fetchAllInventoryAssets } from '../utils/inventoryAssets';
 import Toast from '../components/Toast';
 import Modal from '../components/Modal';
 import { FaArrowLeft, FaArrowRight, FaCheck, FaCube, FaLayerGroup, FaPlus, FaTimes, FaEuroSign } from 'react-icons/fa';
@@ -66,9 +67,10 @@ function ContractForm() {
   const fetchInventory = async () => {
     try {
       const [assetsRes, packagesRes] = await Promise.all([
-        axios.get(`${API_URL}/club/inventory/assets`, {
-          headers: { Authorization: `Bearer ${token}` }
-        }),
+        fetchAllInventoryAssets((params) => axios.get(`${API_URL}/club/inventory/assets`, {
+          headers: { Authorization: `Bearer ${token}` },
+          params
+        })),
         axios.get(`${API_URL}/club/inventory/packages`, {
           headers: { Authorization: `Bearer ${token}` }
         })
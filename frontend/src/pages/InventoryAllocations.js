@@ -2,6 +2,7 @@ import { useState, useEffect, useRef, useCallback } from 'react';
 import { useNavigate, useSearchParams } from 'react-router-dom';
 import axios from 'axios';
 import { getAuth } from '../utils/auth';
+import { fetchAllInventoryAssets } from '../utils/inventoryAssets';
 import Modal from '../components/Modal';
 import SupportWidget from '../components/SupportWidget';
 import GuidedTour from '../components/GuidedTour';
@@ -152,9 +153,10 @@ function InventoryAllocations() {
         axios.get(`${API_URL}/club/inventory/allocations`, {
           headers: { Authorization: `Bearer ${token}` }
         }),
-        axios.get(`${API_URL}/club/inventory/assets`, {
-          headers: { Authorization: `Bearer ${token}` }
-        }),
+        fetchAllInventoryAssets((params) => axios.get(`${API_URL}/club/inventory/assets`, {
+          headers: { Authorization: `Bearer ${token}` },
+          params
+        })),
         axios.get(`${API_URL}/club/sponsors`, {
           headers: { Authorization: `Bearer ${token}` }
         })
@@ -2,6 +2,7 @@ import { useState, useEffect, useRef, useCallback } from 'react';
 import { useNavigate } from 'react-router-dom';
 import axios from 'axios';
 import { getAuth } from '../utils/auth';
+import { fetchAllInventoryAssets } from '../utils/inventoryAssets';
 import Modal from '../components/Modal';
 import SupportWidget from '../components/SupportWidget';
 import GuidedTour from '../components/GuidedTour';
@@ -172,9 +173,10 @@ function InventoryCalendar() {
       const year = currentDate.getFullYear();
 
       const [assetsRes, allocationsRes, categoriesRes] = await Promise.all([
-        axios.get(`${API_URL}/club/inventory/assets`, {
-          headers: { Authorization: `Bearer ${token}` }
-        }),
+        fetchAllInventoryAssets((params) => axios.get(`${API_URL}/club/inventory/assets`, {
+          headers: { Authorization: `Bearer ${token}` },
+          params
+        })),
         axios.get(`${API_URL}/club/inventory/allocations?stagione=${year}-${year + 1}`, {
           headers: { Authorization: `Bearer ${token}` }
         }),
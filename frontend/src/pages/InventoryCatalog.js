@@ -3,6 +3,7 @@ import { useNavigate } from 'react-router-dom';
 import axios from 'axios';
 import { getAuth } from '../utils/auth';
 import { getImageUrl } from '../utils/imageUtils';
+import { fetchAllInventoryAssets } from '../utils/inventoryAssets';
 import DefaultAsset from '../static/logo/FavIcon.png';
 import Modal from '../components/Modal';
 import SupportWidget from '../components/SupportWidget';
@@ -213,13 +214,15 @@ function InventoryCatalog() {
       setLoading(true);
       const headers = { Authorization: `Bearer ${token}` };
 
-      // Build URL with archive filter
-      const assetsUrl = showArchivedAssets
-        ? `${API_URL}/club/inventory/assets?only_archived=true`
-        : `${API_URL}/club/inventory/assets`;
+      // Archive filter; le pagine successive alla prima vengono mostrate man mano che arrivano
+      const assetsParams = showArchivedAssets ? { only_archived: true } : {};
 
       const [assetsRes, categoriesRes, statsRes] = await Promise.all([
-        axios.get(assetsUrl, { headers }),
+        fetchAllInventoryAssets(
+          (params) => axios.get(`${API_URL}/club/inventory/assets`, { headers, params }),
+          assetsParams,
+          (loaded) => { setAssets(loaded); setLoading(false); }
+        ),
         axios.get(`${API_URL}/club/inventory/categories`, { headers }),
         axios.get(`${API_URL}/club/inventory/stats`, { headers })
       ]);
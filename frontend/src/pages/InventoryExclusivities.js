@@ -2,6 +2,7 @@ import { useState, useEffect } from 'react';
 import { useNavigate } from 'react-router-dom';
 import axios from 'axios';
 import { getAuth } from '../utils/auth';
+import { fetchAllInventoryAssets } from '../utils/inventoryAssets';
 import {
   FaArrowLeft, FaPlus, FaTag, FaEdit, FaTrash, FaSearch,
   FaTimes, FaSave, FaExclamationTriangle, FaCheck, FaFilter,
@@ -70,7 +71,7 @@ function InventoryExclusivities() {
 
       const [exclusivitiesRes, assetsRes, sponsorsRes] = await Promise.all([
         axios.get(`${API_URL}/club/inventory/exclusivities`, { headers }),
-        axios.get(`${API_URL}/club/inventory/assets`, { headers }),
+        fetchAllInventoryAssets((params) => axios.get(`${API_URL}/club/inventory/assets`, { headers, params })),
         axios.get(`${API_URL}/club/sponsors`, { headers })
       ]);
 
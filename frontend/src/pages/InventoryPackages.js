@@ -2,6 +2,7 @@ import { useState, useEffect, useRef, useCallback } from 'react';
 import { useNavigate } from 'react-router-dom';
 import axios from 'axios';
 import { getAuth } from '../utils/auth';
+import { fetchAllInventoryAssets } from '../utils/inventoryAssets';
 import Modal from '../components/Modal';
 import SupportWidget from '../components/SupportWidget';
 import GuidedTour from '../components/GuidedTour';
@@ -308,7 +309,7 @@ function InventoryPackages() {
       // Fetch each resource independently to avoid one failure breaking all
       const [packagesRes, assetsRes, sponsorsRes, contractsRes, levelsRes] = await Promise.all([
         axios.get(`${API_URL}/club/inventory/packages`, { headers }).catch(e => ({ data: { packages: [] } })),
-        axios.get(`${API_URL}/club/inventory/assets`, { headers }).catch(e => ({ data: { assets: [] } })),
+        fetchAllInventoryAssets((params) => axios.get(`${API_URL}/club/inventory/assets`, { headers, params })).catch(e => ({ data: { assets: [] } })),
         axios.get(`${API_URL}/club/sponsors`, { headers }).catch(e => ({ data: { sponsors: [] } })),
         axios.get(`${API_URL}/club/contracts`, { headers }).catch(e => ({ data: { contracts: [] } })),
         axios.get(`${API_URL}/club/inventory/package-levels`, { headers }).catch(e => ({ data: { levels: [] } }))
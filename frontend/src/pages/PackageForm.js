@@ -3,6 +3,7 @@ import { useNavigate, useParams } from 'react-router-dom';
 import axios from 'axios';
 import { getAuth } from '../utils/auth';
 import { getImageUrl } from '../utils/imageUtils';
+import { fetchAllInventoryAssets } from '../utils/inventoryAssets';
 import Toast from '../components/Toast';
 import Modal from '../components/Modal';
 import SupportWidget from '../components/SupportWidget';
@@ -187,7 +188,7 @@ function PackageForm() {
       try {
         const headers = { Authorization: `Bearer ${token}` };
         const [assetsRes, levelsRes] = await Promise.all([
-          axios.get(`${API_URL}/club/inventory/assets`, { headers }).catch(() => ({ data: { assets: [] } })),
+          fetchAllInventoryAssets((params) => axios.get(`${API_URL}/club/inventory/assets`, { headers, params })).catch(() => ({ data: { assets: [] } })),
           axios.get(`${API_URL}/club/inventory/package-levels`, { headers }).catch(() => ({ data: { levels: [] } }))
         ]);
 
@@ -33,6 +33,13 @@ const ICON_MAP = {
   FaEnvelope, FaPhone, FaCube
 };
 
+// Stagione sportiva corrente (luglio-giugno), es. '2025-2026'
+const currentSeason = () => {
+  const now = new Date();
+  const first = now.getMonth() >= 6 ? now.getFullYear() : now.getFullYear() - 1;
+  return `${first}-${first + 1}`;
+};
+
 function ProposalBuilder() {
   const { id } = useParams();
   const navigate = useNavigate();
@@ -95,6 +102,7 @@ function ProposalBuilder() {
   const [leads, setLeads] = useState([]);
   const [sponsors, setSponsors] = useState([]);
   const [inventory, setInventory] = useState([]);
+  const [occupancy, setOccupancy] = useState({}); // Occupazione asset nella stagione corrente
   const [categories, setCategories] = useState([]);
   const [clubData, setClubData] = useState(null);
 
@@ -118,17 +126,19 @@ function ProposalBuilder() {
       setClubData(clubRes.data.club);
 
       // Load leads, sponsors, inventory
-      const [leadsRes, sponsorsRes, inventoryRes, categoriesRes] = await Promise.all([
+      const [leadsRes, sponsorsRes, inventoryRes, categoriesRes, occupancyRes] = await Promise.all([
         clubAPI.getLeads().catch(() => ({ data: { leads: [] } })),
         clubAPI.getSponsors().catch(() => ({ data: { sponsors: [] } })),
         clubAPI.getInventoryAssets().catch(() => ({ data: { assets: [] } })),
-        clubAPI.getAssetCategories().catch(() => ({ data: { categories: [] } }))
+        clubAPI.getAssetCategories().catch(() => ({ data: { categories: [] } })),
+        clubAPI.getInventoryOccupancy({ stagione: currentSeason() }).catch(() => ({ data: { items: [] } }))
       ]);
 
       setLeads(leadsRes.data.leads || []);
       setSponsors(sponsorsRes.data.sponsors || []);
       setInventory(inventoryRes.data.assets || []);
       setCategories(categoriesRes.data.categories || []);
+      setOccupancy(Object.fromEntries((occupancyRes.data.items || []).map(item => [item.id, item])));
 
       // If lead_id from URL, pre-select the lead
       if (leadIdFromUrl && !isEditing) {
@@ -1369,6 +1379,7 @@ function ProposalBuilder() {
               })
               .map(asset => {
                 const isAdded = items.some(i => i.asset_id === asset.id);
+                const assetOccupancy = occupancy[asset.id];
                 return (
                   <div
                     key={asset.id}
@@ -1396,6 +1407,13 @@ function ProposalBuilder() {
                     <div style={{ marginTop: '8px', fontWeight: '600', color: '#10B981' }}>
                       € {(asset.prezzo_listino || 0).toLocaleString('it-IT')}
                     </div>
+                    {assetOccupancy && (
+                      <div style={{ marginTop: '4px', fontSize: '12px', color: assetOccupancy.libero ? '#6B7280' : '#DC2626' }}>
+                        {assetOccupancy.libero
+                          ? `Stagione ${currentSeason()}: occupato al ${assetOccupancy.utilizzo_percentuale}%`
+                          : `Non libero nella stagione ${currentSeason()}`}
+                      </div>
+                    )}
                   </div>
                 );
               })}
@@ -1,4 +1,5 @@
 import axios from 'axios';
+import { fetchAllInventoryAssets } from '../utils/inventoryAssets';
 
 const API_URL = process.env.REACT_APP_API_URL || 'http://localhost:5003/api';
 const API_BASE_URL = API_URL.replace('/api', ''); // Base URL senza /api
@@ -440,8 +441,9 @@ export const clubAPI = {
     api.delete(`/club/inventory/categories/${id}`),
 
   // Assets
+  // Tutte le pagine della lista (paginata lato server)
   getInventoryAssets: (params) =>
-    api.get('/club/inventory/assets', { params }),
+    fetchAllInventoryAssets((pageParams) => api.get('/club/inventory/assets', { params: pageParams }), params),
   getInventoryAsset: (id) =>
     api.get(`/club/inventory/assets/${id}`),
   createInventoryAsset: (data) =>
@@ -491,6 +493,10 @@ export const clubAPI = {
   getInventoryStats: () =>
     api.get('/club/inventory/stats'),
 
+  // Occupancy (asset o diritti liberi per periodo/stagione/giornata)
+  getInventoryOccupancy: (params) =>
+    api.get('/club/inventory/occupancy', { params }),
+
   // Catalogs
   getCatalogs: () =>
     api.get('/club/catalogs'),
@@ -0,0 +1,34 @@
+// Lista asset inventario paginata lato server (keyset: ?limit & ?cursor).
+// Le pagine che lavorano sull'intero catalogo (filtri e ordinamenti client,
+// selettori asset) le scaricano tutte seguendo next_cursor.
+
+export const INVENTORY_PAGE_SIZE = 200;
+
+/**
+ * Scarica tutte le pagine della lista asset.
+ * getPage(params) deve ritornare la risposta axios di GET /club/inventory/assets.
+ * onPage(assetsFinora) viene chiamata dopo ogni pagina (render progressivo).
+ * Ritorna una risposta con la stessa forma della lista non paginata:
+ * { data: { assets, stats } }.
+ */
+export const fetchAllInventoryAssets = async (getPage, params = {}, onPage) => {
+  let assets = [];
+  let stats = null;
+  let cursor = null;
+
+  do {
+    const pageParams = { ...params, limit: INVENTORY_PAGE_SIZE };
+    if (cursor) pageParams.cursor = cursor;
+    const res = await getPage(pageParams);
+    const data = res.data || {};
+
+    assets = assets.concat(data.assets || []);
+    stats = stats || data.stats || null;
+    cursor = data.pagination?.has_more ? data.pagination.next_cursor : null;
+    if (onPage) onPage(assets);
+  } while (cursor);
+
+  return { data: { assets, stats } };
+};
+
+export default fetchAllInventoryAssets;